@@ -1,7 +1,8 @@
 from django.contrib import admin
 from django.contrib.auth.models import User
 from django import forms
-from .models import Recipe, IngredientList, EquipmentList, NutritionList, RecipeStep, Diet
+from .models import Recipe, IngredientList, EquipmentList, NutritionList, RecipeStep, Diet, SpoonacularMiss, \
+    EnrichmentBatch, GPTCallStat, Substitution, ScreeningDecision, RoutingDecision
 
 
 class IngredientListInline(admin.TabularInline):
@@ -58,3 +59,55 @@ admin.site.register(Recipe, RecipeAdmin)
 @admin.register(Diet)
 class DietAdmin(admin.ModelAdmin):
     list_display = ('name',)
+
+
+@admin.register(SpoonacularMiss)
+class SpoonacularMissAdmin(admin.ModelAdmin):
+    list_display = ('spoonacular_id', 'status_code', 'reason', 'hits', 'failed_at', 'expires_at')
+    list_filter = ('status_code',)
+    search_fields = ('spoonacular_id', 'reason')
+    readonly_fields = ('failed_at', 'hits')
+    ordering = ('-failed_at',)
+
+
+@admin.register(EnrichmentBatch)
+class EnrichmentBatchAdmin(admin.ModelAdmin):
+    list_display = ('batch_id', 'backend', 'status', 'applied', 'failed', 'created_at', 'finished_at')
+    list_filter = ('backend', 'status')
+    search_fields = ('batch_id',)
+    readonly_fields = ('recipes', 'input_file', 'created_at', 'finished_at')
+    ordering = ('-created_at',)
+
+
+@admin.register(GPTCallStat)
+class GPTCallStatAdmin(admin.ModelAdmin):
+    list_display = ('day', 'method', 'model', 'outcome', 'calls', 'retries', 'fallbacks', 'total_seconds', 'max_seconds',
+                    'cost')
+    list_filter = ('method', 'model', 'outcome')
+    readonly_fields = ('latency_buckets',)
+    ordering = ('-day', 'method')
+
+
+@admin.register(Substitution)
+class SubstitutionAdmin(admin.ModelAdmin):
+    list_display = ('ingredient', 'diets', 'cuisines', 'hits', 'created_at', 'last_used_at')
+    search_fields = ('ingredient__name', 'diets', 'cuisines')
+    raw_id_fields = ('ingredient',)
+    ordering = ('-hits',)
+
+
+@admin.register(ScreeningDecision)
+class ScreeningDecisionAdmin(admin.ModelAdmin):
+    list_display = ('recipe', 'verdict', 'rule', 'detail', 'duplicate_of', 'created_at')
+    list_filter = ('verdict', 'rule')
+    search_fields = ('recipe__name', 'detail')
+    raw_id_fields = ('recipe', 'duplicate_of')
+    ordering = ('-created_at',)
+
+
+@admin.register(RoutingDecision)
+class RoutingDecisionAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'task', 'model', 'action', 'routed_to', 'reason', 'requests', 'p95_seconds',
+                    'error_rate')
+    list_filter = ('task', 'model', 'action')
+    ordering = ('-created_at',)
@@ -0,0 +1,79 @@
+"""Module for assessing recipes with the AI in batches."""
+from datetime import timedelta
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from webpage.models import EnrichmentBatch
+from webpage.modules.batch_backend import BACKEND, BACKENDS, get_backend
+from webpage.modules.batch_enrichment import PARTS, collect_batches, select_recipes, submit_batch
+from webpage.modules.status_code import BatchStatus
+
+
+class Command(BaseCommand):
+    """Command to submit the recipes missing their difficulty, nutrition or approval as one batch, then apply it."""
+
+    help = 'Assess the recipes missing their difficulty, nutrition or approval through a batch backend'
+
+    def add_arguments(self, parser):
+        """
+        Add the command line arguments.
+
+        :param parser: The argument parser.
+        """
+        parser.add_argument('--parts', default=','.join(PARTS),
+                            help='Comma-separated parts to fill in, among difficulty, nutrition and approval.')
+        parser.add_argument('--stale-days', type=float,
+                            help='Also assess again the recipes enriched more than this many days ago.')
+        parser.add_argument('--limit', type=int, help='The most recipes in the batch.')
+        parser.add_argument('--backend', choices=list(BACKENDS), default=BACKEND, help='The batch backend.')
+        parser.add_argument('--collect-only', action='store_true',
+                            help='Only apply the batches that finished, without submitting a new one.')
+        parser.add_argument('--wait', action='store_true', help='Wait until the new batch finishes and apply it.')
+        parser.add_argument('--poll-interval', type=float, default=60,
+                            help='Seconds between checks of the batch while waiting.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the recipes that would be assessed.')
+
+    def handle(self, *args, **options):
+        """
+        Apply the finished batches, then submit the recipes that still need an assessment.
+
+        :param *args: Positional arguments.
+        :param **options: Keyword arguments.
+        """
+        parts = [part.strip() for part in options['parts'].split(',') if part.strip()]
+        unknown = set(parts) - set(PARTS)
+        if unknown:
+            raise CommandError(f"Unknown part(s): {', '.join(sorted(unknown))}")
+        stale_before = None
+        if options['stale_days'] is not None:
+            stale_before = timezone.now() - timedelta(days=options['stale_days'])
+        if options['dry_run']:
+            count = select_recipes(parts, stale_before)[:options['limit']].count()
+            self.stdout.write(f"Would assess {count} recipe(s)")
+            return
+
+        backend = get_backend(options['backend'])
+        self.collect(backend)
+        if options['collect_only']:
+            return
+        batch = submit_batch(backend, select_recipes(parts, stale_before)[:options['limit']], parts, stale_before)
+        if batch is None:
+            self.stdout.write("No recipe needs an assessment")
+            return
+        self.stdout.write(f"Submitted batch {batch.batch_id} with {len(batch.recipes)} recipe(s)")
+        self.collect(backend)
+        while options['wait'] and EnrichmentBatch.objects.filter(
+                pk=batch.pk, status=BatchStatus.SUBMITTED.value[0]).exists():
+            time.sleep(options['poll_interval'])
+            self.collect(backend)
+
+    def collect(self, backend):
+        """
+        Apply the finished batches of the backend and report them.
+
+        :param backend: The batch backend.
+        """
+        for batch in collect_batches(backend):
+            self.stdout.write(self.style.SUCCESS(
+                f"Applied batch {batch.batch_id}: {batch.applied} recipe(s) updated, {batch.failed} failed"
+            ))
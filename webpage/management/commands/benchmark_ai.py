@@ -0,0 +1,254 @@
+"""Module for load testing the pages that ask GPT, against a local fake of the OpenAI API."""
+import json
+import math
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from webpage.management.commands.compare_prompts import FIXTURES, create_recipe
+from webpage.models import Recipe, Job
+from webpage.modules import gpt_handler, job_queue
+from webpage.modules.fake_openai import FakeOpenAIServer, parse_latency
+from webpage.modules.gpt_cache import default_cache
+# Import the module defining the enrichment job handler so that it is registered.
+from webpage.modules import recipe_enrichment  # noqa: F401
+
+SCENARIOS = ('alternatives', 'add_recipe')
+NUTRIENTS = [{"name": "Calories", "amount": 450, "unit": "kcal", "percentOfDailyNeeds": 22},
+             {"name": "Protein", "amount": 20, "unit": "g", "percentOfDailyNeeds": 40}]
+ALTERNATIVES = [{"name": "Tofu", "description": "Firm and mild, it takes the flavour of the sauce.",
+                 "amount": 200, "unit": "g"}]
+# Answers to the structured calls of the advisor, by the name of their JSON schema. The recipes are not approved,
+# as the screening would flag the next submissions of the same fixture as near copies of an approved one, without GPT.
+SCRIPTS = {
+    'recipe_assessment': json.dumps({"difficulty": "Normal", "nutrients": NUTRIENTS, "approved": False}),
+    'nutrition': json.dumps({"nutrients": NUTRIENTS}),
+    'alternative_ingredients': json.dumps({"alternatives": ALTERNATIVES}),
+}
+
+
+def advisor_answer(body: dict[str, Any]) -> str:
+    """
+    Answer a call of the advisor without a JSON schema, e.g. with GPT_STRUCTURED_OUTPUTS off, by its question.
+
+    :param body: The JSON body of the request.
+    :return: A plausible answer of the model.
+    """
+    question = json.dumps(body.get('messages', [])[1:]).lower()
+    if 'alternative' in question:
+        return json.dumps(ALTERNATIVES)
+    if 'difficulty' in question:
+        return "Normal"
+    if 'nutri' in question:
+        return SCRIPTS['nutrition']
+    return "False"
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """
+    Return the nearest-rank percentile of some values.
+
+    :param values: The values, in any order.
+    :param fraction: The percentile between 0 and 1, e.g. 0.99.
+    :return: The smallest value that at least this fraction of the values do not exceed, 0 without values.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def summarize(name: str, samples: list[tuple[float, str]], seconds: float) -> str:
+    """
+    Describe the throughput and the latency of a scenario.
+
+    :param name: The name of the scenario.
+    :param samples: The seconds and the outcome of each request.
+    :param seconds: The seconds the whole scenario took.
+    :return: One line with the requests per second, the latency percentiles and the outcomes.
+    """
+    latencies = [latency for latency, _ in samples]
+    outcomes = ", ".join(f"{outcome}={count}" for outcome, count in sorted(Counter(o for _, o in samples).items()))
+    return f"{name}\t{len(samples)} in {seconds:.2f}s = {len(samples) / max(seconds, 1e-9):.1f}/s\t" \
+           f"p50={percentile(latencies, 0.5) * 1000:.0f}ms p95={percentile(latencies, 0.95) * 1000:.0f}ms " \
+           f"p99={percentile(latencies, 0.99) * 1000:.0f}ms max={max(latencies, default=0) * 1000:.0f}ms\t{outcomes}"
+
+
+class Command(BaseCommand):
+    """Command to measure the throughput and tail latency of the AI pages against a fake OpenAI API."""
+
+    help = 'Load test RecipeView.post and AddRecipeView, with its enrichment job, against a local fake OpenAI API'
+
+    def add_arguments(self, parser):
+        """
+        Add the command line arguments.
+
+        :param parser: The argument parser.
+        """
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                            help='The pages to load, every one by default. Can be repeated.')
+        parser.add_argument('--requests', type=int, default=50, help='Requests per scenario.')
+        parser.add_argument('--concurrency', type=int, default=4, help='Requests sent at the same time.')
+        parser.add_argument('--latency', default='lognormal:0.4,0.5',
+                            help='Latency of the fake model: seconds, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA.')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of the model requests that fail.')
+        parser.add_argument('--error-status', type=int, default=503, help='HTTP status code of the failed requests.')
+        parser.add_argument('--malformed-rate', type=float, default=0.0,
+                            help='Share of the model answers that are malformed.')
+        parser.add_argument('--stream', action='store_true', help='Stream the alternative ingredients.')
+        parser.add_argument('--seed', type=int, default=None, help='Seed of the latency, errors and malformations.')
+        parser.add_argument('--base-url', default=None,
+                            help='Use an already running OpenAI compatible server, e.g. `manage.py fake_openai`, '
+                                 'instead of starting one.')
+        parser.add_argument('--cache', action='store_true', help='Keep the GPT response cache on.')
+
+    def handle(self, *args, **options):
+        """
+        Create the fixture recipes, load the pages and print one line per scenario, then delete what was created.
+
+        :param *args: Positional arguments.
+        :param **options: Keyword arguments.
+        """
+        try:
+            latency = parse_latency(options['latency'])
+        except ValueError as e:
+            raise CommandError(f"Cannot read the latency: {e}")
+        with open(FIXTURES, encoding='utf-8') as file:
+            fixtures = json.load(file)
+        server = None
+        if options['base_url'] is None:
+            server = FakeOpenAIServer(advisor_answer, scripts=SCRIPTS, latency=latency,
+                                      error_rate=options['error_rate'], error_status=options['error_status'],
+                                      malformed_rate=options['malformed_rate'], seed=options['seed']).start()
+        previous_url, previous_ttls = gpt_handler.BASE_URL, default_cache.ttls
+        gpt_handler.use_base_url(options['base_url'] or server.url)
+        if not options['cache']:
+            default_cache.ttls = {}
+        user = User.objects.create_user(username=f"benchmark-{int(time.time())}")
+        try:
+            recipes = [create_recipe(fixture, user) for fixture in fixtures]
+            for scenario in options['scenario'] or SCENARIOS:
+                for name, samples, seconds in getattr(self, scenario)(recipes, user, options):
+                    self.stdout.write(summarize(name, samples, seconds))
+            if server is not None:
+                self.stdout.write(f"Model\t{', '.join(f'{key}={value}' for key, value in sorted(server.counts.items()))}")
+        finally:
+            Recipe.objects.filter(poster_id=user).delete()
+            Job.objects.filter(user=user).delete()
+            user.delete()
+            default_cache.ttls = previous_ttls
+            gpt_handler.use_base_url(previous_url)
+            if server is not None:
+                server.stop()
+
+    def alternatives(self, recipes: list[Recipe], user: User, options: dict) -> list[tuple[str, list, float]]:
+        """
+        Ask RecipeView.post for the alternatives of the ingredients of the recipes in turn.
+
+        Each request has its own special instruction, so the substitution knowledge base and the ingredient index
+        cannot answer it.
+
+        :param recipes: The fixture recipes.
+        :param user: The benchmark user.
+        :param options: The command options.
+        :return: The scenario with the latency and status code of each request.
+        """
+        ingredients = [(recipe.id, entry.ingredient_id) for recipe in recipes for entry in recipe.ingredientlist_set.all()]
+
+        def request(client: Client, number: int) -> list[tuple[str, float, str]]:
+            recipe_id, ingredient_id = ingredients[number % len(ingredients)]
+            data = {'ingredient_id': ingredient_id, 'prompt': f"Benchmark request {number}"}
+            if options['stream']:
+                data['stream'] = '1'
+            start = time.perf_counter()
+            response = client.post(reverse('recipe', args=[recipe_id]), data)
+            outcome = str(response.status_code)
+            if options['stream']:
+                events = b"".join(response.streaming_content)
+                outcome += " error" if b"event: error" in events else ""
+            return [('alternatives', time.perf_counter() - start, outcome)]
+
+        return self.run(request, user, options)
+
+    def add_recipe(self, recipes: list[Recipe], user: User, options: dict) -> list[tuple[str, list, float]]:
+        """
+        Submit new recipes to AddRecipeView, then run their enrichment job as a worker would.
+
+        :param recipes: The fixture recipes, whose ingredients, equipment and steps are submitted under new names.
+        :param user: The benchmark user, who submits the recipes.
+        :param options: The command options.
+        :return: The submission with the latency and status code of each request, and the enrichment with the
+                 latency and final status of each job.
+        """
+        def request(client: Client, number: int) -> list[tuple[str, float, str]]:
+            recipe = recipes[number % len(recipes)]
+            data = {
+                'name': f"Benchmark {recipe.name} {number}",
+                'description': recipe.description,
+                'estimated_time': 30,
+                'ingredients_data': json.dumps([f"{entry.amount} {entry.unit} {entry.ingredient.name}"
+                                                for entry in recipe.ingredientlist_set.all()]),
+                'equipment_data': json.dumps([entry.equipment.name for entry in recipe.equipmentlist_set.all()]),
+                'steps_data': json.dumps([step.description for step in recipe.steps.order_by('number')]),
+            }
+            start = time.perf_counter()
+            response = client.post(reverse('add_recipe'), data)
+            submitted = time.perf_counter()
+            samples = [('add_recipe', submitted - start, str(response.status_code))]
+            if response.status_code == 202:
+                job = job_queue.claim_job(f"benchmark:{threading.get_native_id()}", job_id=response.json()['job_id'])
+                if job is not None:
+                    job_queue.run_job(job)
+                    samples.append(('enrichment', time.perf_counter() - submitted, job.status))
+            return samples
+
+        return self.run(request, user, options, login=True)
+
+    @staticmethod
+    def run(request: Callable[[Client, int], list[tuple[str, float, str]]], user: User, options: dict,
+            login: bool = False) -> list[tuple[str, list, float]]:
+        """
+        Send the requests of a scenario from several threads, each with its own test client.
+
+        :param request: The function sending one numbered request and returning the name, seconds and outcome of
+                        what it measured.
+        :param user: The benchmark user.
+        :param options: The command options.
+        :param login: Whether the clients log in as the user.
+        :return: The name, the seconds and outcome of each request, and the seconds of the whole run, per
+                 measured name.
+        """
+        local = threading.local()
+        host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+
+        def send(number: int) -> list[tuple[str, float, str]]:
+            if not hasattr(local, 'client'):
+                local.client = Client(HTTP_HOST=host)
+                if login:
+                    local.client.force_login(user)
+            return request(local.client, number)
+
+        start = time.perf_counter()
+        if options['concurrency'] <= 1:
+            results = [send(number) for number in range(options['requests'])]
+        else:
+            def send_and_close(number: int) -> list[tuple[str, float, str]]:
+                try:
+                    return send(number)
+                finally:
+                    connection.close()
+
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                results = list(executor.map(send_and_close, range(options['requests'])))
+        seconds = time.perf_counter() - start
+        scenarios: dict[str, list] = {}
+        for name, latency, outcome in (sample for samples in results for sample in samples):
+            scenarios.setdefault(name, []).append((latency, outcome))
+        return [(name, samples, seconds) for name, samples in scenarios.items()]
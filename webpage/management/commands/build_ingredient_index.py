@@ -0,0 +1,44 @@
+"""Module for computing the local embedding index of the ingredients."""
+from django.core.management.base import BaseCommand
+from webpage.models import Ingredient
+from webpage.modules import ingredient_index
+from webpage.modules.ingredient_index import IngredientIndex
+
+
+class Command(BaseCommand):
+    """Command to compute the ingredient vectors from the recipes, for the substitutes answered without GPT."""
+
+    help = 'Compute the ingredient embedding index from the ingredients used together in recipes'
+
+    def add_arguments(self, parser):
+        """
+        Add the command line arguments.
+
+        :param parser: The argument parser.
+        """
+        parser.add_argument('--dimensions', type=int, default=ingredient_index.DIMENSIONS,
+                            help='Length of the ingredient vectors.')
+        parser.add_argument('--min-recipes', type=int, default=ingredient_index.MIN_RECIPES,
+                            help='Number of recipes an ingredient needs to be indexed.')
+        parser.add_argument('--max-ingredients', type=int, default=ingredient_index.MAX_INGREDIENTS,
+                            help='Number of most used ingredients to index.')
+        parser.add_argument('--query', help='Print the ingredients most similar to this one after building.')
+
+    def handle(self, *args, **options):
+        """
+        Build and write the index.
+
+        :param *args: Positional arguments.
+        :param **options: Keyword arguments.
+        """
+        index = IngredientIndex.build(options['dimensions'], options['min_recipes'], options['max_ingredients'])
+        index.save()
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {len(index)} ingredient(s) in {index.dimensions} dimensions to {ingredient_index.INDEX_DIR}"))
+        if options['query']:
+            ingredient = Ingredient.objects.filter(name__iexact=options['query']).first()
+            if ingredient is None or ingredient.id not in index:
+                self.stdout.write(f"{options['query']} is not indexed.")
+                return
+            for neighbour in index.similar(ingredient.id):
+                self.stdout.write(f"{neighbour.score:.3f}\t{neighbour.name}")
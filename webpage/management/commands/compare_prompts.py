@@ -0,0 +1,184 @@
+"""Module for measuring what the prompt compaction saves and whether the answers stay the same."""
+import json
+import time
+from collections import defaultdict
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from pantry import settings
+from webpage.models import Recipe, Ingredient, IngredientList, Equipment, EquipmentList, RecipeStep, Diet
+from webpage.modules import json_repair
+from webpage.modules.ai_advisor import AIRecipeAdvisor
+
+FIXTURES = settings.BASE_DIR / 'webpage' / 'fixtures' / 'prompt_recipes.json'
+# Relative difference of the calories under which two nutrition answers agree.
+CALORIES_TOLERANCE = 0.2
+
+
+class Command(BaseCommand):
+    """Command to compare the verbatim and the compact prompts of fixture recipes, in tokens and optionally live."""
+
+    help = 'Compare the tokens, and with --live the latency and answers, of the verbatim and compact advisor prompts'
+
+    def add_arguments(self, parser):
+        """
+        Add the command line arguments.
+
+        :param parser: The argument parser.
+        """
+        parser.add_argument('--fixtures', default=str(FIXTURES),
+                            help='JSON list of recipes with name, description, ingredients, equipment, steps, diets '
+                                 'and the expected difficulty and approval.')
+        parser.add_argument('--live', action='store_true',
+                            help='Ask the model with both prompts, without the cache, and compare the latency and answers.')
+
+    def handle(self, *args, **options):
+        """
+        Create the fixture recipes in a transaction that is rolled back, and print one line per recipe and call.
+
+        :param *args: Positional arguments.
+        :param **options: Keyword arguments.
+        """
+        try:
+            with open(options['fixtures'], encoding='utf-8') as file:
+                fixtures = json.load(file)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read the fixtures: {e}")
+        totals = defaultdict(float)
+        with transaction.atomic():
+            user = User.objects.create_user(username="prompt-fixtures")
+            for fixture in fixtures:
+                recipe = create_recipe(fixture, user)
+                prompts = {compact: advisor(recipe, compact).prompts() for compact in (False, True)}
+                for call_type, (_, verbatim) in prompts[False].items():
+                    handler, compact = prompts[True][call_type]
+                    totals['verbatim'] += verbatim.tokens
+                    totals['compact'] += compact.tokens
+                    line = f"{fixture['name']}\t{call_type}\t{verbatim.tokens} -> {compact.tokens} tokens " \
+                           f"(-{compact.saved_tokens / max(verbatim.tokens, 1):.0%})"
+                    if options['live']:
+                        line += "\t" + self.compare_live(prompts[False][call_type][0], verbatim, handler, compact,
+                                                         call_type, fixture.get('expected', {}), totals)
+                    self.stdout.write(line)
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS(
+            f"Total: {totals['verbatim']:.0f} -> {totals['compact']:.0f} tokens "
+            f"(-{1 - totals['compact'] / max(totals['verbatim'], 1):.0%})"))
+        if options['live'] and totals['calls']:
+            self.stdout.write(f"Latency: {totals['verbatim_seconds'] / totals['calls']:.2f}s -> "
+                              f"{totals['compact_seconds'] / totals['calls']:.2f}s per call, "
+                              f"{totals['agreed']:.0f} of {totals['calls']:.0f} answers agree")
+
+    @staticmethod
+    def compare_live(verbatim_handler, verbatim: str, compact_handler, compact: str, call_type: str,
+                     expected: dict, totals: dict) -> str:
+        """
+        Ask the model with both prompts and compare the answers.
+
+        :param verbatim_handler: The handler of the verbatim prompt.
+        :param verbatim: The verbatim prompt.
+        :param compact_handler: The handler of the compact prompt.
+        :param compact: The compact prompt.
+        :param call_type: The kind of call.
+        :param expected: The expected difficulty and approval of the recipe.
+        :param totals: The totals to add the latency and agreement to.
+        :return: The latency of both prompts and whether the answers agree.
+        """
+        answers, seconds = {}, {}
+        for name, handler, prompt in [('verbatim', verbatim_handler, verbatim), ('compact', compact_handler, compact)]:
+            handler.cache = None
+            start = time.perf_counter()
+            answers[name] = handler.generate(prompt)
+            seconds[name] = time.perf_counter() - start
+            totals[f'{name}_seconds'] += seconds[name]
+        totals['calls'] += 1
+        agreed = agree(call_type, answers['verbatim'], answers['compact'])
+        totals['agreed'] += agreed
+        expectation = check_expected(call_type, answers['compact'], expected)
+        return f"{seconds['verbatim']:.2f}s -> {seconds['compact']:.2f}s\t{'agree' if agreed else 'DIFFER'}" + \
+            (f"\t{expectation}" if expectation else "")
+
+
+def advisor(recipe: Recipe, compact: bool) -> AIRecipeAdvisor:
+    """
+    Return an advisor of a recipe.
+
+    :param recipe: The recipe.
+    :param compact: Whether the prompts are compacted.
+    :return: The advisor.
+    """
+    consultant = AIRecipeAdvisor(recipe)
+    consultant.compact = compact
+    return consultant
+
+
+def create_recipe(fixture: dict, user: User) -> Recipe:
+    """
+    Create a fixture recipe.
+
+    :param fixture: The recipe with name, description, ingredients as [name, amount, unit], equipment, steps and diets.
+    :param user: The poster.
+    :return: The recipe.
+    """
+    recipe = Recipe.objects.create(name=fixture['name'], description=fixture.get('description', ''), poster_id=user)
+    for name, amount, unit in fixture.get('ingredients', []):
+        IngredientList.objects.create(recipe=recipe, ingredient=Ingredient.objects.get_or_create(name=name)[0],
+                                      amount=amount, unit=unit)
+    for name in fixture.get('equipment', []):
+        EquipmentList.objects.create(recipe=recipe, equipment=Equipment.objects.get_or_create(name=name)[0], amount=1)
+    for number, description in enumerate(fixture.get('steps', []), start=1):
+        RecipeStep.objects.create(recipe=recipe, number=number, description=description)
+    recipe.diets.set([Diet.objects.get_or_create(name=name)[0] for name in fixture.get('diets', [])])
+    return recipe
+
+
+def _calories(answer: dict) -> float | None:
+    """
+    Return the calories of a nutrition or assessment answer.
+
+    :param answer: The parsed answer.
+    :return: The calories, None if they are missing.
+    """
+    for nutrient in answer.get('nutrients', []) if isinstance(answer, dict) else []:
+        if isinstance(nutrient, dict) and str(nutrient.get('name', '')).lower() == 'calories':
+            return float(nutrient.get('amount') or 0)
+    return None
+
+
+def agree(call_type: str, verbatim: str, compact: str) -> bool:
+    """
+    Return whether the answers to the verbatim and the compact prompt agree.
+
+    :param call_type: The kind of call.
+    :param verbatim: The answer to the verbatim prompt.
+    :param compact: The answer to the compact prompt.
+    :return: True for the same difficulty and approval, and calories within CALORIES_TOLERANCE of each other.
+    """
+    if call_type in ('difficulty', 'approval'):
+        return verbatim.strip() == compact.strip()
+    try:
+        first, second = json_repair.load(verbatim)[0], json_repair.load(compact)[0]
+    except ValueError:
+        return False
+    if call_type == 'assessment' and any(first.get(key) != second.get(key) for key in ('difficulty', 'approved')):
+        return False
+    calories = _calories(first), _calories(second)
+    if None in calories:
+        return calories[0] == calories[1]
+    return abs(calories[0] - calories[1]) <= CALORIES_TOLERANCE * max(abs(calories[0]), 1)
+
+
+def check_expected(call_type: str, answer: str, expected: dict) -> str:
+    """
+    Compare an answer with the expected difficulty and approval of the fixture.
+
+    :param call_type: The kind of call.
+    :param answer: The answer to the compact prompt.
+    :param expected: The expected `difficulty` and `approved`.
+    :return: What differs from the expectation, empty if nothing does or nothing is expected.
+    """
+    if call_type == 'difficulty' and 'difficulty' in expected and answer.strip() != expected['difficulty']:
+        return f"expected {expected['difficulty']}, got {answer.strip()}"
+    if call_type == 'approval' and 'approved' in expected and answer.strip() != str(expected['approved']):
+        return f"expected {expected['approved']}, got {answer.strip()}"
+    return ""
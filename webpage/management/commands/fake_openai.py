@@ -0,0 +1,58 @@
+"""Module for serving a local fake of the OpenAI API, to run the site or a benchmark offline."""
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from webpage.management.commands.benchmark_ai import SCRIPTS, advisor_answer
+from webpage.modules.fake_openai import FakeOpenAIServer, parse_latency
+
+
+class Command(BaseCommand):
+    """Command to serve scripted chat completions until interrupted."""
+
+    help = 'Serve a fake OpenAI chat completions API. Point the site at it with OPENAI_BASE_URL'
+
+    def add_arguments(self, parser):
+        """
+        Add the command line arguments.
+
+        :param parser: The argument parser.
+        """
+        parser.add_argument('--port', type=int, default=8001, help='Local port to serve on.')
+        parser.add_argument('--scripts', default=None,
+                            help='JSON object of answers by JSON schema name or by a part of the system prompt, '
+                                 'added to the answers of the advisor calls.')
+        parser.add_argument('--latency', default='0', help='Seconds, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA.')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of the requests that fail.')
+        parser.add_argument('--error-status', type=int, default=503, help='HTTP status code of the failed requests.')
+        parser.add_argument('--malformed-rate', type=float, default=0.0, help='Share of the answers that are malformed.')
+        parser.add_argument('--chunk-size', type=int, default=8, help='Characters per streamed chunk.')
+        parser.add_argument('--seed', type=int, default=None, help='Seed of the latency, errors and malformations.')
+
+    def handle(self, *args, **options):
+        """
+        Serve until interrupted, then print how many requests were answered.
+
+        :param *args: Positional arguments.
+        :param **options: Keyword arguments.
+        """
+        scripts = dict(SCRIPTS)
+        try:
+            latency = parse_latency(options['latency'])
+            if options['scripts']:
+                with open(options['scripts'], encoding='utf-8') as file:
+                    scripts.update(json.load(file))
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot start the fake server: {e}")
+        server = FakeOpenAIServer(advisor_answer, chunk_size=options['chunk_size'], scripts=scripts, latency=latency,
+                                  error_rate=options['error_rate'], error_status=options['error_status'],
+                                  malformed_rate=options['malformed_rate'], seed=options['seed'],
+                                  port=options['port']).start()
+        self.stdout.write(self.style.SUCCESS(f"Serving on {server.url}, set OPENAI_BASE_URL={server.url}"))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
+            self.stdout.write(", ".join(f"{key}={value}" for key, value in sorted(server.counts.items())))
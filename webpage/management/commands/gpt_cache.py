@@ -0,0 +1,42 @@
+"""Module for inspecting and clearing the stored GPT responses."""
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+from django.utils import timezone
+from webpage.models import GPTResponseCache
+
+
+class Command(BaseCommand):
+    """Command to show how much the stored GPT responses are reused, or to delete them."""
+
+    help = 'Show the stored GPT responses and their hits per call type, or clear them'
+
+    def add_arguments(self, parser):
+        """
+        Add the command line arguments.
+
+        :param parser: The argument parser.
+        """
+        parser.add_argument('--call-type', help='Only the responses of this call type, e.g. difficulty.')
+        parser.add_argument('--clear', action='store_true', help='Delete the responses.')
+        parser.add_argument('--expired', action='store_true', help='Only the responses that already expired.')
+
+    def handle(self, *args, **options):
+        """
+        Print the statistics of the stored responses, or delete them.
+
+        :param *args: Positional arguments.
+        :param **options: Keyword arguments.
+        """
+        responses = GPTResponseCache.objects.all()
+        if options['call_type']:
+            responses = responses.filter(call_type=options['call_type'])
+        if options['expired']:
+            responses = responses.filter(expires_at__lte=timezone.now())
+        if options['clear']:
+            count = responses.delete()[0]
+            self.stdout.write(self.style.SUCCESS(f"Deleted {count} response(s)"))
+            return
+
+        rows = responses.values('call_type').annotate(entries=Count('key'), hits=Sum('hits')).order_by('call_type')
+        for row in rows:
+            self.stdout.write(f"{row['call_type']}\t{row['entries']} response(s)\t{row['hits']} hit(s)")
@@ -0,0 +1,81 @@
+"""Module for reporting the time, tokens and cost of the calls to the GPT model."""
+from collections import defaultdict
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from webpage.models import GPTCallStat
+from webpage.modules.status_code import CallOutcome
+from webpage.modules.telemetry import CallStats, SUMMED_FIELDS, percentile
+
+
+class Command(BaseCommand):
+    """Command to print the GPT call statistics per method and per day, to decide which calls to cache or replace."""
+
+    help = 'Report the latency, tokens, retries, invalid responses and cost of the GPT calls per advisor method and per day'
+
+    def add_arguments(self, parser):
+        """
+        Add the command line arguments.
+
+        :param parser: The argument parser.
+        """
+        parser.add_argument('--days', type=int, default=7, help='Number of days to report, including today.')
+        parser.add_argument('--method', help='Only the calls of this advisor method, e.g. difficulty_calculator.')
+
+    def handle(self, *args, **options):
+        """
+        Print one line per day and method, then one line per method over all the days.
+
+        :param *args: Positional arguments.
+        :param **options: Keyword arguments.
+        """
+        rows = GPTCallStat.objects.filter(day__gt=timezone.localdate() - timedelta(days=options['days']))
+        if options['method']:
+            rows = rows.filter(method=options['method'])
+        per_day, per_method = defaultdict(Summary), defaultdict(Summary)
+        for row in rows.order_by('day', 'method'):
+            per_day[(row.day, row.method)].add(row)
+            per_method[row.method].add(row)
+        if not per_method:
+            self.stdout.write("No GPT calls recorded.")
+            return
+
+        self.stdout.write("Per day and method:")
+        for (day, method), summary in per_day.items():
+            self.stdout.write(f"{day}\t{method}\t{summary}")
+        self.stdout.write("Per method:")
+        for method, summary in sorted(per_method.items(), key=lambda item: -item[1].stats.cost):
+            self.stdout.write(f"{method}\t{summary}")
+        total = sum(summary.stats.cost for summary in per_method.values())
+        self.stdout.write(self.style.SUCCESS(f"Total cost: ${total:.4f}"))
+
+
+class Summary:
+    """The statistics of several GPTCallStat rows, with the calls counted per outcome."""
+
+    def __init__(self):
+        """Start without calls."""
+        self.stats = CallStats()
+        self.outcomes = defaultdict(int)
+
+    def add(self, row: GPTCallStat):
+        """
+        Add a row.
+
+        :param row: The statistics of one day, method, model and outcome.
+        """
+        row_stats = CallStats(**{name: getattr(row, name) for name in (*SUMMED_FIELDS, 'max_seconds')},
+                              latency_buckets=list(row.latency_buckets))
+        row_stats.merge_into(self.stats)
+        self.outcomes[row.outcome] += row.calls
+
+    def __str__(self):
+        """Return the calls, outcomes, retries, fallbacks, unusable and repaired responses, latency, tokens and cost."""
+        stats = self.stats
+        outcomes = " ".join(f"{outcome.value[0]}={self.outcomes[outcome.value[0]]}" for outcome in CallOutcome)
+        p50, p95 = (percentile(stats.latency_buckets, fraction) for fraction in (0.5, 0.95))
+        return f"{stats.calls} call(s)\t{outcomes}\tretries={stats.retries} ({stats.retries / stats.calls:.2f}/call) " \
+               f"fallbacks={stats.fallbacks} invalid={stats.invalid_responses} repaired={stats.repaired_responses}\t" \
+               f"avg={stats.total_seconds / stats.calls:.2f}s p50<={p50}s p95<={p95}s max={stats.max_seconds:.2f}s\t" \
+               f"tokens={stats.prompt_tokens}+{stats.completion_tokens} saved~{stats.saved_prompt_tokens}\t" \
+               f"cost=${stats.cost:.4f}"
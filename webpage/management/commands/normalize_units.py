@@ -0,0 +1,38 @@
+"""Module for converting the ingredient amounts of recipes to grams, milliliters and pieces."""
+from django.core.management.base import BaseCommand
+from webpage.models import IngredientList
+from webpage.modules.quantities import BATCH_SIZE, normalize_queryset
+
+
+class Command(BaseCommand):
+    """Command to fill in the normalized quantities of the ingredient lines, e.g. after the unit registry changed."""
+
+    help = 'Convert the ingredient amounts to grams, milliliters and pieces'
+
+    def add_arguments(self, parser):
+        """
+        Add the command line arguments.
+
+        :param parser: The argument parser.
+        """
+        parser.add_argument('--ingredient', type=int, action='append',
+                            help='Only the lines of this ingredient id. Can be repeated.')
+        parser.add_argument('--missing', action='store_true',
+                            help='Only the lines without any normalized quantity.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Number of lines converted per query.')
+
+    def handle(self, *args, **options):
+        """
+        Convert the selected lines.
+
+        :param *args: Positional arguments.
+        :param **options: Keyword arguments.
+        """
+        lines = IngredientList.objects.all()
+        if options['ingredient']:
+            lines = lines.filter(ingredient_id__in=options['ingredient'])
+        if options['missing']:
+            lines = lines.filter(grams__isnull=True, milliliters__isnull=True, pieces__isnull=True)
+        count = normalize_queryset(lines, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Normalized {count} ingredient line(s)"))
@@ -0,0 +1,47 @@
+"""Module for loading and inspecting the nutrients per gram of the ingredients."""
+import csv
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from webpage.models import IngredientNutrient
+from webpage.modules.nutrition_engine import MIN_SAMPLES, estimate_nutrition, load_nutrient_table
+
+
+class Command(BaseCommand):
+    """Command to load a nutrient dataset into the table used by the nutrition engine, or to show its coverage."""
+
+    help = 'Load a CSV of nutrients per 100 g of ingredients, or show how many ingredients the table covers'
+
+    def add_arguments(self, parser):
+        """
+        Add the command line arguments.
+
+        :param parser: The argument parser.
+        """
+        parser.add_argument('--load', metavar='CSV',
+                            help='A CSV file with the columns ingredient, nutrient, unit and per_100g.')
+        parser.add_argument('--recipe', type=int, help='Print the nutrition the engine calculates for this recipe.')
+
+    def handle(self, *args, **options):
+        """
+        Load the dataset, or print the coverage of the table.
+
+        :param *args: Positional arguments.
+        :param **options: Keyword arguments.
+        """
+        if options['load']:
+            with open(options['load'], newline='', encoding='utf-8') as file:
+                count = load_nutrient_table(csv.DictReader(file))
+            self.stdout.write(self.style.SUCCESS(f"Loaded {count} nutrient row(s)"))
+        if options['recipe']:
+            estimate = estimate_nutrition(options['recipe'])
+            for nutrient in estimate.nutrients:
+                self.stdout.write(f"{nutrient['name']}\t{nutrient['amount']} {nutrient['unit']}")
+            for line in estimate.unknown:
+                self.stdout.write(f"Unknown: {line}")
+            return
+
+        trusted = IngredientNutrient.objects.filter(samples__gte=MIN_SAMPLES)
+        coverage = trusted.aggregate(ingredients=Count('ingredient', distinct=True),
+                                     nutrients=Count('nutrition', distinct=True))
+        self.stdout.write(f"{coverage['ingredients']} ingredient(s), {coverage['nutrients']} nutrient(s), "
+                          f"{trusted.count()} row(s) with at least {MIN_SAMPLES} sample(s)")
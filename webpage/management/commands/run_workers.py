@@ -0,0 +1,85 @@
+"""Module for processing the background job queue."""
+import socket
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from decouple import config
+from webpage.modules import job_queue, telemetry
+from webpage.modules.model_router import default_router
+# Import the modules defining job handlers so that they are registered.
+from webpage.modules import recipe_enrichment, recipe_snapshot  # noqa: F401
+
+
+class Command(BaseCommand):
+    """Command to run workers that process the background job queue."""
+
+    help = 'Run workers that process queued background jobs'
+
+    def add_arguments(self, parser):
+        """
+        Add the command line arguments.
+
+        :param parser: The argument parser.
+        """
+        parser.add_argument('--concurrency', type=int, default=config('WORKER_CONCURRENCY', cast=int, default=2),
+                            help='Number of worker threads.')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait before polling an empty queue again.')
+        parser.add_argument('--stale-after', type=float, default=600,
+                            help='Seconds after which a running job is assumed abandoned and queued again.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty instead of polling forever.')
+
+    def handle(self, *args, **options):
+        """
+        Start the worker threads and wait for them until interrupted.
+
+        :param *args: Positional arguments.
+        :param **options: Keyword arguments.
+        """
+        requeued = job_queue.requeue_stale_jobs(options['stale_after'])
+        if requeued:
+            self.stdout.write(self.style.WARNING(f"Queued {requeued} abandoned job(s) again"))
+
+        stop = threading.Event()
+        prefix = f"{socket.gethostname()}:{threading.get_native_id()}"
+        threads = [
+            threading.Thread(target=self.worker_loop, args=(f"{prefix}:{number}", stop, options), daemon=True)
+            for number in range(options['concurrency'])
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(self.style.SUCCESS(f"Started {len(threads)} worker(s)"))
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(0.2)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping workers after their current job...")
+            stop.set()
+            for thread in threads:
+                thread.join()
+        finally:
+            telemetry.collector.flush()
+            default_router.flush()
+
+    def worker_loop(self, worker_id: str, stop: threading.Event, options: dict):
+        """
+        Process jobs until stopped, or until the queue is empty when running with --once.
+
+        :param worker_id: The name of the worker.
+        :param stop: Event set when the command is interrupted.
+        :param options: The command options.
+        """
+        try:
+            while not stop.is_set():
+                close_old_connections()
+                if job_queue.work(worker_id):
+                    telemetry.collector.flush_if_due()
+                    default_router.flush_if_possible()
+                    continue
+                if options['once']:
+                    break
+                stop.wait(options['poll_interval'])
+        finally:
+            connection.close()
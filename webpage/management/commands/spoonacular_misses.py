@@ -0,0 +1,47 @@
+"""Module for inspecting and clearing the Spoonacular ids that failed to load."""
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from webpage.models import SpoonacularMiss
+from webpage.modules.spoonacular_miss import clear_misses
+
+
+class Command(BaseCommand):
+    """Command to list or clear the remembered Spoonacular failures."""
+
+    help = 'List the Spoonacular recipe ids that are skipped after failing, or clear them'
+
+    def add_arguments(self, parser):
+        """
+        Add the command line arguments.
+
+        :param parser: The argument parser.
+        """
+        parser.add_argument('ids', nargs='*', type=int,
+                            help='Only these Spoonacular recipe ids.')
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete the failures so the ids are requested again.')
+        parser.add_argument('--expired', action='store_true',
+                            help='Only the failures that already expired.')
+
+    def handle(self, *args, **options):
+        """
+        List or clear the failures.
+
+        :param *args: Positional arguments.
+        :param **options: Keyword arguments.
+        """
+        ids = options['ids'] or None
+        if options['clear']:
+            count = clear_misses(ids, expired_only=options['expired'])
+            self.stdout.write(self.style.SUCCESS(f"Cleared {count} failure(s)"))
+            return
+
+        misses = SpoonacularMiss.objects.order_by('-failed_at')
+        if ids is not None:
+            misses = misses.filter(spoonacular_id__in=ids)
+        now = timezone.now()
+        if options['expired']:
+            misses = misses.filter(expires_at__lte=now)
+        for miss in misses:
+            state = "expired" if miss.expires_at <= now else f"until {miss.expires_at:%Y-%m-%d %H:%M:%S}"
+            self.stdout.write(f"{miss.spoonacular_id}\t{miss.reason}\t{miss.hits} skipped\t{state}")
@@ -0,0 +1,68 @@
+"""Module for removing partial recipes and unreferenced catalog rows."""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import QuerySet
+from webpage.models import Recipe, Ingredient, Equipment, Nutrition
+from webpage.modules.builder import SPOONACULAR_USERNAME
+
+
+class Command(BaseCommand):
+    """Command to delete rows left behind by failed imports, in small batches."""
+
+    help = 'Delete partial Spoonacular recipes and catalog rows that no recipe uses'
+
+    def add_arguments(self, parser):
+        """
+        Add the command line arguments.
+
+        :param parser: The argument parser.
+        """
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of rows deleted per transaction.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the rows that would be deleted.')
+
+    def handle(self, *args, **options):
+        """
+        Sweep the partial recipes first, then the catalog rows they were the last users of.
+
+        :param *args: Positional arguments.
+        :param **options: Keyword arguments.
+        """
+        sweeps = [
+            ('recipes', Recipe.objects.filter(poster_id__username=SPOONACULAR_USERNAME, spoonacular_id__isnull=True)),
+            ('ingredients', Ingredient.objects.filter(
+                ingredientlist__isnull=True, ingredientnutrient__isnull=True, substitutions__isnull=True)),
+            ('equipment', Equipment.objects.filter(equipmentlist__isnull=True)),
+            ('nutrition', Nutrition.objects.filter(nutritionlist__isnull=True, ingredientnutrient__isnull=True)),
+        ]
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        for label, queryset in sweeps:
+            count = self.sweep(queryset, options['batch_size'], options['dry_run'])
+            self.stdout.write(self.style.SUCCESS(f"{verb} {count} orphan {label}"))
+
+    def sweep(self, queryset: QuerySet, batch_size: int, dry_run: bool) -> int:
+        """
+        Delete the rows of the queryset in batches ordered by id, resuming after the last id seen.
+
+        Each batch is checked against the queryset again when deleting, so a row that got referenced in the meantime
+        is kept.
+
+        :param queryset: The rows to delete.
+        :param batch_size: The number of rows per batch.
+        :param dry_run: Whether to only count the rows.
+        :return: The number of rows deleted, or that would be deleted.
+        """
+        total = 0
+        last_id = 0
+        while True:
+            ids = list(queryset.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return total
+            last_id = ids[-1]
+            if dry_run:
+                total += len(ids)
+                continue
+            with transaction.atomic():
+                _, deleted = queryset.filter(id__in=ids).delete()
+            total += deleted.get(queryset.model._meta.label, 0)
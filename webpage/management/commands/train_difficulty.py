@@ -0,0 +1,42 @@
+"""Module for training the local classifier of the recipe difficulty."""
+from django.core.management.base import BaseCommand, CommandError
+from webpage.modules import difficulty_model
+from webpage.modules.difficulty_model import DifficultyModel
+
+
+class Command(BaseCommand):
+    """Command to train the difficulty classifier on the recipes GPT rated, so confident recipes skip GPT."""
+
+    help = 'Train the local difficulty classifier on the recipes that already have a difficulty'
+
+    def add_arguments(self, parser):
+        """
+        Add the command line arguments.
+
+        :param parser: The argument parser.
+        """
+        parser.add_argument('--min-confidence', type=float, default=difficulty_model.MIN_CONFIDENCE,
+                            help='Confidence to report the coverage and accuracy at.')
+        parser.add_argument('--dry-run', action='store_true', help='Report the accuracy without saving.')
+
+    def handle(self, *args, **options):
+        """
+        Train the classifier, print how it did on the held out recipes and save it.
+
+        :param *args: Positional arguments.
+        :param **options: Keyword arguments.
+        """
+        try:
+            model = DifficultyModel.train(min_confidence=options['min_confidence'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        metrics = model.metrics
+        self.stdout.write(f"Trained on {metrics['samples']} recipe(s), {metrics['held_out']} held out: "
+                          f"accuracy {metrics['accuracy']:.0%}")
+        confident_accuracy = metrics['confident_accuracy']
+        self.stdout.write(f"Confidence >= {metrics['min_confidence']}: {metrics['coverage']:.0%} of the recipes, "
+                          f"accuracy {'n/a' if confident_accuracy is None else f'{confident_accuracy:.0%}'}")
+        if options['dry_run']:
+            return
+        model.save()
+        self.stdout.write(self.style.SUCCESS(f"Saved the classifier to {difficulty_model.MODEL_PATH}"))
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0026_custom_cuisine'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='equipment',
+            name='normalized_name',
+            field=models.CharField(editable=False, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='normalized_name',
+            field=models.CharField(editable=False, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='nutrition',
+            name='normalized_name',
+            field=models.CharField(editable=False, max_length=100, null=True),
+        ),
+    ]
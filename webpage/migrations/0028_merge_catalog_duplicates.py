@@ -0,0 +1,68 @@
+import re
+
+from django.db import migrations
+
+BATCH_SIZE = 500
+
+CATALOG = [
+    ('Ingredient', 'IngredientList', 'ingredient'),
+    ('Equipment', 'EquipmentList', 'equipment'),
+    ('Nutrition', 'NutritionList', 'nutrition'),
+]
+
+
+def normalize_name(name):
+    """Return the name stripped, case-folded and with its whitespace collapsed, frozen from webpage.models."""
+    return re.sub(r'\s+', ' ', name or '').strip().casefold()
+
+
+def merge_catalog(apps, model_name, list_name, fk_name):
+    """Fill normalized_name and fold every duplicate into the entry with the lowest id."""
+    Model = apps.get_model('webpage', model_name)
+    ListModel = apps.get_model('webpage', list_name)
+    has_picture = model_name != 'Nutrition'
+    survivors = {}
+    last_pk = 0
+    while True:
+        batch = list(Model.objects.filter(pk__gt=last_pk).order_by('pk')[:BATCH_SIZE])
+        if not batch:
+            break
+        last_pk = batch[-1].pk
+        keep, duplicates, filled = [], {}, {}
+        for row in batch:
+            key = normalize_name(row.name)
+            survivor = survivors.get(key)
+            if survivor is None:
+                row.normalized_name = key
+                survivors[key] = row
+                keep.append(row)
+                continue
+            duplicates.setdefault(survivor.pk, []).append(row.pk)
+            if has_picture and not survivor.picture and row.picture:
+                survivor.picture = row.picture
+                filled[survivor.pk] = survivor
+            if survivor.spoonacular_id is None and row.spoonacular_id is not None:
+                survivor.spoonacular_id = row.spoonacular_id
+                filled[survivor.pk] = survivor
+        Model.objects.bulk_update(keep, ['normalized_name'])
+        for survivor_pk, duplicate_pks in duplicates.items():
+            ListModel.objects.filter(**{f'{fk_name}_id__in': duplicate_pks}).update(**{f'{fk_name}_id': survivor_pk})
+        Model.objects.filter(pk__in=[pk for pks in duplicates.values() for pk in pks]).delete()
+        fields = ['spoonacular_id', 'picture'] if has_picture else ['spoonacular_id']
+        Model.objects.bulk_update(filled.values(), fields)
+
+
+def merge_duplicates(apps, schema_editor):
+    for model_name, list_name, fk_name in CATALOG:
+        merge_catalog(apps, model_name, list_name, fk_name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0027_catalog_normalized_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0028_merge_catalog_duplicates'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='equipment',
+            name='normalized_name',
+            field=models.CharField(editable=False, max_length=100, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='ingredient',
+            name='normalized_name',
+            field=models.CharField(editable=False, max_length=100, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='nutrition',
+            name='normalized_name',
+            field=models.CharField(editable=False, max_length=100, unique=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.1 on 2026-10-19 16:14
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0031_recipesnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpoonacularMiss',
+            fields=[
+                ('spoonacular_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('status_code', models.IntegerField(blank=True, null=True)),
+                ('reason', models.CharField(max_length=200)),
+                ('hits', models.IntegerField(default=0)),
+                ('failed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
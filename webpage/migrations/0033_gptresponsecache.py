@@ -0,0 +1,26 @@
+# Generated by Django 5.1.1 on 2026-10-19 16:15
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0032_spoonacularmiss'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GPTResponseCache',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('call_type', models.CharField(db_index=True, max_length=50)),
+                ('model', models.CharField(max_length=50)),
+                ('response', models.TextField()),
+                ('hits', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.1 on 2026-10-19 16:27
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0033_gptresponsecache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnrichmentBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('backend', models.CharField(max_length=20)),
+                ('batch_id', models.CharField(max_length=100, unique=True)),
+                ('status', models.CharField(choices=[('submitted', 'Submitted'), ('applied', 'Applied'), ('failed', 'Failed')], db_index=True, default='submitted', max_length=20)),
+                ('recipes', models.JSONField(default=dict)),
+                ('input_file', models.CharField(max_length=300)),
+                ('applied', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='enriched_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
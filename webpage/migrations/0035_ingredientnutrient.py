@@ -0,0 +1,29 @@
+# Generated by Django 5.1.1 on 2026-10-19 16:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0034_enrichmentbatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngredientNutrient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('per_gram', models.FloatField()),
+                ('unit', models.CharField(max_length=50)),
+                ('samples', models.IntegerField(default=1)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='webpage.ingredient')),
+                ('nutrition', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='webpage.nutrition')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('ingredient', 'nutrition'), name='unique_ingredient_nutrient')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.1 on 2026-10-19 16:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0035_ingredientnutrient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='density',
+            field=models.FloatField(blank=True, help_text='Grams per milliliter, water if empty.', null=True),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='piece_weight',
+            field=models.FloatField(blank=True, help_text='Grams per piece, e.g. per slice or clove.', null=True),
+        ),
+        migrations.AddField(
+            model_name='ingredientlist',
+            name='grams',
+            field=models.FloatField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='ingredientlist',
+            name='milliliters',
+            field=models.FloatField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='ingredientlist',
+            name='pieces',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='ingredientlist',
+            name='unit_key',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=100),
+        ),
+    ]
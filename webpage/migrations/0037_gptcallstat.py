@@ -0,0 +1,35 @@
+# Generated by Django 5.1.1 on 2026-10-19 16:43
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0036_normalized_quantities'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GPTCallStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(default=django.utils.timezone.localdate)),
+                ('method', models.CharField(max_length=50)),
+                ('model', models.CharField(max_length=50)),
+                ('outcome', models.CharField(choices=[('ok', 'OK'), ('cached', 'Cached'), ('failed', 'Failed'), ('unavailable', 'Unavailable')], max_length=20)),
+                ('calls', models.IntegerField(default=0)),
+                ('retries', models.IntegerField(default=0)),
+                ('total_seconds', models.FloatField(default=0)),
+                ('max_seconds', models.FloatField(default=0)),
+                ('prompt_tokens', models.BigIntegerField(default=0)),
+                ('completion_tokens', models.BigIntegerField(default=0)),
+                ('cost', models.FloatField(default=0, help_text='US dollars, from the token prices of the model.')),
+                ('latency_buckets', models.JSONField(default=list, help_text='Calls per latency bucket of the telemetry module.')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'method', 'model', 'outcome'), name='unique_gpt_call_stat')],
+            },
+        ),
+    ]
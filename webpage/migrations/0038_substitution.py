@@ -0,0 +1,33 @@
+# Generated by Django 5.1.1 on 2026-10-19 16:47
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0037_gptcallstat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Substitution',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('diets', models.CharField(blank=True, default='', max_length=500)),
+                ('cuisines', models.CharField(blank=True, default='', max_length=500)),
+                ('alternatives', models.JSONField(default=list)),
+                ('amount', models.FloatField(blank=True, null=True)),
+                ('unit_key', models.CharField(blank=True, default='', max_length=50)),
+                ('hits', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_used_at', models.DateTimeField(blank=True, null=True)),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='substitutions', to='webpage.ingredient')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('ingredient', 'diets', 'cuisines'), name='unique_substitution')],
+            },
+        ),
+    ]
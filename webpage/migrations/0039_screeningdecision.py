@@ -0,0 +1,27 @@
+# Generated by Django 5.1.1 on 2026-10-19 17:00
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0038_substitution'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScreeningDecision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('verdict', models.CharField(choices=[('pass', 'Pass'), ('flag', 'Flag'), ('reject', 'Reject')], db_index=True, max_length=20)),
+                ('rule', models.CharField(blank=True, default='', max_length=50)),
+                ('detail', models.CharField(blank=True, default='', max_length=500)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('duplicate_of', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='webpage.recipe')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='screenings', to='webpage.recipe')),
+            ],
+        ),
+    ]
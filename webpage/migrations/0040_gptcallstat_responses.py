@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-19 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0039_screeningdecision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gptcallstat',
+            name='invalid_responses',
+            field=models.IntegerField(default=0, help_text='Responses that could not be used and were asked again.'),
+        ),
+        migrations.AddField(
+            model_name='gptcallstat',
+            name='repaired_responses',
+            field=models.IntegerField(default=0, help_text='Responses whose JSON had to be repaired.'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-19 17:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0040_gptcallstat_responses'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gptcallstat',
+            name='saved_prompt_tokens',
+            field=models.BigIntegerField(default=0, help_text='Estimated prompt tokens saved by the compaction.'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.1 on 2026-10-19 17:25
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0041_gptcallstat_saved_prompt_tokens'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoutingDecision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=20)),
+                ('model', models.CharField(max_length=50)),
+                ('action', models.CharField(choices=[('demote', 'Demote'), ('probe', 'Probe'), ('restore', 'Restore')], db_index=True, max_length=20)),
+                ('reason', models.CharField(blank=True, default='', max_length=200)),
+                ('routed_to', models.CharField(blank=True, default='', help_text='The model the requests of the task are sent to from now on.', max_length=50)),
+                ('requests', models.IntegerField(default=0, help_text='Requests in the rolling window of the model.')),
+                ('p95_seconds', models.FloatField(default=0)),
+                ('error_rate', models.FloatField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='gptcallstat',
+            name='fallbacks',
+            field=models.IntegerField(default=0, help_text='Calls the router sent to a fallback model of the task.'),
+        ),
+    ]
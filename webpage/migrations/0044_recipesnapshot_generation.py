@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-19 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0043_flightlock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipesnapshot',
+            name='generation',
+            field=models.IntegerField(default=0),
+        ),
+    ]
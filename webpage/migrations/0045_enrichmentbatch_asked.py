@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-19 18:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0044_recipesnapshot_generation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='enrichmentbatch',
+            name='asked',
+            field=models.JSONField(default=dict),
+        ),
+    ]
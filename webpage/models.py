@@ -3,26 +3,136 @@ This module defines the models for the recipe application, including models.
 
 For Recipe, Ingredient, Equipment, Diet, Nutrition, and their relationships.
 """
+import math
+import re
+from typing import Iterable
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.db.models import QuerySet
+from django.dispatch import Signal
 from django.contrib.auth.models import User
 from django.utils import timezone
-from webpage.modules.status_code import StatusCode
+from webpage.modules.status_code import StatusCode, JobStatus, BatchStatus, CallOutcome, ScreeningVerdict, RoutingAction
+from webpage.modules.units import convert
 
+NORMALIZED_QUANTITIES = ('grams', 'milliliters', 'pieces')
+# Sent by CatalogEntry.upsert_many with the existing `entries` whose fields it changed, as bulk writes skip post_save.
+catalog_entries_updated = Signal()
 
-class Ingredient(models.Model):
+
+def normalize_name(name: str) -> str:
+    """
+    Return the key used to deduplicate catalog entries.
+
+    :param name: The name as typed by the user or returned by Spoonacular.
+    :return: The name stripped, case-folded and with its whitespace collapsed.
+    """
+    return re.sub(r'\s+', ' ', name or '').strip().casefold()
+
+
+class CatalogEntry(models.Model):
+    """
+    Base class for the shared catalog (ingredients, equipment and nutrition).
+
+    Each entry is unique on its normalized name, so lookups and upserts are a single index probe.
+    """
+
+    normalized_name = models.CharField(max_length=100, unique=True, editable=False)
+
+    class Meta:
+        """Do not create a table for the base class."""
+
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        """Keep the normalized name in sync with the name before saving."""
+        self.normalized_name = normalize_name(self.name)
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def upsert_many(cls, rows: Iterable[dict], update_fields: list[str] | None = None) -> dict[str, 'CatalogEntry']:
+        """
+        Insert the missing entries and return every entry keyed by its normalized name.
+
+        The rows are written with one INSERT ... ON CONFLICT statement and read back with one query. The existing
+        entries whose update_fields changed are sent with catalog_entries_updated.
+
+        :param rows: Dictionaries of field values, each containing at least `name`.
+        :param update_fields: The fields refreshed on existing entries, none by default.
+        :return: A dictionary mapping the normalized name to the saved entry.
+        """
+        objects: dict[str, CatalogEntry] = {}
+        for row in rows:
+            key = normalize_name(row['name'])
+            if key and key not in objects:
+                objects[key] = cls(normalized_name=key, **row)
+        if not objects:
+            return {}
+        before = {} if not update_fields else {
+            values[0]: values[1:] for values in
+            cls.objects.filter(normalized_name__in=list(objects)).values_list('normalized_name', *update_fields)
+        }
+        cls._release_taken_spoonacular_ids(objects)
+        cls.objects.bulk_create(
+            objects.values(),
+            update_conflicts=True,
+            unique_fields=['normalized_name'],
+            update_fields=update_fields or ['normalized_name'],
+        )
+        saved = cls.objects.in_bulk(list(objects), field_name='normalized_name')
+        changed = [saved[key] for key, values in before.items()
+                   if values != tuple(getattr(saved[key], field) for field in update_fields)]
+        if changed:
+            catalog_entries_updated.send(sender=cls, entries=changed)
+        return saved
+
+    @classmethod
+    def upsert(cls, name: str, **fields) -> 'CatalogEntry':
+        """
+        Return the entry with the given name, creating it if it does not exist.
+
+        :param name: The name of the entry.
+        :param fields: Other field values used when the entry is created.
+        :return: The saved entry.
+        """
+        return cls.upsert_many([dict(name=name, **fields)])[normalize_name(name)]
+
+    @classmethod
+    def _release_taken_spoonacular_ids(cls, objects: dict[str, 'CatalogEntry']):
+        """
+        Drop the spoonacular_id of new entries when another entry already owns it.
+
+        :param objects: The entries about to be inserted, keyed by normalized name.
+        """
+        seen = set()
+        for entry in objects.values():
+            if entry.spoonacular_id in seen:
+                entry.spoonacular_id = None
+            elif entry.spoonacular_id is not None:
+                seen.add(entry.spoonacular_id)
+        if not seen:
+            return
+        taken = dict(cls.objects.filter(spoonacular_id__in=seen).values_list('spoonacular_id', 'normalized_name'))
+        for key, entry in objects.items():
+            if entry.spoonacular_id in taken and taken[entry.spoonacular_id] != key:
+                entry.spoonacular_id = None
+
+
+class Ingredient(CatalogEntry):
     """An ingredient contains the name, a spoonacular_id(if exists) and a link to a picture."""
 
     name = models.CharField(max_length=100, default='Unnamed Ingredient')
     spoonacular_id = models.IntegerField(unique=True, null=True, blank=True)
     picture = models.CharField(max_length=200, null=True, blank=True)
+    density = models.FloatField(null=True, blank=True, help_text='Grams per milliliter, water if empty.')
+    piece_weight = models.FloatField(null=True, blank=True, help_text='Grams per piece, e.g. per slice or clove.')
 
     def __str__(self):
         """Return the ingredient name."""
         return self.name
 
 
-class Equipment(models.Model):
+class Equipment(CatalogEntry):
     """Equipment contains the name, a spoonacular_id(if exists) and a link to a picture."""
 
     name = models.CharField(max_length=100, default='Unnamed Equipment')
@@ -47,12 +157,34 @@ class RecipeStep(models.Model):
 
 
 class IngredientList(models.Model):
-    """The relations representing which ingredient is used in which recipe."""
+    """
+    The relations representing which ingredient is used in which recipe.
+
+    The amount is also stored in grams, milliliters and pieces, whichever can be known, so quantities can be added up
+    and compared in the database.
+    """
 
     ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
     recipe = models.ForeignKey('Recipe', on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     unit = models.CharField(max_length=100)
+    unit_key = models.CharField(max_length=100, blank=True, default='', db_index=True, editable=False)
+    grams = models.FloatField(null=True, blank=True, db_index=True, editable=False)
+    milliliters = models.FloatField(null=True, blank=True, db_index=True, editable=False)
+    pieces = models.FloatField(null=True, blank=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        """Keep the normalized quantities in sync with the amount and unit before saving."""
+        self.normalize()
+        super().save(*args, **kwargs)
+
+    def normalize(self):
+        """Convert the amount to grams, milliliters and pieces with the density and piece weight of the ingredient."""
+        quantities = convert([self.amount], [self.unit], [self.ingredient.density], [self.ingredient.piece_weight])
+        self.unit_key = quantities['unit_key'][0]
+        for field in NORMALIZED_QUANTITIES:
+            value = quantities[field][0]
+            setattr(self, field, None if math.isnan(value) else float(value))
 
 
 class EquipmentList(models.Model):
@@ -84,7 +216,7 @@ class Cuisine(models.Model):
         return self.name
 
 
-class Nutrition(models.Model):
+class Nutrition(CatalogEntry):
     """Nutrition, contains a nutrition for each recipe."""
 
     name = models.CharField(max_length=100)
@@ -104,6 +236,55 @@ class NutritionList(models.Model):
         return f'{self.nutrition.name}: {self.amount} {self.unit}'
 
 
+class IngredientNutrient(models.Model):
+    """The amount of a nutrient in one gram of an ingredient, averaged over the samples it was learned from."""
+
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
+    nutrition = models.ForeignKey(Nutrition, on_delete=models.CASCADE)
+    per_gram = models.FloatField()
+    unit = models.CharField(max_length=50)
+    samples = models.IntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        """Keep one row per ingredient and nutrient."""
+
+        constraints = [models.UniqueConstraint(fields=['ingredient', 'nutrition'], name='unique_ingredient_nutrient')]
+
+    def __str__(self):
+        """Return the nutrient per gram of the ingredient."""
+        return f'{self.ingredient.name}: {self.per_gram} {self.unit} {self.nutrition.name} per g'
+
+
+class Substitution(models.Model):
+    """
+    The alternatives to a missing ingredient suggested by GPT, reused for recipes with the same diets and cuisines.
+
+    `diets` and `cuisines` hold the normalized names of the recipe asked about, sorted and joined by commas.
+    `amount` and `unit_key` are the quantity of the ingredient in that recipe, to scale the alternatives to others.
+    """
+
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE, related_name='substitutions')
+    diets = models.CharField(max_length=500, blank=True, default='')
+    cuisines = models.CharField(max_length=500, blank=True, default='')
+    alternatives = models.JSONField(default=list)
+    amount = models.FloatField(null=True, blank=True)
+    unit_key = models.CharField(max_length=50, blank=True, default='')
+    hits = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    last_used_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        """Keep one row per ingredient, diets and cuisines."""
+
+        constraints = [models.UniqueConstraint(fields=['ingredient', 'diets', 'cuisines'],
+                                               name='unique_substitution')]
+
+    def __str__(self):
+        """Return the ingredient and the context of the alternatives."""
+        return f'{self.ingredient.name} ({self.diets or "any diet"}; {self.cuisines or "any cuisine"})'
+
+
 class Recipe(models.Model):
     """The recipe class containing information about the recipe and methods."""
 
@@ -119,6 +300,7 @@ class Recipe(models.Model):
     status = models.CharField(max_length=30, choices=StatusCode.get_choice(), default=StatusCode.PENDING.value[0])
     difficulty = models.CharField(max_length=30, default='Unknown')
     AI_status = models.BooleanField(default=False)
+    enriched_at = models.DateTimeField(null=True, blank=True, db_index=True)
 
     def __str__(self) -> str:
         """Return the name of the recipe."""
@@ -173,3 +355,176 @@ class Profile(models.Model):
     def __str__(self):
         """Return the user's profile."""
         return f"{self.user.username}'s Profile"
+
+
+class RecipeSnapshot(models.Model):
+    """A denormalized copy of everything the recipe detail page shows, rebuilt when the recipe changes."""
+
+    recipe = models.OneToOneField(Recipe, primary_key=True, related_name='snapshot', on_delete=models.CASCADE)
+    version = models.IntegerField(default=0)
+    stale = models.BooleanField(default=False)
+    # Increased every time the snapshot is flagged, so a rebuild only saves data read after the last change.
+    generation = models.IntegerField(default=0)
+    data = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    built_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        """Return the recipe id and version of the snapshot."""
+        return f'Snapshot of recipe {self.recipe_id} (v{self.version})'
+
+
+class SpoonacularMiss(models.Model):
+    """A Spoonacular recipe id that failed to load recently, so it is not requested again until the entry expires."""
+
+    spoonacular_id = models.IntegerField(primary_key=True)
+    status_code = models.IntegerField(null=True, blank=True)
+    reason = models.CharField(max_length=200)
+    hits = models.IntegerField(default=0)
+    failed_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        """Return the id and the reason of the failure."""
+        return f'Spoonacular recipe {self.spoonacular_id}: {self.reason}'
+
+
+class GPTResponseCache(models.Model):
+    """A stored response of the GPT model, reused for the same model, context, input and sampling parameters."""
+
+    key = models.CharField(max_length=64, primary_key=True)
+    call_type = models.CharField(max_length=50, db_index=True)
+    model = models.CharField(max_length=50)
+    response = models.TextField()
+    hits = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        """Return the call type and the key of the response."""
+        return f'{self.call_type} response {self.key[:12]}'
+
+
+class GPTCallStat(models.Model):
+    """The calls of one AI advisor method to one GPT model with one outcome on one day, added up."""
+
+    day = models.DateField(default=timezone.localdate)
+    method = models.CharField(max_length=50)
+    model = models.CharField(max_length=50)
+    outcome = models.CharField(max_length=20, choices=CallOutcome.get_choice())
+    calls = models.IntegerField(default=0)
+    retries = models.IntegerField(default=0)
+    total_seconds = models.FloatField(default=0)
+    max_seconds = models.FloatField(default=0)
+    prompt_tokens = models.BigIntegerField(default=0)
+    completion_tokens = models.BigIntegerField(default=0)
+    cost = models.FloatField(default=0, help_text="US dollars, from the token prices of the model.")
+    invalid_responses = models.IntegerField(default=0, help_text="Responses that could not be used and were asked again.")
+    repaired_responses = models.IntegerField(default=0, help_text="Responses whose JSON had to be repaired.")
+    saved_prompt_tokens = models.BigIntegerField(default=0, help_text="Estimated prompt tokens saved by the compaction.")
+    fallbacks = models.IntegerField(default=0, help_text="Calls the router sent to a fallback model of the task.")
+    latency_buckets = models.JSONField(default=list, help_text="Calls per latency bucket of the telemetry module.")
+
+    class Meta:
+        """Keep one row per day, method, model and outcome."""
+
+        constraints = [models.UniqueConstraint(fields=['day', 'method', 'model', 'outcome'],
+                                               name='unique_gpt_call_stat')]
+
+    def __str__(self):
+        """Return the day, method and outcome of the calls."""
+        return f'{self.day} {self.method} ({self.outcome})'
+
+
+class ScreeningDecision(models.Model):
+    """What the pre-screening rules decided about a submitted recipe, and the rule that decided it."""
+
+    recipe = models.ForeignKey('Recipe', on_delete=models.CASCADE, related_name='screenings')
+    verdict = models.CharField(max_length=20, choices=ScreeningVerdict.get_choice(), db_index=True)
+    rule = models.CharField(max_length=50, blank=True, default='')
+    detail = models.CharField(max_length=500, blank=True, default='')
+    duplicate_of = models.ForeignKey('Recipe', null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        """Return the recipe, verdict and rule."""
+        return f'{self.recipe.name}: {self.verdict}{f" ({self.rule})" if self.rule else ""}'
+
+
+class RoutingDecision(models.Model):
+    """A model of a task demoted for breaching its latency or error objective, probed again, or restored."""
+
+    task = models.CharField(max_length=20)
+    model = models.CharField(max_length=50)
+    action = models.CharField(max_length=20, choices=RoutingAction.get_choice(), db_index=True)
+    reason = models.CharField(max_length=200, blank=True, default='')
+    routed_to = models.CharField(max_length=50, blank=True, default='',
+                                 help_text="The model the requests of the task are sent to from now on.")
+    requests = models.IntegerField(default=0, help_text="Requests in the rolling window of the model.")
+    p95_seconds = models.FloatField(default=0)
+    error_rate = models.FloatField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        """Return the action, task and model."""
+        return f'{self.action} {self.model} for {self.task}'
+
+
+class EnrichmentBatch(models.Model):
+    """A batch file of recipe assessments submitted to a batch backend, whose results are applied once it finishes."""
+
+    backend = models.CharField(max_length=20)
+    batch_id = models.CharField(max_length=100, unique=True)
+    status = models.CharField(max_length=20, choices=BatchStatus.get_choice(), default=BatchStatus.SUBMITTED.value[0],
+                              db_index=True)
+    recipes = models.JSONField(default=dict)
+    # What the request of each recipe asked for, keyed by recipe id, e.g. the fields left to GPT.
+    asked = models.JSONField(default=dict)
+    input_file = models.CharField(max_length=300)
+    applied = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        """Return the backend, batch id and status of the batch."""
+        return f'{self.backend} batch {self.batch_id} ({self.status})'
+
+
+class Job(models.Model):
+    """A unit of background work stored in the database and processed by the run_workers command."""
+
+    kind = models.CharField(max_length=50, db_index=True)
+    payload = models.JSONField(default=dict)
+    attachment = models.BinaryField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=JobStatus.get_choice(), default=JobStatus.QUEUED.value[0])
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        """Index the columns the workers poll on."""
+
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    def __str__(self):
+        """Return the kind, id and status of the job."""
+        return f'{self.kind} #{self.pk} ({self.status})'
+
+
+class FlightLock(models.Model):
+    """A call to an external service running in one worker, which the other workers wait for instead of repeating it."""
+
+    key = models.CharField(max_length=255, unique=True)
+    token = models.CharField(max_length=32)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        """Return the key of the call and when the lock expires."""
+        return f'{self.key} until {self.expires_at:%H:%M:%S}'
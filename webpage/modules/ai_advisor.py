@@ -1,14 +1,71 @@
 """Generate response from the AI about the recipe."""
 
-from webpage.models import Recipe, Ingredient
-from webpage.modules.gpt_handler import GPTHandler
+import asyncio
+from typing import Any, Awaitable, Callable, Iterator
+from functools import cached_property
+from asgiref.sync import async_to_sync, sync_to_async
+from django.db.models import Prefetch
+from webpage.models import Recipe, Ingredient, IngredientList, EquipmentList, RecipeStep, normalize_name
+from webpage.modules.gpt_handler import AsyncGPTHandler, json_schema_format, object_schema
+from webpage.modules.json_stream import JSONArrayStream
+from webpage.modules.nutrition_engine import ingredient_line
+from webpage.modules import difficulty_model, ingredient_index, json_repair, prompt_builder, telemetry
+from webpage.modules.prompt_builder import Prompt, PromptBuilder
+from webpage.modules.ingredient_index import IngredientIndex, Neighbour
+from webpage.modules.resilience import Deadline, GPTUnavailable, is_retryable
+from webpage.modules.model_router import default_router
 from decouple import config
-import json
 import logging
+import time
 from enum import Enum
 
 logger = logging.getLogger("AI_Recipe")
 
+LIMIT = 5
+# Alternatives answered per missing ingredient when the ingredient index answers without GPT.
+LOCAL_ALTERNATIVES = 3
+# Seconds each advisor call may take when awaited together with others. The deadline of GPT_DEADLINE seconds
+# normally ends the call first, this is the outer bound.
+CALL_TIMEOUT = config('GPT_CALL_TIMEOUT', cast=float, default=60)
+DIFFICULTIES = ["Easy", "Normal", "Hard"]
+NUTRIENT_KEYS = {"name", "amount", "unit", "percentOfDailyNeeds"}
+ASSESSMENT_PROMPT = 'You are a chef embedded inside a recipe-viewing program. For the recipe given by the user, ' + \
+    'rate its difficulty based on the techniques, steps, ingredients and preparation, estimate its nutrition ' + \
+    'based on the ingredients, and decide whether it is possible to make and eatable.'
+# Answer with JSON matching a schema instead of free text, for the models and servers that support it. Without it,
+# the JSON is read from the text, repairing it if needed.
+STRUCTURED_OUTPUTS = config('GPT_STRUCTURED_OUTPUTS', cast=bool, default=True)
+NUTRIENTS_SCHEMA = {
+    "type": "array",
+    "items": object_schema({
+        "name": {"type": "string"},
+        "amount": {"type": "number"},
+        "unit": {"type": "string"},
+        "percentOfDailyNeeds": {"type": "number"},
+    }),
+}
+ASSESSMENT_PROPERTIES = {
+    "difficulty": {"type": "string", "enum": DIFFICULTIES},
+    "nutrients": NUTRIENTS_SCHEMA,
+    "approved": {"type": "boolean"},
+}
+ASSESSMENT_FIELDS = tuple(ASSESSMENT_PROPERTIES)
+
+
+def assessment_format(fields: tuple[str, ...] = ASSESSMENT_FIELDS) -> dict[str, Any]:
+    """
+    Return the structured output of an assessment, so the fields asked for come back in this shape in one response.
+
+    :param fields: The fields of the assessment, among ASSESSMENT_FIELDS.
+    :return: The response format.
+    """
+    properties = {field: ASSESSMENT_PROPERTIES[field] for field in fields}
+    return json_schema_format("recipe_assessment", object_schema(properties))
+
+
+ASSESSMENT_FORMAT = assessment_format()
+NUTRITION_FORMAT = json_schema_format("nutrition", object_schema({"nutrients": NUTRIENTS_SCHEMA}))
+
 
 class Tags(Enum):
     """The name of tag keys that should be in the output from the GPT."""
@@ -19,9 +76,32 @@ class Tags(Enum):
     UNIT_TAG: str = "unit"
 
 
+ALTERNATIVES_SCHEMA = {
+    "type": "array",
+    "items": object_schema({tag.value: {"type": "number" if tag is Tags.AMOUNT_TAG else "string"} for tag in Tags}),
+}
+# The root of a strict schema is an object, so the list of alternatives is wrapped in one.
+ALTERNATIVES_FORMAT = json_schema_format("alternative_ingredients", object_schema({"alternatives": ALTERNATIVES_SCHEMA}))
+BATCH_ALTERNATIVES_PROMPT = 'You are a chef embedded inside a recipe-viewing program. For each ingredient the user ' + \
+    'does not have, suggest alternative ingredients that fit the recipe and its diet restrictions, each with a short ' + \
+    'description and the amount and unit replacing the missing ingredient. Answer with JSON shaped like ' + \
+    '{"ingredients": [{"ingredient": "<missing ingredient>", "alternatives": [{"name": "", "description": "", ' + \
+    '"amount": 0, "unit": ""}]}]}, with one entry per missing ingredient.'
+# The alternatives of several missing ingredients in one response, each entry naming the ingredient it replaces.
+BATCH_ALTERNATIVES_FORMAT = json_schema_format("alternative_ingredients_per_ingredient", object_schema({
+    "ingredients": {
+        "type": "array",
+        "items": object_schema({"ingredient": {"type": "string"}, "alternatives": ALTERNATIVES_SCHEMA}),
+    },
+}))
+
+
 class AIRecipeAdvisor:
     """
     Generates a response from GPT about the recipe.
+
+    Every call has a blocking version and an awaitable one prefixed with `a`, so separate calls can run together
+    with gather_advice, or with run_concurrently from synchronous code.
     
     :param _recipe: The recipe that the AI will take as an input.
     :param _gpt: The GPT model handler.
@@ -29,25 +109,207 @@ class AIRecipeAdvisor:
 
     def __init__(self, recipe: Recipe):
         """
-        Initialize the class and fill out the information to put into the AI.
+        Initialize the class. The recipe is only read, and the GPT handlers only created, when a call needs them.
         
         :param recipe: The recipe that you want to generate response from.
         """
         self._recipe = recipe
-        self._gpt = GPTHandler(config("ALTER_PROMT", default="default"), "gpt-4o-mini")
-        self._difficulty_gpt = GPTHandler(config("DIFF_PROMPT", default="default"), "gpt-4o-mini")
-        self._nutrition_gpt = GPTHandler(config("NUTRITION_PROMPT", default="default"), "gpt-4o-mini")
-        self._approval_gpt = GPTHandler(config("APPROVAL_PROMPT", default="default"), "gpt-4o-mini")
-        name = "The recipe name:" + self._recipe.name
-        description = "Description:" + self._recipe.description
-        ingredients = ""
-        for ingre in self._recipe.get_ingredients():
-            ingredients += ingre.ingredient.name + " " + str(ingre.amount) + " " + ingre.unit + "\n"
-        diets = "Diet restrictions:" + ",".join([diet.name for diet in self._recipe.diets.all()])
-        self._ingredient_information = name + '\n' +\
-            description + '\n' + \
-            ingredients + '\n' + \
-            diets
+        self.answered_locally = False
+        self.local_ingredient_ids: set[int] = set()
+        self.compact = prompt_builder.COMPACT
+
+    @staticmethod
+    def _handler(context: str, call_type: str, **options) -> AsyncGPTHandler:
+        """
+        Create the handler of a kind of call, whose requests the model router sends to the models of the call type.
+
+        :param context: The context of the model.
+        :param call_type: The kind of call, e.g. 'difficulty'.
+        :param options: The other arguments of the handler, such as the response format.
+        :return: The handler.
+        """
+        return AsyncGPTHandler(context, default_router.primary(call_type), call_type=call_type,
+                               router=default_router, **options)
+
+    @cached_property
+    def _gpt(self) -> AsyncGPTHandler:
+        """The handler asked for alternative ingredients."""
+        return self._handler(config("ALTER_PROMT", default="default"), "alternatives",
+                             response_format=ALTERNATIVES_FORMAT if STRUCTURED_OUTPUTS else None)
+
+    @cached_property
+    def _batch_gpt(self) -> AsyncGPTHandler:
+        """The handler asked for the alternatives of several ingredients at once."""
+        return self._handler(config("BATCH_ALTER_PROMPT", default=BATCH_ALTERNATIVES_PROMPT), "alternatives",
+                             response_format=BATCH_ALTERNATIVES_FORMAT if STRUCTURED_OUTPUTS else None)
+
+    @cached_property
+    def _difficulty_gpt(self) -> AsyncGPTHandler:
+        """The handler asked for the difficulty."""
+        return self._handler(config("DIFF_PROMPT", default="default"), "difficulty")
+
+    @cached_property
+    def _nutrition_gpt(self) -> AsyncGPTHandler:
+        """The handler asked for the nutrition."""
+        return self._handler(config("NUTRITION_PROMPT", default="default"), "nutrition",
+                             response_format=NUTRITION_FORMAT if STRUCTURED_OUTPUTS else None)
+
+    @cached_property
+    def _approval_gpt(self) -> AsyncGPTHandler:
+        """The handler asked for the approval."""
+        return self._handler(config("APPROVAL_PROMPT", default="default"), "approval")
+
+    @cached_property
+    def _assessment_gpt(self) -> AsyncGPTHandler:
+        """The handler asked for the combined assessment."""
+        return self._handler(config("ASSESSMENT_PROMPT", default=ASSESSMENT_PROMPT), "assessment",
+                             response_format=ASSESSMENT_FORMAT)
+
+    def _assessment_handler(self, fields: tuple[str, ...]) -> AsyncGPTHandler:
+        """
+        Return the handler asked for an assessment with some of the fields.
+
+        :param fields: The fields of the assessment.
+        :return: The handler, whose response format only has these fields.
+        """
+        if fields == ASSESSMENT_FIELDS:
+            return self._assessment_gpt
+        return self._handler(config("ASSESSMENT_PROMPT", default=ASSESSMENT_PROMPT), "assessment",
+                             response_format=assessment_format(fields))
+
+    @cached_property
+    def _related(self) -> Recipe:
+        """
+        The recipe with its ingredients, equipment, steps and diets, loaded in one prefetched query set.
+
+        A separate instance is loaded, so the prefetched relations never go stale on the recipe of the caller.
+        """
+        return Recipe.objects.prefetch_related(
+            Prefetch('ingredientlist_set', queryset=IngredientList.objects.select_related('ingredient').order_by('id')),
+            Prefetch('equipmentlist_set', queryset=EquipmentList.objects.select_related('equipment').order_by('id')),
+            Prefetch('steps', queryset=RecipeStep.objects.order_by('number')),
+            'diets',
+        ).get(pk=self._recipe.pk)
+
+    @cached_property
+    def _ingredient_lines(self) -> list[str]:
+        """One line per ingredient with its amount and unit."""
+        return [ingredient_line(item.ingredient.name, item.amount, item.unit)
+                for item in self._related.ingredientlist_set.all()]
+
+    @cached_property
+    def _equipment_lines(self) -> list[str]:
+        """One line per equipment."""
+        return [item.equipment.name for item in self._related.equipmentlist_set.all()]
+
+    @cached_property
+    def _steps(self) -> list[RecipeStep]:
+        """The steps in order."""
+        return list(self._related.steps.all())
+
+    @cached_property
+    def _diet_names(self) -> str:
+        """The diets of the recipe, separated by commas."""
+        return ", ".join(diet.name for diet in self._related.diets.all())
+
+    def _prompt(self, call_type: str) -> PromptBuilder:
+        """
+        Start a prompt within the token budget of a kind of call.
+
+        :param call_type: The kind of call, e.g. 'difficulty'.
+        :return: The prompt builder.
+        """
+        return PromptBuilder(prompt_builder.BUDGETS.get(call_type), self.compact)
+
+    def _add_information(self, prompt: PromptBuilder, needs_description: bool = True,
+                         needs_diets: bool = True) -> PromptBuilder:
+        """
+        Add the name, description, ingredients and diets of the recipe to a prompt.
+
+        :param prompt: The prompt.
+        :param needs_description: Whether the method needs the description, else it is dropped from compact prompts.
+        :param needs_diets: Whether the method needs the diets, else they are dropped from compact prompts.
+        :return: The prompt.
+        """
+        return prompt.add(self._recipe.name, label="The recipe name:") \
+            .add(self._recipe.description or "", label="Description:", priority=0, optional=not needs_description) \
+            .add(self._ingredient_lines, unique=True) \
+            .add(self._diet_names, header="", label="Diet restrictions:", optional=not needs_diets)
+
+    @cached_property
+    def _index(self) -> IngredientIndex | None:
+        """The local ingredient index, None if it was not built."""
+        return ingredient_index.get_index()
+
+    def _candidates(self, ingredients: list[Ingredient]) -> dict[int, list[Neighbour]]:
+        """
+        Find the ingredients used like the missing ones in similar recipes, that fit the diets of the recipe.
+
+        :param ingredients: The missing ingredients.
+        :return: The candidates per missing ingredient id, empty if the index was not built.
+        """
+        index = self._index
+        if index is None or not ingredients:
+            return {}
+        diets = [diet.name for diet in self._related.diets.all()]
+        used = [item.ingredient_id for item in self._related.ingredientlist_set.all()]
+        return {ingredient.id: index.similar(ingredient.id, ingredient_index.CANDIDATES, diets, used,
+                                             ingredient_index.MIN_SCORE) for ingredient in ingredients}
+
+    def _local_alternatives(self, ingredients: list[Ingredient],
+                            candidates: dict[int, list[Neighbour]]) -> list[dict[str, str | int]] | None:
+        """
+        Answer the alternatives from the ingredient index, in the amount and unit of the missing ingredients.
+
+        :param ingredients: The missing ingredients.
+        :param candidates: The candidates per missing ingredient id.
+        :return: The alternatives, None if an ingredient has no candidate.
+        """
+        if not candidates or not all(candidates.values()):
+            return None
+        lines = {item.ingredient_id: item for item in self._related.ingredientlist_set.all()}
+        alternatives = []
+        for ingredient in ingredients:
+            line = lines.get(ingredient.id)
+            for neighbour in candidates[ingredient.id][:LOCAL_ALTERNATIVES]:
+                alternatives.append({
+                    Tags.NAME_TAG.value: neighbour.name,
+                    Tags.DESCRIPTION_TAG.value: f"Used like {ingredient.name.lower()} in similar recipes.",
+                    Tags.AMOUNT_TAG.value: float(line.amount) if line else 1,
+                    Tags.UNIT_TAG.value: line.unit if line else "",
+                })
+        self.answered_locally = True
+        self.local_ingredient_ids.update(ingredient.id for ingredient in ingredients)
+        return alternatives
+
+    @staticmethod
+    def _confident(candidates: dict[int, list[Neighbour]], special_ins: str | None) -> bool:
+        """
+        Return whether the index alone can answer, without a special instruction only it cannot follow.
+
+        :param candidates: The candidates per missing ingredient id.
+        :param special_ins: Special instructions, e.g., I don't like chocolate.
+        :return: True if the best candidate of every missing ingredient is similar enough.
+        """
+        return not (special_ins or "").strip() and bool(candidates) and \
+            all(found and found[0].score >= ingredient_index.FAST_SCORE for found in candidates.values())
+
+    def _full_description(self, call_type: str) -> PromptBuilder:
+        """
+        Start a prompt with everything about the recipe, for the approval and the assessment.
+
+        When it is too long, the description is shortened first, then the equipment, then the steps.
+
+        :param call_type: The kind of call, e.g. 'approval'.
+        :return: The prompt builder.
+        """
+        return self._prompt(call_type) \
+            .add(self._recipe.name, label="Recipe Name: ") \
+            .add(self._recipe.description or "", label="Description: ", priority=0) \
+            .add(self._ingredient_lines, header="Ingredients:", label="- ", unique=True) \
+            .add(self._equipment_lines, header="Equipment:", label="- ", priority=1, unique=True) \
+            .add([step.description for step in self._steps], header="Steps:", numbered=True, priority=2) \
+            .add(self._diet_names, label="Diet Restrictions: ")
     
     def check_output_structure(self, output: list[dict[str, str | int]]) -> bool:
         """
@@ -68,126 +330,709 @@ class AIRecipeAdvisor:
 
         return True
 
+    def check_assessment_structure(self, output: dict, fields: tuple[str, ...] = ASSESSMENT_FIELDS) -> bool:
+        """
+        Check whether the assessment from GPT has a known difficulty, complete nutrients and a boolean approval.
+
+        :param output: The dictionary generated from the output from GPT.
+        :param fields: The fields that were asked for, the others are not checked.
+        :return: True, if the output is valid. Else, if it's not.
+        """
+        if not isinstance(output, dict):
+            return False
+        if "difficulty" in fields and output.get("difficulty") not in DIFFICULTIES:
+            return False
+        if "approved" in fields and not isinstance(output.get("approved"), bool):
+            return False
+        if "nutrients" not in fields:
+            return True
+        return isinstance(output.get("nutrients"), list) and \
+            all(isinstance(nutrient, dict) and NUTRIENT_KEYS.issubset(nutrient.keys()) for nutrient in output["nutrients"])
+
+    def _ask(self, gpt: AsyncGPTHandler, query: str, parse: Callable[[str], Any], task: str, method: str) -> Any:
+        """
+        Ask the model until it gives a usable answer or the deadline of the call passes.
+
+        Failed requests are retried after a backoff, unusable answers right away. The call is recorded by the telemetry.
+
+        :param gpt: The GPT model handler.
+        :param query: The input to the model.
+        :param parse: Turns the response into the result, raising ValueError if the response is unusable.
+        :param task: The name of the task, for the logs and the error.
+        :param method: The name of the advisor method, for the telemetry.
+        :return: The parsed response.
+        :raises GPTUnavailable: If the circuit breaker is open or the deadline passed.
+        :raises: Exception if the GPT model fails to give a usable answer.
+        """
+        deadline = Deadline()
+        with telemetry.track(method, gpt.model):
+            telemetry.count_saved_tokens(getattr(query, 'saved_tokens', 0))
+            for attempt in range(LIMIT):
+                try:
+                    response = gpt.generate(query, timeout=deadline.timeout())
+                except Exception as e:
+                    time.sleep(_retry_delay(e, attempt, deadline, task))
+                    continue
+                try:
+                    return parse(response)
+                except Exception as e:
+                    logger.error(f"Invalid response during {task}: {e}")
+                    telemetry.count_invalid_response()
+                    gpt.invalidate(query)
+            raise Exception(f"Error with LLM in {task}. Please try again.")
+
+    async def _aask(self, gpt: AsyncGPTHandler, query: str, parse: Callable[[str], Any], task: str,
+                    method: str) -> Any:
+        """
+        Ask the model until it gives a usable answer or the deadline of the call passes, without blocking the event loop.
+
+        :param gpt: The GPT model handler.
+        :param query: The input to the model.
+        :param parse: Turns the response into the result, raising ValueError if the response is unusable.
+        :param task: The name of the task, for the logs and the error.
+        :param method: The name of the blocking advisor method, for the telemetry, so both variants of a call are
+                       counted together.
+        :return: The parsed response.
+        :raises GPTUnavailable: If the circuit breaker is open or the deadline passed.
+        :raises: Exception if the GPT model fails to give a usable answer.
+        """
+        deadline = Deadline()
+        with telemetry.track(method, gpt.model):
+            telemetry.count_saved_tokens(getattr(query, 'saved_tokens', 0))
+            for attempt in range(LIMIT):
+                try:
+                    response = await gpt.agenerate(query, timeout=deadline.timeout())
+                except Exception as e:
+                    await asyncio.sleep(_retry_delay(e, attempt, deadline, task))
+                    continue
+                try:
+                    return parse(response)
+                except Exception as e:
+                    logger.error(f"Invalid response during {task}: {e}")
+                    telemetry.count_invalid_response()
+                    await sync_to_async(gpt.invalidate)(query)
+            raise Exception(f"Error with LLM in {task}. Please try again.")
+
+    def __alternatives_query(self, ingredients: list[Ingredient], special_ins: str,
+                             candidates: dict[int, list[Neighbour]] | None = None) -> Prompt:
+        """
+        Build the question about the alternatives of the ingredients.
+
+        With candidates for every missing ingredient, only the missing ingredient lines and the candidates are sent
+        instead of the whole recipe, which makes the prompt much shorter.
+
+        :param ingredients: A list of ingredients to be suggested as alternative ingredients.
+        :param special_ins: Special instructions, e.g., I don't like chocolate.
+        :param candidates: The candidates from the ingredient index per missing ingredient id.
+        :return: The input to the model.
+        """
+        prompt = self._prompt("alternatives")
+        if candidates and all(candidates.values()):
+            missing = {ingredient.id for ingredient in ingredients}
+            names = dict.fromkeys(neighbour.name for found in candidates.values() for neighbour in found)
+            prompt.add(self._recipe.name, label="The recipe name:") \
+                .add([ingredient_line(item.ingredient.name, item.amount, item.unit)
+                      for item in self._related.ingredientlist_set.all() if item.ingredient_id in missing], unique=True) \
+                .add(self._diet_names, header="", label="Diet restrictions:") \
+                .add(", ".join(names), label="Candidates used like it in similar recipes:")
+        else:
+            self._add_information(prompt)
+        return prompt.add(",".join([ingredient.name for ingredient in ingredients]),
+                          label="The ingredient I don't have:") \
+            .add(special_ins or "", label="The special instruction:") \
+            .build()
+
+    def __parse_alternatives(self, response: str) -> list[dict[str, str | int]]:
+        """
+        Parse the alternative ingredients.
+
+        :param response: The response from the model.
+        :return: The alternative ingredients, unwrapped from the object of the structured output.
+        :raises ValueError: If the response is not a list of ingredients.
+        """
+        alternatives = _load_json(response)
+        if isinstance(alternatives, dict) and list(alternatives) == ["alternatives"]:
+            alternatives = alternatives["alternatives"]
+        if not isinstance(alternatives, list) or not self.check_output_structure(alternatives):
+            raise ValueError("Invalid structure of the alternative ingredients.")
+        return alternatives
+
     def get_alternative_ingredients(self, ingredients: list[Ingredient], special_ins: str = "") -> list[dict[str, str | int]]:
         """
         Generate an alternative ingredients to the ingredients specified.
 
+        The ingredient index answers alone when its candidates are similar enough and there is no special
+        instruction, and when GPT is unavailable. Otherwise its candidates shorten the question to GPT.
         Raises an Exception when there's an error with the GPT model.
 
         :param ingredients: A list of ingredients to be suggested as alternative ingredients.
         :param special_ins: Special instructions, e.g., I don't like chocolate.
         :return: Returns a list of dictionaries with `name` and `description` keys.
         """
-        LIMIT = 5
-        lacking_ingredients = "The ingredient I don't have:" + ",".join([ingredient.name for ingredient in ingredients])
-        query = self._ingredient_information + "\n" + \
-            lacking_ingredients + "\n" + \
-            "The special instruction:" + special_ins
+        candidates = self._candidates(ingredients)
+        if self._confident(candidates, special_ins):
+            return self._local_alternatives(ingredients, candidates)
+        try:
+            return self._ask(self._gpt, self.__alternatives_query(ingredients, special_ins, candidates),
+                             self.__parse_alternatives, "alternative ingredients", "get_alternative_ingredients")
+        except GPTUnavailable as e:
+            local = self._local_alternatives(ingredients, candidates)
+            if local is None:
+                raise
+            logger.warning(f"Answering the alternative ingredients from the ingredient index: {e}")
+            return local
+
+    async def aget_alternative_ingredients(self, ingredients: list[Ingredient],
+                                           special_ins: str = "") -> list[dict[str, str | int]]:
+        """
+        Awaitable version of get_alternative_ingredients.
+
+        :param ingredients: A list of ingredients to be suggested as alternative ingredients.
+        :param special_ins: Special instructions, e.g., I don't like chocolate.
+        :return: Returns a list of dictionaries with `name` and `description` keys.
+        """
+        candidates = await sync_to_async(self._candidates)(ingredients)
+        if self._confident(candidates, special_ins):
+            return await sync_to_async(self._local_alternatives)(ingredients, candidates)
+        query = await sync_to_async(self.__alternatives_query)(ingredients, special_ins, candidates)
+        try:
+            return await self._aask(self._gpt, query, self.__parse_alternatives, "alternative ingredients",
+                                    "get_alternative_ingredients")
+        except GPTUnavailable as e:
+            local = await sync_to_async(self._local_alternatives)(ingredients, candidates)
+            if local is None:
+                raise
+            logger.warning(f"Answering the alternative ingredients from the ingredient index: {e}")
+            return local
+
+    def _cached_alternatives(self, ingredient: Ingredient, special_ins: str,
+                             candidates: dict[int, list[Neighbour]]) -> list[dict[str, str | int]] | None:
+        """
+        Return the alternatives GPT already gave when asked about the ingredient alone, from the response cache.
+
+        :param ingredient: The missing ingredient.
+        :param special_ins: Special instructions, e.g., I don't like chocolate.
+        :param candidates: The candidates of the ingredient from the ingredient index.
+        :return: The cached alternatives, None if they are not cached or not usable.
+        """
+        _, cached = self._gpt._read_cache(self.__alternatives_query([ingredient], special_ins, candidates))
+        if cached is None:
+            return None
+        try:
+            return self.__parse_alternatives(cached)
+        except ValueError:
+            return None
+
+    def _prepare_batch(self, ingredients: list[Ingredient], special_ins: str) -> \
+            tuple[dict[int, list[dict[str, str | int]]], list[Ingredient], dict[int, list[Neighbour]]]:
+        """
+        Answer the ingredients the ingredient index or the response cache can, and build the rest into one question.
+
+        :param ingredients: The missing ingredients.
+        :param special_ins: Special instructions, e.g., I don't like chocolate.
+        :return: The answered alternatives per ingredient id, the ingredients left for GPT and their candidates.
+        """
+        candidates = self._candidates(ingredients)
+        answers, remaining = {}, []
+        for ingredient in ingredients:
+            found = {ingredient.id: candidates[ingredient.id]} if ingredient.id in candidates else {}
+            if self._confident(found, special_ins):
+                answers[ingredient.id] = self._local_alternatives([ingredient], found)
+                continue
+            cached = self._cached_alternatives(ingredient, special_ins, found)
+            if cached is None:
+                remaining.append(ingredient)
+            else:
+                answers[ingredient.id] = cached
+        return answers, remaining, {ingredient.id: candidates[ingredient.id] for ingredient in remaining
+                                    if ingredient.id in candidates}
+
+    def __parse_batch(self, response: str, ingredients: list[Ingredient]) -> dict[int, list[dict[str, str | int]]]:
+        """
+        Parse the alternatives of several ingredients.
+
+        :param response: The response from the model.
+        :param ingredients: The ingredients asked about.
+        :return: The alternatives per ingredient id.
+        :raises ValueError: If the response is malformed or misses one of the ingredients.
+        """
+        answer = _load_json(response)
+        entries = answer.get("ingredients") if isinstance(answer, dict) else None
+        if not isinstance(entries, list):
+            raise ValueError("The response has no list of ingredients.")
+        alternatives = {}
+        for entry in entries:
+            if not isinstance(entry, dict) or not isinstance(entry.get("alternatives"), list) or \
+                    not self.check_output_structure(entry["alternatives"]):
+                raise ValueError("Invalid structure of the alternative ingredients.")
+            alternatives[normalize_name(str(entry.get("ingredient", "")))] = entry["alternatives"]
+        missing = [ingredient.name for ingredient in ingredients if normalize_name(ingredient.name) not in alternatives]
+        if missing:
+            raise ValueError(f"No alternatives to {', '.join(missing)}.")
+        return {ingredient.id: alternatives[normalize_name(ingredient.name)] for ingredient in ingredients}
+
+    def _local_batch(self, ingredients: list[Ingredient],
+                     candidates: dict[int, list[Neighbour]]) -> dict[int, list[dict[str, str | int]]] | None:
+        """
+        Answer every ingredient from the ingredient index, when GPT is unavailable.
+
+        :param ingredients: The missing ingredients.
+        :param candidates: The candidates per missing ingredient id.
+        :return: The alternatives per ingredient id, None if an ingredient has no candidate.
+        """
+        if not all(candidates.get(ingredient.id) for ingredient in ingredients):
+            return None
+        return {ingredient.id: self._local_alternatives([ingredient], {ingredient.id: candidates[ingredient.id]})
+                for ingredient in ingredients}
 
-        for _ in range(LIMIT):
+    def get_alternatives_per_ingredient(self, ingredients: list[Ingredient],
+                                        special_ins: str = "") -> dict[int, list[dict[str, str | int]]]:
+        """
+        Generate the alternatives of several ingredients, asking GPT about all the unanswered ones in one request.
+
+        The ingredient index and the cached answers about single ingredients answer first. The ids of the
+        ingredients answered by the index are kept in local_ingredient_ids.
+
+        :param ingredients: The missing ingredients.
+        :param special_ins: Special instructions, e.g., I don't like chocolate.
+        :return: The alternatives per ingredient id, in the order of the ingredients.
+        :raises GPTUnavailable: If GPT is unavailable and the index cannot answer every ingredient.
+        :raises: Exception if the GPT model fails to give a usable answer.
+        """
+        answers, remaining, candidates = self._prepare_batch(ingredients, special_ins)
+        if remaining:
             try:
-                string_alternative_ingredients = self._gpt.generate(query)
-                processed_alternative_ingredients = json.loads(string_alternative_ingredients)
-                # If there's an error, the following line will not be executed.
-                if not self.check_output_structure(processed_alternative_ingredients):
+                answers.update(self._ask(
+                    self._batch_gpt, self.__alternatives_query(remaining, special_ins, candidates),
+                    lambda response: self.__parse_batch(response, remaining), "alternative ingredients",
+                    "get_alternatives_per_ingredient"))
+            except GPTUnavailable as e:
+                local = self._local_batch(remaining, candidates)
+                if local is None:
+                    raise
+                logger.warning(f"Answering the alternative ingredients from the ingredient index: {e}")
+                answers.update(local)
+        return {ingredient.id: answers[ingredient.id] for ingredient in ingredients}
+
+    async def aget_alternatives_per_ingredient(self, ingredients: list[Ingredient],
+                                               special_ins: str = "") -> dict[int, list[dict[str, str | int]]]:
+        """
+        Awaitable version of get_alternatives_per_ingredient.
+
+        :param ingredients: The missing ingredients.
+        :param special_ins: Special instructions, e.g., I don't like chocolate.
+        :return: The alternatives per ingredient id, in the order of the ingredients.
+        """
+        answers, remaining, candidates = await sync_to_async(self._prepare_batch)(ingredients, special_ins)
+        if remaining:
+            query = await sync_to_async(self.__alternatives_query)(remaining, special_ins, candidates)
+            try:
+                answers.update(await self._aask(
+                    self._batch_gpt, query, lambda response: self.__parse_batch(response, remaining),
+                    "alternative ingredients", "get_alternatives_per_ingredient"))
+            except GPTUnavailable as e:
+                local = await sync_to_async(self._local_batch)(remaining, candidates)
+                if local is None:
+                    raise
+                logger.warning(f"Answering the alternative ingredients from the ingredient index: {e}")
+                answers.update(local)
+        return {ingredient.id: answers[ingredient.id] for ingredient in ingredients}
+
+    def stream_alternative_ingredients(self, ingredients: list[Ingredient],
+                                       special_ins: str = "") -> Iterator[dict[str, str | int]]:
+        """
+        Generate alternative ingredients one at a time, each as soon as the model has finished writing it.
+
+        The response is retried only while nothing has been returned yet. The ingredient index answers like in
+        get_alternative_ingredients.
+
+        :param ingredients: A list of ingredients to be suggested as alternative ingredients.
+        :param special_ins: Special instructions, e.g., I don't like chocolate.
+        :return: An iterator over dictionaries with `name`, `description`, `amount` and `unit` keys.
+        :raises GPTUnavailable: If the circuit breaker is open or the deadline passed before any alternative.
+        :raises: Exception if the GPT model fails to give any usable alternative.
+        """
+        candidates = self._candidates(ingredients)
+        if self._confident(candidates, special_ins):
+            yield from self._local_alternatives(ingredients, candidates)
+            return
+        try:
+            yield from self.__stream_alternatives(self.__alternatives_query(ingredients, special_ins, candidates))
+        except GPTUnavailable as e:
+            local = self._local_alternatives(ingredients, candidates)
+            if local is None:
+                raise
+            logger.warning(f"Answering the alternative ingredients from the ingredient index: {e}")
+            yield from local
+
+    def __stream_alternatives(self, query: str) -> Iterator[dict[str, str | int]]:
+        """
+        Stream the alternative ingredients from GPT.
+
+        :param query: The input to the model.
+        :return: An iterator over the alternatives.
+        :raises GPTUnavailable: If the circuit breaker is open or the deadline passed before any alternative.
+        :raises: Exception if the GPT model fails to give any usable alternative.
+        """
+        deadline = Deadline()
+        with telemetry.track("stream_alternative_ingredients", self._gpt.model):
+            telemetry.count_saved_tokens(getattr(query, 'saved_tokens', 0))
+            for attempt in range(LIMIT):
+                sent = []
+                try:
+                    yield from self.__stream_response(query, deadline.timeout(), sent)
+                    return
+                except ValueError as e:
+                    logger.error(f"Invalid response during alternative ingredients: {e}")
+                    telemetry.count_invalid_response()
+                    self._gpt.invalidate(query)
+                except Exception as e:
+                    if sent:
+                        logger.error(f"Error during alternative ingredients: {e}")
+                        return
+                    time.sleep(_retry_delay(e, attempt, deadline, "alternative ingredients"))
+                if sent:
+                    return
+            raise Exception("Error with LLM in alternative ingredients. Please try again.")
+
+    def __stream_response(self, query: str, timeout: float, sent: list) -> Iterator[dict[str, str | int]]:
+        """
+        Stream one response of GPT, yielding each well-formed alternative as soon as it is complete.
+
+        A response with malformed alternatives, or cut before its end, is not kept in the cache.
+
+        :param query: The input to the model.
+        :param timeout: The seconds the response may take.
+        :param sent: The list the yielded alternatives are added to, read by the caller when the response fails.
+        :return: An iterator over the alternatives.
+        :raises ValueError: If the response holds no usable alternative.
+        """
+        parser = JSONArrayStream()
+        valid = True
+        for piece in self._gpt.stream(query, timeout=timeout):
+            for alternative in parser.feed(piece):
+                if not self.check_output_structure([alternative]):
+                    valid = False
                     continue
-                return processed_alternative_ingredients
-            except json.decoder.JSONDecodeError:
-                continue
-        raise Exception("Error with LLM. Please try again.")
+                sent.append(alternative)
+                yield alternative
+        if not sent:
+            raise ValueError("No usable alternative ingredient in the response.")
+        if not valid or not parser.finished:
+            self._gpt.invalidate(query)
+
+    def __difficulty_query(self) -> Prompt:
+        """
+        Build the question about the difficulty of the recipe.
+
+        :return: The input to the model.
+        """
+        prompt = self._prompt("difficulty").add(
+            "Based on the following recipe, determine the difficulty level. "
+            "The difficulty should be one of 'Easy', 'Normal', or 'Hard':").add("")
+        return self._add_information(prompt, needs_description=False, needs_diets=False) \
+            .add([step.description for step in self._steps], header="Steps:", priority=0) \
+            .build()
+
+    def __parse_difficulty(self, response: str) -> str:
+        """
+        Parse the difficulty.
+
+        :param response: The response from the model.
+        :return: "Easy", "Normal" or "Hard".
+        :raises ValueError: If the response is not one of the difficulties.
+        """
+        difficulty = response.strip()
+        if difficulty not in DIFFICULTIES:
+            raise ValueError(f"Unknown difficulty {difficulty!r}.")
+        return difficulty
+
+    def local_difficulty(self) -> str | None:
+        """
+        Classify the difficulty with the local classifier.
+
+        :return: The difficulty, None if the classifier was not trained or is not confident enough.
+        """
+        model = difficulty_model.get_model()
+        if model is None:
+            return None
+        prediction = model.predict(difficulty_model.features(
+            [step.description for step in self._steps], self._recipe.estimated_time,
+            len(self._equipment_lines), len(self._ingredient_lines)))
+        if prediction.confidence < difficulty_model.MIN_CONFIDENCE:
+            return None
+        logger.info(f"Difficulty of {self._recipe.name} classified locally: {prediction}")
+        return prediction.label
 
     def difficulty_calculator(self):
         """
-        Calculate the difficulty of the recipe using the GPT model.
+        Calculate the difficulty of the recipe with the local classifier, or the GPT model if it is not confident.
 
         :return: A string representing the difficulty level ("Easy", "Normal", "Hard").
         :raises: Exception if the GPT model fails to generate a valid difficulty response.
         """
-        query = "Based on the following recipe, determine the difficulty level. " + \
-                "The difficulty should be one of 'Easy', 'Normal', or 'Hard':\n\n" + \
-                f"{self._ingredient_information}\n" + \
-                "Steps:\n" + "\n".join([step.description for step in self._recipe.steps.all()])
-        LIMIT = 5
-        for _ in range(LIMIT):
-            try:
-                response = self._difficulty_gpt.generate(query)
-                difficulty = response.strip()
-                if difficulty in ["Easy", "Normal", "Hard"]:
-                    return difficulty
-            except Exception as e:
-                logger.error(f"Error during difficulty calculation: {e}")
-                continue
-        raise Exception("Error with LLM in difficulty calculation. Please try again.")
+        local = self.local_difficulty()
+        if local is not None:
+            return local
+        return self._ask(self._difficulty_gpt, self.__difficulty_query(), self.__parse_difficulty,
+                         "difficulty calculation", "difficulty_calculator")
+
+    async def adifficulty_calculator(self):
+        """
+        Awaitable version of difficulty_calculator.
 
-    def nutrition_calculator(self):
+        :return: A string representing the difficulty level ("Easy", "Normal", "Hard").
+        """
+        local = await sync_to_async(self.local_difficulty)()
+        if local is not None:
+            return local
+        query = await sync_to_async(self.__difficulty_query)()
+        return await self._aask(self._difficulty_gpt, query, self.__parse_difficulty, "difficulty calculation",
+                                "difficulty_calculator")
+
+    def __nutrition_query(self, lines: list[str] | None = None) -> Prompt:
+        """
+        Build the question about the nutrition of the recipe.
+
+        :param lines: Only these ingredient lines, all the ingredients of the recipe by default.
+        :return: The input to the model.
+        """
+        return self._prompt("nutrition").add(self._ingredient_lines if lines is None else lines, unique=True) \
+            .add("").build()
+
+    def __parse_nutrition(self, response: str) -> dict:
+        """
+        Parse the nutrition.
+
+        :param response: The response from the model.
+        :return: The nutrition information.
+        :raises ValueError: If the response does not contain a complete list of nutrients.
+        """
+        nutrition_info = _load_json(response)
+        if not isinstance(nutrition_info, dict) or not isinstance(nutrition_info.get("nutrients"), list):
+            raise ValueError("The response has no list of nutrients.")
+        for nutrient in nutrition_info["nutrients"]:
+            if not NUTRIENT_KEYS.issubset(nutrient.keys()):
+                raise ValueError("Invalid structure for a nutrient entry.")
+        return nutrition_info
+
+    def nutrition_calculator(self, lines: list[str] | None = None):
         """
         Calculate the nutritional information of the recipe based on its ingredients.
 
+        :param lines: Only these ingredient lines, e.g. the ones the nutrition engine does not know.
         :return: A dictionary containing a list of nutrients, each with name, amount, unit, and percent of daily needs.
         :raises: Exception if the GPT model fails to generate valid nutritional information.
         """
-        LIMIT = 5
-        ingredients_query = ""
-        for ingre in self._recipe.get_ingredients():
-            ingredients_query += f"{ingre.ingredient.name}, amount: {ingre.amount} {ingre.unit}\n"
+        return self._ask(self._nutrition_gpt, self.__nutrition_query(lines), self.__parse_nutrition,
+                         "nutrition calculation", "nutrition_calculator")
 
-        query = ingredients_query
+    async def anutrition_calculator(self, lines: list[str] | None = None):
+        """
+        Awaitable version of nutrition_calculator.
 
-        for _ in range(LIMIT):
-            try:
-                response = self._nutrition_gpt.generate(query)
-                nutrition_info = json.loads(response)
-                if "nutrients" in nutrition_info and isinstance(
-                        nutrition_info["nutrients"], list):
-                    required_keys = {"name", "amount", "unit", "percentOfDailyNeeds"}
-                    for nutrient in nutrition_info["nutrients"]:
-                        if not required_keys.issubset(nutrient.keys()):
-                            raise ValueError("Invalid structure for a nutrient entry.")
-                    return nutrition_info
-            except json.JSONDecodeError:
-                logger.error("Error decoding JSON from GPT response.")
-            except ValueError as e:
-                logger.error(f"Validation error in response structure: {e}")
-            except Exception as e:
-                logger.error(f"Error during nutrition calculation: {e}")
-                continue
+        :param lines: Only these ingredient lines, all the ingredients of the recipe by default.
+        :return: A dictionary containing a list of nutrients, each with name, amount, unit, and percent of daily needs.
+        """
+        query = await sync_to_async(self.__nutrition_query)(lines)
+        return await self._aask(self._nutrition_gpt, query, self.__parse_nutrition, "nutrition calculation",
+                                "nutrition_calculator")
+
+    def __approval_query(self) -> Prompt:
+        """
+        Build the question about whether the recipe can be approved.
+
+        :return: The input to the model.
+        """
+        return self._full_description("approval").add("").build()
+
+    def __parse_approval(self, response: str) -> str:
+        """
+        Parse the approval.
 
-        raise Exception("Error with LLM in nutrition calculation. Please try again.")
+        :param response: The response from the model.
+        :return: 'True' or 'False'.
+        :raises ValueError: If the response is neither.
+        """
+        approval = response.strip()
+        if approval not in ('True', 'False'):
+            raise ValueError(f"Unknown approval {approval!r}.")
+        return approval
 
     def recipe_approval(self):
         """
         Determine whether the recipe is possible to make and eatable.
 
-        :return: True if the recipe is approved (possible to make and eatable), False otherwise.
+        :return: 'True' if the recipe is approved (possible to make and eatable), 'False' otherwise.
         :raises: Exception if the GPT model fails to generate a valid response.
         """
-        LIMIT = 5
-        name = f"Recipe Name: {self._recipe.name}\n"
-        description = f"Description: {self._recipe.description}\n"
-        ingredients = "Ingredients:\n"
-        for ingre in self._recipe.get_ingredients():
-            ingredients += f"- {ingre.ingredient.name}, amount: {ingre.amount} {ingre.unit}\n"
+        return self._ask(self._approval_gpt, self.__approval_query(), self.__parse_approval,
+                         "recipe approval calculation", "recipe_approval")
 
-        equipment = "Equipment:\n"
-        for equip in self._recipe.get_equipments():
-            equipment += f"- {equip.equipment.name}\n"
+    async def arecipe_approval(self):
+        """
+        Awaitable version of recipe_approval.
 
-        steps = "Steps:\n"
-        for step in self._recipe.steps.all():
-            steps += f"{step.number}. {step.description}\n"
+        :return: 'True' if the recipe is approved (possible to make and eatable), 'False' otherwise.
+        """
+        query = await sync_to_async(self.__approval_query)()
+        return await self._aask(self._approval_gpt, query, self.__parse_approval, "recipe approval calculation",
+                                "recipe_approval")
 
-        diets = f"Diet Restrictions: {', '.join([diet.name for diet in self._recipe.diets.all()])}\n"
-        query = name + description + ingredients + equipment + steps + diets
+    def __assessment_query(self, fields: tuple[str, ...] = ASSESSMENT_FIELDS,
+                           nutrition_lines: list[str] | None = None) -> Prompt:
+        """
+        Build the question about the difficulty, nutrition and approval of the recipe.
 
-        for _ in range(LIMIT):
-            try:
-                response = self._approval_gpt.generate(query)
-                approval = response.strip()
-                print(approval, type(approval))
-                return approval
-            except Exception as e:
-                logger.error(f"Error during recipe approval calculation: {e}")
-                continue
+        :param fields: The fields asked for.
+        :param nutrition_lines: The only ingredient lines whose nutrients are asked for, all of them by default.
+        :return: The input to the model.
+        """
+        prompt = self._full_description("assessment")
+        if "nutrients" in fields and nutrition_lines is not None:
+            prompt.add(nutrition_lines, header="Estimate the nutrients of these ingredients only:", label="- ",
+                       unique=True)
+        if fields != ASSESSMENT_FIELDS:
+            prompt.add(f"Only answer the {', '.join(fields)}.")
+        return prompt.build()
+
+    def assessment_request(self, fields: tuple[str, ...] = ASSESSMENT_FIELDS,
+                           nutrition_lines: list[str] | None = None) -> dict[str, Any]:
+        """
+        Return the completion request recipe_assessment would send, e.g. to write it into a batch file.
+
+        :param fields: The fields asked for.
+        :param nutrition_lines: The only ingredient lines whose nutrients are asked for, all of them by default.
+        :return: The body of the chat completion request.
+        """
+        return self._assessment_handler(fields)._request(self.__assessment_query(fields, nutrition_lines))
+
+    def prompts(self) -> dict[str, tuple[AsyncGPTHandler, Prompt]]:
+        """
+        Return the handler and the prompt of each call about the whole recipe, e.g. to measure the compaction.
+
+        :return: The handler and the prompt per kind of call.
+        """
+        return {
+            "difficulty": (self._difficulty_gpt, self.__difficulty_query()),
+            "nutrition": (self._nutrition_gpt, self.__nutrition_query()),
+            "approval": (self._approval_gpt, self.__approval_query()),
+            "assessment": (self._assessment_gpt, self.__assessment_query()),
+        }
+
+    def parse_assessment(self, response: str, fields: tuple[str, ...] = ASSESSMENT_FIELDS) -> dict:
+        """
+        Parse an assessment, e.g. one returned by a batch.
+
+        :param response: The response from the model.
+        :param fields: The fields that were asked for.
+        :return: The assessment.
+        :raises ValueError: If the response does not match the assessment structure.
+        """
+        assessment = _load_json(response)
+        if not self.check_assessment_structure(assessment, fields):
+            raise ValueError("Invalid structure of the recipe assessment.")
+        return assessment
+
+    def recipe_assessment(self, fields: tuple[str, ...] = ASSESSMENT_FIELDS,
+                          nutrition_lines: list[str] | None = None) -> dict:
+        """
+        Rate the difficulty, calculate the nutrition and decide the approval of the recipe in one GPT request.
+
+        :param fields: The fields asked for, e.g. without the difficulty when the local classifier knows it.
+        :param nutrition_lines: The only ingredient lines whose nutrients are asked for, e.g. the ones the nutrition
+                                engine does not know. All of them by default.
+        :return: A dictionary with the fields asked for: `difficulty` ("Easy", "Normal" or "Hard"), `nutrients`
+                 (a list of nutrients, each with name, amount, unit and percentOfDailyNeeds) and `approved` (a boolean).
+        :raises: Exception if the GPT model fails to generate a valid assessment.
+        """
+        return self._ask(self._assessment_handler(fields), self.__assessment_query(fields, nutrition_lines),
+                         lambda response: self.parse_assessment(response, fields), "recipe assessment",
+                         "recipe_assessment")
 
-        raise Exception(
-            "Error with LLM in recipe approval calculation. Please try again.")
+    async def arecipe_assessment(self, fields: tuple[str, ...] = ASSESSMENT_FIELDS,
+                                 nutrition_lines: list[str] | None = None) -> dict:
+        """
+        Awaitable version of recipe_assessment.
+
+        :param fields: The fields asked for.
+        :param nutrition_lines: The only ingredient lines whose nutrients are asked for, all of them by default.
+        :return: A dictionary with the fields asked for among `difficulty`, `nutrients` and `approved`.
+        """
+        query = await sync_to_async(self.__assessment_query)(fields, nutrition_lines)
+        return await self._aask(self._assessment_handler(fields), query,
+                                lambda response: self.parse_assessment(response, fields), "recipe assessment",
+                                "recipe_assessment")
+
+    def assess_separately(self) -> dict:
+        """
+        Ask for the difficulty, the nutrition and the approval with separate prompts, all at the same time.
+
+        Use this when the model does not support the structured output of recipe_assessment.
+
+        :return: A dictionary shaped like the one of recipe_assessment.
+        """
+        difficulty, nutrition, approval = run_concurrently(
+            self.adifficulty_calculator(), self.anutrition_calculator(), self.arecipe_approval()
+        )
+        return {"difficulty": difficulty, "nutrients": nutrition["nutrients"], "approved": approval == 'True'}
+
+
+def _load_json(response: str) -> Any:
+    """
+    Read the JSON of a response, repairing code fences, surrounding text and trailing commas before a retry is needed.
+
+    :param response: The response from the model.
+    :return: The JSON value.
+    :raises ValueError: If the response contains no readable JSON.
+    """
+    value, repaired = json_repair.load(response)
+    if repaired:
+        logger.warning("Repaired the JSON of a response.")
+        telemetry.count_repaired_response()
+    return value
+
+
+def _retry_delay(error: Exception, attempt: int, deadline: Deadline, task: str) -> float:
+    """
+    Log a failed request to the model and return the wait before sending it again.
+
+    :param error: The error raised by the request.
+    :param attempt: The number of the failed attempt, starting at 0.
+    :param deadline: The deadline of the call.
+    :param task: The name of the task, for the logs and the error.
+    :return: The seconds to wait.
+    :raises GPTUnavailable: If the circuit breaker is open or no time is left for a retry.
+    :raises: Exception if the request is not worth retrying or was the last attempt.
+    """
+    logger.error(f"Error during {task}: {error}")
+    if isinstance(error, GPTUnavailable):
+        raise error
+    if not is_retryable(error) or attempt + 1 >= LIMIT:
+        raise Exception(f"Error with LLM in {task}. Please try again.") from error
+    return deadline.backoff(attempt)
+
+
+async def gather_advice(*calls: Awaitable, timeout: float | None = CALL_TIMEOUT) -> list:
+    """
+    Await advisor calls together, so they take as long as the slowest one instead of the sum of all.
+
+    The number of requests sent to the model at once is capped by GPT_CONCURRENCY.
+
+    :param calls: The awaitable advisor calls, e.g. advisor.adifficulty_calculator().
+    :param timeout: The seconds each call may take, None for no limit.
+    :return: The results, in the order of the calls.
+    :raises asyncio.TimeoutError: If a call does not finish in time.
+    """
+    return list(await asyncio.gather(*(asyncio.wait_for(call, timeout) for call in calls)))
+
+
+def run_concurrently(*calls: Awaitable, timeout: float | None = CALL_TIMEOUT) -> list:
+    """
+    Run advisor calls together from synchronous code such as a view or a job.
+
+    :param calls: The awaitable advisor calls, e.g. advisor.adifficulty_calculator().
+    :param timeout: The seconds each call may take, None for no limit.
+    :return: The results, in the order of the calls.
+    """
+    return async_to_sync(gather_advice)(*calls, timeout=timeout)
@@ -0,0 +1,226 @@
+"""Backends running a JSONL file of chat completion requests as one batch, for the ai_enrich command."""
+import json
+import logging
+import os
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any
+from decouple import config
+from openai import OpenAI
+from pantry import settings
+from webpage.modules import gpt_handler
+
+logger = logging.getLogger("Batch backend")
+
+BACKEND = config('AI_BATCH_BACKEND', default='openai')
+BATCH_DIR = config('AI_BATCH_DIR', default=str(settings.BASE_DIR / 'ai_batches'))
+# How long OpenAI may take to finish a batch. 24h is the only window it accepts at the moment.
+COMPLETION_WINDOW = config('AI_BATCH_COMPLETION_WINDOW', default='24h')
+ENDPOINT = '/v1/chat/completions'
+
+PENDING = 'pending'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+
+class BatchBackend(ABC):
+    """
+    Run a batch file whose lines are {"custom_id", "method", "url", "body"} requests.
+
+    The results are lines shaped like those of the OpenAI Batch API: {"custom_id", "response": {"status_code",
+    "body"}, "error"}.
+    """
+
+    name = ''
+
+    @abstractmethod
+    def submit(self, path: str) -> str:
+        """
+        Submit a batch file.
+
+        :param path: The path of the JSONL file.
+        :return: The id of the batch.
+        """
+        pass
+
+    @abstractmethod
+    def status(self, batch_id: str) -> str:
+        """
+        Return the state of a batch.
+
+        :param batch_id: The id returned by submit.
+        :return: PENDING, COMPLETED or FAILED.
+        """
+        pass
+
+    @abstractmethod
+    def results(self, batch_id: str) -> list[dict[str, Any]]:
+        """
+        Return the results of a finished batch. A failed batch may still have the results of some requests.
+
+        :param batch_id: The id returned by submit.
+        :return: One dictionary per answered request.
+        """
+        pass
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """
+    Run the batch with the OpenAI Batch API, which answers within the completion window at a lower price per token.
+
+    :param client: The OpenAI client, the shared module client by default.
+    """
+
+    name = 'openai'
+
+    def __init__(self, client: OpenAI | None = None):
+        """
+        Initialize the backend.
+
+        :param client: The OpenAI client, the shared module client by default.
+        """
+        self._client = client
+
+    @property
+    def client(self) -> OpenAI:
+        """Return the OpenAI client."""
+        return self._client or gpt_handler.client
+
+    def submit(self, path: str) -> str:
+        """
+        Upload the batch file and create the batch.
+
+        :param path: The path of the JSONL file.
+        :return: The id of the OpenAI batch.
+        """
+        with open(path, 'rb') as file:
+            uploaded = self.client.files.create(file=file, purpose='batch')
+        batch = self.client.batches.create(input_file_id=uploaded.id, endpoint=ENDPOINT,
+                                           completion_window=COMPLETION_WINDOW)
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        """
+        Return the state of the OpenAI batch.
+
+        :param batch_id: The id of the OpenAI batch.
+        :return: PENDING, COMPLETED or FAILED.
+        """
+        status = self.client.batches.retrieve(batch_id).status
+        if status == 'completed':
+            return COMPLETED
+        if status in ('failed', 'expired', 'cancelled'):
+            return FAILED
+        return PENDING
+
+    def results(self, batch_id: str) -> list[dict[str, Any]]:
+        """
+        Download the output file of the OpenAI batch.
+
+        :param batch_id: The id of the OpenAI batch.
+        :return: One dictionary per answered request.
+        """
+        batch = self.client.batches.retrieve(batch_id)
+        if not batch.output_file_id:
+            return []
+        text = self.client.files.content(batch.output_file_id).text
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    Run the batch right away, one chat completion at a time, for tests and development.
+
+    Point it at a FakeOpenAIServer to run the whole ai_enrich command offline.
+
+    :param client: The OpenAI client, the shared module client by default.
+    :param directory: Where the results are written.
+    """
+
+    name = 'local'
+
+    def __init__(self, client: OpenAI | None = None, directory: str | None = None):
+        """
+        Initialize the backend.
+
+        :param client: The OpenAI client, the shared module client by default.
+        :param directory: Where the results are written, AI_BATCH_DIR by default.
+        """
+        self._client = client
+        self.directory = directory or BATCH_DIR
+
+    def submit(self, path: str) -> str:
+        """
+        Send every request of the batch file and write the results.
+
+        :param path: The path of the JSONL file.
+        :return: The id of the local batch.
+        """
+        batch_id = f"local-{uuid.uuid4().hex}"
+        client = self._client or gpt_handler.client
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path, encoding='utf-8') as requests, \
+                open(self.__output_path(batch_id), 'w', encoding='utf-8') as output:
+            for line in requests:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                result = {'id': f"{batch_id}-{request['custom_id']}", 'custom_id': request['custom_id'],
+                          'response': None, 'error': None}
+                try:
+                    completion = client.chat.completions.create(**request['body'])
+                    result['response'] = {'status_code': 200, 'body': completion.model_dump()}
+                except Exception as e:
+                    logger.error(f"Request {request['custom_id']} of batch {batch_id} failed: {e}")
+                    result['error'] = {'message': str(e)}
+                output.write(json.dumps(result) + '\n')
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        """
+        Return the state of the local batch, which is finished as soon as it is submitted.
+
+        :param batch_id: The id of the local batch.
+        :return: COMPLETED, or FAILED if its results are missing.
+        """
+        return COMPLETED if os.path.exists(self.__output_path(batch_id)) else FAILED
+
+    def results(self, batch_id: str) -> list[dict[str, Any]]:
+        """
+        Read the results of the local batch.
+
+        :param batch_id: The id of the local batch.
+        :return: One dictionary per request.
+        """
+        if not os.path.exists(self.__output_path(batch_id)):
+            return []
+        with open(self.__output_path(batch_id), encoding='utf-8') as output:
+            return [json.loads(line) for line in output if line.strip()]
+
+    def __output_path(self, batch_id: str) -> str:
+        """
+        Return the path of the results of a local batch.
+
+        :param batch_id: The id of the local batch.
+        :return: The path of the JSONL file.
+        """
+        return os.path.join(self.directory, f"{batch_id}.output.jsonl")
+
+
+BACKENDS: dict[str, type[BatchBackend]] = {
+    OpenAIBatchBackend.name: OpenAIBatchBackend,
+    LocalBatchBackend.name: LocalBatchBackend,
+}
+
+
+def get_backend(name: str = BACKEND) -> BatchBackend:
+    """
+    Return a batch backend by name.
+
+    :param name: 'openai' or 'local'.
+    :return: The backend.
+    :raises ValueError: If there is no backend with that name.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown batch backend {name!r}. Choose one of {', '.join(BACKENDS)}.")
+    return BACKENDS[name]()
@@ -0,0 +1,312 @@
+"""Assess many recipes at once through a batch backend, then apply the difficulty, nutrition and approval in bulk."""
+from datetime import datetime
+from decimal import Decimal
+import json
+import logging
+import os
+from typing import Any, Iterable
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q, QuerySet
+from django.utils import timezone
+from webpage.models import EnrichmentBatch, Nutrition, NutritionList, Recipe, normalize_name
+from webpage.modules.ai_advisor import ASSESSMENT_FIELDS, AIRecipeAdvisor, DIFFICULTIES
+from webpage.modules import batch_backend, difficulty_model
+from webpage.modules.batch_backend import COMPLETED, ENDPOINT, FAILED, BatchBackend
+from webpage.modules.nutrition_engine import estimate_many, merge_nutrients, nutrition_request
+from webpage.modules.status_code import BatchStatus, StatusCode
+
+logger = logging.getLogger("Batch enrichment")
+
+PARTS = ('difficulty', 'nutrition', 'approval')
+# The field of the assessment answering each part.
+FIELDS = {'difficulty': 'difficulty', 'nutrition': 'nutrients', 'approval': 'approved'}
+CUSTOM_ID_PREFIX = 'recipe-'
+
+
+def select_recipes(parts: Iterable[str] = PARTS, stale_before: datetime | None = None) -> QuerySet[Recipe]:
+    """
+    Return the recipes missing one of the parts, or enriched before a date.
+
+    Rejected recipes and recipes already waiting in a submitted batch are left out.
+
+    :param parts: The parts to look at, among 'difficulty', 'nutrition' and 'approval'.
+    :param stale_before: Also return the recipes enriched before this time, None to only return missing parts.
+    :return: The recipes, annotated with `has_nutrition`, ordered by id.
+    """
+    parts = set(parts)
+    missing = Q(pk__in=[])
+    if 'difficulty' in parts:
+        missing |= ~Q(difficulty__in=DIFFICULTIES)
+    if 'nutrition' in parts:
+        missing |= Q(has_nutrition=False)
+    if 'approval' in parts:
+        missing |= Q(status=StatusCode.PENDING.value[0], enriched_at__isnull=True)
+    if stale_before is not None:
+        missing |= Q(enriched_at__lt=stale_before)
+    submitted = EnrichmentBatch.objects.filter(status=BatchStatus.SUBMITTED.value[0])
+    waiting = {int(recipe_id) for recipes in submitted.values_list('recipes', flat=True) for recipe_id in recipes}
+    return Recipe.objects.annotate(
+        has_nutrition=Exists(NutritionList.objects.filter(recipe=OuterRef('pk')))
+    ).filter(missing).exclude(status=StatusCode.REJECTED.value[0]).exclude(pk__in=waiting).order_by('id')
+
+
+def parts_to_apply(recipe: Recipe, parts: Iterable[str], stale_before: datetime | None = None) -> list[str]:
+    """
+    Return the parts of a selected recipe that its assessment should overwrite.
+
+    :param recipe: A recipe returned by select_recipes.
+    :param parts: The parts asked for.
+    :param stale_before: The time before which an enrichment is stale, None if only missing parts are refreshed.
+    :return: The parts, in the order of PARTS.
+    """
+    stale = stale_before is not None and recipe.enriched_at is not None and recipe.enriched_at < stale_before
+    pending = recipe.status == StatusCode.PENDING.value[0]
+    missing = {
+        'difficulty': recipe.difficulty not in DIFFICULTIES,
+        'nutrition': not recipe.has_nutrition,
+        'approval': pending and recipe.enriched_at is None,
+    }
+    # Spoonacular's own nutrition and the approval of a published or rejected recipe are never replaced.
+    refresh = {
+        'difficulty': stale,
+        'nutrition': stale and recipe.spoonacular_id is None,
+        'approval': stale and pending,
+    }
+    return [part for part in PARTS if part in parts and (missing[part] or refresh[part])]
+
+
+def write_batch(recipes: Iterable[Recipe], parts: Iterable[str], path: str,
+                stale_before: datetime | None = None) -> tuple[dict[str, list[str]], dict[str, dict]]:
+    """
+    Write one assessment request per recipe into a batch file, asking only for the fields of its planned parts.
+
+    The local classifier rates the difficulty and the nutrition engine estimates the nutrition first. GPT is only
+    asked for the difficulties the classifier is not confident about, and for the nutrients of the ingredients the
+    engine does not know. A recipe left without a field to ask gets no request.
+
+    :param recipes: The recipes returned by select_recipes.
+    :param parts: The parts asked for.
+    :param path: The path of the JSONL file to write.
+    :param stale_before: The time before which an enrichment is stale.
+    :return: The parts to apply and what each request asked for, keyed by recipe id.
+    """
+    planned = {}
+    for recipe in recipes:
+        recipe_parts = parts_to_apply(recipe, parts, stale_before)
+        if recipe_parts:
+            planned[recipe] = recipe_parts
+    local = local_difficulties(planned)
+    estimates = estimate_many(recipe.id for recipe, recipe_parts in planned.items() if 'nutrition' in recipe_parts)
+    asked = {}
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as file:
+        for recipe, recipe_parts in planned.items():
+            estimate = estimates.get(recipe.id)
+            ask_nutrients, nutrition_lines = nutrition_request(estimate)
+            answered = {'difficulty'} if recipe.id in local else set()
+            if not ask_nutrients:
+                answered.add('nutrition')
+            fields = assessment_fields(recipe_parts, answered)
+            asked[str(recipe.id)] = {'fields': list(fields), 'difficulty': local.get(recipe.id),
+                                     'nutrients': estimate.nutrients if estimate else []}
+            if not fields:
+                continue
+            line = {'custom_id': f"{CUSTOM_ID_PREFIX}{recipe.id}", 'method': 'POST', 'url': ENDPOINT,
+                    'body': AIRecipeAdvisor(recipe).assessment_request(fields, nutrition_lines)}
+            file.write(json.dumps(line) + '\n')
+    return {str(recipe.id): recipe_parts for recipe, recipe_parts in planned.items()}, asked
+
+
+def local_difficulties(planned: dict[Recipe, list[str]]) -> dict[int, str]:
+    """
+    Rate the difficulty of the recipes that need one with the local classifier.
+
+    :param planned: The parts to apply, keyed by recipe.
+    :return: The difficulties the classifier is confident about, keyed by recipe id.
+    """
+    ids = [recipe.id for recipe, recipe_parts in planned.items() if 'difficulty' in recipe_parts]
+    return difficulty_model.classify_many(Recipe.objects.filter(id__in=ids)) if ids else {}
+
+
+def assessment_fields(recipe_parts: Iterable[str], answered: set[str]) -> tuple[str, ...]:
+    """
+    Return the fields asked for in the assessment of a recipe.
+
+    :param recipe_parts: The parts to apply to the recipe.
+    :param answered: The parts answered locally, which GPT is not asked for.
+    :return: The fields of the other parts, among ASSESSMENT_FIELDS.
+    """
+    return tuple(FIELDS[part] for part in PARTS if part in recipe_parts and part not in answered)
+
+
+def asked_for(batch: EnrichmentBatch, recipe_id: int) -> dict:
+    """
+    Return what the request of a recipe asked for when the batch was submitted.
+
+    :param batch: The batch.
+    :param recipe_id: The id of the recipe.
+    :return: The `fields` asked for, the `difficulty` rated locally, None if GPT rates it, and the `nutrients`
+             estimated locally. Every field for the batches submitted before it was recorded.
+    """
+    return batch.asked.get(str(recipe_id)) or {'fields': list(ASSESSMENT_FIELDS), 'difficulty': None, 'nutrients': []}
+
+
+def submit_batch(backend: BatchBackend, recipes: Iterable[Recipe], parts: Iterable[str] = PARTS,
+                 stale_before: datetime | None = None, directory: str | None = None) -> EnrichmentBatch | None:
+    """
+    Write the batch file of the recipes and submit it.
+
+    The recipes whose planned parts were all answered locally are updated at once instead.
+
+    :param backend: The batch backend.
+    :param recipes: The recipes returned by select_recipes.
+    :param parts: The parts asked for.
+    :param stale_before: The time before which an enrichment is stale.
+    :param directory: Where the batch file is written, AI_BATCH_DIR by default.
+    :return: The submitted batch, None if no recipe needed a request.
+    """
+    path = os.path.join(directory or batch_backend.BATCH_DIR, f"enrich-{timezone.now():%Y%m%d-%H%M%S-%f}.jsonl")
+    planned, asked = write_batch(recipes, parts, path, stale_before)
+    answered = [int(recipe_id) for recipe_id in planned if not asked[recipe_id]['fields']]
+    if answered:
+        with transaction.atomic():
+            save_assessments(Recipe.objects.in_bulk(answered), {recipe_id: {} for recipe_id in answered},
+                             planned, asked)
+        logger.info(f"Enriched {len(answered)} recipe(s) locally without a request")
+    requested = {recipe_id: recipe_parts for recipe_id, recipe_parts in planned.items()
+                 if asked[recipe_id]['fields']}
+    if not requested:
+        os.remove(path)
+        return None
+    batch_id = backend.submit(path)
+    return EnrichmentBatch.objects.create(backend=backend.name, batch_id=batch_id, recipes=requested,
+                                          asked={recipe_id: asked[recipe_id] for recipe_id in requested},
+                                          input_file=path)
+
+
+def read_result(result: dict[str, Any]) -> str:
+    """
+    Return the answer of the model in one result line.
+
+    :param result: A line of the results of a batch.
+    :return: The content of the answer.
+    :raises ValueError: If the request failed.
+    """
+    response = result.get('response') or {}
+    if result.get('error') or response.get('status_code') != 200:
+        raise ValueError(f"The request failed: {result.get('error') or response.get('status_code')}")
+    try:
+        return response['body']['choices'][0]['message']['content']
+    except (KeyError, IndexError, TypeError):
+        raise ValueError("The response has no answer.")
+
+
+def read_assessments(batch: EnrichmentBatch, recipes: dict[int, Recipe],
+                     results: Iterable[dict[str, Any]]) -> dict[int, dict]:
+    """
+    Parse the usable assessments among the result lines of a batch, each checked for the fields its request asked.
+
+    :param batch: The batch the results belong to.
+    :param recipes: The recipes of the batch, by id.
+    :param results: The result lines returned by the backend.
+    :return: The assessments, keyed by recipe id.
+    """
+    assessments: dict[int, dict] = {}
+    for result in results:
+        custom_id = str(result.get('custom_id') or '')
+        try:
+            recipe_id = int(custom_id.removeprefix(CUSTOM_ID_PREFIX) or 0)
+        except ValueError:
+            logger.error(f"Skipping the result with the unknown custom_id {custom_id!r} in batch {batch.batch_id}")
+            continue
+        if recipe_id not in recipes:
+            continue
+        try:
+            assessments[recipe_id] = AIRecipeAdvisor(recipes[recipe_id]).parse_assessment(
+                read_result(result), tuple(asked_for(batch, recipe_id)['fields']))
+        except ValueError as e:
+            logger.error(f"Unusable assessment of recipe {recipe_id} in batch {batch.batch_id}: {e}")
+    return assessments
+
+
+def save_assessments(recipes: dict[int, Recipe], assessments: dict[int, dict], planned: dict[str, list[str]],
+                     asked: dict[str, dict]):
+    """
+    Write assessments into the recipes with bulk queries, in the caller's transaction.
+
+    The difficulty comes from the local classifier when it was confident at submission, and from GPT otherwise. The
+    nutrients estimated locally at submission are added to the ones GPT gave for the other ingredients.
+
+    :param recipes: The recipes, by id.
+    :param assessments: The assessments to write, keyed by recipe id.
+    :param planned: The parts to apply, keyed by recipe id as a string.
+    :param asked: What each request asked for, keyed by recipe id as a string.
+    """
+    now = timezone.now()
+    nutrition_recipes = [recipe_id for recipe_id in assessments if 'nutrition' in planned[str(recipe_id)]]
+    nutrients = {}
+    for recipe_id in nutrition_recipes:
+        request = asked[str(recipe_id)]
+        answer = assessments[recipe_id]["nutrients"] if "nutrients" in request['fields'] else []
+        nutrients[recipe_id] = merge_nutrients(request.get('nutrients', []),
+                                               [entry for entry in answer if entry.get("name")])
+    for recipe_id, assessment in assessments.items():
+        recipe = recipes[recipe_id]
+        parts = planned[str(recipe_id)]
+        if 'difficulty' in parts:
+            recipe.difficulty = asked[str(recipe_id)]['difficulty'] or assessment["difficulty"]
+        if 'approval' in parts:
+            recipe.AI_status = assessment["approved"]
+            if assessment["approved"] and recipe.status == StatusCode.PENDING.value[0]:
+                recipe.status = StatusCode.APPROVE.value[0]
+        recipe.enriched_at = now
+    Recipe.objects.bulk_update([recipes[recipe_id] for recipe_id in assessments],
+                               ['difficulty', 'AI_status', 'status', 'enriched_at'], batch_size=500)
+
+    NutritionList.objects.filter(recipe_id__in=nutrition_recipes).delete()
+    nutrition_objects = Nutrition.upsert_many({'name': entry["name"]}
+                                              for entries in nutrients.values() for entry in entries)
+    NutritionList.objects.bulk_create([
+        NutritionList(recipe_id=recipe_id, nutrition=nutrition_objects[normalize_name(entry["name"])],
+                      amount=Decimal(str(entry["amount"])), unit=entry.get("unit") or '')
+        for recipe_id, entries in nutrients.items() for entry in entries
+    ], batch_size=500)
+
+
+def apply_results(batch: EnrichmentBatch, results: Iterable[dict[str, Any]]) -> tuple[int, int]:
+    """
+    Write the assessments of a finished batch into the recipes with bulk queries.
+
+    :param batch: The batch the results belong to.
+    :param results: The result lines returned by the backend.
+    :return: The number of recipes updated and the number of requests without a usable answer.
+    """
+    recipes = Recipe.objects.in_bulk([int(recipe_id) for recipe_id in batch.recipes])
+    assessments = read_assessments(batch, recipes, results)
+    with transaction.atomic():
+        save_assessments(recipes, assessments, batch.recipes,
+                         {str(recipe_id): asked_for(batch, recipe_id) for recipe_id in assessments})
+        batch.applied = len(assessments)
+        batch.failed = len(recipes) - len(assessments)
+        batch.finished_at = timezone.now()
+        batch.save(update_fields=['applied', 'failed', 'finished_at'])
+    return batch.applied, batch.failed
+
+
+def collect_batches(backend: BatchBackend) -> list[EnrichmentBatch]:
+    """
+    Apply the results of every submitted batch of the backend that has finished.
+
+    :param backend: The batch backend.
+    :return: The batches that finished.
+    """
+    finished = []
+    for batch in EnrichmentBatch.objects.filter(backend=backend.name, status=BatchStatus.SUBMITTED.value[0]):
+        state = backend.status(batch.batch_id)
+        if state not in (COMPLETED, FAILED):
+            continue
+        apply_results(batch, backend.results(batch.batch_id))
+        batch.status = BatchStatus.APPLIED.value[0] if state == COMPLETED else BatchStatus.FAILED.value[0]
+        batch.save(update_fields=['status'])
+        finished.append(batch)
+    return finished
@@ -5,7 +5,7 @@ Both manually (NormalRecipeBuilder) and via Spoonacular API (SpoonacularRecipeBu
 """
 from decimal import Decimal
 from webpage.models import Recipe, Equipment, Ingredient, RecipeStep, IngredientList, EquipmentList, \
-    Nutrition, NutritionList, Diet, Cuisine
+    Nutrition, NutritionList, Diet, Cuisine, normalize_name
 from django.contrib.auth.models import User
 from abc import ABC, abstractmethod
 import requests
@@ -13,12 +13,30 @@ from decouple import config
 from bs4 import BeautifulSoup
 import logging
 from webpage.modules.ai_advisor import AIRecipeAdvisor
+from webpage.modules.nutrition_engine import learn_ingredient_nutrients
 from webpage.modules.status_code import StatusCode
 
 logger = logging.getLogger("Builder")
 
 API_KEY = config('API_KEY', default='fake-secret-key')
 spoonacular_password = config('SPOONACULAR_PASSWORD', default='fake-password')
+SPOONACULAR_USERNAME = "Spoonacular"
+SPOONACULAR_TIMEOUT = config('SPOONACULAR_TIMEOUT', cast=float, default=10)
+
+
+class SpoonacularAPIError(Exception):
+    """Raised when the Spoonacular API cannot load a recipe."""
+
+    def __init__(self, reason: str, status_code: int | None = None):
+        """
+        Initialize the error.
+
+        :param reason: Why the recipe could not be loaded, e.g. "HTTP 404" or the network error.
+        :param status_code: The HTTP status code of the response, None if there was no response.
+        """
+        super().__init__("Cannot load the recipe")
+        self.reason = reason
+        self.status_code = status_code
 
 
 class Builder(ABC):
@@ -123,6 +141,20 @@ class NormalRecipeBuilder(Builder):
         self.__diet_list = []
         self.__user = user
 
+    @classmethod
+    def from_recipe(cls, recipe: Recipe) -> 'NormalRecipeBuilder':
+        """
+        Create a builder that continues building an already saved recipe.
+
+        :param recipe: The recipe to keep building.
+        :return: A builder wrapping the recipe.
+        """
+        builder = cls.__new__(cls)
+        builder.__recipe = recipe
+        builder.__diet_list = list(recipe.diets.all())
+        builder.__user = recipe.poster_id
+        return builder
+
     def build_details(self, **kwargs):
         """Build the properties of the Recipe class."""
         for key, value in kwargs.items():
@@ -271,8 +303,20 @@ class SpoonacularRecipeBuilder():
         self.__api_is_called = False
         self.__api_equipment_is_fetch = False
         self.__api_nutrition_is_fetch = False
+        self.__normal_builder: NormalRecipeBuilder | None = None
+
+    @property
+    def __builder(self) -> NormalRecipeBuilder:
+        """
+        Return the builder of the local recipe, creating the recipe row on first use.
 
-        self.__builder = NormalRecipeBuilder(name=self.name, user=self.__create_spoonacular_user())  # This needs fixing later
+        The row is only created once something is written, so fetching the data first never leaves a partial recipe.
+
+        :return: The NormalRecipeBuilder wrapping the local recipe.
+        """
+        if self.__normal_builder is None:
+            self.__normal_builder = NormalRecipeBuilder(name=self.name, user=self.__create_spoonacular_user())
+        return self.__normal_builder
 
     def __create_spoonacular_user(self) -> User:  # Fix later
         """
@@ -281,52 +325,68 @@ class SpoonacularRecipeBuilder():
         :return: A spoonacular user class.
         """
         # Create a test user
-        user = User.objects.filter(username="Spoonacular").first()
+        user = User.objects.filter(username=SPOONACULAR_USERNAME).first()
         if user is None:
-            user = User(username="Spoonacular", password=spoonacular_password)
+            user = User(username=SPOONACULAR_USERNAME, password=spoonacular_password)
             user.save()
         return user
 
+    def __get(self, url: str) -> dict:
+        """
+        Request one endpoint of the Spoonacular API.
+
+        :param url: The URL of the endpoint.
+        :return: The JSON response.
+        :raises SpoonacularAPIError: If the request fails or the response is not successful.
+        """
+        try:
+            response = requests.get(url, params={'apiKey': API_KEY}, timeout=SPOONACULAR_TIMEOUT)
+        except requests.RequestException as e:
+            raise SpoonacularAPIError(f"{type(e).__name__}: {e}"[:200]) from e
+        if response.status_code != 200:
+            logger.debug(f"Error code: {response.status_code}")
+            raise SpoonacularAPIError(f"HTTP {response.status_code}", status_code=response.status_code)
+        return response.json()
+
     def __call_api(self):
-        """Fetch the information about the recipe from the Spoonacular API."""
-        if not self.__api_is_called:
-            response = requests.get(self.__url, params={'apiKey': API_KEY})
+        """
+        Fetch the information about the recipe from the Spoonacular API.
 
-            if response.status_code == 200:
-                self.__data = response.json()
-                self.__api_is_called = True
-            else:
-                logger.debug(f"Error code: {response.status_code}")
-                raise Exception("Cannot load the recipe")
+        Raise a SpoonacularAPIError if the recipe cannot be found.
+        """
+        if not self.__api_is_called:
+            self.__data = self.__get(self.__url)
+            self.__api_is_called = True
 
     def __fetch_equipment(self):
         """
         Fetch the equipments of the recipe from the Spoonacular API.
 
-        Raise an Exception if the recipe cannot be found.
+        Raise a SpoonacularAPIError if the recipe cannot be found.
         """
         if not self.__api_equipment_is_fetch:
-            response = requests.get(self.__equipment_url, params={'apiKey': API_KEY})
-
-            if response.status_code == 200:
-                self.__equipment_data = response.json()
-                self.__api_equipment_is_fetch = True
-            else:
-                raise Exception("Cannot load the recipe")
+            self.__equipment_data = self.__get(self.__equipment_url)
+            self.__api_equipment_is_fetch = True
 
     def __fetch_nutrition(self):
         """
         Fetch the nutrition of the recipe from the Spoonacular API.
 
-        Raise an Exeption if the recipe cannot be found.
+        Raise a SpoonacularAPIError if the recipe cannot be found.
         """
         if not self.__api_nutrition_is_fetch:
-            response = requests.get(self.__nutrition_url, params={'apiKey': API_KEY})
-            if response.status_code == 200:
-                self.__nutrition_data = response.json()
-                self.__api_nutrition_is_fetch = True
-            else:
-                raise Exception("Cannot load the recipe")
+            self.__nutrition_data = self.__get(self.__nutrition_url)
+            self.__api_nutrition_is_fetch = True
+
+    def fetch(self):
+        """
+        Fetch the information, equipment and nutrition of the recipe without writing anything to the database.
+
+        Raise a SpoonacularAPIError if any of them cannot be loaded.
+        """
+        self.__call_api()
+        self.__fetch_equipment()
+        self.__fetch_nutrition()
 
     def __strip_html(self, html_content: str) -> str:
         """
@@ -397,15 +457,17 @@ class SpoonacularRecipeBuilder():
         self.__call_api()
 
         # Use builder
-        for ingredient_data in self.__data.get('extendedIngredients', []):
-            ingredient, _ = Ingredient.objects.get_or_create(
-                spoonacular_id=ingredient_data['id'],
-                defaults={'name': ingredient_data['name'],
-                          'picture': self.__link_ingredient_image(ingredient_data['image']), }
-            )
-            ingredient.save()
+        extended_ingredients = self.__data.get('extendedIngredients', [])
+        ingredients = Ingredient.upsert_many(
+            ({'name': ingredient_data['name'],
+              'spoonacular_id': ingredient_data['id'],
+              'picture': self.__link_ingredient_image(ingredient_data['image'])}
+             for ingredient_data in extended_ingredients),
+            update_fields=['picture'],
+        )
+        for ingredient_data in extended_ingredients:
             self.__builder.build_ingredient(
-                ingredient=ingredient,
+                ingredient=ingredients[normalize_name(ingredient_data['name'])],
                 amount=ingredient_data['measures']['metric']['amount'],
                 unit=ingredient_data['measures']['metric']['unitLong'],
             )
@@ -430,14 +492,16 @@ class SpoonacularRecipeBuilder():
         self.__fetch_equipment()
 
         # Save the equipment (if available)
-        for equipment_data in self.__equipment_data.get('equipment', []):
-            equipment, _ = Equipment.objects.get_or_create(
-                name=equipment_data['name'],
-                picture=self.__link_equipment_image(equipment_data['image'])
-            )
-            equipment.save()
+        equipment_data_list = self.__equipment_data.get('equipment', [])
+        equipments = Equipment.upsert_many(
+            ({'name': equipment_data['name'],
+              'picture': self.__link_equipment_image(equipment_data['image'])}
+             for equipment_data in equipment_data_list),
+            update_fields=['picture'],
+        )
+        for equipment_data in equipment_data_list:
             self.__builder.build_equipment(
-                equipment=equipment,
+                equipment=equipments[normalize_name(equipment_data['name'])],
             )
 
     def build_diet(self):
@@ -449,15 +513,14 @@ class SpoonacularRecipeBuilder():
             self.__builder.build_diet(diet_object)
 
     def build_nutrition(self):
-        """Fetch and build nutrition data for the recipe."""
+        """Fetch and build nutrition data for the recipe, and learn the nutrients of its ingredients."""
         self.__fetch_nutrition()
-        for nutrition_data in self.__nutrition_data.get('nutrients', []):
-            nutrition, _ = Nutrition.objects.get_or_create(
-                name=nutrition_data['name'],
-            )
-            nutrition.save()
+        learn_ingredient_nutrients(self.__nutrition_data.get('ingredients', []))
+        nutrients = self.__nutrition_data.get('nutrients', [])
+        nutritions = Nutrition.upsert_many({'name': nutrition_data['name']} for nutrition_data in nutrients)
+        for nutrition_data in nutrients:
             self.__builder.build_nutrition(
-                nutrition=nutrition,
+                nutrition=nutritions[normalize_name(nutrition_data['name'])],
                 amount=nutrition_data['amount'],
                 unit=nutrition_data['unit'],
             )
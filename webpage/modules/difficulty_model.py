@@ -0,0 +1,275 @@
+"""Local classifier of the recipe difficulty, trained on the difficulties GPT gave, to skip GPT when it is confident."""
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Iterable
+import numpy as np
+from django.db.models import Count, QuerySet
+from django.utils import timezone
+from decouple import config
+from pantry import settings
+from webpage.models import Recipe, RecipeStep
+
+logger = logging.getLogger("Difficulty model")
+
+MODEL_PATH = config('DIFFICULTY_MODEL_PATH', default=str(settings.BASE_DIR / 'difficulty_model.json'))
+# Probability of its label above which the classifier answers instead of GPT.
+MIN_CONFIDENCE = config('DIFFICULTY_MIN_CONFIDENCE', cast=float, default=0.8)
+# Labelled recipes needed to train the classifier.
+MIN_SAMPLES = config('DIFFICULTY_MIN_SAMPLES', cast=int, default=30)
+LABELS = ["Easy", "Normal", "Hard"]
+# Techniques that make a recipe harder, searched for in the steps.
+TECHNIQUES = [
+    "blanch", "braise", "brine", "caramelize", "caramelise", "clarify", "confit", "cure", "deglaze", "emulsify",
+    "ferment", "flambe", "flambé", "fold", "julienne", "knead", "laminate", "poach", "proof", "reduce", "render",
+    "sear", "smoke", "sous vide", "temper", "truss", "water bath", "whip",
+]
+FEATURES = ["steps", "step_characters", "minutes", "equipment", "ingredients", "techniques"]
+# Share of the labelled recipes held out to measure the accuracy before training on all of them.
+HOLDOUT = 0.2
+_technique_pattern = re.compile(r"\b(" + "|".join(re.escape(technique) for technique in TECHNIQUES) + r")", re.IGNORECASE)
+
+
+def features(steps: Iterable[str], minutes: float, equipment: int, ingredients: int) -> list[float]:
+    """
+    Describe a recipe by numbers, on a log scale so a few huge recipes do not dominate.
+
+    :param steps: The descriptions of the steps.
+    :param minutes: The estimated time.
+    :param equipment: The number of equipment.
+    :param ingredients: The number of ingredients.
+    :return: One value per name in FEATURES.
+    """
+    steps = list(steps)
+    techniques = {match.lower() for step in steps for match in _technique_pattern.findall(step)}
+    return [math.log1p(len(steps)), math.log1p(sum(len(step) for step in steps)), math.log1p(max(minutes or 0, 0)),
+            math.log1p(equipment), math.log1p(ingredients), float(len(techniques))]
+
+
+def queryset_features(recipes: QuerySet[Recipe]) -> tuple[list[Recipe], np.ndarray]:
+    """
+    Describe many recipes by numbers with three queries.
+
+    :param recipes: The recipes.
+    :return: The recipes and their features, one row per recipe.
+    """
+    steps = defaultdict(list)
+    for recipe_id, description in RecipeStep.objects.filter(recipe__in=recipes.values('id')) \
+            .order_by('recipe_id', 'number').values_list('recipe_id', 'description'):
+        steps[recipe_id].append(description)
+    recipes = list(recipes.annotate(equipment_count=Count('equipmentlist', distinct=True),
+                                    ingredient_count=Count('ingredientlist', distinct=True)).order_by('id'))
+    rows = [features(steps[recipe.id], recipe.estimated_time, recipe.equipment_count, recipe.ingredient_count)
+            for recipe in recipes]
+    return recipes, np.array(rows, dtype=np.float64).reshape(-1, len(FEATURES))
+
+
+@dataclass(frozen=True)
+class Prediction:
+    """A difficulty and the probability the classifier gives it."""
+
+    label: str
+    confidence: float
+
+
+class DifficultyModel:
+    """
+    Multinomial logistic regression of the difficulty on the features of a recipe.
+
+    :param mean: The mean of each feature in the training recipes.
+    :param scale: The standard deviation of each feature in the training recipes.
+    :param weights: One column of weights per label.
+    :param bias: The bias of each label.
+    :param metrics: How the classifier did on the held out recipes.
+    """
+
+    def __init__(self, mean: np.ndarray, scale: np.ndarray, weights: np.ndarray, bias: np.ndarray,
+                 metrics: dict | None = None):
+        """
+        Initialize the classifier.
+
+        :param mean: The mean of each feature in the training recipes.
+        :param scale: The standard deviation of each feature in the training recipes.
+        :param weights: One column of weights per label.
+        :param bias: The bias of each label.
+        :param metrics: How the classifier did on the held out recipes.
+        """
+        self.mean = mean
+        self.scale = scale
+        self.weights = weights
+        self.bias = bias
+        self.metrics = metrics or {}
+
+    def probabilities(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Return the probability of each label.
+
+        :param rows: The features, one row per recipe.
+        :return: One row of probabilities per recipe, in the order of LABELS.
+        """
+        return _softmax(((np.atleast_2d(rows) - self.mean) / self.scale) @ self.weights + self.bias)
+
+    def predict(self, row: list[float]) -> Prediction:
+        """
+        Classify one recipe.
+
+        :param row: The features of the recipe.
+        :return: The most probable difficulty.
+        """
+        probabilities = self.probabilities(np.array(row, dtype=np.float64))[0]
+        best = int(np.argmax(probabilities))
+        return Prediction(LABELS[best], float(probabilities[best]))
+
+    @classmethod
+    def fit(cls, rows: np.ndarray, labels: np.ndarray, l2: float = 0.01, iterations: int = 500,
+            learning_rate: float = 0.5) -> 'DifficultyModel':
+        """
+        Train the classifier by gradient descent on the cross-entropy.
+
+        :param rows: The features, one row per recipe.
+        :param labels: The index in LABELS of the difficulty of each recipe.
+        :param l2: The weight decay, which keeps the probabilities from being overconfident.
+        :param iterations: The gradient steps.
+        :param learning_rate: The size of the gradient steps.
+        :return: The classifier.
+        """
+        mean = rows.mean(axis=0)
+        scale = rows.std(axis=0)
+        scale[scale == 0] = 1
+        standardized = (rows - mean) / scale
+        targets = np.eye(len(LABELS))[labels]
+        weights = np.zeros((rows.shape[1], len(LABELS)))
+        bias = np.zeros(len(LABELS))
+        for _ in range(iterations):
+            error = (_softmax(standardized @ weights + bias) - targets) / len(rows)
+            weights -= learning_rate * (standardized.T @ error + l2 * weights)
+            bias -= learning_rate * error.sum(axis=0)
+        return cls(mean, scale, weights, bias)
+
+    @classmethod
+    def train(cls, recipes: QuerySet[Recipe] | None = None, min_confidence: float | None = None,
+              seed: int = 0) -> 'DifficultyModel':
+        """
+        Train on the recipes that have a difficulty, after measuring the accuracy on a held out part of them.
+
+        :param recipes: The recipes to learn from, by default all those with a difficulty.
+        :param min_confidence: The confidence the metrics are measured at, MIN_CONFIDENCE by default.
+        :param seed: The seed of the held out split.
+        :return: The classifier trained on all the recipes, with the metrics of the held out recipes.
+        :raises ValueError: If fewer than MIN_SAMPLES recipes have a difficulty.
+        """
+        min_confidence = MIN_CONFIDENCE if min_confidence is None else min_confidence
+        recipes = Recipe.objects.all() if recipes is None else recipes
+        recipes, rows = queryset_features(recipes.filter(difficulty__in=LABELS))
+        if len(recipes) < MIN_SAMPLES:
+            raise ValueError(f"{len(recipes)} recipe(s) have a difficulty, {MIN_SAMPLES} are needed.")
+        labels = np.array([LABELS.index(recipe.difficulty) for recipe in recipes])
+
+        order = np.random.default_rng(seed).permutation(len(recipes))
+        held_out, kept = order[:max(int(len(order) * HOLDOUT), 1)], order[max(int(len(order) * HOLDOUT), 1):]
+        probabilities = cls.fit(rows[kept], labels[kept]).probabilities(rows[held_out])
+        predicted, confidence = probabilities.argmax(axis=1), probabilities.max(axis=1)
+        confident = confidence >= min_confidence
+        model = cls.fit(rows, labels)
+        model.metrics = {
+            'samples': len(recipes),
+            'held_out': len(held_out),
+            'accuracy': float(np.mean(predicted == labels[held_out])),
+            'min_confidence': min_confidence,
+            'coverage': float(np.mean(confident)),
+            'confident_accuracy': float(np.mean(predicted[confident] == labels[held_out][confident]))
+            if confident.any() else None,
+            'trained_at': timezone.now().isoformat(),
+        }
+        return model
+
+    def save(self, path: str | None = None):
+        """
+        Write the classifier to a JSON file, replacing the previous one at once.
+
+        :param path: The file, DIFFICULTY_MODEL_PATH by default.
+        """
+        path = path or MODEL_PATH
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump({'labels': LABELS, 'features': FEATURES, 'mean': self.mean.tolist(), 'scale': self.scale.tolist(),
+                       'weights': self.weights.tolist(), 'bias': self.bias.tolist(), 'metrics': self.metrics}, file)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path: str | None = None) -> 'DifficultyModel':
+        """
+        Read a classifier.
+
+        :param path: The file, DIFFICULTY_MODEL_PATH by default.
+        :return: The classifier.
+        :raises FileNotFoundError: If the classifier was not trained.
+        :raises ValueError: If the file was written for other labels or features.
+        """
+        with open(path or MODEL_PATH, encoding='utf-8') as file:
+            data = json.load(file)
+        if data['labels'] != LABELS or data['features'] != FEATURES:
+            raise ValueError("The classifier was trained on other labels or features, train it again.")
+        return cls(*(np.array(data[name]) for name in ('mean', 'scale', 'weights', 'bias')), data['metrics'])
+
+
+def _softmax(scores: np.ndarray) -> np.ndarray:
+    """
+    Turn scores into probabilities.
+
+    :param scores: One row of scores per recipe.
+    :return: One row of probabilities per recipe.
+    """
+    exponentials = np.exp(scores - scores.max(axis=-1, keepdims=True))
+    return exponentials / exponentials.sum(axis=-1, keepdims=True)
+
+
+def classify_many(recipes: QuerySet[Recipe]) -> dict[int, str]:
+    """
+    Classify the difficulty of many recipes at once, e.g. the recipes of a batch.
+
+    :param recipes: The recipes.
+    :return: The difficulties the classifier is confident about, keyed by recipe id. Empty if it was not trained.
+    """
+    model = get_model()
+    if model is None:
+        return {}
+    recipes, rows = queryset_features(recipes)
+    if not recipes:
+        return {}
+    probabilities = model.probabilities(rows)
+    best = probabilities.argmax(axis=1)
+    return {recipe.id: LABELS[label] for recipe, label, row in zip(recipes, best, probabilities)
+            if row[label] >= MIN_CONFIDENCE}
+
+
+_lock = threading.Lock()
+_loaded: tuple[str, float, DifficultyModel] | None = None
+
+
+def get_model(path: str | None = None) -> DifficultyModel | None:
+    """
+    Return the classifier, loaded once per process and again after it is trained.
+
+    :param path: The file, DIFFICULTY_MODEL_PATH by default.
+    :return: The classifier, None if it was not trained.
+    """
+    global _loaded
+    path = path or MODEL_PATH
+    try:
+        modified = os.stat(path).st_mtime
+    except OSError:
+        return None
+    with _lock:
+        if _loaded is None or _loaded[:2] != (path, modified):
+            try:
+                _loaded = (path, modified, DifficultyModel.load(path))
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"Cannot load the difficulty classifier from {path}: {e}")
+                return None
+        return _loaded[2]
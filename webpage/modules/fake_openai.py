@@ -0,0 +1,372 @@
+"""A local stand-in for the OpenAI chat completions API, streaming or not, for tests, benchmarks and offline development."""
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Iterable, Mapping
+
+# Seconds to wait before answering, drawn with the random generator of the server.
+Latency = Callable[[random.Random], float]
+Answer = str | Callable[[dict[str, Any]], str]
+# Ways to break an answer: the usual mistakes of a model that json_repair reads, then ones it cannot.
+MALFORMATIONS = ('fenced', 'trailing_comma', 'truncated', 'prose')
+
+
+def constant(seconds: float) -> Latency:
+    """
+    Return a latency that is always the same.
+
+    :param seconds: The seconds.
+    :return: The latency.
+    """
+    return lambda generator: seconds
+
+
+def uniform(low: float, high: float) -> Latency:
+    """
+    Return a latency spread evenly between two bounds.
+
+    :param low: The fewest seconds.
+    :param high: The most seconds.
+    :return: The latency.
+    """
+    return lambda generator: generator.uniform(low, high)
+
+
+def lognormal(median: float, sigma: float) -> Latency:
+    """
+    Return a latency with a long tail, as the model usually answers in about the median but sometimes takes much longer.
+
+    :param median: The median seconds.
+    :param sigma: The standard deviation of the logarithm of the seconds, 0.5 puts the 99th percentile at about 3.2
+                  times the median.
+    :return: The latency.
+    """
+    return lambda generator: generator.lognormvariate(math.log(median), sigma)
+
+
+def parse_latency(spec: str) -> Latency:
+    """
+    Read a latency from the command line.
+
+    :param spec: Seconds such as `0.2`, `uniform:LOW,HIGH` or `lognormal:MEDIAN,SIGMA`.
+    :return: The latency.
+    :raises ValueError: If the latency cannot be read.
+    """
+    kind, _, arguments = spec.partition(':')
+    distributions = {'uniform': uniform, 'lognormal': lognormal}
+    if not arguments:
+        return constant(float(kind))
+    if kind not in distributions:
+        raise ValueError(f"Unknown latency distribution '{kind}', use {', '.join(distributions)}.")
+    values = [float(value) for value in arguments.split(',')]
+    if len(values) != 2:
+        raise ValueError(f"The {kind} latency takes two numbers.")
+    return distributions[kind](*values)
+
+
+def malform(content: str, kind: str) -> str:
+    """
+    Break an answer the way a model sometimes does.
+
+    :param content: The answer.
+    :param kind: One of MALFORMATIONS.
+    :return: The broken answer.
+    """
+    if kind == 'fenced':
+        return f"Here you go:\n```json\n{content}\n```\nEnjoy your meal!"
+    if kind == 'trailing_comma':
+        return content[:-1] + ",}" if content.endswith('}') else content + ","
+    if kind == 'truncated':
+        return content[:len(content) // 2]
+    return "I'm sorry, I can't help with that recipe."
+
+
+class FakeOpenAIServer:
+    """
+    Serve chat completions with canned answers from a background thread.
+
+    Point a client at it with OpenAI(base_url=server.url, api_key="fake"), or every handler with
+    gpt_handler.use_base_url(server.url).
+
+    :param content: The answer, or a function building it from the JSON body of the request.
+    :param chunk_size: The number of characters per streamed chunk.
+    :param delay: The seconds to wait before each streamed chunk, or before the whole answer when not streaming.
+    :param errors: The HTTP status codes answered to the next requests instead of the answer, one per request.
+    :param scripts: The answers per call, used instead of content when their key is the name of the JSON schema of
+                    the request or is part of its system prompt.
+    :param latency: The seconds to wait before answering or before the first streamed chunk, None for none.
+    :param error_rate: The share of the requests answered with error_status.
+    :param error_status: The HTTP status code of the injected errors.
+    :param malformed_rate: The share of the answers broken in one of the MALFORMATIONS.
+    :param seed: The seed of the random latency, errors and malformations, None for a different run every time.
+    :param port: The local port to serve on, 0 for a free one.
+    """
+
+    def __init__(self, content: Answer = "", chunk_size: int = 8, delay: float = 0.0, errors: Iterable[int] = (),
+                 scripts: Mapping[str, Answer] | None = None, latency: Latency | None = None, error_rate: float = 0.0,
+                 error_status: int = 503, malformed_rate: float = 0.0, seed: int | None = None, port: int = 0):
+        """
+        Initialize the server without starting it.
+
+        :param content: The answer, or a function building it from the JSON body of the request.
+        :param chunk_size: The number of characters per streamed chunk.
+        :param delay: The seconds to wait before each streamed chunk, or before the whole answer when not streaming.
+        :param errors: The HTTP status codes answered to the next requests instead of the answer, one per request,
+                       e.g. [503, 503] for a service that recovers on the third request.
+        :param scripts: The answers per call, by JSON schema name or by a part of the system prompt, e.g.
+                        {"recipe_assessment": "{...}", "determine the difficulty": "Hard"}.
+        :param latency: The seconds to wait before answering, e.g. lognormal(0.5, 0.5). None for none.
+        :param error_rate: The share of the requests answered with error_status, e.g. 0.05.
+        :param error_status: The HTTP status code of the injected errors.
+        :param malformed_rate: The share of the answers broken in one of the MALFORMATIONS.
+        :param seed: The seed of the random latency, errors and malformations, None for a different run every time.
+        :param port: The local port to serve on, 0 for a free one.
+        """
+        self.content = content
+        self.chunk_size = chunk_size
+        self.delay = delay
+        self.errors = list(errors)
+        self.scripts = dict(scripts or {})
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.malformed_rate = malformed_rate
+        self.port = port
+        self.requests: list[dict[str, Any]] = []
+        # How many requests were answered, and how many of them with an error or a malformed answer.
+        self.counts: Counter = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server: ThreadingHTTPServer | None = None
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        """Return the base URL of the API."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def answer_for(self, body: dict[str, Any]) -> str:
+        """
+        Return the scripted answer to a request.
+
+        :param body: The JSON body of the request.
+        :return: The answer of the first script matching the schema name or the system prompt, content otherwise.
+        """
+        schema = (body.get('response_format') or {}).get('json_schema', {}).get('name')
+        system = system_prompt(body)
+        answer = next((answer for key, answer in self.scripts.items() if key == schema or key in system), self.content)
+        return answer(body) if callable(answer) else answer
+
+    def draw(self) -> tuple[int | None, str | None, float]:
+        """
+        Decide how to answer the next request.
+
+        :return: The HTTP status code of an error to send instead of the answer, None for no error, the
+                 malformation of the answer, None to keep it, and the seconds to wait before answering.
+        """
+        with self._lock:
+            self.counts['requests'] += 1
+            if self.errors:
+                status = self.errors.pop(0)
+            else:
+                status = self.error_status if self._random.random() < self.error_rate else None
+            malformation = None
+            if status is None and self._random.random() < self.malformed_rate:
+                malformation = self._random.choice(MALFORMATIONS)
+                self.counts[f'malformed_{malformation}'] += 1
+            if status is not None:
+                self.counts['errors'] += 1
+            return status, malformation, self.latency(self._random) if self.latency else 0.0
+
+    def start(self) -> 'FakeOpenAIServer':
+        """
+        Start serving on the local port.
+
+        :return: The server itself.
+        """
+        self._server = ThreadingHTTPServer(('127.0.0.1', self.port), FakeOpenAIHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> 'FakeOpenAIServer':
+        """Start the server when entering a with block."""
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        """Stop the server when leaving a with block."""
+        self.stop()
+
+    @staticmethod
+    def chunk(body: dict[str, Any], delta: dict[str, str], finish_reason: str | None) -> dict[str, Any]:
+        """
+        Build one streamed chunk.
+
+        :param body: The JSON body of the request.
+        :param delta: The new part of the message.
+        :param finish_reason: Why the answer ended, None if it goes on.
+        :return: The chunk.
+        """
+        return {
+            'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+            'model': body.get('model', 'fake'),
+            'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+        }
+
+    @staticmethod
+    def completion(body: dict[str, Any], content: str) -> dict[str, Any]:
+        """
+        Build a whole completion.
+
+        :param body: The JSON body of the request.
+        :param content: The answer.
+        :return: The completion.
+        """
+        return {
+            'id': 'chatcmpl-fake', 'object': 'chat.completion', 'created': int(time.time()),
+            'model': body.get('model', 'fake'),
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': content}}],
+            'usage': FakeOpenAIServer.usage(body, content),
+        }
+
+    @staticmethod
+    def usage(body: dict[str, Any], content: str) -> dict[str, int]:
+        """
+        Estimate the tokens of a request and its answer at about four characters per token.
+
+        :param body: The JSON body of the request.
+        :param content: The answer.
+        :return: The usage of the completion.
+        """
+        prompt_tokens = len(json.dumps(body.get('messages', []))) // 4
+        completion_tokens = len(content) // 4
+        return {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens}
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Answer POST /v1/chat/completions for the FakeOpenAIServer stored on its HTTP server."""
+
+    @property
+    def fake(self) -> FakeOpenAIServer:
+        """Return the fake server whose answers are sent."""
+        return self.server.fake
+
+    def do_POST(self):
+        """Answer the request, unless the client stopped waiting for it, e.g. after its timeout."""
+        try:
+            self.answer()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def answer(self):
+        """Send an injected error, or the answer as one completion or as server-sent chunks."""
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        self.fake.requests.append(body)
+        status, malformation, latency = self.fake.draw()
+        self.wait(latency)
+        if status is not None:
+            self.send_fake_error(status)
+            return
+        content = self.fake.answer_for(body)
+        if malformation:
+            content = malform(content, malformation)
+        if body.get('stream'):
+            self.send_stream(body, content)
+        else:
+            self.wait(self.fake.delay)
+            self.send_json(self.fake.completion(body, content))
+
+    @staticmethod
+    def wait(seconds: float):
+        """
+        Wait before answering, as the model would.
+
+        :param seconds: The seconds to wait.
+        """
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def send_fake_error(self, status: int):
+        """
+        Answer with an error of the API.
+
+        :param status: The HTTP status code.
+        """
+        self.send_json({'error': {'message': "Fake error", 'type': 'server_error'}}, status)
+
+    def send_stream(self, body: dict[str, Any], content: str):
+        """
+        Send the answer in server-sent chunks, then its usage if the request asked for it.
+
+        :param body: The JSON body of the request.
+        :param content: The answer.
+        """
+        fake = self.fake
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        for start in range(0, len(content), fake.chunk_size):
+            self.wait(fake.delay)
+            self.send_event(fake.chunk(body, {'content': content[start:start + fake.chunk_size]}, None))
+        self.send_event(fake.chunk(body, {}, 'stop'))
+        if body.get('stream_options', {}).get('include_usage'):
+            self.send_event(dict(fake.chunk(body, {}, None), choices=[], usage=fake.usage(body, content)))
+        self.wfile.write(b'data: [DONE]\n\n')
+
+    def send_event(self, data: dict[str, Any]):
+        """
+        Write one server-sent event.
+
+        :param data: The chunk.
+        """
+        self.wfile.write(f"data: {json.dumps(data)}\n\n".encode('utf-8'))
+        self.wfile.flush()
+
+    def send_json(self, data: dict[str, Any], status: int = 200):
+        """
+        Write a JSON response.
+
+        :param data: The response.
+        :param status: The HTTP status code.
+        """
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        """Keep the test output quiet."""
+
+
+def system_prompt(body: dict[str, Any]) -> str:
+    """
+    Return the text of the system messages of a request.
+
+    :param body: The JSON body of the request.
+    :return: The text, whether each message content is a string or a list of parts.
+    """
+    texts = []
+    for message in body.get('messages', []):
+        if message.get('role') != 'system':
+            continue
+        content = message.get('content', '')
+        texts += [content] if isinstance(content, str) else [part.get('text', '') for part in content]
+    return "\n".join(texts)
@@ -0,0 +1,198 @@
+"""Two-tier cache of GPT responses: a per-process LRU in front of a table shared by every process."""
+from collections import OrderedDict, defaultdict
+from datetime import timedelta
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Any
+from django.db.models import F
+from django.utils import timezone
+from decouple import config
+from webpage.models import GPTResponseCache
+
+logger = logging.getLogger("GPT cache")
+
+DEFAULT_CALL_TYPE = 'default'
+MEMORY_SIZE = config('GPT_CACHE_MEMORY_SIZE', cast=int, default=256)
+# Answers sampled above this temperature are meant to vary, so they are never cached.
+MAX_TEMPERATURE = config('GPT_CACHE_MAX_TEMPERATURE', cast=float, default=1.0)
+# Seconds a response is reused for, per kind of call. 0 disables caching for that kind.
+TTLS = {
+    DEFAULT_CALL_TYPE: config('GPT_CACHE_TTL', cast=int, default=86400),
+    'alternatives': config('GPT_CACHE_TTL_ALTERNATIVES', cast=int, default=7 * 86400),
+    'difficulty': config('GPT_CACHE_TTL_DIFFICULTY', cast=int, default=30 * 86400),
+    'nutrition': config('GPT_CACHE_TTL_NUTRITION', cast=int, default=30 * 86400),
+    'approval': config('GPT_CACHE_TTL_APPROVAL', cast=int, default=86400),
+    'assessment': config('GPT_CACHE_TTL_ASSESSMENT', cast=int, default=86400),
+}
+
+
+def make_key(model: str, context: str, input: str, params: dict[str, Any]) -> str:
+    """
+    Hash everything that determines the response.
+
+    :param model: The GPT's model name.
+    :param context: The system context.
+    :param input: The user input.
+    :param params: The sampling parameters.
+    :return: The hex digest used as the cache key.
+    """
+    payload = json.dumps({'model': model, 'context': context, 'input': input, 'params': params},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class GPTCache:
+    """
+    Cache GPT responses in memory and in the database.
+
+    :param memory_size: The number of responses kept in memory by this process.
+    :param ttls: Seconds a response is reused for, per call type.
+    :param max_temperature: The highest temperature whose responses are cached.
+    """
+
+    def __init__(self, memory_size: int = MEMORY_SIZE, ttls: dict[str, int] | None = None,
+                 max_temperature: float = MAX_TEMPERATURE):
+        """
+        Initialize the cache.
+
+        :param memory_size: The number of responses kept in memory by this process.
+        :param ttls: Seconds a response is reused for, per call type.
+        :param max_temperature: The highest temperature whose responses are cached.
+        """
+        self.memory_size = memory_size
+        self.ttls = TTLS if ttls is None else ttls
+        self.max_temperature = max_temperature
+        self._memory: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def ttl(self, call_type: str) -> int:
+        """
+        Return how long responses of a call type are reused.
+
+        :param call_type: The kind of call, e.g. 'difficulty'.
+        :return: The number of seconds, 0 if they are not cached.
+        """
+        return self.ttls.get(call_type, self.ttls.get(DEFAULT_CALL_TYPE, 0))
+
+    def is_cacheable(self, call_type: str, temperature: float) -> bool:
+        """
+        Return whether a call may be answered from the cache.
+
+        :param call_type: The kind of call.
+        :param temperature: The sampling temperature of the call.
+        :return: True if the call is cached.
+        """
+        return temperature <= self.max_temperature and self.ttl(call_type) > 0
+
+    def get(self, key: str, call_type: str = DEFAULT_CALL_TYPE) -> str | None:
+        """
+        Return a cached response, looking in memory first and then in the database.
+
+        :param key: The cache key.
+        :param call_type: The kind of call, used for the metrics.
+        :return: The response, or None on a miss.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[1] > time.time():
+                self._memory.move_to_end(key)
+                self._stats[call_type]['memory_hits'] += 1
+                return entry[0]
+            self._memory.pop(key, None)
+
+        entries = GPTResponseCache.objects.filter(key=key, expires_at__gt=timezone.now())
+        row = entries.values_list('response', 'expires_at').first()
+        if row is None:
+            self._count(call_type, 'misses')
+            return None
+        entries.update(hits=F('hits') + 1)
+        self._remember(key, row[0], row[1].timestamp())
+        self._count(call_type, 'db_hits')
+        return row[0]
+
+    def set(self, key: str, response: str, call_type: str = DEFAULT_CALL_TYPE, model: str = ''):
+        """
+        Store a response in both tiers.
+
+        :param key: The cache key.
+        :param response: The response of the model.
+        :param call_type: The kind of call, which decides the TTL.
+        :param model: The GPT's model name.
+        """
+        ttl = self.ttl(call_type)
+        if ttl <= 0:
+            return
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=ttl)
+        GPTResponseCache.objects.update_or_create(
+            key=key,
+            defaults={'call_type': call_type, 'model': model, 'response': response, 'hits': 0,
+                      'created_at': now, 'expires_at': expires_at},
+        )
+        self._remember(key, response, expires_at.timestamp())
+
+    def delete(self, key: str):
+        """
+        Forget a response, e.g. because it turned out to be unusable.
+
+        :param key: The cache key.
+        """
+        with self._lock:
+            self._memory.pop(key, None)
+        GPTResponseCache.objects.filter(key=key).delete()
+
+    def count_bypass(self, call_type: str = DEFAULT_CALL_TYPE):
+        """
+        Count a call that skipped the cache.
+
+        :param call_type: The kind of call.
+        """
+        self._count(call_type, 'bypassed')
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """
+        Return the hit and miss counts of this process.
+
+        :return: The counts of memory_hits, db_hits, misses and bypassed calls, per call type.
+        """
+        with self._lock:
+            return {call_type: dict(counts) for call_type, counts in self._stats.items()}
+
+    def clear_memory(self):
+        """Empty the in-memory tier and reset the metrics."""
+        with self._lock:
+            self._memory.clear()
+            self._stats.clear()
+
+    def _remember(self, key: str, response: str, expires_at: float):
+        """
+        Put a response in the in-memory tier, evicting the least recently used one if it is full.
+
+        :param key: The cache key.
+        :param response: The response of the model.
+        :param expires_at: The expiry time as a timestamp.
+        """
+        if self.memory_size <= 0:
+            return
+        with self._lock:
+            self._memory[key] = (response, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def _count(self, call_type: str, name: str):
+        """
+        Increase one of the metrics.
+
+        :param call_type: The kind of call.
+        :param name: The name of the metric.
+        """
+        with self._lock:
+            self._stats[call_type][name] += 1
+
+
+default_cache = GPTCache()
@@ -1,9 +1,101 @@
 """The handler for the GPT model."""
-from openai import OpenAI
-from typing import Any
+import asyncio
+import time
+from weakref import WeakKeyDictionary
+from asgiref.sync import sync_to_async
+from openai import OpenAI, AsyncOpenAI
+from typing import Any, Awaitable, Iterator
 from decouple import config
+import logging
+from webpage.modules.gpt_cache import GPTCache, DEFAULT_CALL_TYPE, default_cache, make_key
+from webpage.modules import telemetry
+from webpage.modules.model_router import ModelRouter, Route
+from webpage.modules.resilience import CircuitBreaker, REQUEST_TIMEOUT, default_breaker
+from webpage.modules.single_flight import SingleFlight, default_flight
 
-client = OpenAI(api_key=config("OPENAI_APIKEY", default="Fake-API-key"))
+logger = logging.getLogger("GPT handler")
+
+# Another OpenAI compatible server to send the requests to, e.g. `python manage.py fake_openai`. OpenAI by default.
+BASE_URL = config("OPENAI_BASE_URL", default='') or None
+
+
+def make_client() -> OpenAI:
+    """
+    Create the OpenAI client of the handlers, sending the requests to BASE_URL.
+
+    The advisor retries with backoff under a deadline, so the client neither retries nor waits longer on its own.
+
+    :return: The client.
+    """
+    return OpenAI(api_key=config("OPENAI_APIKEY", default="Fake-API-key"), base_url=BASE_URL, max_retries=0,
+                  timeout=REQUEST_TIMEOUT)
+
+
+client = make_client()
+# The most requests awaited at the same time on one event loop.
+CONCURRENCY = config("GPT_CONCURRENCY", cast=int, default=4)
+
+# An async client and its connections belong to the event loop they were created on.
+_async_clients: WeakKeyDictionary = WeakKeyDictionary()
+_concurrency_limits: WeakKeyDictionary = WeakKeyDictionary()
+
+
+def get_async_client() -> AsyncOpenAI:
+    """
+    Return the async OpenAI client of the running event loop.
+
+    :return: The client.
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        _async_clients[loop] = AsyncOpenAI(api_key=config("OPENAI_APIKEY", default="Fake-API-key"), base_url=BASE_URL,
+                                           max_retries=0, timeout=REQUEST_TIMEOUT)
+    return _async_clients[loop]
+
+
+def use_base_url(base_url: str | None):
+    """
+    Send the requests of every handler to another server from now on, e.g. a FakeOpenAIServer of a benchmark.
+
+    :param base_url: The base URL of the API, None for OpenAI.
+    """
+    global BASE_URL, client
+    BASE_URL = base_url
+    client = make_client()
+    _async_clients.clear()
+
+
+def get_concurrency_limit() -> asyncio.Semaphore:
+    """
+    Return the semaphore capping the requests awaited at the same time on the running event loop.
+
+    :return: The semaphore.
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _concurrency_limits:
+        _concurrency_limits[loop] = asyncio.Semaphore(CONCURRENCY)
+    return _concurrency_limits[loop]
+
+
+def object_schema(properties: dict[str, dict[str, Any]]) -> dict[str, Any]:
+    """
+    Return the JSON schema of an object with exactly these properties, as strict structured outputs require.
+
+    :param properties: The schema of each property.
+    :return: The schema of the object.
+    """
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+
+def json_schema_format(name: str, schema: dict[str, Any]) -> dict[str, Any]:
+    """
+    Return the response format making the model answer with JSON that matches a schema.
+
+    :param name: The name of the schema.
+    :param schema: The JSON schema, with an object at its root.
+    :return: The response format of the request.
+    """
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
 
 
 class GPTHandler:
@@ -12,17 +104,47 @@ class GPTHandler:
     
     :param context: The context of the model.
     :param model: The GPT's model name.
+    :param temperature: The sampling temperature.
+    :param call_type: The kind of call, which decides how long its responses are cached.
+    :param cache: The response cache, None to always call the model.
+    :param response_format: The response format of the request, plain text by default.
+    :param client: The OpenAI client, the shared module client by default.
+    :param breaker: The circuit breaker guarding the requests, shared by every handler by default.
+    :param router: The router choosing the model of each request among the models of the call type, None to always
+                   ask the model.
+    :param flight: Shares one request between the concurrent identical cached calls, None to send each of them.
     """
 
-    def __init__(self, context: str, model: str) -> None:
+    def __init__(self, context: str, model: str, temperature: float = 1, call_type: str = DEFAULT_CALL_TYPE,
+                 cache: GPTCache | None = default_cache, response_format: dict[str, Any] | None = None,
+                 client: OpenAI | None = None, breaker: CircuitBreaker = default_breaker,
+                 router: ModelRouter | None = None, flight: SingleFlight | None = default_flight) -> None:
         """
         Initialize the class.
         
         :param context: The context of the model.
         :param model: The GPT's model name.
+        :param temperature: The sampling temperature.
+        :param call_type: The kind of call, which decides how long its responses are cached.
+        :param cache: The response cache, None to always call the model.
+        :param response_format: The response format of the request, e.g. a JSON schema. Plain text by default.
+        :param client: The OpenAI client, e.g. one pointed at a FakeOpenAIServer. The shared module client by default.
+        :param breaker: The circuit breaker guarding the requests, shared by every handler by default.
+        :param router: The router choosing the model of each request among the models of the call type, e.g.
+                       model_router.default_router. None to always ask the model.
+        :param flight: Shares one request between the concurrent identical cached calls, so only one of them asks
+                       the model and the others get its response. None to send each of them.
         """
         self.context = context
         self.model = model
+        self.temperature = temperature
+        self.call_type = call_type
+        self.cache = cache
+        self.response_format = response_format or {"type": "text"}
+        self._client = client
+        self.breaker = breaker
+        self.router = router
+        self.flight = flight
         
     def __get_message(self, input: str) -> list[dict[str, Any]]:
         """
@@ -51,23 +173,249 @@ class GPTHandler:
             }
         ]
     
-    def generate(self, input: str) -> str:
+    def __get_params(self) -> dict[str, Any]:
         """
-        Generate a response from the model.
-        
+        Return the sampling parameters sent with every request.
+
+        :return: The parameters of the completion request other than the model and the messages.
+        """
+        return {
+            "temperature": self.temperature,
+            "max_tokens": 1000,
+            "top_p": 1,
+            "frequency_penalty": 0,
+            "presence_penalty": 0,
+            "response_format": self.response_format
+        }
+
+    def cache_key(self, input: str) -> str:
+        """
+        Return the key of the cached response to an input.
+
+        :param input: The input to the model.
+        :return: The cache key.
+        """
+        return make_key(self.model, self.context, input, self.__get_params())
+
+    def _request(self, input: str, model: str | None = None) -> dict[str, Any]:
+        """
+        Return the arguments of the completion request for an input.
+
+        :param input: The input to the model.
+        :param model: The model to ask, the model of the handler by default.
+        :return: The keyword arguments of chat.completions.create.
+        """
+        return {"model": model or self.model, "messages": self.__get_message(input), **self.__get_params()}
+
+    def _route(self) -> Route:
+        """
+        Choose the model of the next request and record it on the running advisor call.
+
+        The cached responses stay under the model of the handler, whichever model answered them.
+
+        :return: The route of the request, to the model of the handler without a router.
+        """
+        if self.router is None:
+            return Route(self.call_type, self.model)
+        route = self.router.choose(self.call_type, self.model)
+        telemetry.count_route(route.model, route.fallback)
+        return route
+
+    def _record_route(self, route: Route, start: float, error: BaseException | None = None):
+        """
+        Tell the router how a request went.
+
+        :param route: The route of the request.
+        :param start: The time.perf_counter() when the request was sent.
+        :param error: The error raised by the request, None if it succeeded.
+        """
+        if self.router is not None:
+            self.router.record(route, time.perf_counter() - start, error)
+
+    def _read_cache(self, input: str) -> tuple[str | None, str | None]:
+        """
+        Look up the cached response to an input.
+
         :param input: The input to the model.
+        :return: The cache key, None if the call is not cached, and the cached response, None on a miss.
+        """
+        if self.cache is None:
+            return None, None
+        if not self.cache.is_cacheable(self.call_type, self.temperature):
+            self.cache.count_bypass(self.call_type)
+            return None, None
+        key = self.cache_key(input)
+        return key, self.cache.get(key, self.call_type)
+
+    def _write_cache(self, key: str | None, content: str | None):
+        """
+        Store a response if the call is cached.
+
+        :param key: The cache key returned by _read_cache.
+        :param content: The response from the model.
+        """
+        if key is not None and content is not None:
+            self.cache.set(key, content, self.call_type, self.model)
+
+    def generate(self, input: str, timeout: float = REQUEST_TIMEOUT) -> str:
+        """
+        Generate a response from the model, reusing the cached response to the same request if there is one.
+
+        A cached response is returned even while the circuit breaker is open. Concurrent identical calls, in this
+        process or in other workers, wait for the first one and reuse its response rather than asking the model again.
+
+        :param input: The input to the model.
+        :param timeout: The seconds the request may take.
         :return: The response from the model.
+        :raises CircuitOpenError: If the breaker is open.
         """
-        response = client.chat.completions.create(
-            model=self.model,
-            messages=self.__get_message(input),
-            temperature=1,
-            max_tokens=1000,
-            top_p=1,
-            frequency_penalty=0,
-            presence_penalty=0,
-            response_format={
-                "type": "text"
-            }
-        )
-        return response.choices[0].message.content
+        key, cached = self._read_cache(input)
+        if cached is not None:
+            telemetry.count_cache_hit()
+            return cached
+        if key is None or self.flight is None:
+            return self._ask(input, key, timeout)
+        asked = []
+
+        def ask() -> str:
+            asked.append(True)
+            return self._ask(input, key, timeout)
+
+        content = self.flight.do(f"gpt:{key}", ask, lookup=lambda: self.cache.get(key, self.call_type))
+        if not asked:
+            telemetry.count_cache_hit()
+        return content
+
+    def _ask(self, input: str, key: str | None, timeout: float) -> str:
+        """
+        Send the request of an input to the model and cache the response.
+
+        :param input: The input to the model.
+        :param key: The cache key returned by _read_cache.
+        :param timeout: The seconds the request may take.
+        :return: The response from the model.
+        :raises CircuitOpenError: If the breaker is open.
+        """
+        route = self._route()
+        start = time.perf_counter()
+        with self.breaker.guard():
+            try:
+                response = (self._client or client).chat.completions.create(**self._request(input, route.model),
+                                                                            timeout=timeout)
+            except Exception as e:
+                telemetry.count_request()
+                self._record_route(route, start, e)
+                raise
+        self._record_route(route, start)
+        telemetry.count_request(response.usage)
+        content = response.choices[0].message.content
+        self._write_cache(key, content)
+        return content
+
+    def stream(self, input: str, timeout: float = REQUEST_TIMEOUT) -> Iterator[str]:
+        """
+        Generate a response from the model piece by piece, as the model writes it.
+
+        A cached response is returned as a single piece. A complete streamed response is cached like one from generate.
+
+        :param input: The input to the model.
+        :param timeout: The seconds to wait for the response to start and for each of its pieces.
+        :return: An iterator over the pieces of the response.
+        :raises CircuitOpenError: If the breaker is open.
+        """
+        key, cached = self._read_cache(input)
+        if cached is not None:
+            telemetry.count_cache_hit()
+            yield cached
+            return
+        pieces = []
+        usage = None
+        route = self._route()
+        start = time.perf_counter()
+        with self.breaker.guard():
+            try:
+                for chunk in (self._client or client).chat.completions.create(
+                        **self._request(input, route.model), stream=True, stream_options={"include_usage": True},
+                        timeout=timeout):
+                    usage = chunk.usage or usage
+                    if not chunk.choices:
+                        continue
+                    piece = chunk.choices[0].delta.content
+                    if piece:
+                        pieces.append(piece)
+                        yield piece
+            except Exception as e:
+                self._record_route(route, start, e)
+                raise
+            finally:
+                telemetry.count_request(usage)
+        self._record_route(route, start)
+        self._write_cache(key, "".join(pieces))
+
+    def invalidate(self, input: str):
+        """
+        Forget the cached response to an input, so the next call asks the model again.
+
+        :param input: The input whose response turned out to be unusable.
+        """
+        if self.cache is not None:
+            self.cache.delete(self.cache_key(input))
+
+
+class AsyncGPTHandler(GPTHandler):
+    """GPTHandler that can also be awaited, so several requests can wait for the model at the same time."""
+
+    async def agenerate(self, input: str, timeout: float = REQUEST_TIMEOUT) -> str:
+        """
+        Generate a response from the model without blocking the event loop.
+
+        Concurrent identical calls on the same event loop wait for the first one and reuse its response.
+
+        :param input: The input to the model.
+        :param timeout: The seconds the request may take.
+        :return: The response from the model.
+        :raises CircuitOpenError: If the breaker is open.
+        """
+        key, cached = await sync_to_async(self._read_cache)(input)
+        if cached is not None:
+            telemetry.count_cache_hit()
+            return cached
+        if key is None or self.flight is None:
+            return await self._aask(input, key, timeout)
+        asked = []
+
+        def ask() -> Awaitable[str]:
+            asked.append(True)
+            return self._aask(input, key, timeout)
+
+        content = await self.flight.ado(f"gpt:{key}", ask)
+        if not asked:
+            telemetry.count_cache_hit()
+        return content
+
+    async def _aask(self, input: str, key: str | None, timeout: float) -> str:
+        """
+        Send the request of an input to the model without blocking the event loop, and cache the response.
+
+        :param input: The input to the model.
+        :param key: The cache key returned by _read_cache.
+        :param timeout: The seconds the request may take.
+        :return: The response from the model.
+        :raises CircuitOpenError: If the breaker is open.
+        """
+        async with get_concurrency_limit():
+            route = self._route()
+            start = time.perf_counter()
+            with self.breaker.guard():
+                try:
+                    response = await get_async_client().chat.completions.create(**self._request(input, route.model),
+                                                                                timeout=timeout)
+                except Exception as e:
+                    telemetry.count_request()
+                    self._record_route(route, start, e)
+                    raise
+        self._record_route(route, start)
+        telemetry.count_request(response.usage)
+        content = response.choices[0].message.content
+        await sync_to_async(self._write_cache)(key, content)
+        return content
@@ -0,0 +1,287 @@
+"""Local embedding index of the ingredients, to find substitutes in milliseconds without asking GPT."""
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Iterable
+import numpy as np
+from decouple import config
+from pantry import settings
+from webpage.models import Ingredient, IngredientList, Recipe, normalize_name
+from webpage.modules.status_code import StatusCode
+
+logger = logging.getLogger("Ingredient index")
+
+INDEX_DIR = config('INGREDIENT_INDEX_DIR', default=str(settings.BASE_DIR / 'ingredient_index'))
+# Length of the ingredient vectors. Fewer ingredients than this give shorter vectors.
+DIMENSIONS = config('INGREDIENT_INDEX_DIMENSIONS', cast=int, default=64)
+# Ingredients used by fewer recipes have too little context to be embedded.
+MIN_RECIPES = config('INGREDIENT_INDEX_MIN_RECIPES', cast=int, default=2)
+# The co-occurrence matrix takes MAX_INGREDIENTS² floats, so only the most used ingredients are kept.
+MAX_INGREDIENTS = config('INGREDIENT_INDEX_MAX_INGREDIENTS', cast=int, default=5000)
+# Number of similar ingredients given to GPT as candidates, and the cosine similarity they need.
+CANDIDATES = config('INGREDIENT_INDEX_CANDIDATES', cast=int, default=8)
+MIN_SCORE = config('INGREDIENT_INDEX_MIN_SCORE', cast=float, default=0.2)
+# Cosine similarity of the best candidate above which the alternatives are answered from the index alone.
+FAST_SCORE = config('INGREDIENT_INDEX_FAST_SCORE', cast=float, default=0.8)
+# Recipes added to the co-occurrence matrix per matrix product.
+CHUNK_SIZE = 1000
+
+VECTORS_FILE = 'vectors.npy'
+DIETS_FILE = 'diets.npy'
+META_FILE = 'index.json'
+
+
+@dataclass(frozen=True)
+class Neighbour:
+    """An ingredient similar to another one."""
+
+    id: int
+    name: str
+    score: float
+
+
+class IngredientIndex:
+    """
+    Unit vectors of the ingredients, with the diets each ingredient was seen in.
+
+    Two ingredients are similar when they are used with the same other ingredients, e.g. butter and margarine, even
+    if they are never used together. The vectors are the rows of the positive pointwise mutual information of the
+    ingredients used in the same recipe, reduced by a truncated SVD.
+
+    :param ids: The ingredient id of each row.
+    :param names: The ingredient name of each row.
+    :param vectors: The unit vectors, one row per ingredient, zero for an ingredient without context.
+    :param diet_names: The normalized diet name of each column of the diet matrix.
+    :param diet_matrix: Whether each ingredient was used by a recipe with each diet.
+    """
+
+    def __init__(self, ids: list[int], names: list[str], vectors: np.ndarray, diet_names: list[str],
+                 diet_matrix: np.ndarray):
+        """
+        Initialize the index.
+
+        :param ids: The ingredient id of each row.
+        :param names: The ingredient name of each row.
+        :param vectors: The unit vectors, one row per ingredient.
+        :param diet_names: The normalized diet name of each column of the diet matrix.
+        :param diet_matrix: Whether each ingredient was used by a recipe with each diet.
+        """
+        self.ids = ids
+        self.names = names
+        self.vectors = vectors
+        self.diet_names = diet_names
+        self.diet_matrix = diet_matrix
+        self._rows = {ingredient_id: row for row, ingredient_id in enumerate(ids)}
+        self._diet_columns = {name: column for column, name in enumerate(diet_names)}
+
+    def __len__(self) -> int:
+        """Return the number of indexed ingredients."""
+        return len(self.ids)
+
+    def __contains__(self, ingredient_id: int) -> bool:
+        """Return whether an ingredient is indexed."""
+        return ingredient_id in self._rows
+
+    @property
+    def dimensions(self) -> int:
+        """The length of the vectors."""
+        return self.vectors.shape[1]
+
+    def diet_mask(self, diets: Iterable[str]) -> np.ndarray:
+        """
+        Return which ingredients were used by recipes with each of the diets.
+
+        :param diets: The diet names.
+        :return: One boolean per ingredient, all False if no recipe has one of the diets.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for diet in {normalize_name(name) for name in diets if name}:
+            column = self._diet_columns.get(diet)
+            if column is None:
+                return np.zeros(len(self), dtype=bool)
+            mask &= self.diet_matrix[:, column]
+        return mask
+
+    def similar(self, ingredient_id: int, k: int = CANDIDATES, diets: Iterable[str] = (),
+                exclude: Iterable[int] = (), min_score: float = 0.0) -> list[Neighbour]:
+        """
+        Find the ingredients most similar to one, for recipes with some diets.
+
+        :param ingredient_id: The ingredient.
+        :param k: The maximum number of similar ingredients.
+        :param diets: The diets the similar ingredients must have been used with.
+        :param exclude: The ingredients not to return, e.g. those already in the recipe.
+        :param min_score: The cosine similarity the similar ingredients need.
+        :return: The similar ingredients, most similar first, none if the ingredient is not indexed.
+        """
+        row = self._rows.get(ingredient_id)
+        if row is None or k <= 0:
+            return []
+        scores = np.asarray(self.vectors @ self.vectors[row], dtype=np.float32)
+        allowed = self.diet_mask(diets) & (scores > min_score)
+        allowed[row] = False
+        for other in exclude:
+            if other in self._rows:
+                allowed[self._rows[other]] = False
+        candidates = np.flatnonzero(allowed)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [Neighbour(self.ids[index], self.names[index], float(scores[index])) for index in candidates]
+
+    @classmethod
+    def build(cls, dimensions: int = DIMENSIONS, min_recipes: int = MIN_RECIPES,
+              max_ingredients: int = MAX_INGREDIENTS, seed: int = 0) -> 'IngredientIndex':
+        """
+        Compute the vectors from the ingredients of the recipes that were not rejected.
+
+        :param dimensions: The length of the vectors.
+        :param min_recipes: The recipes an ingredient needs to be indexed.
+        :param max_ingredients: The number of most used ingredients to index.
+        :param seed: The seed of the random projection of the SVD.
+        :return: The index.
+        """
+        recipes = Recipe.objects.exclude(status=StatusCode.REJECTED.value[0])
+        pairs = np.array(list(IngredientList.objects.filter(recipe__in=recipes)
+                              .values_list('recipe_id', 'ingredient_id').distinct()), dtype=np.int64).reshape(-1, 2)
+        ingredient_ids, counts = np.unique(pairs[:, 1], return_counts=True)
+        kept = ingredient_ids[counts >= min_recipes]
+        if len(kept) > max_ingredients:
+            kept = kept[np.argsort(-counts[counts >= min_recipes], kind='stable')[:max_ingredients]]
+        kept = np.sort(kept)
+        pairs = pairs[np.isin(pairs[:, 1], kept)]
+        columns = np.searchsorted(kept, pairs[:, 1])
+        recipe_ids, recipe_rows = np.unique(pairs[:, 0], return_inverse=True)
+
+        indexed = set(recipe_ids.tolist())
+        diet_pairs = [(recipe_id, normalize_name(name)) for recipe_id, name in Recipe.diets.through.objects
+                      .filter(recipe__in=recipes).values_list('recipe_id', 'diet__name') if recipe_id in indexed]
+        diet_names = sorted({name for _, name in diet_pairs})
+        recipe_diets = np.zeros((len(recipe_ids), len(diet_names)), dtype=np.float32)
+        for recipe_id, name in diet_pairs:
+            recipe_diets[np.searchsorted(recipe_ids, recipe_id), diet_names.index(name)] = 1
+
+        cooccurrence = np.zeros((len(kept), len(kept)), dtype=np.float32)
+        diet_counts = np.zeros((len(kept), len(diet_names)), dtype=np.float32)
+        for start in range(0, len(recipe_ids), CHUNK_SIZE):
+            selected = (recipe_rows >= start) & (recipe_rows < start + CHUNK_SIZE)
+            incidence = np.zeros((min(CHUNK_SIZE, len(recipe_ids) - start), len(kept)), dtype=np.float32)
+            incidence[recipe_rows[selected] - start, columns[selected]] = 1
+            cooccurrence += incidence.T @ incidence
+            diet_counts += incidence.T @ recipe_diets[start:start + CHUNK_SIZE]
+
+        vectors = embed(ppmi(cooccurrence), dimensions, seed)
+        names = dict(Ingredient.objects.filter(id__in=kept.tolist()).values_list('id', 'name'))
+        return cls([int(ingredient_id) for ingredient_id in kept], [names[int(ingredient_id)] for ingredient_id in kept],
+                   vectors, diet_names, diet_counts > 0)
+
+    def save(self, directory: str | None = None):
+        """
+        Write the index, replacing the previous one only once every file is written.
+
+        :param directory: The directory of the index files, INGREDIENT_INDEX_DIR by default.
+        """
+        directory = directory or INDEX_DIR
+        os.makedirs(directory, exist_ok=True)
+        for file_name, array in [(VECTORS_FILE, self.vectors.astype(np.float32)), (DIETS_FILE, self.diet_matrix)]:
+            path = os.path.join(directory, file_name)
+            with open(path + '.tmp', 'wb') as file:
+                np.save(file, np.ascontiguousarray(array))
+            os.replace(path + '.tmp', path)
+        path = os.path.join(directory, META_FILE)
+        with open(path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump({'ids': self.ids, 'names': self.names, 'diets': self.diet_names}, file)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, directory: str | None = None) -> 'IngredientIndex':
+        """
+        Read an index, with the vectors memory-mapped so the processes share one copy.
+
+        :param directory: The directory of the index files, INGREDIENT_INDEX_DIR by default.
+        :return: The index.
+        :raises FileNotFoundError: If the index was not built.
+        """
+        directory = directory or INDEX_DIR
+        with open(os.path.join(directory, META_FILE), encoding='utf-8') as file:
+            meta = json.load(file)
+        vectors = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode='r')
+        diet_matrix = np.load(os.path.join(directory, DIETS_FILE))
+        return cls(meta['ids'], meta['names'], vectors, meta['diets'], diet_matrix)
+
+
+def ppmi(cooccurrence: np.ndarray) -> np.ndarray:
+    """
+    Return the positive pointwise mutual information of a co-occurrence matrix, without its diagonal.
+
+    :param cooccurrence: How many recipes use each pair of ingredients.
+    :return: log(P(a, b) / (P(a) P(b))) where positive, else 0.
+    """
+    counts = cooccurrence.astype(np.float64)
+    np.fill_diagonal(counts, 0)
+    total = counts.sum()
+    if not total:
+        return np.zeros_like(counts)
+    marginals = counts.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pmi = np.log(counts * total / np.outer(marginals, marginals))
+    return np.where(counts > 0, np.maximum(pmi, 0), 0)
+
+
+def embed(matrix: np.ndarray, dimensions: int, seed: int = 0, oversampling: int = 10,
+          iterations: int = 4) -> np.ndarray:
+    """
+    Reduce the rows of a symmetric matrix to unit vectors with a randomized truncated SVD.
+
+    :param matrix: The matrix.
+    :param dimensions: The length of the vectors.
+    :param seed: The seed of the random projection.
+    :param oversampling: The extra dimensions of the random projection, for accuracy.
+    :param iterations: The power iterations, for accuracy.
+    :return: U·S, the rows projected on the top singular vectors, as float32 unit rows. Rows of zeros stay zero.
+    """
+    size = matrix.shape[0]
+    dimensions = max(min(dimensions, size), 1)
+    if size <= dimensions + oversampling:
+        left, singular, _ = np.linalg.svd(matrix)
+    else:
+        projection = np.random.default_rng(seed).standard_normal((size, dimensions + oversampling))
+        basis, _ = np.linalg.qr(matrix @ projection)
+        for _ in range(iterations):
+            basis, _ = np.linalg.qr(matrix @ (matrix.T @ basis))
+        small_left, singular, _ = np.linalg.svd(basis.T @ matrix, full_matrices=False)
+        left = basis @ small_left
+    vectors = np.zeros((size, dimensions))
+    kept = min(dimensions, left.shape[1])
+    vectors[:, :kept] = left[:, :kept] * singular[:kept]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0).astype(np.float32)
+
+
+_lock = threading.Lock()
+_loaded: tuple[str, float, IngredientIndex] | None = None
+
+
+def get_index(directory: str | None = None) -> IngredientIndex | None:
+    """
+    Return the index, loaded once per process and again after it is rebuilt.
+
+    :param directory: The directory of the index files, INGREDIENT_INDEX_DIR by default.
+    :return: The index, None if it was not built.
+    """
+    global _loaded
+    directory = directory or INDEX_DIR
+    try:
+        modified = os.stat(os.path.join(directory, META_FILE)).st_mtime
+    except OSError:
+        return None
+    with _lock:
+        if _loaded is None or _loaded[:2] != (directory, modified):
+            try:
+                _loaded = (directory, modified, IngredientIndex.load(directory))
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"Cannot load the ingredient index from {directory}: {e}")
+                return None
+        return _loaded[2]
@@ -0,0 +1,149 @@
+"""A small database-backed job queue used to move slow work out of the request cycle."""
+from datetime import timedelta
+from typing import Callable
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from decouple import config
+import logging
+from webpage.models import Job
+from webpage.modules.status_code import JobStatus
+
+logger = logging.getLogger("Job queue")
+
+MAX_ATTEMPTS = config('JOB_MAX_ATTEMPTS', cast=int, default=5)
+RETRY_DELAY = config('JOB_RETRY_DELAY', cast=float, default=30)
+MAX_RETRY_DELAY = config('JOB_MAX_RETRY_DELAY', cast=float, default=3600)
+
+_handlers: dict[str, Callable[[Job], None]] = {}
+
+
+def job_handler(kind: str):
+    """
+    Register the decorated function as the handler of a job kind.
+
+    :param kind: The kind of job the function processes.
+    :return: The decorator.
+    """
+    def decorator(func: Callable[[Job], None]) -> Callable[[Job], None]:
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind: str, payload: dict | None = None, user: User | None = None,
+            attachment: bytes | None = None, max_attempts: int | None = None) -> Job:
+    """
+    Add a job to the queue.
+
+    :param kind: The kind of job, which selects its handler.
+    :param payload: JSON data given to the handler.
+    :param user: The user who requested the job, used for the status endpoint.
+    :param attachment: Binary data the handler needs, e.g. an uploaded image.
+    :param max_attempts: How many times the job is tried before it is marked as dead.
+    :return: The queued job.
+    """
+    return Job.objects.create(
+        kind=kind,
+        payload=payload or {},
+        user=user,
+        attachment=attachment,
+        max_attempts=max_attempts or MAX_ATTEMPTS,
+    )
+
+
+def claim_job(worker_id: str, job_id: int | None = None) -> Job | None:
+    """
+    Lock the next job that is due and mark it as running.
+
+    :param worker_id: The name of the worker claiming the job.
+    :param job_id: Claim only this job, e.g. the one a benchmark just queued. Any job by default.
+    :return: The claimed job, or None if there is nothing to do.
+    """
+    now = timezone.now()
+    jobs = Job.objects.all() if job_id is None else Job.objects.filter(pk=job_id)
+    with transaction.atomic():
+        job = jobs.select_for_update(skip_locked=True).filter(
+            status=JobStatus.QUEUED.value[0],
+            run_after__lte=now,
+        ).order_by('run_after', 'id').first()
+        if job is None:
+            return None
+        # The conditional update keeps two workers from claiming the same job on databases without row locks.
+        claimed = Job.objects.filter(pk=job.pk, status=JobStatus.QUEUED.value[0]).update(
+            status=JobStatus.RUNNING.value[0],
+            attempts=job.attempts + 1,
+            locked_by=worker_id,
+            locked_at=now,
+        )
+    if not claimed:
+        return None
+    job.refresh_from_db()
+    return job
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """
+    Return how long a failed job waits before its next attempt.
+
+    :param attempts: The number of attempts made so far.
+    :return: The exponential backoff delay.
+    """
+    return timedelta(seconds=min(RETRY_DELAY * 2 ** max(attempts - 1, 0), MAX_RETRY_DELAY))
+
+
+def run_job(job: Job):
+    """
+    Run a claimed job and record its outcome.
+
+    A failed job is queued again with a backoff delay until it runs out of attempts,
+    then it is moved to the dead state.
+
+    :param job: The job returned by claim_job.
+    """
+    handler = _handlers.get(job.kind)
+    try:
+        if handler is None:
+            raise LookupError(f"No handler registered for job kind '{job.kind}'")
+        handler(job)
+    except Exception as e:
+        logger.error(f"Job {job} failed on attempt {job.attempts}: {e}")
+        job.last_error = f"{type(e).__name__}: {e}"
+        if handler is None or job.attempts >= job.max_attempts:
+            job.status = JobStatus.DEAD.value[0]
+        else:
+            job.status = JobStatus.QUEUED.value[0]
+            job.run_after = timezone.now() + retry_delay(job.attempts)
+    else:
+        job.status = JobStatus.DONE.value[0]
+        job.last_error = ''
+    job.locked_by = ''
+    job.locked_at = None
+    job.save()
+
+
+def requeue_stale_jobs(timeout: float) -> int:
+    """
+    Put back jobs whose worker died while running them.
+
+    :param timeout: Seconds after which a running job is considered abandoned.
+    :return: The number of jobs put back in the queue.
+    """
+    return Job.objects.filter(
+        status=JobStatus.RUNNING.value[0],
+        locked_at__lt=timezone.now() - timedelta(seconds=timeout),
+    ).update(status=JobStatus.QUEUED.value[0], locked_by='', locked_at=None)
+
+
+def work(worker_id: str) -> bool:
+    """
+    Claim and run a single job.
+
+    :param worker_id: The name of the worker.
+    :return: True if a job was run, False if the queue was empty.
+    """
+    job = claim_job(worker_id)
+    if job is None:
+        return False
+    run_job(job)
+    return True
@@ -0,0 +1,47 @@
+"""Read the JSON in a model response that is not valid JSON by itself, to avoid asking the model again."""
+import json
+import re
+from typing import Any
+
+_fence_pattern = re.compile(r"```[a-zA-Z]*\s*(.*?)\s*```", re.DOTALL)
+_trailing_comma_pattern = re.compile(r",(\s*[\]}])")
+_decoder = json.JSONDecoder()
+
+
+def repair(text: str) -> Any:
+    """
+    Read the first JSON object or array in a text, repairing the usual mistakes of the model.
+
+    A Markdown code fence, the text before and after the JSON, and commas before a closing bracket are dropped.
+
+    :param text: The response of the model.
+    :return: The JSON value.
+    :raises ValueError: If no JSON object or array can be read from the text.
+    """
+    fence = _fence_pattern.search(text)
+    if fence:
+        text = fence.group(1)
+    starts = [index for index in (text.find('['), text.find('{')) if index >= 0]
+    if not starts:
+        raise ValueError("The response contains no JSON object or array.")
+    text = text[min(starts):]
+    for candidate in (text, _trailing_comma_pattern.sub(r"\1", text)):
+        try:
+            return _decoder.raw_decode(candidate)[0]
+        except json.JSONDecodeError:
+            continue
+    raise ValueError("The JSON in the response cannot be repaired.")
+
+
+def load(text: str) -> tuple[Any, bool]:
+    """
+    Read a JSON response, repairing it only if it is not valid JSON as it is.
+
+    :param text: The response of the model.
+    :return: The JSON value and whether it had to be repaired.
+    :raises ValueError: If no JSON object or array can be read from the text.
+    """
+    try:
+        return json.loads(text), False
+    except json.JSONDecodeError:
+        return repair(text), True
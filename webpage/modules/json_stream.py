@@ -0,0 +1,116 @@
+"""Parse a JSON array while it is still being received, returning each element as soon as it is complete."""
+import json
+from typing import Any
+
+
+class JSONArrayStream:
+    """
+    Incremental parser of one JSON array, fed with pieces of text as they arrive.
+
+    Anything before the opening bracket, such as a Markdown code fence, is skipped.
+    """
+
+    def __init__(self):
+        """Initialize the parser before the array starts."""
+        self._started = False
+        self._finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._element: list[str] = []
+
+    @property
+    def finished(self) -> bool:
+        """Return whether the closing bracket of the array was received."""
+        return self._finished
+
+    def feed(self, text: str) -> list[Any]:
+        """
+        Add the next piece of the text.
+
+        :param text: The text received since the last call.
+        :return: The elements completed by this piece, in order.
+        :raises json.JSONDecodeError: If a completed element is not valid JSON.
+        """
+        elements = []
+        for char in text:
+            if self._finished:
+                break
+            if not self._started:
+                self._start(char)
+            elif self._in_string:
+                self._read_string(char)
+            else:
+                self._read_structure(char, elements)
+        return elements
+
+    def _start(self, char: str):
+        """
+        Skip the text before the opening bracket of the array.
+
+        :param char: The next character.
+        """
+        if char == '[':
+            self._started = True
+            self._depth = 1
+
+    def _read_string(self, char: str):
+        """
+        Add a character of a string, which may be an escape or the closing quote.
+
+        :param char: The next character.
+        """
+        self._element.append(char)
+        if self._escaped:
+            self._escaped = False
+        elif char == '\\':
+            self._escaped = True
+        elif char == '"':
+            self._in_string = False
+
+    def _read_structure(self, char: str, elements: list[Any]):
+        """
+        Add a character outside of the strings, completing an element on a comma of the array.
+
+        :param char: The next character.
+        :param elements: The list the completed elements are added to.
+        """
+        if char in ']}':
+            self._close(char, elements)
+            return
+        if char == ',' and self._depth == 1:
+            self._emit(elements)
+            return
+        if char == '"':
+            self._in_string = True
+        elif char in '[{':
+            self._depth += 1
+        self._element.append(char)
+
+    def _close(self, char: str, elements: list[Any]):
+        """
+        Close an object or array, completing the element it ends, or the whole array.
+
+        :param char: The closing bracket or brace.
+        :param elements: The list the completed elements are added to.
+        """
+        self._depth -= 1
+        if self._depth == 0:
+            # The end of the array, which may close a last scalar element.
+            self._finished = True
+            self._emit(elements)
+            return
+        self._element.append(char)
+        if self._depth == 1:
+            self._emit(elements)
+
+    def _emit(self, elements: list[Any]):
+        """
+        Parse the element collected so far, if any, and start a new one.
+
+        :param elements: The list the parsed element is added to.
+        """
+        text = ''.join(self._element).strip()
+        self._element = []
+        if text:
+            elements.append(json.loads(text))
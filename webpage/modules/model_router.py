@@ -0,0 +1,315 @@
+"""Route each kind of GPT call to a chain of models, falling back while a model breaches its latency or error objective."""
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable
+from decouple import config, Csv
+from django.db import connection, transaction
+from webpage.models import RoutingDecision
+from webpage.modules.resilience import is_retryable
+from webpage.modules.status_code import RoutingAction
+
+logger = logging.getLogger("GPT router")
+
+DEFAULT_MODEL = 'gpt-4o-mini'
+TASKS = ('alternatives', 'difficulty', 'nutrition', 'approval', 'assessment')
+# The models of each kind of call, the primary first and then its fallbacks, e.g. gpt-4o,gpt-4o-mini.
+ROUTES = {task: config(f'GPT_MODELS_{task.upper()}', cast=Csv(), default=DEFAULT_MODEL) for task in TASKS}
+# The objective of a model: the 95th percentile of its request latency and its share of failed requests.
+SLO_SECONDS = config('GPT_SLO_SECONDS', cast=float, default=10)
+SLO_ERROR_RATE = config('GPT_SLO_ERROR_RATE', cast=float, default=0.25)
+# The latest requests of a model the objective is measured on, and how many are needed before it is judged.
+WINDOW = config('GPT_SLO_WINDOW', cast=int, default=50)
+MIN_REQUESTS = config('GPT_SLO_MIN_REQUESTS', cast=int, default=10)
+# Seconds a demoted model waits before it is given requests again to measure it anew.
+PROBE_AFTER = config('GPT_SLO_PROBE_AFTER', cast=float, default=120)
+
+
+class ModelHealth:
+    """
+    The latency and failures of the latest requests of one model for one task.
+
+    :param window: The requests kept.
+    """
+
+    def __init__(self, window: int = WINDOW):
+        """
+        Start with no requests.
+
+        :param window: The requests kept.
+        """
+        self.requests: deque[tuple[float, bool]] = deque(maxlen=window)
+        self.demoted_at: float | None = None
+        self.probing = False
+
+    def record(self, seconds: float, failed: bool):
+        """
+        Add a request.
+
+        :param seconds: The seconds the request took.
+        :param failed: Whether it failed in a way a retry may fix, such as a timeout or a server error.
+        """
+        self.requests.append((seconds, failed))
+
+    def p95(self) -> float:
+        """
+        Return the 95th percentile of the latency.
+
+        :return: The seconds, 0 without requests.
+        """
+        ordered = sorted(seconds for seconds, _ in self.requests)
+        return ordered[max(math.ceil(0.95 * len(ordered)) - 1, 0)] if ordered else 0.0
+
+    def error_rate(self) -> float:
+        """
+        Return the share of the requests that failed.
+
+        :return: The share between 0 and 1, 0 without requests.
+        """
+        return sum(failed for _, failed in self.requests) / len(self.requests) if self.requests else 0.0
+
+    def breach(self, slo_seconds: float, slo_error_rate: float, min_requests: int) -> str:
+        """
+        Tell how the model misses its objective.
+
+        :param slo_seconds: The highest 95th percentile latency.
+        :param slo_error_rate: The highest share of failed requests.
+        :param min_requests: The requests needed before the model is judged.
+        :return: The reason, empty if the model meets its objective or has too few requests to tell.
+        """
+        if len(self.requests) < min_requests:
+            return ''
+        if self.error_rate() > slo_error_rate:
+            return f"error rate {self.error_rate():.0%} > {slo_error_rate:.0%}"
+        if self.p95() > slo_seconds:
+            return f"p95 {self.p95():.2f}s > {slo_seconds:.2f}s"
+        return ''
+
+
+@dataclass(frozen=True)
+class Route:
+    """
+    The model a request is sent to.
+
+    :param task: The kind of call.
+    :param model: The model.
+    :param fallback: Whether the model is not the primary of the task.
+    """
+
+    task: str
+    model: str
+    fallback: bool = False
+
+
+class ModelRouter:
+    """
+    Send the requests of each task to the first model of its chain that meets its objective.
+
+    A model that breaches its objective is demoted, and the next one of the chain is used. Once PROBE_AFTER seconds
+    have passed, the demoted model is measured again on new requests, and restored if it meets its objective. If every
+    model of the chain is demoted, the last one is used. The decisions are written to the RoutingDecision table.
+    The router is thread-safe and is shared by every handler of the process.
+
+    :param routes: The models of each task, the primary first. ROUTES by default.
+    :param slo_seconds: The highest 95th percentile latency of a request.
+    :param slo_error_rate: The highest share of failed requests.
+    :param window: The latest requests of a model the objective is measured on.
+    :param min_requests: The requests needed before a model is judged.
+    :param probe_after: The seconds a demoted model waits before it is measured again.
+    :param clock: The function returning the current time in seconds.
+    """
+
+    def __init__(self, routes: dict[str, list[str]] | None = None, slo_seconds: float = SLO_SECONDS,
+                 slo_error_rate: float = SLO_ERROR_RATE, window: int = WINDOW, min_requests: int = MIN_REQUESTS,
+                 probe_after: float = PROBE_AFTER, clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize the router with every model healthy.
+
+        :param routes: The models of each task, the primary first. ROUTES by default.
+        :param slo_seconds: The highest 95th percentile latency of a request.
+        :param slo_error_rate: The highest share of failed requests.
+        :param window: The latest requests of a model the objective is measured on.
+        :param min_requests: The requests needed before a model is judged.
+        :param probe_after: The seconds a demoted model waits before it is measured again.
+        :param clock: The function returning the current time in seconds.
+        """
+        self.routes = {task: list(models) for task, models in (ROUTES if routes is None else routes).items()}
+        self.slo_seconds = slo_seconds
+        self.slo_error_rate = slo_error_rate
+        self.window = window
+        self.min_requests = min_requests
+        self.probe_after = probe_after
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._health: dict[tuple[str, str], ModelHealth] = {}
+        self._decisions: list[RoutingDecision] = []
+
+    def chain(self, task: str, primary: str = DEFAULT_MODEL) -> list[str]:
+        """
+        Return the models of a task.
+
+        :param task: The kind of call.
+        :param primary: The model of a task without a route.
+        :return: The primary model first, then its fallbacks.
+        """
+        return self.routes.get(task) or [primary]
+
+    def primary(self, task: str) -> str:
+        """
+        Return the primary model of a task.
+
+        :param task: The kind of call.
+        :return: The first model of its chain.
+        """
+        return self.chain(task)[0]
+
+    def health(self, task: str, model: str) -> ModelHealth:
+        """
+        Return the health of a model for a task.
+
+        :param task: The kind of call.
+        :param model: The model.
+        :return: The health, created empty the first time.
+        """
+        key = (task, model)
+        if key not in self._health:
+            self._health[key] = ModelHealth(self.window)
+        return self._health[key]
+
+    def choose(self, task: str, primary: str = DEFAULT_MODEL) -> Route:
+        """
+        Pick the model of the next request of a task.
+
+        :param task: The kind of call.
+        :param primary: The model of a task without a route.
+        :return: The route of the request.
+        """
+        route = self._choose(task, primary)
+        self.flush_if_possible()
+        return route
+
+    def _choose(self, task: str, primary: str) -> Route:
+        """
+        Pick the model of the next request of a task, demoting and probing the models on the way.
+
+        :param task: The kind of call.
+        :param primary: The model of a task without a route.
+        :return: The route of the request.
+        """
+        chain = self.chain(task, primary)
+        with self._lock:
+            for index, model in enumerate(chain):
+                health = self.health(task, model)
+                if health.demoted_at is None:
+                    reason = health.breach(self.slo_seconds, self.slo_error_rate, self.min_requests)
+                    if not reason:
+                        return Route(task, model, index > 0)
+                    health.demoted_at = self.clock()
+                    health.probing = False
+                    self._decide(RoutingAction.DEMOTE, task, model, reason, self._next(task, chain, index))
+                elif self.clock() - health.demoted_at >= self.probe_after:
+                    self._decide(RoutingAction.PROBE, task, model, "probe after demotion", model)
+                    health.requests.clear()
+                    health.demoted_at = None
+                    health.probing = True
+                    return Route(task, model, index > 0)
+            return Route(task, chain[-1], len(chain) > 1)
+
+    def _next(self, task: str, chain: list[str], index: int) -> str:
+        """
+        Return the model the requests go to once a model is demoted.
+
+        :param task: The kind of call.
+        :param chain: The models of the task.
+        :param index: The position of the demoted model.
+        :return: The first model after it that is not demoted, the last model if all are.
+        """
+        return next((model for model in chain[index + 1:] if self.health(task, model).demoted_at is None), chain[-1])
+
+    def record(self, route: Route, seconds: float, error: BaseException | None = None):
+        """
+        Record the outcome of a request.
+
+        Errors that are not retryable, such as an invalid request, show that the model is up and only add latency.
+
+        :param route: The route returned by choose.
+        :param seconds: The seconds the request took.
+        :param error: The error raised by the request, None if it succeeded.
+        """
+        with self._lock:
+            health = self.health(route.task, route.model)
+            health.record(seconds, error is not None and is_retryable(error))
+            if health.probing and len(health.requests) >= self.min_requests and \
+                    not health.breach(self.slo_seconds, self.slo_error_rate, self.min_requests):
+                health.probing = False
+                self._decide(RoutingAction.RESTORE, route.task, route.model, "meets its objective again", route.model)
+        self.flush_if_possible()
+
+    def _decide(self, action: RoutingAction, task: str, model: str, reason: str, routed_to: str):
+        """
+        Log a decision and keep it until it is written.
+
+        :param action: What was decided.
+        :param task: The kind of call.
+        :param model: The model decided about.
+        :param reason: Why.
+        :param routed_to: The model the requests of the task go to from now on.
+        """
+        health = self.health(task, model)
+        log = logger.warning if action is RoutingAction.DEMOTE else logger.info
+        log(f"{action.value[1]} {model} for {task}: {reason}, routing to {routed_to}")
+        self._decisions.append(RoutingDecision(task=task, model=model, action=action.value[0], reason=reason[:200],
+                                               routed_to=routed_to, requests=len(health.requests),
+                                               p95_seconds=health.p95(), error_rate=health.error_rate()))
+
+    def flush(self) -> int:
+        """
+        Write the decisions to the database, keeping them for the next flush if the write fails.
+
+        :return: The number of decisions written.
+        """
+        with self._lock:
+            decisions, self._decisions = self._decisions, []
+        if not decisions:
+            return 0
+        try:
+            RoutingDecision.objects.bulk_create(decisions)
+        except Exception as e:
+            logger.error(f"Cannot write the routing decisions, keeping them for the next flush: {e}")
+            with self._lock:
+                self._decisions[:0] = decisions
+            return 0
+        return len(decisions)
+
+    def flush_if_possible(self) -> int:
+        """
+        Write the decisions, unless the caller runs on an event loop, where the database must not be used.
+
+        In a transaction, such as a request or an enrichment step, they are written once it commits, so a rollback
+        does not take them with it and a failed write does not break it. They stay for the next flush otherwise.
+
+        :return: The number of decisions written.
+        """
+        if not self._decisions:
+            return 0
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            if connection.in_atomic_block:
+                transaction.on_commit(self.flush)
+                return 0
+            return self.flush()
+        return 0
+
+    def reset(self):
+        """Forget the health of every model and the decisions not written yet."""
+        with self._lock:
+            self._health.clear()
+            self._decisions.clear()
+
+
+default_router = ModelRouter()
@@ -0,0 +1,233 @@
+"""Calculate the nutrition of recipes locally from the nutrients per gram of their ingredients."""
+import logging
+from dataclasses import dataclass, field
+from typing import Iterable
+import numpy as np
+from decouple import config
+from django.utils import timezone
+from webpage.models import Ingredient, IngredientList, IngredientNutrient, Nutrition, normalize_name
+from webpage.modules.units import to_grams
+
+logger = logging.getLogger("Nutrition engine")
+
+# The samples an ingredient needs before its nutrients are trusted.
+MIN_SAMPLES = config('NUTRITION_MIN_SAMPLES', cast=int, default=1)
+
+
+@dataclass
+class NutritionEstimate:
+    """
+    The nutrition of a recipe calculated from the ingredients in the nutrient table.
+
+    :param nutrients: Dictionaries with `name`, `amount` and `unit`, for the known ingredients.
+    :param unknown: The ingredient lines that are not in the table or whose unit cannot be weighed.
+    """
+
+    nutrients: list[dict] = field(default_factory=list)
+    unknown: list[str] = field(default_factory=list)
+
+    @property
+    def complete(self) -> bool:
+        """Return whether every ingredient of the recipe was counted."""
+        return not self.unknown
+
+
+def ingredient_line(name: str, amount, unit: str) -> str:
+    """
+    Describe an ingredient of a recipe the way the AI advisor does.
+
+    :param name: The name of the ingredient.
+    :param amount: The amount of the ingredient.
+    :param unit: The unit of the amount.
+    :return: The line, e.g. "flour, amount: 200.00 g".
+    """
+    return f"{name}, amount: {amount} {unit}"
+
+
+def estimate_many(recipe_ids: Iterable[int]) -> dict[int, NutritionEstimate]:
+    """
+    Calculate the nutrition of several recipes with two queries and one matrix product.
+
+    The normalized grams of each ingredient per recipe form a recipes x ingredients matrix, which is multiplied by
+    the ingredients x nutrients table of amounts per gram.
+
+    :param recipe_ids: The ids of the recipes.
+    :return: The estimate of each recipe, keyed by id.
+    """
+    recipe_ids = list(dict.fromkeys(recipe_ids))
+    estimates = {recipe_id: NutritionEstimate() for recipe_id in recipe_ids}
+    lines = list(IngredientList.objects.filter(recipe_id__in=recipe_ids).order_by('id').values_list(
+        'recipe_id', 'ingredient_id', 'ingredient__name', 'amount', 'unit', 'grams'))
+    table = list(IngredientNutrient.objects.filter(
+        ingredient_id__in={line[1] for line in lines}, samples__gte=MIN_SAMPLES
+    ).order_by('nutrition_id', 'unit').values_list('ingredient_id', 'nutrition__name', 'unit', 'per_gram'))
+
+    ingredients = {ingredient_id: index for index, ingredient_id in enumerate(dict.fromkeys(row[0] for row in table))}
+    nutrients = {key: index for index, key in enumerate(dict.fromkeys((row[1], row[2]) for row in table))}
+    per_gram = np.zeros((len(ingredients), len(nutrients)))
+    known = np.zeros((len(ingredients), len(nutrients)), dtype=bool)
+    if table:
+        rows = np.fromiter((ingredients[row[0]] for row in table), dtype=np.intp, count=len(table))
+        columns = np.fromiter((nutrients[(row[1], row[2])] for row in table), dtype=np.intp, count=len(table))
+        per_gram[rows, columns] = [row[3] for row in table]
+        known[rows, columns] = True
+
+    recipes = {recipe_id: index for index, recipe_id in enumerate(recipe_ids)}
+    grams = np.zeros((len(recipes), len(ingredients)))
+    for recipe_id, ingredient_id, name, amount, unit, weight in lines:
+        if weight is None or ingredient_id not in ingredients:
+            estimates[recipe_id].unknown.append(ingredient_line(name, amount, unit))
+            continue
+        grams[recipes[recipe_id], ingredients[ingredient_id]] += weight
+
+    totals = grams @ per_gram
+    present = (grams > 0).astype(float) @ known.astype(float) > 0
+    names = list(nutrients)
+    for recipe_id, index in recipes.items():
+        estimates[recipe_id].nutrients = [
+            {'name': names[column][0], 'amount': round(float(totals[index, column]), 2), 'unit': names[column][1]}
+            for column in np.flatnonzero(present[index])
+        ]
+    return estimates
+
+
+def estimate_nutrition(recipe_id: int) -> NutritionEstimate:
+    """
+    Calculate the nutrition of one recipe.
+
+    :param recipe_id: The id of the recipe.
+    :return: The estimate.
+    """
+    return estimate_many([recipe_id])[recipe_id]
+
+
+def merge_nutrients(*nutrient_lists: Iterable[dict]) -> list[dict]:
+    """
+    Add up lists of nutrients, matching them by name and unit.
+
+    :param nutrient_lists: Lists of dictionaries with `name`, `amount` and `unit`.
+    :return: One dictionary per nutrient and unit, in the order they first appear.
+    """
+    merged: dict[tuple[str, str], dict] = {}
+    for nutrients in nutrient_lists:
+        for nutrient in nutrients:
+            key = (normalize_name(nutrient["name"]), nutrient.get("unit") or '')
+            if key in merged:
+                merged[key]["amount"] = round(merged[key]["amount"] + float(nutrient["amount"]), 2)
+            else:
+                merged[key] = {'name': nutrient["name"], 'amount': float(nutrient["amount"]), 'unit': key[1]}
+    return list(merged.values())
+
+
+def nutrition_request(estimate: NutritionEstimate | None) -> tuple[bool, list[str] | None]:
+    """
+    Decide what GPT is asked about the nutrition of a recipe, once the nutrition engine has estimated it.
+
+    :param estimate: The local estimate, None if the nutrition is not needed.
+    :return: Whether the nutrients are asked for at all, and the only ingredient lines they are asked for, None
+             for every ingredient when the engine knows none of them.
+    """
+    if estimate is None or estimate.complete and estimate.nutrients:
+        return False, None
+    return True, estimate.unknown if estimate.nutrients else None
+
+
+def recipe_nutrients(estimate: NutritionEstimate | None, assessment: dict) -> list[dict]:
+    """
+    Add the nutrients GPT estimated for the ingredients the nutrition engine does not know to the local estimate.
+
+    :param estimate: The local estimate, None if the nutrition is not needed.
+    :param assessment: The assessment of the recipe by GPT, with the nutrients of the unknown ingredients if they
+                       were asked for.
+    :return: The nutrients, each with name, amount and unit.
+    """
+    if estimate is None:
+        return []
+    if estimate.complete and estimate.nutrients:
+        return estimate.nutrients
+    asked = [entry for entry in assessment.get("nutrients", []) if entry.get("name")]
+    return merge_nutrients(estimate.nutrients, asked)
+
+
+def save_table(rows: dict[tuple[Ingredient, Nutrition], IngredientNutrient]) -> int:
+    """
+    Write rows of the nutrient table, upserting the new ones and updating the loaded ones in bulk.
+
+    :param rows: The rows, keyed by ingredient and nutrition.
+    :return: The number of rows written.
+    """
+    now = timezone.now()
+    fields = ['per_gram', 'unit', 'samples', 'updated_at']
+    for row in rows.values():
+        row.updated_at = now
+    IngredientNutrient.objects.bulk_create(
+        [row for row in rows.values() if row.pk is None],
+        update_conflicts=True,
+        unique_fields=['ingredient', 'nutrition'],
+        update_fields=fields,
+    )
+    IngredientNutrient.objects.bulk_update([row for row in rows.values() if row.pk is not None], fields)
+    return len(rows)
+
+
+def learn_ingredient_nutrients(entries: Iterable[dict]) -> int:
+    """
+    Add the nutrients of the ingredients of an imported recipe to the table, averaging them with earlier samples.
+
+    :param entries: The `ingredients` of Spoonacular's nutrition widget, each with `name`, `amount`, `unit` and
+                    `nutrients`. The ingredients must already be saved.
+    :return: The number of rows written.
+    """
+    samples: dict[tuple[str, str], tuple[float, str, str]] = {}
+    for entry in entries:
+        weight = to_grams(entry.get('amount') or 0, entry.get('unit'))
+        if not weight:
+            continue
+        for nutrient in entry.get('nutrients', []):
+            if nutrient.get('name') and nutrient.get('amount') is not None:
+                key = (normalize_name(entry.get('name')), normalize_name(nutrient['name']))
+                samples[key] = (float(nutrient['amount']) / weight, nutrient.get('unit') or '', nutrient['name'])
+    if not samples:
+        return 0
+
+    ingredients = Ingredient.objects.in_bulk({key[0] for key in samples}, field_name='normalized_name')
+    nutritions = Nutrition.upsert_many({'name': sample[2]} for sample in samples.values())
+    existing = {(row.ingredient_id, row.nutrition_id): row for row in IngredientNutrient.objects.filter(
+        ingredient__in=ingredients.values(), nutrition__in=nutritions.values())}
+    rows = {}
+    for (ingredient_key, nutrition_key), (amount, unit, _) in samples.items():
+        if ingredient_key not in ingredients:
+            continue
+        ingredient, nutrition = ingredients[ingredient_key], nutritions[nutrition_key]
+        row = existing.get((ingredient.id, nutrition.id))
+        if row is None:
+            row = IngredientNutrient(ingredient=ingredient, nutrition=nutrition, per_gram=amount, unit=unit)
+        elif row.unit != unit:
+            logger.warning(f"Skipping {nutrition.name} of {ingredient.name} in {unit}, the table uses {row.unit}.")
+            continue
+        else:
+            row.samples += 1
+            row.per_gram += (amount - row.per_gram) / row.samples
+        rows[(ingredient, nutrition)] = row
+    return save_table(rows)
+
+
+def load_nutrient_table(entries: Iterable[dict]) -> int:
+    """
+    Load a nutrient dataset into the table, replacing the rows of the same ingredients and nutrients.
+
+    :param entries: Dictionaries with `ingredient`, `nutrient`, `unit` and `per_100g`.
+    :return: The number of rows written.
+    """
+    entries = [entry for entry in entries if entry.get('ingredient') and entry.get('nutrient')]
+    ingredients = Ingredient.upsert_many({'name': entry['ingredient']} for entry in entries)
+    nutritions = Nutrition.upsert_many({'name': entry['nutrient']} for entry in entries)
+    rows = {}
+    for entry in entries:
+        ingredient = ingredients[normalize_name(entry['ingredient'])]
+        nutrition = nutritions[normalize_name(entry['nutrient'])]
+        rows[(ingredient, nutrition)] = IngredientNutrient(
+            ingredient=ingredient, nutrition=nutrition, per_gram=float(entry['per_100g']) / 100,
+            unit=entry.get('unit') or '', samples=max(MIN_SAMPLES, 1)
+        )
+    return save_table(rows)
@@ -0,0 +1,244 @@
+"""Build the prompts of the AI advisor within a token budget, compacting the recipe context the method asks about."""
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from decouple import config
+
+# Compact the prompts. Without it, every field is sent verbatim, e.g. to measure what the compaction saves.
+COMPACT = config('GPT_PROMPT_COMPACTION', cast=bool, default=True)
+# Estimated tokens a prompt may have, per kind of call. The fields that are never shortened, such as the ingredients,
+# may still exceed it.
+BUDGETS = {
+    'alternatives': config('GPT_PROMPT_BUDGET_ALTERNATIVES', cast=int, default=500),
+    'difficulty': config('GPT_PROMPT_BUDGET_DIFFICULTY', cast=int, default=700),
+    'nutrition': config('GPT_PROMPT_BUDGET_NUTRITION', cast=int, default=500),
+    'approval': config('GPT_PROMPT_BUDGET_APPROVAL', cast=int, default=900),
+    'assessment': config('GPT_PROMPT_BUDGET_ASSESSMENT', cast=int, default=900),
+}
+# A line is not truncated below this many tokens, its section drops lines instead.
+MIN_LINE_TOKENS = 12
+
+_token_pattern = re.compile(r"\w+|[^\w\s]")
+_sentence_pattern = re.compile(r"(?<=[.!?])\s+")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Estimate the tokens of a text without a tokenizer: one per punctuation mark, and one per four letters of a word.
+
+    It is only used to compare prompts and fit the budgets. The telemetry records the exact tokens of each request.
+
+    :param text: The text.
+    :return: The estimated tokens.
+    """
+    return sum(1 + (len(token) - 1) // 4 for token in _token_pattern.findall(text))
+
+
+def first_sentence(text: str) -> str:
+    """
+    Return the first sentence of a text.
+
+    :param text: The text.
+    :return: The text up to the end of its first sentence.
+    """
+    return _sentence_pattern.split(text.strip(), maxsplit=1)[0]
+
+
+def truncate(text: str, tokens: int) -> str:
+    """
+    Cut a text at a word boundary so it has at most about this many tokens.
+
+    :param text: The text.
+    :param tokens: The tokens to keep.
+    :return: The text, ending with an ellipsis if it was cut.
+    """
+    if count_tokens(text) <= tokens:
+        return text
+    kept, used = [], 0
+    for word in text.split():
+        used += count_tokens(word)
+        if used > tokens:
+            break
+        kept.append(word)
+    return " ".join(kept).rstrip(",;:") + "..."
+
+
+def unique_lines(lines: list[str]) -> list[str]:
+    """
+    Merge the repeated lines, e.g. an ingredient listed once for the dough and once for the topping.
+
+    :param lines: The lines.
+    :return: Each line once with its whitespace collapsed, followed by how many times it was listed.
+    """
+    collapsed = [" ".join(line.split()) for line in lines]
+    counts = Counter(line.casefold() for line in collapsed)
+    merged = {}
+    for line in collapsed:
+        merged.setdefault(line.casefold(), line)
+    return [line if counts[key] == 1 else f"{line} (x{counts[key]})" for key, line in merged.items()]
+
+
+@dataclass
+class Section:
+    """
+    Lines of a prompt rendered together, such as the steps of the recipe.
+
+    :param lines: The lines.
+    :param header: A line written before the lines, None for no header.
+    :param label: The text written before each line.
+    :param numbered: Whether the lines are numbered from 1 instead of labelled.
+    :param priority: The lowest priorities are shortened first to fit the budget, None is never shortened.
+    :param optional: Whether the section is dropped from compact prompts, as the method does not need it.
+    :param unique: Whether repeated lines are merged in compact prompts.
+    """
+
+    lines: list[str]
+    header: str | None = None
+    label: str = ''
+    numbered: bool = False
+    priority: int | None = None
+    optional: bool = False
+    unique: bool = False
+    omitted: int = 0
+    _summarized: bool = field(default=False, repr=False)
+
+    def render(self) -> list[str]:
+        """
+        Return the lines of the prompt.
+
+        :return: The header, the labelled or numbered lines and how many lines were left out.
+        """
+        rendered = [] if self.header is None else [self.header]
+        rendered += [f"{number}. {line}" if self.numbered else self.label + line
+                     for number, line in enumerate(self.lines, start=1)]
+        if self.omitted:
+            rendered.append(f"... and {self.omitted} more")
+        return rendered
+
+    def compacted(self) -> 'Section':
+        """
+        Return the section with its whitespace collapsed and, if unique, its repeated lines merged.
+
+        :return: A new section.
+        """
+        lines = unique_lines(self.lines) if self.unique else [" ".join(line.split()) for line in self.lines]
+        return Section(lines, self.header, self.label, self.numbered, self.priority)
+
+    def shrink(self) -> bool:
+        """
+        Shorten the section by one stage.
+
+        The first stage keeps the first sentence of each line, the next ones halve the longest lines down to
+        MIN_LINE_TOKENS, and the last ones drop the last lines one at a time.
+
+        :return: False if the section cannot be shortened any more.
+        """
+        if self.priority is None:
+            return False
+        if not self._summarized:
+            self._summarized = True
+            shorter = [first_sentence(line) for line in self.lines]
+            if shorter != self.lines:
+                self.lines = shorter
+                return True
+        longest = max((count_tokens(line) for line in self.lines), default=0)
+        if longest > MIN_LINE_TOKENS:
+            self.lines = [truncate(line, max(longest // 2, MIN_LINE_TOKENS)) for line in self.lines]
+            return True
+        if len(self.lines) > 1:
+            self.lines = self.lines[:-1]
+            self.omitted += 1
+            return True
+        return False
+
+
+class Prompt(str):
+    """
+    The text of a prompt, with its estimated tokens and the tokens the compaction saved.
+
+    :param tokens: The estimated tokens of the prompt.
+    :param saved_tokens: The estimated tokens of the verbatim prompt minus those of this one.
+    """
+
+    tokens: int
+    saved_tokens: int
+
+    def __new__(cls, text: str, tokens: int, saved_tokens: int = 0) -> 'Prompt':
+        """
+        Create the prompt.
+
+        :param text: The text.
+        :param tokens: The estimated tokens of the text.
+        :param saved_tokens: The estimated tokens the compaction saved.
+        :return: The prompt.
+        """
+        prompt = super().__new__(cls, text)
+        prompt.tokens = tokens
+        prompt.saved_tokens = saved_tokens
+        return prompt
+
+
+class PromptBuilder:
+    """
+    Build a prompt from sections, compacted to fit a token budget.
+
+    The sections the method does not need are dropped, and the least important ones are shortened until the
+    prompt fits.
+
+    :param budget: The estimated tokens the prompt may have, None for no limit.
+    :param compact: Whether to compact the prompt, COMPACT by default. Otherwise every section is sent verbatim.
+    """
+
+    def __init__(self, budget: int | None = None, compact: bool | None = None):
+        """
+        Start an empty prompt.
+
+        :param budget: The estimated tokens the prompt may have, None for no limit.
+        :param compact: Whether to compact the prompt, COMPACT by default.
+        """
+        self.budget = budget
+        self.compact = COMPACT if compact is None else compact
+        self.sections: list[Section] = []
+
+    def add(self, lines: list[str] | str, **options) -> 'PromptBuilder':
+        """
+        Add a section after the others.
+
+        :param lines: The lines, or a single line.
+        :param options: The other fields of the Section.
+        :return: The builder, to chain the calls.
+        """
+        self.sections.append(Section([lines] if isinstance(lines, str) else list(lines), **options))
+        return self
+
+    @staticmethod
+    def _render(sections: list[Section]) -> str:
+        """
+        Join the sections.
+
+        :param sections: The sections in order.
+        :return: The text of the prompt.
+        """
+        return "\n".join(line for section in sections for line in section.render())
+
+    def build(self) -> Prompt:
+        """
+        Render the prompt.
+
+        :return: The prompt, with the tokens the compaction saved.
+        """
+        verbatim = self._render(self.sections)
+        verbatim_tokens = count_tokens(verbatim)
+        if not self.compact:
+            return Prompt(verbatim, verbatim_tokens)
+        sections = [section.compacted() for section in self.sections if not section.optional]
+        shrinkable = sorted((section for section in sections if section.priority is not None),
+                            key=lambda section: section.priority)
+        text = self._render(sections)
+        tokens = count_tokens(text)
+        while self.budget is not None and tokens > self.budget:
+            if not any(section.shrink() for section in shrinkable):
+                break
+            text = self._render(sections)
+            tokens = count_tokens(text)
+        return Prompt(text, tokens, max(verbatim_tokens - tokens, 0))
@@ -2,13 +2,15 @@
 
 from typing import Any
 from abc import ABC, abstractmethod
-from django.db.models import QuerySet
+from django.db import IntegrityError, transaction
 from webpage.models import Recipe
 import requests
 from decouple import config
 from webpage.modules.filter_objects import FilterParam
 from webpage.modules.recipe_facade import RecipeFacade
-from webpage.modules.builder import SpoonacularRecipeBuilder
+from webpage.modules.builder import SpoonacularRecipeBuilder, SpoonacularAPIError
+from webpage.modules.spoonacular_miss import find_miss, record_miss
+from webpage.modules.single_flight import default_flight
 import logging
 from webpage.modules.status_code import StatusCode
 API_KEY = config('API_KEY', default=None)
@@ -76,17 +78,37 @@ class GetDataProxy(GetData):
         Find the recipe using the recipe's spoonacular_id.
 
         This method includes additional logic to save the data (including equipment)
-        into the database if the recipe does not exist.
+        into the database if the recipe does not exist. Ids that failed to load recently
+        are not requested from the API again until their failure expires. Concurrent
+        imports of the same id, in this process or in other workers, wait for the first
+        one and reuse the recipe it saved.
 
         :param id: The recipe spoonacular_id.
-        :return: The Recipe object with the specified ID, return None if not found.
+        :return: The Recipe object with the specified ID.
+        :raises SpoonacularAPIError: If the recipe cannot be loaded, or failed to load recently.
         """
-        recipe_queryset: QuerySet = Recipe.objects.filter(spoonacular_id=id)
-        if not recipe_queryset.exists():
-            # Retrieve the recipe data from the API
-            spoonacular_recipe_queryset = self._service.find_by_spoonacular_id(id)
-            return spoonacular_recipe_queryset
-        return recipe_queryset.first()
+        recipe = Recipe.objects.filter(spoonacular_id=id).first()
+        if recipe is not None:
+            return recipe
+        return default_flight.do(f"spoonacular:{id}", lambda: self._load(id),
+                                 lookup=lambda: Recipe.objects.filter(spoonacular_id=id).first())
+
+    def _load(self, id: int) -> Recipe:
+        """
+        Load a recipe from the service, unless it failed to load recently.
+
+        :param id: The recipe spoonacular_id.
+        :return: The saved Recipe object.
+        :raises SpoonacularAPIError: If the recipe cannot be loaded, or failed to load recently.
+        """
+        miss = find_miss(id)
+        if miss is not None:
+            raise SpoonacularAPIError(f"Failed recently: {miss.reason}", status_code=miss.status_code)
+        try:
+            return self._service.find_by_spoonacular_id(id)
+        except SpoonacularAPIError as error:
+            record_miss(id, error)
+            raise
 
     def filter_recipe(self, param: FilterParam) -> list[RecipeFacade]:
         """
@@ -166,23 +188,34 @@ class GetDataSpoonacular(GetData):
         """
         Find the recipe from Spoonacular's API using the recipe's spoonacular_id.
 
+        Every API call is made before anything is written, and the recipe is then saved in a single transaction,
+        so a failed lookup never leaves a partial recipe behind. Its difficulty is left to the ai_enrich command.
+
         :param id: The Spooacular recipe id.
         :return: QuerySet containing the Recipe object corresponding to the provided ID.
                  Raise an Exeption if the recipe cannot found.
         """
         builder = SpoonacularRecipeBuilder(name="", spoonacular_id=id)
-        builder.build_name()
-        builder.build_ingredient()
-        builder.build_equipment()
-        builder.build_nutrition()
-        builder.build_step()
-        builder.build_details()
-        builder.build_diet()
-        builder.build_difficulty()
-        builder.build_status()
-        builder.build_spoonacular_id()
-        builder.build_cuisine()
-        builder.build_recipe().save()
+        builder.fetch()
+        try:
+            with transaction.atomic():
+                builder.build_spoonacular_id()
+                builder.build_name()
+                builder.build_ingredient()
+                builder.build_equipment()
+                builder.build_nutrition()
+                builder.build_step()
+                builder.build_details()
+                builder.build_diet()
+                builder.build_status()
+                builder.build_cuisine()
+                builder.build_recipe().save()
+        except IntegrityError:
+            # Another request may have imported the same recipe in the meantime.
+            existing = Recipe.objects.filter(spoonacular_id=id).first()
+            if existing is None:
+                raise
+            return existing
         return builder.build_recipe()
 
     def filter_recipe(self, param: FilterParam) -> list[RecipeFacade]:
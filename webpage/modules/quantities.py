@@ -0,0 +1,61 @@
+"""Fill in and add up the normalized quantities of the ingredients of recipes."""
+from typing import Iterable
+import numpy as np
+from django.db.models import Count, QuerySet, Sum
+from webpage.models import IngredientList, NORMALIZED_QUANTITIES
+from webpage.modules.units import convert
+
+BATCH_SIZE = 1000
+
+
+def normalize_queryset(queryset: QuerySet[IngredientList], batch_size: int = BATCH_SIZE) -> int:
+    """
+    Convert the amounts of many ingredient lines at once and store their normalized quantities.
+
+    The lines are read in batches ordered by id, converted with array math and written with one bulk update per
+    batch, without loading the model instances.
+
+    :param queryset: The ingredient lines to normalize.
+    :param batch_size: The number of lines per batch.
+    :return: The number of lines updated.
+    """
+    count = 0
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(id__gt=last_id).order_by('id').values_list(
+            'id', 'amount', 'unit', 'ingredient__density', 'ingredient__piece_weight')[:batch_size])
+        if not rows:
+            return count
+        ids, amounts, units, densities, piece_weights = zip(*rows)
+        quantities = convert(amounts, units, densities, piece_weights)
+        values = {field: np.where(np.isnan(quantities[field]), None, quantities[field]).tolist()
+                  for field in NORMALIZED_QUANTITIES}
+        lines = [IngredientList(id=line_id, unit_key=quantities['unit_key'][index],
+                                **{field: values[field][index] for field in NORMALIZED_QUANTITIES})
+                 for index, line_id in enumerate(ids)]
+        IngredientList.objects.bulk_update(lines, ['unit_key', *NORMALIZED_QUANTITIES])
+        count += len(lines)
+        last_id = ids[-1]
+
+
+def shopping_list(recipe_ids: Iterable[int], scale: float = 1.0) -> list[dict]:
+    """
+    Add up the ingredients of several recipes in the database.
+
+    :param recipe_ids: The ids of the recipes.
+    :param scale: The factor applied to every amount, e.g. 2 to cook each recipe twice.
+    :return: One dictionary per ingredient with `name`, `grams`, `milliliters`, `pieces` and `unmeasured` (the
+             lines whose quantity is not known, such as 'salt' typed without an amount), sorted by name.
+    """
+    lines = IngredientList.objects.filter(recipe_id__in=list(recipe_ids))
+    rows = lines.values('ingredient__name').annotate(
+        total_grams=Sum('grams'), total_milliliters=Sum('milliliters'), total_pieces=Sum('pieces'),
+    ).order_by('ingredient__name')
+    unmeasured = dict(lines.filter(grams__isnull=True, milliliters__isnull=True, pieces__isnull=True).values(
+        'ingredient__name').annotate(count=Count('id')).values_list('ingredient__name', 'count'))
+    return [{
+        'name': row['ingredient__name'],
+        **{field: None if row[f'total_{field}'] is None else round(row[f'total_{field}'] * scale, 2)
+           for field in NORMALIZED_QUANTITIES},
+        'unmeasured': unmeasured.get(row['ingredient__name'], 0),
+    } for row in rows]
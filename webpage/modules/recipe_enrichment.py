@@ -0,0 +1,137 @@
+"""Background enrichment of user-submitted recipes: image upload, then nutrition, difficulty and AI approval."""
+from decimal import Decimal
+from typing import Callable
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+import logging
+from pantry import settings
+from webpage.models import Job, Recipe, Nutrition, normalize_name
+from webpage.modules.ai_advisor import AIRecipeAdvisor
+from webpage.modules.builder import NormalRecipeBuilder
+from webpage.modules.image_to_url import upload_image_to_imgur
+from webpage.modules.job_queue import enqueue, job_handler
+from webpage.modules.nutrition_engine import estimate_nutrition, nutrition_request, recipe_nutrients
+from webpage.modules.screening import evaluate, record_verdict
+from webpage.modules.status_code import ScreeningVerdict, StatusCode
+
+logger = logging.getLogger("Recipe enrichment")
+
+ENRICH_RECIPE = 'enrich_recipe'
+
+
+def enqueue_enrichment(recipe: Recipe, user: User, image: bytes | None = None) -> Job:
+    """
+    Queue the slow processing steps of a newly submitted recipe.
+
+    :param recipe: The saved, pending recipe.
+    :param user: The user who submitted the recipe.
+    :param image: The uploaded photo, if any, to be sent to Imgur by the worker.
+    :return: The queued job.
+    """
+    return enqueue(ENRICH_RECIPE, payload={'recipe_id': recipe.id, 'done': []}, user=user, attachment=image)
+
+
+def process_image(builder: NormalRecipeBuilder, job: Job) -> Callable[[], None]:
+    """
+    Upload the photo attached to the job.
+
+    :param builder: Recipe Builder instance.
+    :param job: The enrichment job holding the photo.
+    :return: The function setting the uploaded photo as the recipe's image.
+    """
+    image_url = upload_image_to_imgur(bytes(job.attachment), settings.IMGUR_CLIENT_ID) if job.attachment else None
+
+    def apply():
+        if image_url:
+            builder.build_details(image=image_url)
+        job.attachment = None
+
+    return apply
+
+
+def process_assessment(builder: NormalRecipeBuilder, job: Job) -> Callable[[], None]:
+    """
+    Ask the AI advisor for the nutrition, difficulty and approval of the recipe in one request.
+
+    The local classifier rates the difficulty and the nutrition engine estimates the nutrition first. GPT is only
+    asked for the difficulty when the classifier is not confident, and for the nutrients of the ingredients the
+    engine does not know, or for none when it knows them all. The screening rules run before both. A rejected recipe is
+    rejected without asking GPT, and a flagged one is left pending for the moderators, its difficulty and nutrition
+    left to the ai_enrich command.
+    Parts already applied by a job queued before the steps were merged are skipped.
+
+    :param builder: Recipe Builder instance.
+    :param job: The enrichment job.
+    :return: The function recording the screening and applying the assessment to the recipe.
+    """
+    done = job.payload.get('done', [])
+    recipe = builder.build_recipe()
+    verdict = evaluate(recipe)
+    if not verdict.passed:
+        def flag():
+            record_verdict(recipe, verdict)
+            builder.build_details(AI_status=False, enriched_at=timezone.now())
+            if verdict.verdict == ScreeningVerdict.REJECT.value[0]:
+                builder.build_details(status=StatusCode.REJECTED.value[0])
+
+        return flag
+    advisor = AIRecipeAdvisor(recipe)
+    local_difficulty = None if 'difficulty' in done else advisor.local_difficulty()
+    estimate = None if 'nutrition' in done else estimate_nutrition(recipe.id)
+    ask_nutrients, nutrition_lines = nutrition_request(estimate)
+    fields = tuple(field for field, needed in [("difficulty", 'difficulty' not in done and local_difficulty is None),
+                                               ("nutrients", ask_nutrients), ("approved", True)] if needed)
+    assessment = advisor.recipe_assessment(fields, nutrition_lines)
+    nutrients = recipe_nutrients(estimate, assessment)
+
+    def apply():
+        record_verdict(recipe, verdict)
+        nutrition_objects = Nutrition.upsert_many({'name': entry["name"]} for entry in nutrients)
+        for nutrition_entry in nutrients:
+            builder.build_nutrition(
+                nutrition=nutrition_objects[normalize_name(nutrition_entry["name"])],
+                amount=Decimal(str(nutrition_entry["amount"])),
+                unit=nutrition_entry.get("unit")
+            )
+        if 'difficulty' not in done:
+            builder.build_details(difficulty=local_difficulty or assessment["difficulty"])
+        builder.build_details(AI_status=assessment["approved"], enriched_at=timezone.now())
+        if assessment["approved"]:
+            builder.build_details(status=StatusCode.APPROVE.value[0])
+
+    return apply
+
+
+STEPS = [
+    ('image', process_image),
+    ('assessment', process_assessment),
+]
+
+
+@job_handler(ENRICH_RECIPE)
+def enrich_recipe(job: Job):
+    """
+    Run every enrichment step that has not succeeded yet.
+
+    The network calls of a step, to Imgur or GPT, run outside any transaction. Only its writes and the checkpoint in
+    the payload are committed together, so a retry resumes where the last attempt failed.
+
+    :param job: The enrichment job.
+    """
+    try:
+        recipe = Recipe.objects.get(id=job.payload['recipe_id'])
+    except Recipe.DoesNotExist:
+        logger.warning(f"Recipe {job.payload['recipe_id']} was deleted before it was enriched.")
+        return
+    builder = NormalRecipeBuilder.from_recipe(recipe)
+    done = job.payload.setdefault('done', [])
+    for name, step in STEPS:
+        if name in done:
+            continue
+        apply = step(builder, job)
+        with transaction.atomic():
+            apply()
+            builder.build_recipe().save()
+            done.append(name)
+            job.save(update_fields=['payload', 'attachment'])
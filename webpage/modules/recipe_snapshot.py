@@ -0,0 +1,160 @@
+"""Build and serve the denormalized snapshot used to render the recipe detail page."""
+from django.db.models import F, Prefetch, Q
+from django.utils import timezone
+import logging
+from webpage.models import Recipe, RecipeSnapshot, IngredientList, EquipmentList, NutritionList, Profile, Job
+from webpage.modules.job_queue import enqueue, job_handler
+
+logger = logging.getLogger("Recipe snapshot")
+
+# Increase this whenever the shape of the snapshot changes, so old snapshots are rebuilt on their next read.
+SNAPSHOT_VERSION = 1
+
+# How many times a snapshot is built again when its recipe changed while it was built.
+REBUILD_ATTEMPTS = 3
+
+REBUILD_SNAPSHOTS = 'rebuild_snapshots'
+
+
+def build_snapshot_data(recipe_id: int) -> dict | None:
+    """
+    Collect everything the detail page needs about a recipe into a JSON-serializable dictionary.
+
+    :param recipe_id: The id of the recipe.
+    :return: The snapshot data, or None if the recipe does not exist.
+    """
+    recipe = Recipe.objects.select_related('poster_id').prefetch_related(
+        Prefetch('ingredientlist_set', queryset=IngredientList.objects.select_related('ingredient').order_by('id')),
+        Prefetch('equipmentlist_set', queryset=EquipmentList.objects.select_related('equipment').order_by('id')),
+        Prefetch('nutritionlist_set', queryset=NutritionList.objects.select_related('nutrition').order_by('id')),
+        'steps', 'diets', 'cuisine',
+    ).filter(id=recipe_id).first()
+    if recipe is None:
+        return None
+    poster = recipe.poster_id
+    return {
+        'id': recipe.id,
+        'name': recipe.name,
+        'spoonacular_id': recipe.spoonacular_id,
+        'image': recipe.image,
+        'description': recipe.description,
+        'estimated_time': recipe.estimated_time,
+        'difficulty': recipe.difficulty,
+        'status': recipe.status,
+        'poster': {
+            'id': poster.id,
+            'username': poster.username,
+            'chef_badge': Profile.objects.filter(user=poster, chef_badge=True).exists(),
+        },
+        'diets': [diet.name for diet in recipe.diets.all()],
+        'cuisines': [cuisine.name for cuisine in recipe.cuisine.all()],
+        'ingredients': [
+            {'ingredient': {'id': item.ingredient.id, 'name': item.ingredient.name, 'picture': item.ingredient.picture},
+             'amount': str(item.amount), 'unit': item.unit}
+            for item in recipe.ingredientlist_set.all()
+        ],
+        'equipments': [
+            {'equipment': {'id': item.equipment.id, 'name': item.equipment.name, 'picture': item.equipment.picture},
+             'amount': str(item.amount), 'unit': item.unit}
+            for item in recipe.equipmentlist_set.all()
+        ],
+        'nutrition': [
+            {'name': item.nutrition.name, 'amount': str(item.amount), 'unit': item.unit}
+            for item in recipe.nutritionlist_set.all()
+        ],
+        'steps': [
+            {'number': step.number, 'description': step.description}
+            for step in sorted(recipe.steps.all(), key=lambda step: step.number)
+        ],
+    }
+
+
+def current_generation(recipe_id: int) -> int | None:
+    """
+    Return the generation of the snapshot of a recipe, creating an empty stale snapshot if there is none yet.
+
+    The empty snapshot lets a change made while the first snapshot is built flag it like any other.
+
+    :param recipe_id: The id of the recipe.
+    :return: The generation, or None if the recipe does not exist.
+    """
+    generation = RecipeSnapshot.objects.filter(recipe_id=recipe_id).values_list('generation', flat=True).first()
+    if generation is None and Recipe.objects.filter(id=recipe_id).exists():
+        snapshot, _ = RecipeSnapshot.objects.get_or_create(recipe_id=recipe_id, defaults={'stale': True})
+        generation = snapshot.generation
+    return generation
+
+
+def rebuild_snapshot(recipe_id: int) -> RecipeSnapshot | None:
+    """
+    Rebuild and save the snapshot of a recipe.
+
+    The data is only saved if the snapshot was not flagged while it was built, otherwise it is built again.
+    After REBUILD_ATTEMPTS the snapshot is left stale and the last data built is returned unsaved.
+
+    :param recipe_id: The id of the recipe.
+    :return: The snapshot, or None if the recipe does not exist.
+    """
+    snapshot = None
+    for _ in range(REBUILD_ATTEMPTS):
+        generation = current_generation(recipe_id)
+        data = build_snapshot_data(recipe_id) if generation is not None else None
+        if data is None:
+            return None
+        snapshot = RecipeSnapshot(recipe_id=recipe_id, generation=generation, data=data, version=SNAPSHOT_VERSION,
+                                  stale=False, built_at=timezone.now())
+        if RecipeSnapshot.objects.filter(recipe_id=recipe_id, generation=generation).update(
+                data=data, version=SNAPSHOT_VERSION, stale=False, built_at=snapshot.built_at):
+            return snapshot
+    logger.warning(f"Recipe {recipe_id} kept changing while its snapshot was rebuilt, leaving it stale.")
+    snapshot.stale = True
+    return snapshot
+
+
+def get_snapshot(recipe_id: int) -> dict | None:
+    """
+    Return the snapshot data of a recipe, rebuilding it first if it is missing, stale or outdated.
+
+    :param recipe_id: The id of the recipe.
+    :return: The snapshot data, or None if the recipe does not exist.
+    """
+    snapshot = RecipeSnapshot.objects.filter(recipe_id=recipe_id).first()
+    if snapshot is None or snapshot.stale or snapshot.version != SNAPSHOT_VERSION:
+        snapshot = rebuild_snapshot(recipe_id)
+    return snapshot.data if snapshot is not None else None
+
+
+def mark_stale(**filters) -> int:
+    """
+    Flag the snapshots matching the filters so they are rebuilt on their next read.
+
+    Snapshots that are already stale are flagged again, so a rebuild running at the same time does not save them.
+
+    :param filters: Lookups on RecipeSnapshot, e.g. recipe_id=1 or recipe__diets=diet.
+    :return: The number of snapshots flagged.
+    """
+    return RecipeSnapshot.objects.filter(**filters).update(stale=True, generation=F('generation') + 1)
+
+
+def enqueue_stale_rebuild() -> Job:
+    """
+    Queue a job that rebuilds every stale snapshot ahead of its next read.
+
+    :return: The queued job.
+    """
+    return enqueue(REBUILD_SNAPSHOTS)
+
+
+@job_handler(REBUILD_SNAPSHOTS)
+def rebuild_stale_snapshots(job: Job):
+    """
+    Rebuild every stale or outdated snapshot.
+
+    :param job: The rebuild job.
+    """
+    recipe_ids = list(RecipeSnapshot.objects.filter(
+        Q(stale=True) | ~Q(version=SNAPSHOT_VERSION)
+    ).values_list('recipe_id', flat=True))
+    for recipe_id in recipe_ids:
+        rebuild_snapshot(recipe_id)
+    logger.info(f"Rebuilt {len(recipe_ids)} snapshot(s)")
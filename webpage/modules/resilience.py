@@ -0,0 +1,237 @@
+"""Deadlines, backoff and a circuit breaker that bound how long the requests to the GPT model may take."""
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator
+import openai
+from decouple import config
+
+logger = logging.getLogger("GPT resilience")
+
+# Seconds one request to the model may take.
+REQUEST_TIMEOUT = config('GPT_REQUEST_TIMEOUT', cast=float, default=20)
+# Seconds one advisor call may take, including its retries and the waits between them.
+DEADLINE = config('GPT_DEADLINE', cast=float, default=45)
+# The first retry waits up to BACKOFF_BASE seconds, doubling with every retry up to BACKOFF_MAX.
+BACKOFF_BASE = config('GPT_BACKOFF_BASE', cast=float, default=0.5)
+BACKOFF_MAX = config('GPT_BACKOFF_MAX', cast=float, default=8)
+# Consecutive failed requests that open the breaker, and the seconds it stays open.
+BREAKER_THRESHOLD = config('GPT_BREAKER_THRESHOLD', cast=int, default=5)
+BREAKER_COOLDOWN = config('GPT_BREAKER_COOLDOWN', cast=float, default=30)
+# Status codes of responses worth asking again: timeout, conflict and rate limit. Every 5xx is retried too.
+RETRYABLE_STATUS = {408, 409, 429}
+
+
+class GPTUnavailable(Exception):
+    """Raised instead of asking the model when it cannot answer in time."""
+
+
+class CircuitOpenError(GPTUnavailable):
+    """Raised when the circuit breaker is open after too many failed requests."""
+
+    def __init__(self, retry_after: float):
+        """
+        Initialize the error.
+
+        :param retry_after: The seconds until the breaker lets a request through again.
+        """
+        super().__init__(f"The GPT model is unavailable, retry in {retry_after:.0f} seconds.")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(GPTUnavailable):
+    """Raised when a call has no time left for another request."""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Decide whether a failed request may succeed if it is sent again.
+
+    :param error: The error raised by the request.
+    :return: True for timeouts, connection errors, rate limits and server errors, False for the rest, such as an
+             invalid request or API key.
+    """
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return isinstance(error, (TimeoutError, ConnectionError))
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_MAX) -> float:
+    """
+    Return a random wait before a retry, so the clients of a struggling service do not all retry at once.
+
+    :param attempt: The number of the failed attempt, starting at 0.
+    :param base: The longest wait after the first attempt.
+    :param cap: The longest wait after any attempt.
+    :return: The seconds to wait, between 0 and min(cap, base * 2 ** attempt).
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class Deadline:
+    """
+    The time left for one call to the model, shared by all its retries.
+
+    :param seconds: The seconds the call may take.
+    :param clock: The function returning the current time in seconds.
+    """
+
+    def __init__(self, seconds: float = DEADLINE, clock: Callable[[], float] = time.monotonic):
+        """
+        Start the countdown.
+
+        :param seconds: The seconds the call may take.
+        :param clock: The function returning the current time in seconds.
+        """
+        self.clock = clock
+        self.expires_at = clock() + seconds
+
+    def remaining(self) -> float:
+        """
+        Return the seconds left.
+
+        :return: The seconds left, 0 once the deadline has passed.
+        """
+        return max(self.expires_at - self.clock(), 0.0)
+
+    def timeout(self, limit: float = REQUEST_TIMEOUT) -> float:
+        """
+        Return the timeout of the next request.
+
+        :param limit: The longest a single request may take.
+        :return: The seconds the request may take.
+        :raises DeadlineExceeded: If no time is left.
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("The deadline passed before the model answered.")
+        return min(limit, remaining)
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Return the wait before retrying a failed request.
+
+        :param attempt: The number of the failed attempt, starting at 0.
+        :return: The seconds to wait.
+        :raises DeadlineExceeded: If the wait would use up the time left.
+        """
+        delay = backoff_delay(attempt)
+        if delay >= self.remaining():
+            raise DeadlineExceeded("No time left to retry the request.")
+        return delay
+
+
+class CircuitBreaker:
+    """
+    Stop sending requests to the model for a while after several of them failed in a row.
+
+    While the breaker is open, callers fail fast instead of waiting for a service that is down. After the cooldown,
+    a single trial request is let through: the breaker closes if it succeeds and opens again if it fails.
+    The breaker is thread-safe and is shared by every handler of the process.
+
+    :param threshold: The consecutive failures that open the breaker.
+    :param cooldown: The seconds the breaker stays open.
+    :param clock: The function returning the current time in seconds.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize a closed breaker.
+
+        :param threshold: The consecutive failures that open the breaker.
+        :param cooldown: The seconds the breaker stays open.
+        :param clock: The function returning the current time in seconds.
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Close the breaker and forget the failures."""
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        """Return whether the breaker is closed, open or waiting for a trial request."""
+        if self.opened_at is None:
+            return self.CLOSED
+        if self.clock() - self.opened_at < self.cooldown:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def before_call(self) -> bool:
+        """
+        Check that a request may be sent.
+
+        :return: True if the request is the trial request after the cooldown.
+        :raises CircuitOpenError: If the breaker is open, or its trial request is still running.
+        """
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return False
+            if state == self.HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            raise CircuitOpenError(max(self.opened_at + self.cooldown - self.clock(), 0.0))
+
+    def record(self, error: BaseException | None = None, trial: bool = False):
+        """
+        Record the outcome of a request.
+
+        Errors that are not retryable, such as an invalid request, show that the service is up and count as successes.
+
+        :param error: The error raised by the request, None if it succeeded.
+        :param trial: Whether the request was the trial request returned by before_call.
+        """
+        with self._lock:
+            if trial:
+                self._trial = False
+            if error is None or not is_retryable(error):
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if trial or self.failures >= self.threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"Opening the circuit breaker after {self.failures} failed request(s): {error}")
+                self.opened_at = self.clock()
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """
+        Check the breaker before the requests of a with block and record their outcome after it.
+
+        A block left without an outcome, e.g. a cancelled task or a stream the caller stopped reading, is not recorded.
+
+        :raises CircuitOpenError: If the breaker is open.
+        """
+        trial = self.before_call()
+        try:
+            yield
+        except Exception as e:
+            self.record(e, trial)
+            raise
+        except BaseException:
+            if trial:
+                with self._lock:
+                    self._trial = False
+            raise
+        else:
+            self.record(None, trial)
+
+
+default_breaker = CircuitBreaker()
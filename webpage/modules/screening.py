@@ -0,0 +1,263 @@
+"""Rules screening submitted recipes before GPT is asked to approve them, to reject junk and flag copies at once."""
+import logging
+import math
+import re
+from dataclasses import dataclass, field
+from typing import Callable
+from django.db.models import Count, Q
+from decouple import config, Csv
+from webpage.models import Recipe, IngredientList, ScreeningDecision, normalize_name
+from webpage.modules.status_code import ScreeningVerdict, StatusCode
+
+logger = logging.getLogger("Recipe screening")
+
+BLOCKED_WORDS = config('SCREENING_BLOCKED_WORDS', cast=Csv(),
+                       default='fuck,shit,bitch,cunt,asshole,bullshit,motherfucker')
+# Share of the ingredients and of the step text a recipe must have in common with an approved one to be a near copy.
+NEAR_COPY_INGREDIENTS = config('SCREENING_NEAR_COPY_INGREDIENTS', cast=float, default=0.9)
+NEAR_COPY_STEPS = config('SCREENING_NEAR_COPY_STEPS', cast=float, default=0.8)
+# Links in the description and steps from which a recipe looks like spam.
+MAX_LINKS = config('SCREENING_MAX_LINKS', cast=int, default=1)
+MIN_NAME_LETTERS = 3
+SHINGLE_SIZE = 3
+
+_blocked_pattern = re.compile(r"\b(" + "|".join(re.escape(word) for word in BLOCKED_WORDS if word) + r")\w*",
+                              re.IGNORECASE) if any(BLOCKED_WORDS) else None
+_link_pattern = re.compile(r"https?://|www\.", re.IGNORECASE)
+_repeated_pattern = re.compile(r"(.)\1{4,}")
+_mash_pattern = re.compile(r"\b[b-df-hj-np-tv-xz]{6,}\b", re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class Verdict:
+    """What one rule decided, or what the rules decided together."""
+
+    verdict: str
+    rule: str = ''
+    detail: str = ''
+    duplicate_of: int | None = None
+
+    @property
+    def passed(self) -> bool:
+        """Return whether GPT should be asked to approve the recipe."""
+        return self.verdict == ScreeningVerdict.PASS.value[0]
+
+
+@dataclass
+class Submission:
+    """The parts of a recipe the rules look at, read once."""
+
+    recipe: Recipe
+    name: str
+    text: str
+    steps: list[str]
+    ingredients: set[int] = field(default_factory=set)
+
+    @classmethod
+    def of(cls, recipe: Recipe) -> 'Submission':
+        """
+        Read a recipe.
+
+        :param recipe: The recipe.
+        :return: The submission.
+        """
+        steps = [step.strip() for step in recipe.steps.order_by('number').values_list('description', flat=True)]
+        return cls(recipe, recipe.name or '', "\n".join([recipe.description or '', *steps]), [s for s in steps if s],
+                   set(recipe.ingredientlist_set.values_list('ingredient_id', flat=True)))
+
+
+def _reject(rule: str, detail: str, duplicate_of: int | None = None) -> Verdict:
+    """
+    Return a rejection.
+
+    :param rule: The name of the rule.
+    :param detail: Why the rule fired.
+    :param duplicate_of: The recipe copied, if any.
+    :return: The verdict.
+    """
+    return Verdict(ScreeningVerdict.REJECT.value[0], rule, detail, duplicate_of)
+
+
+def _flag(rule: str, detail: str, duplicate_of: int | None = None) -> Verdict:
+    """
+    Return a flag for the moderators.
+
+    :param rule: The name of the rule.
+    :param detail: Why the rule fired.
+    :param duplicate_of: The recipe copied, if any.
+    :return: The verdict.
+    """
+    return Verdict(ScreeningVerdict.FLAG.value[0], rule, detail, duplicate_of)
+
+
+def no_ingredients(submission: Submission) -> Verdict | None:
+    """
+    Reject a recipe without ingredients.
+
+    :param submission: The submitted recipe.
+    :return: The rejection, None if the rule does not fire.
+    """
+    return None if submission.ingredients else _reject('no_ingredients', "The recipe has no ingredients.")
+
+
+def no_steps(submission: Submission) -> Verdict | None:
+    """
+    Reject a recipe without a written step.
+
+    :param submission: The submitted recipe.
+    :return: The rejection, None if the rule does not fire.
+    """
+    return None if submission.steps else _reject('no_steps', "The recipe has no steps.")
+
+
+def nonsense_name(submission: Submission) -> Verdict | None:
+    """
+    Reject a name without enough letters, with a character repeated many times, a keyboard mash or a link.
+
+    :param submission: The submitted recipe.
+    :return: The rejection, None if the rule does not fire.
+    """
+    name = submission.name
+    if sum(character.isalpha() for character in name) < MIN_NAME_LETTERS:
+        return _reject('nonsense_name', f"The name {name!r} has fewer than {MIN_NAME_LETTERS} letters.")
+    for pattern, reason in [(_repeated_pattern, "repeats a character"), (_mash_pattern, "has a word without vowels"),
+                            (_link_pattern, "contains a link")]:
+        if pattern.search(name):
+            return _reject('nonsense_name', f"The name {name!r} {reason}.")
+    return None
+
+
+def profanity(submission: Submission) -> Verdict | None:
+    """
+    Reject a name with a blocked word, and flag a description or steps with one.
+
+    :param submission: The submitted recipe.
+    :return: The rejection or the flag, None if the rule does not fire.
+    """
+    if _blocked_pattern is None:
+        return None
+    match = _blocked_pattern.search(submission.name)
+    if match:
+        return _reject('profanity', f"The name contains {match.group(0)!r}.")
+    match = _blocked_pattern.search(submission.text)
+    return _flag('profanity', f"The text contains {match.group(0)!r}.") if match else None
+
+
+def links(submission: Submission) -> Verdict | None:
+    """
+    Flag a description and steps with many links, as spam usually has.
+
+    :param submission: The submitted recipe.
+    :return: The flag, None if the rule does not fire.
+    """
+    count = len(_link_pattern.findall(submission.text))
+    return _flag('links', f"The text contains {count} links.") if count > MAX_LINKS else None
+
+
+def _shingles(steps: list[str]) -> set[tuple[str, ...]]:
+    """
+    Return the runs of words of the steps, to compare texts regardless of small edits.
+
+    :param steps: The steps.
+    :return: Every SHINGLE_SIZE words in a row, or the whole text if it is shorter.
+    """
+    words = normalize_name(" ".join(steps)).split()
+    return {tuple(words[index:index + SHINGLE_SIZE]) for index in range(max(len(words) - SHINGLE_SIZE + 1, 1))}
+
+
+def _jaccard(first: set, second: set) -> float:
+    """
+    Return the share of the elements two sets have in common.
+
+    :param first: The first set.
+    :param second: The second set.
+    :return: From 0 to 1, 1 for two empty sets.
+    """
+    if not first and not second:
+        return 1.0
+    return len(first & second) / len(first | second)
+
+
+def copies(submission: Submission) -> Verdict | None:
+    """
+    Reject an exact copy of an approved or earlier pending recipe, and flag a near copy of an approved one.
+
+    Only the recipes sharing enough ingredients are read, found with one grouped query.
+
+    :param submission: The submitted recipe.
+    :return: The rejection or the flag, with the copied recipe, None if the rule does not fire.
+    """
+    if not submission.ingredients:
+        return None
+    needed = math.ceil(NEAR_COPY_INGREDIENTS * len(submission.ingredients))
+    # A copy of a pending recipe is only caught on the later submission, so one of two identical recipes survives.
+    originals = Q(recipe__status=StatusCode.APPROVE.value[0]) | \
+        Q(recipe__lt=submission.recipe.pk, recipe__status=StatusCode.PENDING.value[0])
+    shared = IngredientList.objects.filter(originals, ingredient__in=submission.ingredients) \
+        .values('recipe').annotate(shared=Count('ingredient', distinct=True)).filter(shared__gte=needed)
+    candidates = Recipe.objects.filter(pk__in=shared.values('recipe')).order_by('id') \
+        .prefetch_related('ingredientlist_set', 'steps')
+    shingles = _shingles(submission.steps)
+    name = normalize_name(submission.name)
+    near = None
+    for candidate in candidates:
+        ingredients = {item.ingredient_id for item in candidate.ingredientlist_set.all()}
+        steps = [step.description.strip() for step in sorted(candidate.steps.all(), key=lambda step: step.number)]
+        if ingredients == submission.ingredients and normalize_name(candidate.name) == name and \
+                [normalize_name(step) for step in steps if step] == [normalize_name(step) for step in submission.steps]:
+            return _reject('exact_copy', f"The recipe is a copy of {candidate.name!r}.", candidate.pk)
+        if near is None and candidate.status == StatusCode.APPROVE.value[0] and \
+                _jaccard(ingredients, submission.ingredients) >= NEAR_COPY_INGREDIENTS and \
+                _jaccard(_shingles(steps), shingles) >= NEAR_COPY_STEPS:
+            near = _flag('near_copy', f"The recipe is nearly the same as {candidate.name!r}.", candidate.pk)
+    return near
+
+
+# In order: the first rejection decides, else the first flag.
+RULES: list[Callable[[Submission], Verdict | None]] = [no_ingredients, no_steps, nonsense_name, profanity, links, copies]
+
+
+def evaluate(recipe: Recipe) -> Verdict:
+    """
+    Run the rules on a recipe without recording the decision.
+
+    :param recipe: The submitted recipe.
+    :return: The first rejection, else the first flag, else a pass.
+    """
+    submission = Submission.of(recipe)
+    flag = None
+    for rule in RULES:
+        verdict = rule(submission)
+        if verdict is None:
+            continue
+        if verdict.verdict == ScreeningVerdict.REJECT.value[0]:
+            return verdict
+        flag = flag or verdict
+    return flag or Verdict(ScreeningVerdict.PASS.value[0])
+
+
+def screen(recipe: Recipe) -> Verdict:
+    """
+    Run the rules on a recipe and record the decision with the rule that fired.
+
+    :param recipe: The submitted recipe.
+    :return: The decision.
+    """
+    return record_verdict(recipe, evaluate(recipe))
+
+
+def record_verdict(recipe: Recipe, verdict: Verdict) -> Verdict:
+    """
+    Record the decision of the rules on a recipe.
+
+    :param recipe: The submitted recipe.
+    :param verdict: The decision returned by evaluate.
+    :return: The decision.
+    """
+    ScreeningDecision.objects.create(recipe=recipe, verdict=verdict.verdict, rule=verdict.rule,
+                                     detail=verdict.detail[:500], duplicate_of_id=verdict.duplicate_of)
+    if verdict.passed:
+        logger.info(f"Recipe {recipe.id} passed the screening.")
+    else:
+        logger.warning(f"Recipe {recipe.id} screening: {verdict.verdict} by {verdict.rule}: {verdict.detail}")
+    return verdict
@@ -0,0 +1,231 @@
+"""Let concurrent identical calls, such as importing the same Spoonacular recipe, wait for one of them and share its result."""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from datetime import timedelta
+from typing import Awaitable, Callable, TypeVar
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from decouple import config
+from webpage.models import FlightLock
+
+logger = logging.getLogger("Single flight")
+
+T = TypeVar('T')
+
+# Seconds a worker holds the lock of a call before the other workers assume it died and run the call themselves.
+LOCK_TTL = config('SINGLE_FLIGHT_LOCK_TTL', cast=float, default=60)
+# Seconds between two checks of a lock held by another worker, and the longest a caller waits for another one.
+POLL_INTERVAL = config('SINGLE_FLIGHT_POLL_INTERVAL', cast=float, default=0.2)
+WAIT_TIMEOUT = config('SINGLE_FLIGHT_WAIT_TIMEOUT', cast=float, default=60)
+
+
+class _Flight:
+    """A call running in this process, with the result or error it ended with."""
+
+    def __init__(self):
+        """Start a call without a result."""
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Run a call only once at a time per key, the concurrent callers with the same key sharing its result.
+
+    In a process, the first caller runs the call and the others wait for its result, or its error. Across workers,
+    the caller running the call holds a FlightLock row. A worker finding the row waits until it is released, then
+    looks up the result the other worker stored, e.g. the imported recipe or the cached response, and only runs the
+    call itself if there is none.
+
+    :param lock_ttl: The seconds a lock row is held before it is assumed abandoned.
+    :param poll_interval: The seconds between two checks of a lock held by another worker.
+    :param wait_timeout: The longest a caller waits for another one, after which it runs the call itself.
+    :param clock: The function returning the current time in seconds.
+    :param sleep: The function waiting a number of seconds.
+    """
+
+    def __init__(self, lock_ttl: float = LOCK_TTL, poll_interval: float = POLL_INTERVAL,
+                 wait_timeout: float = WAIT_TIMEOUT, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        """
+        Initialize without calls in flight.
+
+        :param lock_ttl: The seconds a lock row is held before it is assumed abandoned.
+        :param poll_interval: The seconds between two checks of a lock held by another worker.
+        :param wait_timeout: The longest a caller waits for another one, after which it runs the call itself.
+        :param clock: The function returning the current time in seconds.
+        :param sleep: The function waiting a number of seconds.
+        """
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self.wait_timeout = wait_timeout
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._flights: dict[str, _Flight] = {}
+        self._futures: dict[tuple[asyncio.AbstractEventLoop, str], asyncio.Future] = {}
+
+    def waiters(self, key: str) -> int:
+        """
+        Return how many callers wait for the call of a key in this process.
+
+        :param key: The key of the call.
+        :return: The number of waiting callers, 0 if the call is not running.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            return flight.waiters if flight else 0
+
+    def do(self, key: str, call: Callable[[], T], lookup: Callable[[], T | None] | None = None) -> T:
+        """
+        Run a call, or wait for the identical call already running and return its result.
+
+        :param key: What identifies the call, e.g. 'spoonacular:716429'.
+        :param call: The call.
+        :param lookup: Finds the result stored by a call of another worker, None if it is not stored yet. Without it,
+                       or in a transaction, the calls are only shared in this process.
+        :return: The result of the call.
+        :raises: The error of the call, for every caller that waited for it.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.waiters += 1
+        if not leader:
+            if not flight.done.wait(self.wait_timeout):
+                logger.warning(f"Gave up waiting for {key} after {self.wait_timeout:.0f} seconds, running it again.")
+                return call()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            # A lock row written in the caller's transaction is invisible to the other workers until it commits, and
+            # its IntegrityError would break that transaction: only the callers of this process share the call then.
+            shared = lookup is not None and not connection.in_atomic_block
+            flight.result = self._across_workers(key, call, lookup) if shared else call()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _across_workers(self, key: str, call: Callable[[], T], lookup: Callable[[], T | None]) -> T:
+        """
+        Run a call while holding its lock row, or wait for the worker holding it and look up its result.
+
+        :param key: The key of the call.
+        :param call: The call.
+        :param lookup: Finds the result stored by the other worker.
+        :return: The result of the call.
+        """
+        deadline = self.clock() + self.wait_timeout
+        waited = False
+        while True:
+            token = self._acquire(key)
+            if token is not None:
+                try:
+                    found = self._lookup_after_wait(lookup) if waited else None
+                    return call() if found is None else found
+                finally:
+                    self._release(key, token)
+            if self.clock() >= deadline:
+                logger.warning(f"Gave up waiting for another worker to finish {key}, running it again.")
+                return call()
+            waited = True
+            self.sleep(self.poll_interval)
+
+    def _lookup_after_wait(self, lookup: Callable[[], T | None]) -> T | None:
+        """
+        Look up the result of the worker that released the lock, once more after a poll interval if it is missing.
+
+        The other worker may release its lock before the transaction writing its result commits, e.g. when its caller
+        ran it in a longer transaction, so a single miss does not mean it failed.
+
+        :param lookup: Finds the result stored by the other worker.
+        :return: The result, None if the other worker stored none.
+        """
+        found = lookup()
+        if found is None:
+            self.sleep(self.poll_interval)
+            found = lookup()
+        return found
+
+    def _acquire(self, key: str) -> str | None:
+        """
+        Take the lock row of a key, replacing an abandoned one.
+
+        :param key: The key of the call.
+        :return: The token of the lock, None if another caller holds it.
+        """
+        now = timezone.now()
+        FlightLock.objects.filter(key=key, expires_at__lte=now).delete()
+        token = uuid.uuid4().hex
+        try:
+            with transaction.atomic():
+                FlightLock.objects.create(key=key, token=token, expires_at=now + timedelta(seconds=self.lock_ttl))
+        except IntegrityError:
+            return None
+        return token
+
+    @staticmethod
+    def _release(key: str, token: str):
+        """
+        Release a lock row, unless it expired and was taken by another caller.
+
+        :param key: The key of the call.
+        :param token: The token returned by _acquire.
+        """
+        FlightLock.objects.filter(key=key, token=token).delete()
+
+    async def ado(self, key: str, call: Callable[[], Awaitable[T]]) -> T:
+        """
+        Await a call, or the identical call already awaited on the same event loop, and return its result.
+
+        :param key: What identifies the call.
+        :param call: The function returning the awaitable call.
+        :return: The result of the call.
+        :raises: The error of the call, for every caller that waited for it.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            future = self._futures.get((loop, key))
+            leader = future is None
+            if leader:
+                future = self._futures[(loop, key)] = loop.create_future()
+        if not leader:
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # The caller running the call was cancelled, not this one: run it again.
+                if future.cancelled() and not asyncio.current_task().cancelling():
+                    return await self.ado(key, call)
+                raise
+        try:
+            result = await call()
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._futures[(loop, key)]
+
+
+default_flight = SingleFlight()
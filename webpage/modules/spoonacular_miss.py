@@ -0,0 +1,76 @@
+"""Remember the Spoonacular recipe ids that failed to load, so every worker stops requesting them for a while."""
+from datetime import timedelta
+from django.db.models import F
+from django.utils import timezone
+from decouple import config
+import logging
+from webpage.models import SpoonacularMiss
+from webpage.modules.builder import SpoonacularAPIError
+
+logger = logging.getLogger("Spoonacular miss")
+
+# A 404 is unlikely to change soon, other failures (quota, server errors, timeouts) may go away quickly.
+NOT_FOUND_TTL = config('SPOONACULAR_NOT_FOUND_TTL', cast=int, default=86400)
+ERROR_TTL = config('SPOONACULAR_ERROR_TTL', cast=int, default=300)
+
+
+def miss_ttl(status_code: int | None) -> int:
+    """
+    Return how long a failure is remembered.
+
+    :param status_code: The HTTP status code of the failure, None if there was no response.
+    :return: The number of seconds.
+    """
+    return NOT_FOUND_TTL if status_code == 404 else ERROR_TTL
+
+
+def find_miss(spoonacular_id: int) -> SpoonacularMiss | None:
+    """
+    Return the unexpired failure of a recipe id and count the lookup it saved.
+
+    :param spoonacular_id: The Spoonacular ID of the recipe.
+    :return: The failure, or None if the id has not failed recently.
+    """
+    misses = SpoonacularMiss.objects.filter(spoonacular_id=spoonacular_id, expires_at__gt=timezone.now())
+    if not misses.update(hits=F('hits') + 1):
+        return None
+    return misses.first()
+
+
+def record_miss(spoonacular_id: int, error: SpoonacularAPIError) -> SpoonacularMiss:
+    """
+    Remember that a recipe id failed to load.
+
+    :param spoonacular_id: The Spoonacular ID of the recipe.
+    :param error: The error raised when loading the recipe.
+    :return: The saved failure.
+    """
+    now = timezone.now()
+    miss, _ = SpoonacularMiss.objects.update_or_create(
+        spoonacular_id=spoonacular_id,
+        defaults={
+            'status_code': error.status_code,
+            'reason': error.reason[:200],
+            'hits': 0,
+            'failed_at': now,
+            'expires_at': now + timedelta(seconds=miss_ttl(error.status_code)),
+        },
+    )
+    logger.info(f"Spoonacular recipe {spoonacular_id} failed ({error.reason}), skipped until {miss.expires_at}")
+    return miss
+
+
+def clear_misses(spoonacular_ids: list[int] | None = None, expired_only: bool = False) -> int:
+    """
+    Forget failures so their ids are requested again.
+
+    :param spoonacular_ids: The ids to forget, every id if None.
+    :param expired_only: Whether to only delete the failures that already expired.
+    :return: The number of failures deleted.
+    """
+    misses = SpoonacularMiss.objects.all()
+    if spoonacular_ids is not None:
+        misses = misses.filter(spoonacular_id__in=spoonacular_ids)
+    if expired_only:
+        misses = misses.filter(expires_at__lte=timezone.now())
+    return misses.delete()[0]
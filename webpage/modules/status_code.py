@@ -22,6 +22,93 @@ class StatusCode(Enum):
         return statuses
 
 
+class JobStatus(Enum):
+    """The state of a background job in the job queue."""
+
+    QUEUED = ("queued", "Queued")
+    RUNNING = ("running", "Running")
+    DONE = ("done", "Done")
+    DEAD = ("dead", "Dead")
+
+    @classmethod
+    def get_choice(cls) -> list[tuple[str, str]]:
+        """
+        Get the choice set for the job model.
+
+        :return: The list of tuples to be input into choices.
+        """
+        return [(status.value[0], status.value[1]) for status in cls]
+
+
+class BatchStatus(Enum):
+    """The state of a batch of AI requests submitted by the ai_enrich command."""
+
+    SUBMITTED = ("submitted", "Submitted")
+    APPLIED = ("applied", "Applied")
+    FAILED = ("failed", "Failed")
+
+    @classmethod
+    def get_choice(cls) -> list[tuple[str, str]]:
+        """
+        Get the choice set for the enrichment batch model.
+
+        :return: The list of tuples to be input into choices.
+        """
+        return [(status.value[0], status.value[1]) for status in cls]
+
+
+class CallOutcome(Enum):
+    """How a call of the AI advisor to the GPT model ended."""
+
+    OK = ("ok", "OK")
+    CACHED = ("cached", "Cached")
+    FAILED = ("failed", "Failed")
+    UNAVAILABLE = ("unavailable", "Unavailable")
+
+    @classmethod
+    def get_choice(cls) -> list[tuple[str, str]]:
+        """
+        Get the choice set for the GPT call statistics model.
+
+        :return: The list of tuples to be input into choices.
+        """
+        return [(outcome.value[0], outcome.value[1]) for outcome in cls]
+
+
+class ScreeningVerdict(Enum):
+    """What the pre-screening rules decided about a submitted recipe before GPT is asked to approve it."""
+
+    PASS = ("pass", "Pass")
+    FLAG = ("flag", "Flag")
+    REJECT = ("reject", "Reject")
+
+    @classmethod
+    def get_choice(cls) -> list[tuple[str, str]]:
+        """
+        Get the choice set for the screening decision model.
+
+        :return: The list of tuples to be input into choices.
+        """
+        return [(verdict.value[0], verdict.value[1]) for verdict in cls]
+
+
+class RoutingAction(Enum):
+    """What the model router decided about a model of a task, after its rolling latency and error rate."""
+
+    DEMOTE = ("demote", "Demote")
+    PROBE = ("probe", "Probe")
+    RESTORE = ("restore", "Restore")
+
+    @classmethod
+    def get_choice(cls) -> list[tuple[str, str]]:
+        """
+        Get the choice set for the routing decision model.
+
+        :return: The list of tuples to be input into choices.
+        """
+        return [(action.value[0], action.value[1]) for action in cls]
+
+
 # Example usage
 if __name__ == "__main__":
     status_code = StatusCode
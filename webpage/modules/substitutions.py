@@ -0,0 +1,132 @@
+"""Knowledge base of the alternative ingredients suggested by GPT, shared by the recipes with similar diets and cuisines."""
+from typing import Iterable
+from django.db.models import F
+from django.utils import timezone
+from decouple import config
+from webpage.models import Recipe, Ingredient, IngredientList, Substitution, normalize_name
+
+# How similar the diets and cuisines of a stored answer must be to those of the recipe, from 0 to 1, to reuse it.
+MIN_SIMILARITY = config('SUBSTITUTION_MIN_SIMILARITY', cast=float, default=0.6)
+# The diets weigh more than the cuisines, since a substitute breaking a diet is unusable.
+DIET_WEIGHT = 2
+
+
+def context_key(names: Iterable[str]) -> str:
+    """
+    Return the stored form of a set of diet or cuisine names.
+
+    :param names: The names.
+    :return: The normalized names, sorted and joined by commas.
+    """
+    return ",".join(sorted({normalize_name(name) for name in names if name}))
+
+
+def recipe_context(recipe: Recipe) -> tuple[str, str]:
+    """
+    Return the diets and cuisines of a recipe in their stored form.
+
+    :param recipe: The recipe.
+    :return: The diets and the cuisines.
+    """
+    return (context_key(diet.name for diet in recipe.diets.all()),
+            context_key(cuisine.name for cuisine in recipe.cuisine.all()))
+
+
+def _jaccard(first: set[str], second: set[str]) -> float:
+    """
+    Return the share of the names two sets have in common.
+
+    :param first: The first set.
+    :param second: The second set.
+    :return: 1 for equal sets, including two empty ones, 0 for sets without common names.
+    """
+    if not first and not second:
+        return 1.0
+    return len(first & second) / len(first | second)
+
+
+def similarity(diets: str, cuisines: str, substitution: Substitution) -> float:
+    """
+    Score how well a stored answer fits the context of a recipe.
+
+    :param diets: The diets of the recipe in their stored form.
+    :param cuisines: The cuisines of the recipe in their stored form.
+    :param substitution: The stored answer.
+    :return: From 0 to 1, 0 if the answer was given for a recipe missing one of the diets.
+    """
+    wanted = set(filter(None, diets.split(",")))
+    known = set(filter(None, substitution.diets.split(",")))
+    if not wanted <= known:
+        return 0.0
+    cuisine_score = _jaccard(set(filter(None, cuisines.split(","))), set(filter(None, substitution.cuisines.split(","))))
+    return (DIET_WEIGHT * _jaccard(wanted, known) + cuisine_score) / (DIET_WEIGHT + 1)
+
+
+def find_substitution(recipe: Recipe, ingredient: Ingredient) -> Substitution | None:
+    """
+    Find the stored answer that fits the recipe best.
+
+    :param recipe: The recipe missing the ingredient.
+    :param ingredient: The missing ingredient.
+    :return: The most similar answer, the most reused among equally similar ones, None if none is similar enough.
+    """
+    diets, cuisines = recipe_context(recipe)
+    scored = [(similarity(diets, cuisines, substitution), substitution.hits, substitution)
+              for substitution in Substitution.objects.filter(ingredient=ingredient)]
+    scored = [entry for entry in scored if entry[0] >= MIN_SIMILARITY]
+    if not scored:
+        return None
+    return max(scored, key=lambda entry: entry[:2])[2]
+
+
+def _quantity(recipe: Recipe, ingredient: Ingredient) -> tuple[float | None, str]:
+    """
+    Return the quantity of an ingredient in a recipe.
+
+    :param recipe: The recipe.
+    :param ingredient: The ingredient.
+    :return: The amount and the normalized unit, None and '' if the recipe does not use the ingredient.
+    """
+    line = IngredientList.objects.filter(recipe=recipe, ingredient=ingredient).values_list('amount', 'unit_key').first()
+    return (float(line[0]), line[1]) if line else (None, '')
+
+
+def lookup(recipe: Recipe, ingredient: Ingredient) -> list[dict] | None:
+    """
+    Return the stored alternatives to an ingredient for a recipe, scaled to its amount of the ingredient.
+
+    :param recipe: The recipe missing the ingredient.
+    :param ingredient: The missing ingredient.
+    :return: The alternatives with `name`, `description`, `amount` and `unit`, None if GPT has to be asked.
+    """
+    substitution = find_substitution(recipe, ingredient)
+    if substitution is None:
+        return None
+    Substitution.objects.filter(pk=substitution.pk).update(hits=F('hits') + 1, last_used_at=timezone.now())
+    amount, unit_key = _quantity(recipe, ingredient)
+    if not amount or not substitution.amount or unit_key != substitution.unit_key:
+        return substitution.alternatives
+    ratio = amount / substitution.amount
+    return [dict(alternative, amount=round(alternative['amount'] * ratio, 2))
+            if isinstance(alternative.get('amount'), (int, float)) else alternative
+            for alternative in substitution.alternatives]
+
+
+def remember(recipe: Recipe, ingredient: Ingredient, alternatives: list[dict]) -> Substitution | None:
+    """
+    Store the alternatives GPT suggested for an ingredient of a recipe, for the recipes with the same context.
+
+    :param recipe: The recipe missing the ingredient.
+    :param ingredient: The missing ingredient.
+    :param alternatives: The alternatives, asked without a special instruction.
+    :return: The stored answer, None if there was nothing to store.
+    """
+    if not alternatives:
+        return None
+    diets, cuisines = recipe_context(recipe)
+    amount, unit_key = _quantity(recipe, ingredient)
+    substitution, _ = Substitution.objects.update_or_create(
+        ingredient=ingredient, diets=diets, cuisines=cuisines,
+        defaults={'alternatives': alternatives, 'amount': amount, 'unit_key': unit_key},
+    )
+    return substitution
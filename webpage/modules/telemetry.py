@@ -0,0 +1,376 @@
+"""Latency, token, retry and cost statistics of the calls of the AI advisor to the GPT model."""
+import asyncio
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Any, Iterator
+from django.db import transaction
+from django.utils import timezone
+from decouple import config
+from webpage.models import GPTCallStat
+from webpage.modules.resilience import GPTUnavailable
+from webpage.modules.status_code import CallOutcome
+
+logger = logging.getLogger("GPT telemetry")
+
+# Upper bounds in seconds of the latency buckets. The last bucket holds the slower calls.
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60)
+# US dollars per million prompt and completion tokens.
+PRICES = {
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4o': (2.50, 10.00),
+}
+# The statistics are written to the database once this many calls were recorded, or this many seconds passed.
+FLUSH_SIZE = config('GPT_TELEMETRY_FLUSH_SIZE', cast=int, default=50)
+FLUSH_INTERVAL = config('GPT_TELEMETRY_FLUSH_INTERVAL', cast=float, default=60)
+SUMMED_FIELDS = ('calls', 'retries', 'total_seconds', 'prompt_tokens', 'completion_tokens', 'cost', 'invalid_responses',
+                 'repaired_responses', 'saved_prompt_tokens', 'fallbacks')
+
+
+@dataclass
+class CallRecord:
+    """What one advisor call sent to the model, filled in by the GPT handler while the call runs."""
+
+    method: str
+    model: str
+    requests: int = 0
+    cache_hits: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    invalid_responses: int = 0
+    repaired_responses: int = 0
+    saved_prompt_tokens: int = 0
+    fallbacks: int = 0
+
+    @property
+    def retries(self) -> int:
+        """Return the requests sent after the first one."""
+        return max(self.requests - 1, 0)
+
+    @property
+    def cost(self) -> float:
+        """Return the price of the tokens in US dollars, 0 for a model without a known price."""
+        prompt_price, completion_price = PRICES.get(self.model, (0, 0))
+        return (self.prompt_tokens * prompt_price + self.completion_tokens * completion_price) / 1_000_000
+
+
+@dataclass
+class CallStats:
+    """The added up calls of one method to one model with one outcome on one day."""
+
+    calls: int = 0
+    retries: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+    invalid_responses: int = 0
+    repaired_responses: int = 0
+    saved_prompt_tokens: int = 0
+    fallbacks: int = 0
+    latency_buckets: list[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+
+    def add(self, record: CallRecord, seconds: float):
+        """
+        Count one call.
+
+        :param record: The call.
+        :param seconds: The wall time of the call, including its retries.
+        """
+        self.calls += 1
+        self.retries += record.retries
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.prompt_tokens += record.prompt_tokens
+        self.completion_tokens += record.completion_tokens
+        self.cost += record.cost
+        self.invalid_responses += record.invalid_responses
+        self.repaired_responses += record.repaired_responses
+        self.saved_prompt_tokens += record.saved_prompt_tokens
+        self.fallbacks += min(record.fallbacks, 1)
+        self.latency_buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def merge_into(self, target: Any):
+        """
+        Add these statistics to others, such as a stored GPTCallStat.
+
+        :param target: The statistics to add to.
+        """
+        for name in SUMMED_FIELDS:
+            setattr(target, name, getattr(target, name) + getattr(self, name))
+        target.max_seconds = max(target.max_seconds, self.max_seconds)
+        buckets = list(target.latency_buckets) or [0] * len(self.latency_buckets)
+        target.latency_buckets = [old + new for old, new in zip(buckets, self.latency_buckets)]
+
+
+StatsKey = tuple[date, str, str, str]
+
+
+class TelemetryCollector:
+    """
+    Add up the advisor calls in memory and write them to the GPTCallStat table in batches.
+
+    Recording a call never touches the database. The statistics are written by flush, which the web requests and
+    the workers call once enough calls were recorded or enough time passed, and the workers call when they stop.
+
+    :param flush_size: The recorded calls that make a flush due.
+    :param flush_interval: The seconds after the last flush that make a flush due.
+    """
+
+    def __init__(self, flush_size: int = FLUSH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        """
+        Initialize an empty collector.
+
+        :param flush_size: The recorded calls that make a flush due.
+        :param flush_interval: The seconds after the last flush that make a flush due.
+        """
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._stats: dict[StatsKey, CallStats] = {}
+        self._pending = 0
+        self._flushed_at = time.monotonic()
+
+    def add(self, record: CallRecord, outcome: str, seconds: float):
+        """
+        Record one advisor call.
+
+        :param record: The call.
+        :param outcome: The value of the CallOutcome of the call.
+        :param seconds: The wall time of the call.
+        """
+        key = (timezone.localdate(), record.method, record.model, outcome)
+        with self._lock:
+            self._stats.setdefault(key, CallStats()).add(record, seconds)
+            self._pending += 1
+
+    def snapshot(self) -> dict[StatsKey, CallStats]:
+        """
+        Return the statistics that have not been written yet.
+
+        :return: The statistics per day, method, model and outcome.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    @property
+    def due(self) -> bool:
+        """Return whether enough calls were recorded or enough time passed to write them."""
+        return self._pending >= self.flush_size or \
+            (self._pending > 0 and time.monotonic() - self._flushed_at >= self.flush_interval)
+
+    def flush(self) -> int:
+        """
+        Write the recorded calls to the database, adding them to the rows of the same day, method, model and outcome.
+
+        If the write fails, the statistics are kept for the next flush.
+
+        :return: The number of rows written.
+        """
+        with self._lock:
+            stats, self._stats = self._stats, {}
+            self._pending = 0
+            self._flushed_at = time.monotonic()
+        if not stats:
+            return 0
+        try:
+            return save_stats(stats)
+        except Exception as e:
+            logger.error(f"Cannot write the GPT call statistics, keeping them for the next flush: {e}")
+            with self._lock:
+                for key, stat in stats.items():
+                    if key in self._stats:
+                        self._stats[key].merge_into(stat)
+                    self._stats[key] = stat
+                self._pending = sum(stat.calls for stat in self._stats.values())
+            return 0
+
+    def flush_if_due(self) -> int:
+        """
+        Write the recorded calls if a flush is due, never from a running event loop.
+
+        :return: The number of rows written.
+        """
+        if not self.due or _in_event_loop():
+            return 0
+        return self.flush()
+
+    def clear(self):
+        """Forget the recorded calls without writing them."""
+        with self._lock:
+            self._stats.clear()
+            self._pending = 0
+
+
+def save_stats(stats: dict[StatsKey, CallStats]) -> int:
+    """
+    Add statistics to the GPTCallStat table.
+
+    :param stats: The statistics per day, method, model and outcome.
+    :return: The number of rows written.
+    """
+    with transaction.atomic():
+        rows = GPTCallStat.objects.select_for_update().filter(
+            day__in={key[0] for key in stats}, method__in={key[1] for key in stats})
+        existing = {(row.day, row.method, row.model, row.outcome): row for row in rows}
+        changed, new = [], []
+        for key, stat in stats.items():
+            row = existing.get(key)
+            if row is None:
+                day, method, model, outcome = key
+                row = GPTCallStat(day=day, method=method, model=model, outcome=outcome)
+                new.append(row)
+            else:
+                changed.append(row)
+            stat.merge_into(row)
+        GPTCallStat.objects.bulk_update(changed, [*SUMMED_FIELDS, 'max_seconds', 'latency_buckets'])
+        GPTCallStat.objects.bulk_create(new)
+    return len(changed) + len(new)
+
+
+def percentile(buckets: list[int], fraction: float) -> float | None:
+    """
+    Estimate a latency percentile from the bucket counts.
+
+    :param buckets: The calls per latency bucket.
+    :param fraction: The percentile as a fraction, e.g. 0.95.
+    :return: The upper bound of the bucket holding the percentile, infinity for the last bucket, None without calls.
+    """
+    total = sum(buckets)
+    if not total:
+        return None
+    seen = 0
+    for bound, count in zip((*LATENCY_BUCKETS, float('inf')), buckets):
+        seen += count
+        if seen >= fraction * total:
+            return bound
+    return float('inf')
+
+
+def _in_event_loop() -> bool:
+    """
+    Return whether the caller runs on an event loop, where the database must not be used.
+
+    :return: True inside a coroutine.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+collector = TelemetryCollector()
+_current: ContextVar[CallRecord | None] = ContextVar('gpt_call', default=None)
+_local = threading.local()
+
+
+@contextmanager
+def track(method: str, model: str) -> Iterator[CallRecord]:
+    """
+    Measure an advisor call and record it in the collector when it ends.
+
+    :param method: The name of the AIRecipeAdvisor method making the call.
+    :param model: The GPT model asked.
+    :return: The record the GPT handler fills in.
+    """
+    record = CallRecord(method, model)
+    previous = _current.get()
+    # Set instead of reset with a token, so a streaming generator may be resumed from another context.
+    _current.set(record)
+    start = time.perf_counter()
+    outcome = CallOutcome.FAILED.value[0]
+    try:
+        yield record
+        outcome = CallOutcome.CACHED.value[0] if record.cache_hits and not record.requests else CallOutcome.OK.value[0]
+    except GPTUnavailable:
+        outcome = CallOutcome.UNAVAILABLE.value[0]
+        raise
+    except GeneratorExit:
+        # The caller stopped reading a stream, after the answers it wanted.
+        outcome = CallOutcome.OK.value[0]
+        raise
+    finally:
+        _current.set(previous)
+        collector.add(record, outcome, time.perf_counter() - start)
+        _local.recorded = True
+
+
+def count_request(usage: Any = None):
+    """
+    Count a request of the running advisor call, with the tokens it used if it succeeded.
+
+    :param usage: The usage of the response, None if the request failed or did not report it.
+    """
+    record = _current.get()
+    if record is None:
+        return
+    record.requests += 1
+    if usage is not None:
+        record.prompt_tokens += usage.prompt_tokens or 0
+        record.completion_tokens += usage.completion_tokens or 0
+
+
+def count_cache_hit():
+    """Count a cached response used by the running advisor call."""
+    record = _current.get()
+    if record is not None:
+        record.cache_hits += 1
+
+
+def count_invalid_response():
+    """Count a response of the running advisor call that could not be used, so it was asked again."""
+    record = _current.get()
+    if record is not None:
+        record.invalid_responses += 1
+
+
+def count_repaired_response():
+    """Count a response of the running advisor call whose JSON had to be repaired."""
+    record = _current.get()
+    if record is not None:
+        record.repaired_responses += 1
+
+
+def count_saved_tokens(tokens: int):
+    """
+    Count the estimated prompt tokens the compaction saved on the running advisor call.
+
+    :param tokens: The estimated tokens saved.
+    """
+    record = _current.get()
+    if record is not None:
+        record.saved_prompt_tokens += tokens
+
+
+def count_route(model: str, fallback: bool):
+    """
+    Record the model the router sent a request of the running advisor call to.
+
+    The call is recorded under the model of its last request.
+
+    :param model: The model asked.
+    :param fallback: Whether the model is a fallback of the task.
+    """
+    record = _current.get()
+    if record is not None:
+        record.model = model
+        record.fallbacks += fallback
+
+
+def start_request():
+    """Start watching for GPT calls made by a web request."""
+    _local.recorded = False
+
+
+def flush_after_request():
+    """Write the statistics after a web request that called the model, if a flush is due."""
+    if getattr(_local, 'recorded', False):
+        _local.recorded = False
+        collector.flush_if_due()
@@ -0,0 +1,125 @@
+"""Registry of mass, volume and count units, converting ingredient amounts to grams, milliliters and pieces."""
+import re
+from typing import Sequence
+import numpy as np
+
+MASS = 'mass'
+VOLUME = 'volume'
+COUNT = 'count'
+
+# Grams in one unit of mass.
+MASS_UNITS = {
+    'mg': 0.001, 'milligram': 0.001,
+    'g': 1.0, 'gram': 1.0, 'gr': 1.0,
+    'kg': 1000.0, 'kilogram': 1000.0,
+    'oz': 28.3495, 'ounce': 28.3495,
+    'lb': 453.592, 'pound': 453.592,
+}
+# Milliliters in one unit of volume.
+VOLUME_UNITS = {
+    'ml': 1.0, 'milliliter': 1.0, 'millilitre': 1.0,
+    'cl': 10.0, 'dl': 100.0,
+    'l': 1000.0, 'liter': 1000.0, 'litre': 1000.0,
+    'pinch': 0.31, 'dash': 0.62,
+    'tsp': 4.92892, 'teaspoon': 4.92892,
+    'tbsp': 14.7868, 'tablespoon': 14.7868,
+    'fl oz': 29.5735, 'fluid ounce': 29.5735,
+    'cup': 236.588,
+    'pint': 473.176, 'quart': 946.353, 'gallon': 3785.41,
+}
+# Pieces in one unit of count.
+COUNT_UNITS = {
+    'piece': 1.0, 'pc': 1.0, 'pcs': 1.0, 'whole': 1.0, 'slice': 1.0, 'clove': 1.0,
+    'small': 1.0, 'medium': 1.0, 'large': 1.0, 'can': 1.0, 'stalk': 1.0, 'sprig': 1.0, 'leaf': 1.0, 'head': 1.0,
+    'dozen': 12.0,
+}
+UNITS: dict[str, tuple[str, float]] = {
+    **{key: (MASS, factor) for key, factor in MASS_UNITS.items()},
+    **{key: (VOLUME, factor) for key, factor in VOLUME_UNITS.items()},
+    **{key: (COUNT, factor) for key, factor in COUNT_UNITS.items()},
+}
+IRREGULAR_PLURALS = {'leaves': 'leaf', 'pinches': 'pinch', 'dashes': 'dash'}
+# Grams in one milliliter when the density of the ingredient is not known.
+WATER_DENSITY = 1.0
+
+_DIMENSION_CODES = {MASS: 0, VOLUME: 1, COUNT: 2}
+
+
+def normalize_unit(unit: str | None) -> str:
+    """
+    Return the key of a unit in the registry, e.g. 'Tbsps' -> 'tbsp'.
+
+    :param unit: The unit as typed by the user or returned by Spoonacular.
+    :return: The unit in lower case and singular, or the cleaned text if the unit is not known.
+    """
+    key = re.sub(r'\s+', ' ', (unit or '').replace('.', '')).strip().casefold()
+    if key in UNITS:
+        return key
+    if key in IRREGULAR_PLURALS:
+        return IRREGULAR_PLURALS[key]
+    for suffix in ('es', 's'):
+        if key.endswith(suffix) and key[:-len(suffix)] in UNITS:
+            return key[:-len(suffix)]
+    return key
+
+
+def convert(amounts: Sequence[float], units: Sequence[str | None], densities: Sequence[float | None] | None = None,
+            piece_weights: Sequence[float | None] | None = None) -> dict[str, np.ndarray]:
+    """
+    Convert many amounts at once to grams, milliliters and pieces.
+
+    Each distinct unit is looked up once, and the rest is array math over all the amounts.
+
+    :param amounts: The amounts.
+    :param units: The unit of each amount.
+    :param densities: The grams per milliliter of each ingredient, None where it is not known.
+    :param piece_weights: The grams per piece of each ingredient, None where it is not known.
+    :return: Arrays `unit_key` (the normalized units), `grams`, `milliliters` and `pieces`, with NaN where a
+             quantity cannot be known, e.g. the grams of '2 slice' without a piece weight.
+    """
+    size = len(amounts)
+    amounts = np.asarray(amounts, dtype=float).reshape(size)
+    densities = _optional(densities, size)
+    densities = np.where(np.isnan(densities), WATER_DENSITY, densities)
+    piece_weights = _optional(piece_weights, size)
+
+    distinct, inverse = np.unique(np.array([unit or '' for unit in units], dtype=object).astype(str),
+                                  return_inverse=True)
+    keys = np.array([normalize_unit(unit) for unit in distinct], dtype=object)
+    codes = np.array([_DIMENSION_CODES[UNITS[key][0]] if key in UNITS else -1 for key in keys], dtype=int)
+    factors = np.array([UNITS[key][1] if key in UNITS else np.nan for key in keys], dtype=float)
+    code, base = codes[inverse], amounts * factors[inverse]
+
+    mass, volume, count = code == 0, code == 1, code == 2
+    grams = np.select([mass, volume, count], [base, base * densities, base * piece_weights], np.nan)
+    milliliters = np.select([mass, volume, count], [base / densities, base, base * piece_weights / densities], np.nan)
+    pieces = np.where(count, base, np.nan)
+    return {'unit_key': keys[inverse].reshape(size), 'grams': grams, 'milliliters': milliliters, 'pieces': pieces}
+
+
+def _optional(values: Sequence[float | None] | None, size: int) -> np.ndarray:
+    """
+    Turn a sequence of optional numbers into a float array with NaN for None.
+
+    :param values: The numbers, or None for an array of NaN.
+    :param size: The length of the array.
+    :return: The array.
+    """
+    if values is None:
+        return np.full(size, np.nan)
+    return np.array([np.nan if value is None else value for value in values], dtype=float).reshape(size)
+
+
+def to_grams(amount: float, unit: str | None, density: float | None = None,
+             piece_weight: float | None = None) -> float | None:
+    """
+    Convert one amount of an ingredient to grams.
+
+    :param amount: The amount in the unit.
+    :param unit: The unit, e.g. 'g', 'cups' or 'Tbsp'.
+    :param density: The grams per milliliter of the ingredient, the density of water if it is not known.
+    :param piece_weight: The grams per piece of the ingredient.
+    :return: The weight in grams, None if it cannot be known, e.g. for '2 slice' without a piece weight.
+    """
+    grams = convert([amount], [unit], [density], [piece_weight])['grams'][0]
+    return None if np.isnan(grams) else float(grams)
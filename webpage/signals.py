@@ -1,7 +1,14 @@
 """Import the essential package for signal."""
-from django.db.models.signals import post_save
+from django.contrib.auth.models import User
+from django.core.signals import request_finished, request_started
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
 from django.dispatch import receiver
-from .models import Recipe, Profile
+from .models import Recipe, Profile, RecipeStep, IngredientList, EquipmentList, NutritionList, Ingredient, \
+    Equipment, Nutrition, Diet, Cuisine, catalog_entries_updated
+from .modules.quantities import normalize_queryset
+from .modules.recipe_snapshot import mark_stale, enqueue_stale_rebuild
+from .modules import telemetry
 from decouple import config
 
 
@@ -23,3 +30,175 @@ def check_approved_recipes(sender, instance, created, **kwargs):
             profile, created = Profile.objects.get_or_create(user=user)
             profile.chef_badge = True
             profile.save()
+
+
+@receiver(post_save, sender=Recipe)
+def invalidate_recipe_snapshot(sender, instance, **kwargs):
+    """
+    Flag the snapshot of a recipe as stale when the recipe is saved.
+
+    :param sender: The model class (`Recipe`) that triggered the signal.
+    :param instance: The saved recipe.
+    :param kwargs: Additional keyword arguments passed by the signal handler.
+    """
+    mark_stale(recipe_id=instance.id)
+
+
+@receiver([post_save, post_delete], sender=RecipeStep)
+@receiver([post_save, post_delete], sender=IngredientList)
+@receiver([post_save, post_delete], sender=EquipmentList)
+@receiver([post_save, post_delete], sender=NutritionList)
+def invalidate_recipe_child_snapshot(sender, instance, **kwargs):
+    """
+    Flag the snapshot of a recipe as stale when one of its steps or list entries changes.
+
+    :param sender: The model class that triggered the signal.
+    :param instance: The saved or deleted row, which belongs to a recipe.
+    :param kwargs: Additional keyword arguments passed by the signal handler.
+    """
+    mark_stale(recipe_id=instance.recipe_id)
+
+
+@receiver(m2m_changed, sender=Recipe.diets.through)
+@receiver(m2m_changed, sender=Recipe.cuisine.through)
+def invalidate_recipe_tags_snapshot(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Flag recipe snapshots as stale when diets or cuisines are added to or removed from recipes.
+
+    :param sender: The intermediate model of the many-to-many relation.
+    :param instance: The recipe, or the diet or cuisine when the relation is changed from the other side.
+    :param action: The kind of change, only the post_* actions are handled.
+    :param reverse: True when the relation is changed from the diet or cuisine side.
+    :param pk_set: The primary keys added or removed.
+    :param kwargs: Additional keyword arguments passed by the signal handler.
+    """
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        mark_stale(recipe_id=instance.id)
+    elif pk_set:
+        mark_stale(recipe_id__in=pk_set)
+    else:
+        mark_stale()
+
+
+# The lookup from a snapshot to the catalog rows its recipe references, per catalog model.
+CATALOG_LOOKUPS = {
+    Ingredient: 'recipe__ingredientlist__ingredient',
+    Equipment: 'recipe__equipmentlist__equipment',
+    Nutrition: 'recipe__nutritionlist__nutrition',
+    Diet: 'recipe__diets',
+    Cuisine: 'recipe__cuisine',
+}
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_save, sender=Equipment)
+@receiver(post_save, sender=Nutrition)
+@receiver(post_save, sender=Diet)
+@receiver(post_save, sender=Cuisine)
+def invalidate_catalog_snapshots(sender, instance, created, **kwargs):
+    """
+    Flag the snapshots of every recipe referencing a catalog row that changed, and queue their rebuild.
+
+    :param sender: The catalog model class that triggered the signal.
+    :param instance: The saved catalog row.
+    :param created: True for a new row, which no recipe references yet.
+    :param kwargs: Additional keyword arguments passed by the signal handler.
+    """
+    if created:
+        return
+    if mark_stale(**{CATALOG_LOOKUPS[sender]: instance}):
+        transaction.on_commit(enqueue_stale_rebuild)
+
+
+@receiver(catalog_entries_updated)
+def invalidate_upserted_catalog_snapshots(sender, entries, **kwargs):
+    """
+    Flag the snapshots of every recipe referencing catalog rows changed by a bulk upsert, and queue their rebuild.
+
+    :param sender: The catalog model class whose rows were upserted.
+    :param entries: The existing rows whose fields changed.
+    :param kwargs: Additional keyword arguments passed by the signal handler.
+    """
+    if mark_stale(**{f'{CATALOG_LOOKUPS[sender]}__in': entries}):
+        transaction.on_commit(enqueue_stale_rebuild)
+
+
+@receiver(post_save, sender=Ingredient)
+def normalize_ingredient_quantities(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Convert the amounts of an ingredient again when its density or piece weight may have changed.
+
+    :param sender: The model class (`Ingredient`) that triggered the signal.
+    :param instance: The saved ingredient.
+    :param created: True for a new ingredient, which no recipe uses yet.
+    :param update_fields: The fields that were saved, None for all of them.
+    :param kwargs: Additional keyword arguments passed by the signal handler.
+    """
+    if created or (update_fields is not None and not {'density', 'piece_weight'} & set(update_fields)):
+        return
+    normalize_queryset(IngredientList.objects.filter(ingredient=instance))
+
+
+@receiver(pre_save, sender=User)
+def remember_username(sender, instance, update_fields=None, **kwargs):
+    """
+    Keep the stored name of a user about to be saved, so its snapshots are only flagged when the name changes.
+
+    :param sender: The model class (`User`) that triggered the signal.
+    :param instance: The user about to be saved.
+    :param update_fields: The fields that are saved, None for all of them.
+    :param kwargs: Additional keyword arguments passed by the signal handler.
+    """
+    if instance.pk is not None and (update_fields is None or 'username' in update_fields):
+        instance._previous_username = User.objects.filter(pk=instance.pk).values_list('username', flat=True).first()
+
+
+@receiver(post_save, sender=User)
+def invalidate_username_snapshots(sender, instance, created, **kwargs):
+    """
+    Flag the snapshots of a user's recipes when their name changes, but not on other saves such as a login.
+
+    :param sender: The model class (`User`) that triggered the signal.
+    :param instance: The saved user.
+    :param created: True for a new user, who has no recipes yet.
+    :param kwargs: Additional keyword arguments passed by the signal handler.
+    """
+    previous = instance.__dict__.pop('_previous_username', instance.username)
+    if not created and previous != instance.username:
+        mark_stale(recipe__poster_id=instance.id)
+
+
+@receiver(post_save, sender=Profile)
+def invalidate_poster_snapshots(sender, instance, **kwargs):
+    """
+    Flag the snapshots of a user's recipes when their chef badge may have changed.
+
+    :param sender: The model class (`Profile`) that triggered the signal.
+    :param instance: The saved profile.
+    :param kwargs: Additional keyword arguments passed by the signal handler.
+    """
+    mark_stale(recipe__poster_id=instance.user_id)
+
+
+@receiver(request_started)
+def start_gpt_telemetry(sender, **kwargs):
+    """
+    Forget the GPT calls recorded outside of the request, so only the calls made by the request can trigger a flush.
+
+    :param sender: The handler class serving the request.
+    :param kwargs: Additional keyword arguments passed by the signal handler (not used in this case).
+    """
+    telemetry.start_request()
+
+
+@receiver(request_finished)
+def flush_gpt_telemetry(sender, **kwargs):
+    """
+    Write the statistics of the GPT calls after a request that called the model, once enough of them were recorded.
+
+    :param sender: The handler class that served the request.
+    :param kwargs: Additional keyword arguments passed by the signal handler (not used in this case).
+    """
+    telemetry.flush_after_request()
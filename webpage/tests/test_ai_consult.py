@@ -99,3 +99,55 @@ class AIConsultTest(TestCase):
         response = ai_consult.get_alternative_ingredients([self.ingredient1])
         self.assertIsNotNone(response[0]['description'])
         print(response)
+
+    @patch('webpage.modules.gpt_handler.GPTHandler.generate')
+    def test_recipe_assessment(self, mock_generate):
+        """Test that the difficulty, nutrition and approval come back from one request."""
+        mock_generate.return_value = '{"difficulty": "Easy", "approved": true, "nutrients": ' + \
+            '[{"name": "Calories", "amount": 300, "unit": "kcal", "percentOfDailyNeeds": 15}]}'
+        assessment = AIRecipeAdvisor(self.recipe).recipe_assessment()
+        self.assertEqual(mock_generate.call_count, 1)
+        self.assertEqual(assessment["difficulty"], "Easy")
+        self.assertTrue(assessment["approved"])
+        self.assertEqual(assessment["nutrients"][0]["name"], "Calories")
+        self.assertIn("- Flour, amount: 2.00 cups", mock_generate.call_args[0][0])
+
+    @patch('webpage.modules.gpt_handler.GPTHandler.generate')
+    def test_recipe_assessment_of_some_fields(self, mock_generate):
+        """Test that only the fields and the ingredient lines asked for are in the question and checked."""
+        mock_generate.return_value = '{"approved": true, "nutrients": []}'
+        assessment = AIRecipeAdvisor(self.recipe).recipe_assessment(("nutrients", "approved"), ["Saffron, amount: 1.00 g"])
+        self.assertEqual(assessment, {"approved": True, "nutrients": []})
+        query = mock_generate.call_args.args[0]
+        self.assertIn("Estimate the nutrients of these ingredients only:\n- Saffron, amount: 1.00 g", query)
+        self.assertIn("Only answer the nutrients, approved.", query)
+
+    @patch('webpage.modules.gpt_handler.GPTHandler.invalidate')
+    @patch('webpage.modules.gpt_handler.GPTHandler.generate')
+    def test_recipe_assessment_retries_invalid_output(self, mock_generate, mock_invalidate):
+        """Test that an assessment with an unknown difficulty is asked again."""
+        mock_generate.side_effect = [
+            '{"difficulty": "Medium", "approved": true, "nutrients": []}',
+            '{"difficulty": "Hard", "approved": false, "nutrients": []}',
+        ]
+        assessment = AIRecipeAdvisor(self.recipe).recipe_assessment()
+        self.assertEqual(assessment["difficulty"], "Hard")
+        self.assertEqual(mock_invalidate.call_count, 1)
+
+    def test_advisor_is_lazy(self):
+        """Test that creating the advisor neither queries the recipe nor creates the GPT handlers."""
+        with self.assertNumQueries(0):
+            ai_consult = AIRecipeAdvisor(self.recipe)
+        self.assertNotIn('_gpt', vars(ai_consult))
+
+    @patch('webpage.modules.gpt_handler.GPTHandler.generate')
+    def test_recipe_context_is_loaded_once(self, mock_generate):
+        """Test that every call of an advisor shares one prefetched load of the recipe."""
+        mock_generate.side_effect = ["Easy", "True", '{"nutrients": []}']
+        ai_consult = AIRecipeAdvisor(self.recipe)
+        # The recipe, then its ingredients, equipment, steps and diets.
+        with self.assertNumQueries(5):
+            ai_consult.difficulty_calculator()
+            ai_consult.recipe_approval()
+            ai_consult.nutrition_calculator()
+        self.assertIn("Flour, amount: 2.00 cups", mock_generate.call_args_list[0][0][0])
@@ -0,0 +1,158 @@
+"""Tests for the batch AI enrichment command."""
+import json
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import Mock, patch
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import timezone
+from openai import OpenAI
+from webpage.models import EnrichmentBatch, Nutrition, NutritionList, Recipe
+from webpage.modules.batch_backend import COMPLETED, FAILED, PENDING, OpenAIBatchBackend
+from webpage.modules.batch_enrichment import apply_results, select_recipes
+from webpage.modules.fake_openai import FakeOpenAIServer
+from webpage.modules.status_code import BatchStatus, StatusCode
+
+NUTRIENTS = [{"name": "Calories", "amount": 120.5, "unit": "kcal", "percentOfDailyNeeds": 6}]
+
+
+def assess(body: dict) -> str:
+    """Answer an assessment request of the fake server, rating soups Hard and everything else Easy."""
+    text = body['messages'][1]['content'][0]['text']
+    if "Broken" in text:
+        return "not json"
+    difficulty = "Hard" if "Soup" in text else "Easy"
+    return json.dumps({"difficulty": difficulty, "nutrients": NUTRIENTS, "approved": True})
+
+
+class AIEnrichCommandTest(TestCase):
+    """Test the ai_enrich command with the local backend and a fake model server."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a pending user recipe and an approved Spoonacular recipe with its own nutrition."""
+        cls.user = User.objects.create_user(username="cook", password="password123")
+        cls.spoonacular = User.objects.create_user(username="Spoonacular", password="password123")
+        cls.toast = Recipe.objects.create(name="Toast", description="Crispy", poster_id=cls.user)
+        cls.soup = Recipe.objects.create(name="Soup", description="Hot", poster_id=cls.spoonacular,
+                                         spoonacular_id=42, status=StatusCode.APPROVE.value[0])
+        protein = Nutrition.objects.create(name="Protein")
+        NutritionList.objects.create(recipe=cls.soup, nutrition=protein, amount=3, unit="g")
+
+    def setUp(self):
+        """Serve assessments locally and write the batch files into a temporary directory."""
+        self.server = FakeOpenAIServer(assess).start()
+        self.addCleanup(self.server.stop)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for target in ['webpage.modules.batch_backend.BATCH_DIR', 'webpage.modules.batch_backend.BACKEND']:
+            value = directory.name if target.endswith('DIR') else 'local'
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch('webpage.modules.gpt_handler.client',
+                        OpenAI(base_url=self.server.url, api_key="fake", max_retries=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def enrich(self, **options) -> str:
+        """Run the command with the local backend and return its output."""
+        out = StringIO()
+        call_command('ai_enrich', backend='local', stdout=out, **options)
+        return out.getvalue()
+
+    def test_enrich_applies_missing_parts(self):
+        """Test that each recipe only gets the parts it was missing, from one batch."""
+        output = self.enrich()
+        self.assertIn("2 recipe(s) updated, 0 failed", output)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[0]['response_format']['type'], "json_schema")
+        # The Spoonacular soup only lacks a difficulty, so nothing else is asked about it.
+        self.assertEqual([list(body['response_format']['json_schema']['schema']['properties'])
+                          for body in self.server.requests], [["difficulty", "nutrients", "approved"], ["difficulty"]])
+
+        toast = Recipe.objects.get(pk=self.toast.pk)
+        self.assertEqual((toast.difficulty, toast.AI_status, toast.status), ("Easy", True, StatusCode.APPROVE.value[0]))
+        self.assertEqual([item.nutrition.name for item in toast.get_nutrition()], ["Calories"])
+        self.assertIsNotNone(toast.enriched_at)
+
+        soup = Recipe.objects.get(pk=self.soup.pk)
+        self.assertEqual((soup.difficulty, soup.AI_status), ("Hard", False))
+        self.assertEqual([item.nutrition.name for item in soup.get_nutrition()], ["Protein"])
+
+        batch = EnrichmentBatch.objects.get()
+        self.assertEqual(batch.status, BatchStatus.APPLIED.value[0])
+        self.assertEqual(batch.recipes, {str(self.toast.pk): ["difficulty", "nutrition", "approval"],
+                                         str(self.soup.pk): ["difficulty"]})
+        self.assertIn("No recipe needs an assessment", self.enrich())
+
+    def test_invalid_answer_is_selected_again(self):
+        """Test that a recipe without a usable answer is left unchanged and stays selected."""
+        broken = Recipe.objects.create(name="Broken", poster_id=self.user)
+        self.assertIn("2 recipe(s) updated, 1 failed", self.enrich())
+        self.assertEqual(Recipe.objects.get(pk=broken.pk).difficulty, "Unknown")
+        self.assertEqual(list(select_recipes()), [broken])
+
+    def test_stale_recipes(self):
+        """Test that --stale-days assesses old recipes again without reopening published ones."""
+        self.enrich()
+        Recipe.objects.update(enriched_at=timezone.now() - timedelta(days=10))
+        self.assertIn("Would assess 0 recipe(s)", self.enrich(dry_run=True))
+        self.assertIn("Would assess 2 recipe(s)", self.enrich(dry_run=True, stale_days=7))
+        self.enrich(stale_days=7)
+        self.assertEqual(EnrichmentBatch.objects.latest('created_at').recipes,
+                         {str(self.toast.pk): ["difficulty", "nutrition"], str(self.soup.pk): ["difficulty"]})
+
+    def test_dry_run_and_parts(self):
+        """Test that a dry run writes nothing and that --parts narrows the selection."""
+        self.assertIn("Would assess 2 recipe(s)", self.enrich(dry_run=True))
+        self.assertIn("Would assess 1 recipe(s)", self.enrich(dry_run=True, parts="approval"))
+        self.assertFalse(EnrichmentBatch.objects.exists())
+        with self.assertRaises(CommandError):
+            self.enrich(parts="taste")
+
+    def test_submitted_recipes_are_not_selected(self):
+        """Test that a recipe waiting in a submitted batch is not submitted again."""
+        EnrichmentBatch.objects.create(backend='openai', batch_id='batch_1', recipes={str(self.toast.pk): ["approval"]})
+        self.assertEqual(list(select_recipes()), [self.soup])
+
+    def test_rejected_recipes_are_not_selected(self):
+        """Test that a rejected recipe is not assessed again."""
+        Recipe.objects.create(name="Spam", poster_id=self.user, status=StatusCode.REJECTED.value[0])
+        self.assertEqual(list(select_recipes()), [self.toast, self.soup])
+
+    def test_malformed_custom_id_is_skipped(self):
+        """Test that a result line with an unreadable custom_id does not stop the other results."""
+        batch = EnrichmentBatch.objects.create(backend='local', batch_id='batch_1',
+                                               recipes={str(self.toast.pk): ["difficulty"]})
+        answer = {'status_code': 200, 'body': {'choices': [{'message': {'content': assess(
+            {'messages': [{}, {'content': [{'text': "Toast"}]}]})}}]}}
+        with self.assertLogs("Batch enrichment", level="ERROR"):
+            applied = apply_results(batch, [{'custom_id': "recipe-x", 'response': answer},
+                                            {'custom_id': f"recipe-{self.toast.pk}", 'response': answer}])
+        self.assertEqual(applied, (1, 0))
+        self.assertEqual(Recipe.objects.get(pk=self.toast.pk).difficulty, "Easy")
+
+
+class OpenAIBatchBackendTest(TestCase):
+    """Test the OpenAI Batch API backend with a mocked client."""
+
+    def test_submit_status_and_results(self):
+        """Test that the file is uploaded for a batch and the output file is read back."""
+        client = Mock()
+        client.files.create.return_value = Mock(id="file_1")
+        client.batches.create.return_value = Mock(id="batch_1")
+        backend = OpenAIBatchBackend(client)
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as file:
+            self.assertEqual(backend.submit(file.name), "batch_1")
+        client.batches.create.assert_called_once_with(input_file_id="file_1", endpoint='/v1/chat/completions',
+                                                      completion_window='24h')
+
+        for status, expected in [('in_progress', PENDING), ('completed', COMPLETED), ('expired', FAILED)]:
+            client.batches.retrieve.return_value = Mock(status=status, output_file_id="file_2")
+            self.assertEqual(backend.status("batch_1"), expected)
+        client.files.content.return_value = Mock(text='{"custom_id": "recipe-1"}\n\n{"custom_id": "recipe-2"}\n')
+        self.assertEqual([line['custom_id'] for line in backend.results("batch_1")], ["recipe-1", "recipe-2"])
@@ -0,0 +1,121 @@
+"""Tests for streaming the alternative ingredients."""
+import json
+import time
+from unittest.mock import patch
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from openai import OpenAI
+from webpage.models import Recipe, Ingredient, IngredientList
+from webpage.modules.ai_advisor import AIRecipeAdvisor
+from webpage.modules.fake_openai import FakeOpenAIServer
+from webpage.modules.gpt_cache import default_cache
+from webpage.modules.gpt_handler import GPTHandler
+from webpage.modules.json_stream import JSONArrayStream
+from webpage.modules.status_code import StatusCode
+
+ALTERNATIVES = [
+    {"name": "Rice flour", "description": "Gluten free, a bit grainy.", "amount": 2, "unit": "cups"},
+    {"name": "Oat flour", "description": "Made of \"ground\" oats [1].", "amount": 2.5, "unit": "cups"},
+    {"name": "Almond flour", "description": "Richer, {nutty} taste.", "amount": 2, "unit": "cups"},
+]
+
+
+def parse_events(content: bytes) -> list[tuple[str, dict]]:
+    """Split a server-sent event stream into (event, data) pairs."""
+    events = []
+    for block in content.decode().strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+
+class JSONArrayStreamTest(TestCase):
+    """Test the incremental JSON array parser."""
+
+    def test_elements_are_returned_when_complete(self):
+        """Test that each element comes out as soon as its closing brace arrives, whatever the piece boundaries."""
+        text = "```json\n" + json.dumps(ALTERNATIVES) + "\n```"
+        for size in [1, 3, 7, len(text)]:
+            parser = JSONArrayStream()
+            elements = []
+            for start in range(0, len(text), size):
+                elements += parser.feed(text[start:start + size])
+            self.assertEqual(elements, ALTERNATIVES)
+            self.assertTrue(parser.finished)
+
+    def test_first_element_before_the_rest(self):
+        """Test that the first element is available before the second one starts."""
+        parser = JSONArrayStream()
+        self.assertEqual(parser.feed('[{"a": "}"}, {"b"'), [{"a": "}"}])
+        self.assertFalse(parser.finished)
+        self.assertEqual(parser.feed(': [1, 2]}, 3]'), [{"b": [1, 2]}, 3])
+
+    def test_invalid_element(self):
+        """Test that a broken element raises a JSON error."""
+        with self.assertRaises(json.JSONDecodeError):
+            JSONArrayStream().feed('[{"a": }]')
+
+
+class AlternativeStreamTest(TestCase):
+    """Test streaming alternatives from a local fake model server."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create an approved recipe with an ingredient."""
+        cls.user = User.objects.create_user(username="streamer", password="password123")
+        cls.recipe = Recipe.objects.create(name="Cake", description="Sweet", poster_id=cls.user,
+                                           status=StatusCode.APPROVE.value[0])
+        cls.flour = Ingredient.objects.create(name="Flour")
+        IngredientList.objects.create(recipe=cls.recipe, ingredient=cls.flour, amount=2, unit="cups")
+
+    def setUp(self):
+        """Start the fake server and empty the in-memory cache."""
+        self.server = FakeOpenAIServer(json.dumps(ALTERNATIVES), chunk_size=8, delay=0.01).start()
+        self.addCleanup(self.server.stop)
+        self.client_api = OpenAI(base_url=self.server.url, api_key="fake", max_retries=0)
+        default_cache.clear_memory()
+        self.addCleanup(default_cache.clear_memory)
+
+    def test_handler_stream(self):
+        """Test that the handler yields the answer in pieces and caches the whole answer."""
+        handler = GPTHandler("context", "gpt-4o-mini", client=self.client_api)
+        pieces = list(handler.stream("flour"))
+        self.assertGreater(len(pieces), 1)
+        self.assertEqual(json.loads("".join(pieces)), ALTERNATIVES)
+        self.assertEqual(self.server.requests[0]['stream'], True)
+        self.assertEqual(list(handler.stream("flour")), ["".join(pieces)])
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_advisor_skips_invalid_alternatives(self):
+        """Test that an element with the wrong keys is not sent."""
+        self.server.content = json.dumps([{"title": "Nope"}] + ALTERNATIVES[:1])
+        advisor = AIRecipeAdvisor(self.recipe)
+        with patch('webpage.modules.gpt_handler.client', self.client_api):
+            self.assertEqual(list(advisor.stream_alternative_ingredients([self.flour])), ALTERNATIVES[:1])
+
+    def test_view_streams_events(self):
+        """Test that the first suggestion reaches the browser long before the whole answer."""
+        with patch('webpage.modules.gpt_handler.client', self.client_api):
+            start = time.monotonic()
+            response = self.client.post(reverse('recipe', args=[self.recipe.id]),
+                                        {'ingredient_id': self.flour.id, 'prompt': '', 'stream': '1'})
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            chunks = iter(response.streaming_content)
+            first = next(chunks)
+            first_at = time.monotonic() - start
+            content = first + b"".join(chunks)
+            total = time.monotonic() - start
+        events = parse_events(content)
+        self.assertEqual([name for name, _ in events], ['suggestion'] * 3 + ['done'])
+        self.assertEqual(events[0][1]['text'], "2 cups Rice flour - Gluten free, a bit grainy.")
+        self.assertLess(first_at, total / 2)
+
+    def test_view_streams_error(self):
+        """Test that an answer without any usable alternative ends with an error event."""
+        self.server.content = "I cannot help with that."
+        with patch('webpage.modules.gpt_handler.client', self.client_api):
+            response = self.client.post(reverse('recipe', args=[self.recipe.id]),
+                                        {'ingredient_id': self.flour.id, 'stream': '1'})
+            events = parse_events(b"".join(response.streaming_content))
+        self.assertEqual(events, [('error', {'message': "Error with LLM. Please try again."})])
@@ -0,0 +1,79 @@
+"""Tests for awaiting several AIRecipeAdvisor calls at the same time."""
+import asyncio
+import time
+from unittest.mock import patch, MagicMock
+from django.contrib.auth.models import User
+from django.test import TestCase
+from webpage.models import Recipe, Ingredient, IngredientList
+from webpage.modules.ai_advisor import AIRecipeAdvisor, run_concurrently
+from webpage.modules.gpt_cache import default_cache
+
+DELAY = 0.2
+
+
+async def slow_completion(**kwargs) -> MagicMock:
+    """Answer like the model would, after a delay."""
+    await asyncio.sleep(DELAY)
+    text = kwargs['messages'][1]['content'][0]['text']
+    if "difficulty level" in text:
+        content = "Easy"
+    elif text.startswith("Recipe Name:"):
+        content = "True"
+    else:
+        content = '{"nutrients": [{"name": "Calories", "amount": 300, "unit": "kcal", "percentOfDailyNeeds": 15}]}'
+    response = MagicMock()
+    response.choices[0].message.content = content
+    return response
+
+
+@patch('webpage.modules.gpt_handler.get_async_client')
+class AsyncAdvisorTest(TestCase):
+    """Test the awaitable advisor calls and the synchronous adapter."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a recipe with an ingredient."""
+        user = User.objects.create_user(username="async_cook")
+        cls.recipe = Recipe.objects.create(name="Soup", description="Hot", poster_id=user)
+        IngredientList.objects.create(recipe=cls.recipe, ingredient=Ingredient.objects.create(name="Water"),
+                                      amount=1, unit="l")
+
+    def setUp(self):
+        """Start every test with an empty in-memory cache."""
+        default_cache.clear_memory()
+        self.addCleanup(default_cache.clear_memory)
+
+    def test_separate_calls_run_together(self, mock_client):
+        """Test that three separate calls take about as long as one."""
+        mock_client.return_value.chat.completions.create.side_effect = slow_completion
+        start = time.monotonic()
+        assessment = AIRecipeAdvisor(self.recipe).assess_separately()
+        elapsed = time.monotonic() - start
+        self.assertEqual(assessment["difficulty"], "Easy")
+        self.assertTrue(assessment["approved"])
+        self.assertEqual(assessment["nutrients"][0]["name"], "Calories")
+        self.assertLess(elapsed, 2 * DELAY)
+
+    def test_concurrency_cap(self, mock_client):
+        """Test that no more requests than GPT_CONCURRENCY wait for the model at once."""
+        mock_client.return_value.chat.completions.create.side_effect = slow_completion
+        advisor = AIRecipeAdvisor(self.recipe)
+        start = time.monotonic()
+        with patch('webpage.modules.gpt_handler.CONCURRENCY', 1):
+            run_concurrently(advisor.adifficulty_calculator(), advisor.arecipe_approval())
+        self.assertGreaterEqual(time.monotonic() - start, 2 * DELAY)
+
+    def test_deadline(self, mock_client):
+        """Test that a call slower than its deadline is abandoned."""
+        mock_client.return_value.chat.completions.create.side_effect = slow_completion
+        advisor = AIRecipeAdvisor(self.recipe)
+        with self.assertRaises(asyncio.TimeoutError):
+            run_concurrently(advisor.adifficulty_calculator(), timeout=DELAY / 4)
+
+    def test_cached_answer_skips_the_model(self, mock_client):
+        """Test that the awaitable calls share the response cache with the blocking ones."""
+        mock_client.return_value.chat.completions.create.side_effect = slow_completion
+        advisor = AIRecipeAdvisor(self.recipe)
+        self.assertEqual(run_concurrently(advisor.adifficulty_calculator()), ["Easy"])
+        self.assertEqual(advisor.difficulty_calculator(), "Easy")
+        self.assertEqual(mock_client.return_value.chat.completions.create.call_count, 1)
@@ -0,0 +1,130 @@
+"""Tests for asking the alternatives of several ingredients at once."""
+import json
+from unittest.mock import patch
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from openai import OpenAI
+from webpage.models import Recipe, Ingredient, IngredientList
+from webpage.modules.ai_advisor import AIRecipeAdvisor
+from webpage.modules.fake_openai import FakeOpenAIServer
+from webpage.modules.gpt_cache import default_cache
+from webpage.modules.resilience import default_breaker
+from webpage.modules.status_code import StatusCode
+from webpage.modules.substitutions import remember
+
+
+def alternative(name: str) -> dict:
+    """
+    Return one alternative ingredient.
+
+    :param name: The name of the alternative.
+    :return: The alternative, as GPT answers it.
+    """
+    return {"name": name, "description": f"Like {name.lower()}.", "amount": 1, "unit": "cup"}
+
+
+class BatchAlternativesTest(TestCase):
+    """Test that the unanswered ingredients are asked about in one request and answered per ingredient."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a cake with four ingredients."""
+        user = User.objects.create_user(username="batcher", password="password123")
+        cls.recipe = Recipe.objects.create(name="Cake", description="Sweet", poster_id=user,
+                                           status=StatusCode.APPROVE.value[0])
+        cls.ingredients = [Ingredient.objects.create(name=name) for name in ["Butter", "Egg", "Milk", "Sugar"]]
+        for ingredient in cls.ingredients:
+            IngredientList.objects.create(recipe=cls.recipe, ingredient=ingredient, amount=1, unit="cup")
+
+    def setUp(self):
+        """Start the fake server answering a batch, with an empty cache and no waits between retries."""
+        self.requests = []
+        self.server = FakeOpenAIServer(self.answer).start()
+        self.addCleanup(self.server.stop)
+        client_api = OpenAI(base_url=self.server.url, api_key="fake", max_retries=0)
+        for patcher in [patch('webpage.modules.gpt_handler.client', client_api),
+                        patch('webpage.modules.resilience.backoff_delay', return_value=0)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for clear in [default_cache.clear_memory, default_breaker.reset]:
+            clear()
+            self.addCleanup(clear)
+        self.skipped = set()
+
+    def answer(self, body: dict) -> str:
+        """
+        Answer one substitute per missing ingredient, leaving out the skipped ones once.
+
+        :param body: The JSON body of the request.
+        :return: The answer.
+        """
+        self.requests.append(body)
+        question = body['messages'][1]['content'][0]['text']
+        missing = question.split("The ingredient I don't have:")[1].split("\n")[0].split(",")
+        if body['response_format']['json_schema']['name'] == "alternative_ingredients":
+            return json.dumps({"alternatives": [alternative(f"Soy {missing[0].lower()}")]})
+        skipped, self.skipped = self.skipped, set()
+        return json.dumps({"ingredients": [{"ingredient": name, "alternatives": [alternative(f"Soy {name.lower()}")]}
+                                           for name in missing if name not in skipped]})
+
+    def ask(self, ingredients: list[Ingredient], **data):
+        """
+        Post to the batch endpoint.
+
+        :param ingredients: The missing ingredients.
+        :param data: More form fields.
+        :return: The response.
+        """
+        return self.client.post(reverse('alternative_ingredients', args=[self.recipe.id]),
+                                {'ingredient_ids': ",".join(str(ingredient.id) for ingredient in ingredients), **data})
+
+    def test_one_request_for_the_rest(self):
+        """Test that the stored and cached ingredients are answered first, and the rest in a single request."""
+        butter, egg, milk, sugar = self.ingredients
+        remember(self.recipe, butter, [alternative("Margarine")])
+        AIRecipeAdvisor(self.recipe).get_alternative_ingredients([egg], "Vegan please")
+        self.requests.clear()
+
+        response = self.ask(self.ingredients, prompt="Vegan please")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.requests), 1)
+        self.assertIn("The ingredient I don't have:Butter,Milk,Sugar", self.requests[0]['messages'][1]['content'][0]['text'])
+        result = response.json()['alternatives']
+        self.assertEqual(list(result), [str(ingredient.id) for ingredient in self.ingredients])
+        self.assertEqual([result[str(ingredient.id)]['alternatives'][0]['name'] for ingredient in self.ingredients],
+                         ["Soy butter", "Soy egg", "Soy milk", "Soy sugar"])
+        self.assertEqual(result[str(milk.id)]['text'], "1 cup Soy milk - Like soy milk.\n")
+
+        self.requests.clear()
+        result = self.ask(self.ingredients).json()['alternatives']
+        self.assertEqual(result[str(butter.id)]['alternatives'][0]['name'], "Margarine")
+        self.assertEqual(len(self.requests), 1)
+        self.ask([sugar, egg])
+        self.assertEqual(len(self.requests), 1)
+
+    def test_missing_ingredient_is_retried(self):
+        """Test that an answer leaving out an ingredient is asked again."""
+        self.skipped = {"Milk"}
+        result = AIRecipeAdvisor(self.recipe).get_alternatives_per_ingredient(self.ingredients[2:])
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(result[self.ingredients[2].id][0]['name'], "Soy milk")
+
+    def test_invalid_ids(self):
+        """Test that unknown or malformed ingredient ids are refused without asking GPT."""
+        self.assertEqual(self.client.post(reverse('alternative_ingredients', args=[self.recipe.id]),
+                                          {'ingredient_ids': "1,x"}).status_code, 400)
+        self.assertEqual(self.client.post(reverse('alternative_ingredients', args=[self.recipe.id]),
+                                          {'ingredient_ids': "999"}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('alternative_ingredients', args=[self.recipe.id])).status_code, 405)
+        self.assertEqual(self.requests, [])
+
+    def test_ingredients_outside_the_recipe_or_too_many(self):
+        """Test that ingredients of other recipes and requests over the limit are refused without asking GPT."""
+        salt = Ingredient.objects.create(name="Salt")
+        self.assertEqual(self.ask([self.ingredients[0], salt]).status_code, 400)
+        with patch('webpage.views.ALTERNATIVES_MAX_INGREDIENTS', 3):
+            response = self.ask(self.ingredients)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'At most 3 ingredients'})
+        self.assertEqual(self.requests, [])
@@ -0,0 +1,132 @@
+"""Tests for the fake OpenAI server and the benchmark of the AI pages."""
+import random
+from io import StringIO
+from unittest.mock import patch
+import openai
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from openai import OpenAI
+from webpage.management.commands.benchmark_ai import percentile
+from webpage.models import Recipe
+from webpage.modules import gpt_handler, json_repair
+from webpage.modules.fake_openai import FakeOpenAIServer, lognormal, malform, parse_latency
+from webpage.modules.gpt_cache import default_cache
+from webpage.modules.gpt_handler import GPTHandler, json_schema_format, object_schema
+from webpage.modules.resilience import default_breaker
+from webpage.modules.telemetry import collector
+
+
+class FakeOpenAIServerTest(TestCase):
+    """Test the scripts, latency and injected faults of the fake server."""
+
+    def setUp(self):
+        """Empty the in-memory cache."""
+        default_cache.clear_memory()
+        self.addCleanup(default_cache.clear_memory)
+
+    def ask(self, server: FakeOpenAIServer, context: str, response_format: dict | None = None) -> str:
+        """
+        Ask the fake server once, without the cache.
+
+        :param server: The started server.
+        :param context: The system prompt.
+        :param response_format: The response format of the request.
+        :return: The answer.
+        """
+        client = OpenAI(base_url=server.url, api_key="fake", max_retries=0)
+        return GPTHandler(context, "gpt-4o-mini", cache=None, response_format=response_format,
+                          client=client).generate("question")
+
+    def test_scripts(self):
+        """Test that the answer is chosen by the schema name, then by the system prompt, then the content."""
+        schema = json_schema_format("assessment", object_schema({"approved": {"type": "boolean"}}))
+        scripts = {"assessment": '{"approved": true}', "difficulty": lambda body: body['model']}
+        with FakeOpenAIServer("Default", scripts=scripts) as server:
+            self.assertEqual(self.ask(server, "Rate it", schema), '{"approved": true}')
+            self.assertEqual(self.ask(server, "Tell the difficulty level"), "gpt-4o-mini")
+            self.assertEqual(self.ask(server, "Anything else"), "Default")
+
+    def test_latency(self):
+        """Test that the latency is read from the command line and drawn from the seeded generator."""
+        self.assertEqual(parse_latency("0.25")(random.Random()), 0.25)
+        self.assertTrue(0.1 <= parse_latency("uniform:0.1,0.2")(random.Random()) <= 0.2)
+        draws = [lognormal(0.2, 0.5)(random.Random(7)) for _ in range(2)]
+        self.assertEqual(draws[0], draws[1])
+        for spec in ["gamma:1,2", "uniform:1", "soon"]:
+            with self.assertRaises(ValueError):
+                parse_latency(spec)
+
+    def test_injected_errors(self):
+        """Test that the error rate answers with the error status."""
+        with FakeOpenAIServer("Easy", error_rate=1, error_status=429) as server:
+            with self.assertRaises(openai.RateLimitError):
+                self.ask(server, "context")
+        self.assertEqual((server.counts['requests'], server.counts['errors']), (1, 1))
+
+    def test_malformed_answers(self):
+        """Test that the malformations are counted, and that json_repair reads only the usual mistakes."""
+        with FakeOpenAIServer('{"a": [1, 2]}', malformed_rate=1, seed=3) as server:
+            answers = [self.ask(server, "context") for _ in range(4)]
+        self.assertNotIn('{"a": [1, 2]}', answers)
+        self.assertEqual(sum(value for key, value in server.counts.items() if key.startswith('malformed_')), 4)
+        for kind in ['fenced', 'trailing_comma']:
+            self.assertEqual(json_repair.repair(malform('{"a": [1, 2]}', kind)), {"a": [1, 2]})
+        for kind in ['truncated', 'prose']:
+            with self.assertRaises(ValueError):
+                json_repair.repair(malform('{"a": [1, 2]}', kind))
+
+    def test_base_url(self):
+        """Test that every handler without its own client sends its requests to the base URL."""
+        previous = gpt_handler.BASE_URL
+        self.addCleanup(gpt_handler.use_base_url, previous)
+        with FakeOpenAIServer("Hard") as server:
+            gpt_handler.use_base_url(server.url)
+            self.assertEqual(GPTHandler("context", "gpt-4o-mini", cache=None).generate("question"), "Hard")
+            self.assertEqual("".join(GPTHandler("context", "gpt-4o-mini", cache=None).stream("question")), "Hard")
+        self.assertEqual(len(server.requests), 2)
+
+
+class BenchmarkTest(TestCase):
+    """Test the benchmark command against the fake server."""
+
+    def setUp(self):
+        """Forget the calls of the other tests."""
+        default_cache.clear_memory()
+        collector.clear()
+        default_breaker.reset()
+        self.addCleanup(collector.clear)
+
+    def test_percentile(self):
+        """Test the nearest-rank percentiles."""
+        values = [float(value) for value in range(100, 0, -1)]
+        self.assertEqual([percentile(values, fraction) for fraction in (0.5, 0.95, 0.99, 1)], [50, 95, 99, 100])
+        self.assertEqual(percentile([], 0.5), 0)
+
+    @patch('webpage.modules.resilience.backoff_delay', return_value=0)
+    def test_benchmark(self, mock_backoff):
+        """Test that both pages are loaded, their jobs are run, and what was created is deleted."""
+        recipes = Recipe.objects.count()
+        out = StringIO()
+        call_command('benchmark_ai', requests=3, concurrency=1, latency='0.01', seed=1, stdout=out)
+        lines = {line.split("\t")[0]: line for line in out.getvalue().splitlines()}
+        self.assertIn("3 in", lines['alternatives'])
+        self.assertIn("200=3", lines['alternatives'])
+        self.assertIn("202=3", lines['add_recipe'])
+        self.assertIn("done=3", lines['enrichment'])
+        self.assertIn("p99=", lines['enrichment'])
+        self.assertIn("requests=", lines['Model'])
+        self.assertEqual(Recipe.objects.count(), recipes)
+        self.assertFalse(User.objects.filter(username__startswith="benchmark-").exists())
+        self.assertIsNone(gpt_handler.BASE_URL)
+
+    @patch('webpage.modules.resilience.backoff_delay', return_value=0)
+    def test_benchmark_streams_malformed_answers(self, mock_backoff):
+        """Test that malformed streamed answers are reported as errors rather than failing the benchmark."""
+        out = StringIO()
+        call_command('benchmark_ai', scenario=['alternatives'], requests=2, concurrency=1, latency='0',
+                     malformed_rate=1, stream=True, seed=1, stdout=out)
+        summary = out.getvalue()
+        self.assertIn("alternatives\t2 in", summary)
+        self.assertNotIn("add_recipe", summary)
+        self.assertIn("malformed_", summary)
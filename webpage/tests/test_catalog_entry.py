@@ -0,0 +1,65 @@
+"""Tests for the normalized name and upsert helpers shared by the catalog models."""
+from django.db import IntegrityError
+from django.test import TestCase
+from webpage.models import Ingredient, Equipment, Nutrition, normalize_name
+
+
+class CatalogEntryTest(TestCase):
+    """Test the CatalogEntry base class through its concrete models."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create an existing ingredient with a picture and a spoonacular_id."""
+        cls.butter = Ingredient.objects.create(
+            name="Butter",
+            spoonacular_id=1001,
+            picture="http://example.com/butter.jpg"
+        )
+
+    def test_normalize_name(self):
+        """Test that casing and whitespace do not change the normalized name."""
+        self.assertEqual(normalize_name("  Brown   SUGAR "), "brown sugar")
+        self.assertEqual(normalize_name(None), "")
+
+    def test_save_sets_normalized_name(self):
+        """Test that saving an entry fills its normalized name."""
+        self.assertEqual(self.butter.normalized_name, "butter")
+
+    def test_unique_normalized_name(self):
+        """Test that two entries cannot differ only by casing."""
+        with self.assertRaises(IntegrityError):
+            Ingredient.objects.create(name="BUTTER ")
+
+    def test_upsert_many_reuses_existing_entry(self):
+        """Test that upserting an existing name returns the same row untouched."""
+        entries = Ingredient.upsert_many([{'name': "butter"}, {'name': "Flour"}])
+        self.assertEqual(entries["butter"].pk, self.butter.pk)
+        self.assertEqual(entries["butter"].picture, "http://example.com/butter.jpg")
+        self.assertEqual(entries["flour"].name, "Flour")
+        self.assertEqual(Ingredient.objects.count(), 2)
+
+    def test_upsert_many_deduplicates_rows(self):
+        """Test that the same name given twice creates a single entry."""
+        entries = Equipment.upsert_many([{'name': "Pan"}, {'name': " pan"}])
+        self.assertEqual(list(entries), ["pan"])
+        self.assertEqual(Equipment.objects.count(), 1)
+
+    def test_upsert_many_update_fields(self):
+        """Test that update_fields refreshes the given columns on existing entries."""
+        Ingredient.upsert_many(
+            [{'name': "Butter", 'spoonacular_id': 1001, 'picture': "http://example.com/new.jpg"}],
+            update_fields=['picture'])
+        self.butter.refresh_from_db()
+        self.assertEqual(self.butter.picture, "http://example.com/new.jpg")
+        self.assertEqual(self.butter.spoonacular_id, 1001)
+
+    def test_upsert_many_releases_taken_spoonacular_id(self):
+        """Test that a new entry does not steal the spoonacular_id of another entry."""
+        entries = Ingredient.upsert_many([{'name': "Salted Butter", 'spoonacular_id': 1001}])
+        self.assertIsNone(entries["salted butter"].spoonacular_id)
+
+    def test_upsert(self):
+        """Test that upsert returns a single saved entry."""
+        nutrition = Nutrition.upsert("Protein")
+        self.assertEqual(Nutrition.upsert("protein"), nutrition)
+        self.assertIsNotNone(nutrition.pk)
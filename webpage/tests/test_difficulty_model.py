@@ -0,0 +1,161 @@
+"""Tests for the local classifier of the recipe difficulty."""
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest.mock import Mock, patch
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from webpage.models import Recipe, RecipeStep, Ingredient, IngredientList, Equipment, EquipmentList, EnrichmentBatch, Job
+from webpage.modules.ai_advisor import AIRecipeAdvisor
+from webpage.modules.batch_enrichment import apply_results, select_recipes, submit_batch, write_batch
+from webpage.modules.builder import NormalRecipeBuilder
+from webpage.modules.difficulty_model import DifficultyModel, features, get_model
+from webpage.modules.recipe_enrichment import process_assessment
+from webpage.modules.screening import Verdict
+from webpage.modules.status_code import ScreeningVerdict
+
+# Steps, step text, minutes, equipment and ingredients of each difficulty.
+SHAPES = {
+    "Easy": (2, "Mix everything in a bowl.", 10, 1, 3),
+    "Normal": (5, "Chop the vegetables and cook them in the pan until soft.", 40, 3, 7),
+    "Hard": (10, "Temper the chocolate, then fold it into the whipped cream and knead the dough.", 150, 6, 14),
+}
+
+
+class DifficultyModelTest(TestCase):
+    """Test training the classifier and answering the difficulty without GPT."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create twelve recipes of each difficulty, slightly different within a difficulty."""
+        cls.user = User.objects.create_user(username="rater", password="password123")
+        cls.ingredients = [Ingredient.objects.create(name=f"Ingredient {number}") for number in range(16)]
+        cls.equipment = [Equipment.objects.create(name=f"Equipment {number}") for number in range(8)]
+        for difficulty in SHAPES:
+            for variant in range(12):
+                cls.recipe(difficulty, variant)
+
+    @classmethod
+    def recipe(cls, difficulty: str, variant: int, label: str | None = None) -> Recipe:
+        """
+        Create a recipe shaped like a difficulty.
+
+        :param difficulty: The difficulty whose shape is used.
+        :param variant: A number varying the shape a little.
+        :param label: The difficulty stored, the shape's by default.
+        :return: The recipe.
+        """
+        steps, text, minutes, equipment, ingredients = SHAPES[difficulty]
+        recipe = Recipe.objects.create(name=f"{difficulty} {variant}", poster_id=cls.user,
+                                       estimated_time=minutes * (1 + variant % 3 / 10),
+                                       difficulty=difficulty if label is None else label)
+        for number in range(steps + variant % 2):
+            RecipeStep.objects.create(recipe=recipe, number=number + 1, description=text)
+        for item in cls.equipment[:equipment]:
+            EquipmentList.objects.create(recipe=recipe, equipment=item, amount=1)
+        for item in cls.ingredients[:ingredients + variant % 2]:
+            IngredientList.objects.create(recipe=recipe, ingredient=item, amount=1, unit="cup")
+        return recipe
+
+    def setUp(self):
+        """Keep the classifier in a temporary file."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "difficulty_model.json")
+        patcher = patch('webpage.modules.difficulty_model.MODEL_PATH', self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_features(self):
+        """Test that the techniques are counted once each, whatever their case."""
+        row = features(["Temper the chocolate.", "TEMPER again, then knead."], 0, 0, 0)
+        self.assertEqual(row[-1], 2)
+        self.assertEqual(row[0], features(["a", "b"], 0, 0, 0)[0])
+
+    def test_train_and_predict(self):
+        """Test that the classifier learns the difficulties, is confident about them and can be read back."""
+        model = DifficultyModel.train()
+        self.assertEqual(model.metrics['samples'], 36)
+        self.assertGreaterEqual(model.metrics['accuracy'], 0.9)
+        model.save()
+        loaded = get_model()
+        self.assertIs(get_model(), loaded)
+        for difficulty, (steps, text, minutes, equipment, ingredients) in SHAPES.items():
+            prediction = loaded.predict(features([text] * steps, minutes, equipment, ingredients))
+            self.assertEqual(prediction.label, difficulty)
+            self.assertGreater(prediction.confidence, 0.8)
+
+    def test_too_few_samples(self):
+        """Test that the classifier is not trained on too few recipes."""
+        with self.assertRaises(ValueError):
+            DifficultyModel.train(Recipe.objects.filter(name__startswith="Easy"))
+        with patch('webpage.modules.difficulty_model.MIN_SAMPLES', 50), self.assertRaises(CommandError):
+            call_command('train_difficulty', stdout=StringIO())
+
+    @patch('webpage.modules.ai_advisor.AIRecipeAdvisor._ask', return_value="Normal")
+    def test_fast_path(self, mock_ask):
+        """Test that GPT is only asked when the classifier is missing or not confident."""
+        recipe = self.recipe("Hard", 1, label="Unknown")
+        self.assertEqual(AIRecipeAdvisor(recipe).difficulty_calculator(), "Normal")
+        self.assertEqual(mock_ask.call_count, 1)
+        DifficultyModel.train().save()
+        self.assertEqual(AIRecipeAdvisor(recipe).difficulty_calculator(), "Hard")
+        self.assertEqual(mock_ask.call_count, 1)
+        with patch('webpage.modules.difficulty_model.MIN_CONFIDENCE', 1.01):
+            self.assertEqual(AIRecipeAdvisor(recipe).difficulty_calculator(), "Normal")
+        self.assertEqual(mock_ask.call_count, 2)
+
+    def test_command(self):
+        """Test that the command reports the accuracy and saves the classifier."""
+        out = StringIO()
+        call_command('train_difficulty', '--dry-run', stdout=out)
+        self.assertIn("Trained on 36 recipe(s), 7 held out", out.getvalue())
+        self.assertFalse(os.path.exists(self.path))
+        call_command('train_difficulty', stdout=out)
+        self.assertTrue(os.path.exists(self.path))
+
+    @patch('webpage.modules.recipe_enrichment.evaluate', return_value=Verdict(ScreeningVerdict.PASS.value[0]))
+    @patch('webpage.modules.ai_advisor.AIRecipeAdvisor.recipe_assessment')
+    def test_enrichment_asks_gpt_only_when_not_confident(self, mock_assessment, mock_evaluate):
+        """Test that the enrichment step takes the difficulty from the classifier and leaves it out of the question."""
+        recipe = self.recipe("Hard", 1, label="Unknown")
+        DifficultyModel.train().save()
+        mock_assessment.return_value = {"difficulty": "Easy", "approved": False}
+        builder = NormalRecipeBuilder.from_recipe(recipe)
+        process_assessment(builder, Job(payload={'done': ['nutrition']}))()
+        mock_assessment.assert_called_once_with(("approved",), None)
+        self.assertEqual(builder.build_recipe().difficulty, "Hard")
+        with patch('webpage.modules.difficulty_model.MIN_CONFIDENCE', 1.01):
+            process_assessment(builder, Job(payload={'done': ['nutrition']}))()
+        mock_assessment.assert_called_with(("difficulty", "approved"), None)
+        self.assertEqual(builder.build_recipe().difficulty, "Easy")
+
+    def test_batch_leaves_the_difficulty_to_the_classifier(self):
+        """Test that a batch does not ask GPT for a difficulty the classifier is confident about, and applies its own."""
+        recipe = self.recipe("Hard", 1, label="Unknown")
+        DifficultyModel.train().save()
+        path = os.path.join(os.path.dirname(self.path), "batch.jsonl")
+        parts = ['difficulty', 'approval']
+        planned, asked = write_batch(select_recipes(parts).filter(pk=recipe.pk), parts, path)
+        with open(path, encoding='utf-8') as file:
+            body = json.loads(file.readline())['body']
+        self.assertEqual(list(body['response_format']['json_schema']['schema']['properties']), ["approved"])
+        batch = EnrichmentBatch.objects.create(backend='local', batch_id='batch_1', recipes=planned, asked=asked)
+        answer = {'status_code': 200, 'body': {'choices': [{'message': {'content': '{"approved": true}'}}]}}
+        # The classifier changing before the batch is collected does not change what was asked.
+        with patch('webpage.modules.difficulty_model.MIN_CONFIDENCE', 1.01):
+            self.assertEqual(apply_results(batch, [{'custom_id': f"recipe-{recipe.pk}", 'response': answer}]), (1, 0))
+        self.assertEqual(Recipe.objects.get(pk=recipe.pk).difficulty, "Hard")
+
+    def test_batch_without_a_question_for_gpt(self):
+        """Test that a recipe only missing a difficulty the classifier is confident about is not submitted."""
+        recipe = self.recipe("Hard", 1, label="Unknown")
+        DifficultyModel.train().save()
+        backend = Mock()
+        recipes = select_recipes(['difficulty']).filter(pk=recipe.pk)
+        self.assertIsNone(submit_batch(backend, recipes, ['difficulty'], directory=os.path.dirname(self.path)))
+        backend.submit.assert_not_called()
+        self.assertEqual(Recipe.objects.get(pk=recipe.pk).difficulty, "Hard")
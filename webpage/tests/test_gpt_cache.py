@@ -0,0 +1,91 @@
+"""Tests for the cache of GPT responses."""
+from io import StringIO
+from unittest.mock import patch, MagicMock
+from django.core.management import call_command
+from django.test import TestCase
+from webpage.models import GPTResponseCache
+from webpage.modules.gpt_cache import GPTCache
+from webpage.modules.gpt_handler import GPTHandler
+
+
+def completion(content: str) -> MagicMock:
+    """Return a fake chat completion with the given content."""
+    response = MagicMock()
+    response.choices[0].message.content = content
+    return response
+
+
+@patch('webpage.modules.gpt_handler.client')
+class GPTCacheTest(TestCase):
+    """Test reusing GPT responses across calls and processes."""
+
+    def setUp(self):
+        """Create a cache with a small memory tier."""
+        self.cache = GPTCache(memory_size=2, ttls={'default': 60, 'difficulty': 60, 'approval': 0},
+                              max_temperature=1.0)
+
+    def test_same_request_is_answered_from_memory(self, mock_client):
+        """Test that the second identical call does not reach the model."""
+        mock_client.chat.completions.create.return_value = completion("Easy")
+        handler = GPTHandler("context", "gpt-4o-mini", call_type='difficulty', cache=self.cache)
+        self.assertEqual(handler.generate("toast"), "Easy")
+        self.assertEqual(handler.generate("toast"), "Easy")
+        self.assertEqual(mock_client.chat.completions.create.call_count, 1)
+        self.assertEqual(self.cache.stats()['difficulty'], {'misses': 1, 'memory_hits': 1})
+
+    def test_database_tier_is_shared(self, mock_client):
+        """Test that another process, with an empty memory tier, reuses the stored response."""
+        mock_client.chat.completions.create.return_value = completion("Hard")
+        GPTHandler("context", "gpt-4o-mini", cache=self.cache).generate("stew")
+        other = GPTCache(ttls={'default': 60})
+        self.assertEqual(GPTHandler("context", "gpt-4o-mini", cache=other).generate("stew"), "Hard")
+        self.assertEqual(mock_client.chat.completions.create.call_count, 1)
+        self.assertEqual(other.stats()['default'], {'db_hits': 1})
+        self.assertEqual(GPTResponseCache.objects.get().hits, 1)
+
+    def test_key_depends_on_context_and_sampling(self, mock_client):
+        """Test that a different context or temperature is not served the same response."""
+        base = GPTHandler("context", "gpt-4o-mini", temperature=0.2, cache=self.cache)
+        self.assertNotEqual(base.cache_key("x"), GPTHandler("other", "gpt-4o-mini", temperature=0.2).cache_key("x"))
+        self.assertNotEqual(base.cache_key("x"), GPTHandler("context", "gpt-4o-mini", temperature=0.3).cache_key("x"))
+
+    def test_high_temperature_bypasses_cache(self, mock_client):
+        """Test that calls above the temperature threshold always reach the model."""
+        mock_client.chat.completions.create.return_value = completion("Normal")
+        handler = GPTHandler("context", "gpt-4o-mini", temperature=1.5, cache=self.cache)
+        handler.generate("soup")
+        handler.generate("soup")
+        self.assertEqual(mock_client.chat.completions.create.call_count, 2)
+        self.assertFalse(GPTResponseCache.objects.exists())
+        self.assertEqual(self.cache.stats()['default'], {'bypassed': 2})
+
+    def test_zero_ttl_is_not_cached(self, mock_client):
+        """Test that a call type with a TTL of 0 is never cached."""
+        mock_client.chat.completions.create.return_value = completion("True")
+        handler = GPTHandler("context", "gpt-4o-mini", call_type='approval', cache=self.cache)
+        handler.generate("cake")
+        handler.generate("cake")
+        self.assertEqual(mock_client.chat.completions.create.call_count, 2)
+
+    def test_invalidate(self, mock_client):
+        """Test that an unusable response is asked again."""
+        mock_client.chat.completions.create.side_effect = [completion("Maybe"), completion("Easy")]
+        handler = GPTHandler("context", "gpt-4o-mini", cache=self.cache)
+        self.assertEqual(handler.generate("toast"), "Maybe")
+        handler.invalidate("toast")
+        self.assertEqual(handler.generate("toast"), "Easy")
+
+    def test_memory_tier_is_lru(self, mock_client):
+        """Test that the least recently used response is evicted from memory first."""
+        for name in ["a", "b", "c"]:
+            self.cache.set(name, name)
+        self.assertEqual(list(self.cache._memory), ["b", "c"])
+
+    def test_command(self, mock_client):
+        """Test listing and clearing the stored responses."""
+        self.cache.set("key", "Easy", call_type='difficulty')
+        out = StringIO()
+        call_command('gpt_cache', stdout=out)
+        self.assertIn("difficulty\t1 response(s)", out.getvalue())
+        call_command('gpt_cache', clear=True, stdout=StringIO())
+        self.assertFalse(GPTResponseCache.objects.exists())
@@ -0,0 +1,130 @@
+"""Tests for the local embedding index of the ingredients."""
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from webpage.models import Recipe, Ingredient, IngredientList, Diet, Substitution
+from webpage.modules.ai_advisor import AIRecipeAdvisor
+from webpage.modules.ingredient_index import IngredientIndex, get_index
+from webpage.modules.resilience import CircuitOpenError
+from webpage.modules.status_code import StatusCode
+
+GROUPS = [
+    (["Butter", "Flour", "Sugar", "Egg"], False),
+    (["Butter", "Flour", "Milk", "Salt"], False),
+    (["Margarine", "Flour", "Sugar", "Banana"], True),
+    (["Margarine", "Flour", "Milk", "Salt"], True),
+    (["Vanilla", "Milk", "Cream", "Sugar"], False),
+    (["Chicken", "Rice", "Salt", "Garlic"], False),
+    (["Beef", "Rice", "Salt", "Onion"], False),
+]
+
+
+class IngredientIndexTest(TestCase):
+    """Test finding substitutes from the ingredients used together in recipes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create three recipes of each group of ingredients, the margarine ones vegan."""
+        user = User.objects.create_user(username="indexer", password="password123")
+        vegan = Diet.objects.get_or_create(name="Vegan")[0]
+        cls.ingredients = {}
+        for names, is_vegan in GROUPS:
+            for number in range(3):
+                recipe = Recipe.objects.create(name=f"{names[0]} {names[-1]} {number}", poster_id=user,
+                                               status=StatusCode.APPROVE.value[0])
+                if is_vegan:
+                    recipe.diets.add(vegan)
+                for name in names:
+                    ingredient = cls.ingredients.get(name) or Ingredient.objects.create(name=name)
+                    cls.ingredients[name] = ingredient
+                    IngredientList.objects.create(recipe=recipe, ingredient=ingredient, amount=2, unit="cups")
+        cls.recipe = Recipe.objects.get(name="Butter Egg 0")
+
+    def setUp(self):
+        """Build the index into a temporary directory, with thresholds fitting this small set of recipes."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for patcher in [patch('webpage.modules.ingredient_index.INDEX_DIR', directory.name),
+                        patch('webpage.modules.ingredient_index.MIN_SCORE', 0.2),
+                        patch('webpage.modules.ingredient_index.FAST_SCORE', 0.3)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.index = IngredientIndex.build()
+        self.index.save()
+
+    def pk(self, name: str) -> int:
+        """
+        Return the id of an ingredient.
+
+        :param name: The name of the ingredient.
+        :return: The id.
+        """
+        return self.ingredients[name].pk
+
+    def test_similar(self):
+        """Test that an ingredient used with the same ingredients is the most similar, and the diet filter."""
+        used = [self.pk(name) for name in ["Flour", "Sugar", "Egg"]]
+        similar = self.index.similar(self.pk("Butter"), exclude=used, min_score=0.2)
+        self.assertEqual([neighbour.name for neighbour in similar], ["Margarine", "Banana"])
+        self.assertGreater(similar[0].score, similar[1].score)
+        vegan = [neighbour.name for neighbour in self.index.similar(self.pk("Butter"), k=20, diets=["VEGAN"])]
+        self.assertIn("Margarine", vegan)
+        self.assertNotIn("Egg", vegan)
+        self.assertNotIn("Chicken", vegan)
+        self.assertEqual(self.index.similar(self.pk("Butter"), diets=["Keto"]), [])
+        self.assertEqual(len(self.index.similar(self.pk("Butter"), k=2)), 2)
+
+    def test_load_memory_mapped(self):
+        """Test that the saved vectors are memory-mapped, loaded once and unchanged."""
+        index = get_index()
+        self.assertIsInstance(index.vectors, np.memmap)
+        self.assertEqual(index.vectors.dtype, np.float32)
+        self.assertIs(get_index(), index)
+        self.assertEqual(index.similar(self.pk("Butter")), self.index.similar(self.pk("Butter")))
+        with tempfile.TemporaryDirectory() as empty:
+            self.assertIsNone(get_index(empty))
+
+    @patch('webpage.modules.ai_advisor.AIRecipeAdvisor._ask')
+    def test_fast_path(self, mock_ask):
+        """Test that a confident index answers without GPT, in the amount of the missing ingredient."""
+        advisor = AIRecipeAdvisor(self.recipe)
+        alternatives = advisor.get_alternative_ingredients([self.ingredients["Butter"]])
+        self.assertEqual(alternatives, [
+            {"name": "Margarine", "description": "Used like butter in similar recipes.", "amount": 2.0, "unit": "cups"},
+            {"name": "Banana", "description": "Used like butter in similar recipes.", "amount": 2.0, "unit": "cups"},
+        ])
+        self.assertTrue(advisor.check_output_structure(alternatives))
+        self.assertTrue(advisor.answered_locally)
+        mock_ask.assert_not_called()
+
+    @patch('webpage.modules.ai_advisor.AIRecipeAdvisor._ask', return_value=[])
+    def test_candidates_shorten_prompt(self, mock_ask):
+        """Test that with a special instruction GPT is asked about the candidates instead of the whole recipe."""
+        AIRecipeAdvisor(self.recipe).get_alternative_ingredients([self.ingredients["Butter"]], "Nothing yellow")
+        query = mock_ask.call_args[0][1]
+        self.assertIn("Candidates used like it in similar recipes:Margarine, Banana", query)
+        self.assertIn("Butter", query)
+        self.assertNotIn("Egg, amount", query)
+        self.assertTrue(query.endswith("The special instruction:Nothing yellow"))
+
+    @patch('webpage.modules.ai_advisor.AIRecipeAdvisor._ask', side_effect=CircuitOpenError(10))
+    def test_fallback_when_unavailable(self, mock_ask):
+        """Test that the index answers when GPT is unavailable, and the answer is not stored for other recipes."""
+        response = self.client.post(reverse('recipe', args=[self.recipe.id]),
+                                    {'ingredient_id': self.pk("Butter"), 'prompt': "Cheap please"})
+        self.assertIn("2.0 cups Margarine", response.json()['text'])
+        response = self.client.post(reverse('recipe', args=[self.recipe.id]), {'ingredient_id': self.pk("Butter")})
+        self.assertIn("Margarine", response.json()['text'])
+        self.assertEqual(Substitution.objects.count(), 0)
+
+    def test_command(self):
+        """Test that the command builds the index and prints the neighbours of an ingredient."""
+        out = StringIO()
+        call_command('build_ingredient_index', '--dimensions', '4', '--query', 'butter', stdout=out)
+        self.assertIn("Indexed 15 ingredient(s) in 4 dimensions", out.getvalue())
+        self.assertIn("\tFlour", out.getvalue())
@@ -0,0 +1,97 @@
+"""Tests for the database-backed job queue."""
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+from webpage.models import Job
+from webpage.modules import job_queue
+from webpage.modules.status_code import JobStatus
+
+calls = []
+
+
+@job_queue.job_handler('test_succeed')
+def succeed(job):
+    """Record the job and succeed."""
+    calls.append(job.payload)
+
+
+@job_queue.job_handler('test_fail')
+def fail(job):
+    """Always fail."""
+    raise ValueError("boom")
+
+
+class JobQueueTest(TestCase):
+    """Test enqueuing, claiming and running jobs."""
+
+    def setUp(self):
+        """Reset the recorded handler calls."""
+        calls.clear()
+
+    def test_enqueue(self):
+        """Test that a new job is queued with the default number of attempts."""
+        user = User.objects.create_user(username="worker_test")
+        job = job_queue.enqueue('test_succeed', {'a': 1}, user=user)
+        self.assertEqual(job.status, JobStatus.QUEUED.value[0])
+        self.assertEqual(job.max_attempts, job_queue.MAX_ATTEMPTS)
+        self.assertEqual(job.user, user)
+
+    def test_claim_job_marks_running(self):
+        """Test that claiming a job locks it and counts the attempt."""
+        job = job_queue.enqueue('test_succeed')
+        claimed = job_queue.claim_job("worker-1")
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(claimed.status, JobStatus.RUNNING.value[0])
+        self.assertEqual(claimed.attempts, 1)
+        self.assertEqual(claimed.locked_by, "worker-1")
+        self.assertIsNone(job_queue.claim_job("worker-2"))
+
+    def test_claim_job_skips_future_jobs(self):
+        """Test that a job waiting for a retry is not claimed early."""
+        Job.objects.create(kind='test_succeed', run_after=timezone.now() + timedelta(minutes=5))
+        self.assertIsNone(job_queue.claim_job("worker-1"))
+
+    def test_work_success(self):
+        """Test that a successful job is marked as done."""
+        job = job_queue.enqueue('test_succeed', {'a': 1})
+        self.assertTrue(job_queue.work("worker-1"))
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.DONE.value[0])
+        self.assertEqual(calls, [{'a': 1}])
+        self.assertFalse(job_queue.work("worker-1"))
+
+    def test_work_failure_is_retried_later(self):
+        """Test that a failed job goes back to the queue with a backoff delay."""
+        job = job_queue.enqueue('test_fail')
+        job_queue.work("worker-1")
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.QUEUED.value[0])
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn("boom", job.last_error)
+
+    def test_work_failure_dead_letter(self):
+        """Test that a job is marked as dead once it runs out of attempts."""
+        job = job_queue.enqueue('test_fail', max_attempts=1)
+        job_queue.work("worker-1")
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.DEAD.value[0])
+
+    def test_unknown_kind_is_dead(self):
+        """Test that a job without a handler is not retried."""
+        job = job_queue.enqueue('test_unknown')
+        job_queue.work("worker-1")
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.DEAD.value[0])
+
+    def test_retry_delay_is_exponential(self):
+        """Test the backoff delay between attempts."""
+        self.assertEqual(job_queue.retry_delay(2), 2 * job_queue.retry_delay(1))
+
+    def test_requeue_stale_jobs(self):
+        """Test that a job abandoned by a dead worker is queued again."""
+        job = Job.objects.create(kind='test_succeed', status=JobStatus.RUNNING.value[0],
+                                 locked_at=timezone.now() - timedelta(hours=1), locked_by="gone")
+        self.assertEqual(job_queue.requeue_stale_jobs(60), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.QUEUED.value[0])
@@ -0,0 +1,25 @@
+"""Tests for reading the JSON of model responses that are not valid JSON by themselves."""
+from django.test import TestCase
+from webpage.modules.json_repair import load, repair
+
+
+class JSONRepairTest(TestCase):
+    """Test repairing the usual mistakes of the model."""
+
+    def test_valid_json_is_not_repaired(self):
+        """Test that valid JSON is read as it is."""
+        self.assertEqual(load('{"nutrients": []}'), ({"nutrients": []}, False))
+
+    def test_repairs(self):
+        """Test that code fences, surrounding text and trailing commas are dropped."""
+        for text in ['```json\n[{"name": "Milk"}]\n```', 'Here you go: [{"name": "Milk"}] Enjoy!',
+                     '[{"name": "Milk",},]', '```\n[{"name": "Milk"}]\n``` and more [1]']:
+            self.assertEqual(load(text), ([{"name": "Milk"}], True), text)
+        self.assertEqual(repair('Sure! {"nutrients": [{"name": "Fat"}]} {"extra": 1}'),
+                         {"nutrients": [{"name": "Fat"}]})
+
+    def test_unrepairable(self):
+        """Test that text without complete JSON raises ValueError."""
+        for text in ["Easy", '[{"name": "Milk"', "```\nno json\n```"]:
+            with self.assertRaises(ValueError):
+                load(text)
@@ -0,0 +1,161 @@
+"""Tests for routing the GPT calls to the models of their task after the latency and error objectives."""
+import time
+from unittest.mock import patch
+import httpx
+import openai
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import TestCase
+from openai import OpenAI
+from webpage.models import Recipe, Ingredient, IngredientList, GPTCallStat, RoutingDecision
+from webpage.modules.ai_advisor import AIRecipeAdvisor
+from webpage.modules.fake_openai import FakeOpenAIServer
+from webpage.modules.gpt_cache import default_cache
+from webpage.modules.model_router import ModelRouter, Route
+from webpage.modules.resilience import default_breaker
+from webpage.modules.telemetry import collector
+
+
+class FakeClock:
+    """A clock that only moves when told to."""
+
+    def __init__(self):
+        """Start at 0."""
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        """Return the current time."""
+        return self.now
+
+
+def status_error(status: int) -> openai.APIStatusError:
+    """
+    Build the error of a response with a status code.
+
+    :param status: The HTTP status code.
+    :return: The error.
+    """
+    response = httpx.Response(status, request=httpx.Request('POST', 'http://fake/v1/chat/completions'))
+    return openai.APIStatusError("Fake error", response=response, body=None)
+
+
+class ModelRouterTest(TestCase):
+    """Test the demotion, probing and restoration of the models."""
+
+    def setUp(self):
+        """Create a router with two models for the difficulty and a fake clock."""
+        self.clock = FakeClock()
+        self.router = ModelRouter({'difficulty': ['big', 'small']}, slo_seconds=1, slo_error_rate=0.5, window=4,
+                                  min_requests=3, probe_after=60, clock=self.clock)
+
+    def send(self, seconds: float, count: int, error: BaseException | None = None) -> list[str]:
+        """
+        Route some difficulty requests that all take as long.
+
+        :param seconds: The seconds each request takes.
+        :param count: The number of requests.
+        :param error: The error each request raises, None for none.
+        :return: The model of each request.
+        """
+        models = []
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(count):
+                route = self.router.choose('difficulty')
+                self.router.record(route, seconds, error)
+                models.append(route.model)
+        return models
+
+    def test_slow_primary_is_demoted_probed_and_restored(self):
+        """Test that a slow primary hands over to the fallback until it is fast again."""
+        self.assertEqual(self.send(2, 3), ['big'] * 3)
+        self.assertEqual(self.router.choose('difficulty'), Route('difficulty', 'small', fallback=True))
+        self.assertEqual(self.send(0.1, 2), ['small'] * 2)
+        self.clock.now = 60
+        self.assertEqual(self.send(0.1, 3), ['big'] * 3)
+        self.assertEqual(self.router.choose('difficulty'), Route('difficulty', 'big'))
+        decisions = list(RoutingDecision.objects.order_by('id').values_list('model', 'action', 'routed_to'))
+        self.assertEqual(decisions, [('big', 'demote', 'small'), ('big', 'probe', 'big'), ('big', 'restore', 'big')])
+        self.assertEqual(RoutingDecision.objects.first().reason, "p95 2.00s > 1.00s")
+
+    def test_failures(self):
+        """Test that retryable errors count against the objective and rejected requests do not."""
+        self.assertEqual(self.send(0.1, 4, status_error(400)), ['big'] * 4)
+        self.assertEqual(self.send(0.1, 3, status_error(503)), ['big'] * 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.router.choose('difficulty').model, 'small')
+        self.assertEqual(RoutingDecision.objects.get().reason, "error rate 75% > 50%")
+
+    def test_every_model_demoted(self):
+        """Test that the last model is used once every model of the chain breaches its objective."""
+        self.send(2, 3)
+        self.assertEqual(self.send(2, 4), ['small'] * 4)
+        self.assertEqual(self.router.choose('difficulty'), Route('difficulty', 'small', fallback=True))
+        self.assertEqual(RoutingDecision.objects.filter(action='demote').count(), 2)
+
+    def test_decisions_wait_for_the_commit(self):
+        """Test that the decisions made in a transaction are written after it commits, and kept if it rolls back."""
+        with self.assertRaises(ValueError), transaction.atomic():
+            for _ in range(3):
+                self.router.record(self.router.choose('difficulty'), 2)
+            self.assertEqual(self.router.choose('difficulty').model, 'small')
+            self.assertFalse(RoutingDecision.objects.exists())
+            raise ValueError("rolled back")
+        self.assertEqual(self.router.flush(), 1)
+        self.assertEqual(RoutingDecision.objects.get().action, 'demote')
+
+    def test_task_without_route(self):
+        """Test that a task without models keeps the model of its handler."""
+        self.assertEqual(self.router.choose('nutrition', 'gpt-4o'), Route('nutrition', 'gpt-4o'))
+
+
+class RoutedAdvisorTest(TestCase):
+    """Test the advisor against a local stub whose primary model is slow."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a recipe with an ingredient."""
+        user = User.objects.create_user(username="routed", password="password123")
+        cls.recipe = Recipe.objects.create(name="Soup", description="Hot", poster_id=user)
+        IngredientList.objects.create(recipe=cls.recipe, ingredient=Ingredient.objects.create(name="Water"),
+                                      amount=1, unit="l")
+
+    def setUp(self):
+        """Start the stub and route the difficulty to a slow model, then a fast one, without the cache."""
+        self.server = FakeOpenAIServer(self.answer).start()
+        self.addCleanup(self.server.stop)
+        self.router = ModelRouter({'difficulty': ['slow-model', 'fast-model']}, slo_seconds=0.05, min_requests=2)
+        for patcher in [patch('webpage.modules.gpt_handler.client',
+                              OpenAI(base_url=self.server.url, api_key="fake", max_retries=0)),
+                        patch('webpage.modules.ai_advisor.default_router', self.router),
+                        patch.object(default_cache, 'ttls', {})]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for clear in [collector.clear, default_breaker.reset]:
+            clear()
+            self.addCleanup(clear)
+
+    @staticmethod
+    def answer(body: dict) -> str:
+        """
+        Answer slowly as the slow model.
+
+        :param body: The JSON body of the request.
+        :return: The difficulty, Hard from the slow model and Easy from the fast one.
+        """
+        if body['model'] == 'slow-model':
+            time.sleep(0.1)
+            return "Hard"
+        return "Easy"
+
+    def test_falls_back_to_the_fast_model(self):
+        """Test that the calls move to the fallback once the primary breaches its latency objective."""
+        with self.captureOnCommitCallbacks(execute=True):
+            difficulties = [AIRecipeAdvisor(self.recipe).difficulty_calculator() for _ in range(4)]
+        self.assertEqual(difficulties, ["Hard", "Hard", "Easy", "Easy"])
+        self.assertEqual([body['model'] for body in self.server.requests],
+                         ['slow-model', 'slow-model', 'fast-model', 'fast-model'])
+        decision = RoutingDecision.objects.get()
+        self.assertEqual((decision.task, decision.model, decision.routed_to), ('difficulty', 'slow-model', 'fast-model'))
+        collector.flush()
+        stats = {row.model: (row.calls, row.fallbacks) for row in GPTCallStat.objects.filter(method='difficulty_calculator')}
+        self.assertEqual(stats, {'slow-model': (2, 0), 'fast-model': (2, 2)})
@@ -0,0 +1,144 @@
+"""Tests for the local nutrition engine."""
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest.mock import Mock, patch
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from webpage.models import Recipe, Ingredient, IngredientList, IngredientNutrient, Job, RecipeStep
+from webpage.modules.batch_enrichment import apply_results, select_recipes, submit_batch
+from webpage.modules.builder import NormalRecipeBuilder
+from webpage.modules.nutrition_engine import estimate_many, estimate_nutrition, learn_ingredient_nutrients, merge_nutrients, \
+    recipe_nutrients
+from webpage.modules.recipe_enrichment import process_assessment
+from webpage.modules.units import normalize_unit, to_grams
+
+WIDGET_INGREDIENTS = [
+    {"name": "flour", "amount": 100, "unit": "g",
+     "nutrients": [{"name": "Calories", "amount": 364, "unit": "kcal"}, {"name": "Protein", "amount": 10, "unit": "g"}]},
+    {"name": "butter", "amount": 1, "unit": "Tbsp",
+     "nutrients": [{"name": "Calories", "amount": 106, "unit": "kcal"}]},
+    {"name": "egg", "amount": 1, "unit": "large", "nutrients": [{"name": "Calories", "amount": 72, "unit": "kcal"}]},
+]
+
+
+class UnitsTest(TestCase):
+    """Test the unit conversion."""
+
+    def test_to_grams(self):
+        """Test that masses and volumes are converted and counts are not."""
+        self.assertEqual(normalize_unit("Tbsps"), "tbsp")
+        self.assertEqual(normalize_unit(" Cups "), "cup")
+        self.assertAlmostEqual(to_grams(2, "kilograms"), 2000)
+        self.assertAlmostEqual(to_grams(1, "cups"), 236.588)
+        self.assertIsNone(to_grams(2, "slice"))
+        self.assertIsNone(to_grams(2, ""))
+
+
+class NutritionEngineTest(TestCase):
+    """Test learning the nutrients of ingredients and calculating the nutrition of recipes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create the ingredients and two recipes."""
+        cls.user = User.objects.create_user(username="cook", password="password123")
+        cls.flour = Ingredient.objects.create(name="Flour")
+        cls.butter = Ingredient.objects.create(name="Butter")
+        cls.egg = Ingredient.objects.create(name="Egg")
+        cls.saffron = Ingredient.objects.create(name="Saffron")
+        cls.bread = Recipe.objects.create(name="Bread", poster_id=cls.user)
+        IngredientList.objects.create(recipe=cls.bread, ingredient=cls.flour, amount=500, unit="g")
+        IngredientList.objects.create(recipe=cls.bread, ingredient=cls.butter, amount=2, unit="tbsp")
+        cls.rice = Recipe.objects.create(name="Rice", poster_id=cls.user)
+        IngredientList.objects.create(recipe=cls.rice, ingredient=cls.flour, amount=0.1, unit="kg")
+        IngredientList.objects.create(recipe=cls.rice, ingredient=cls.saffron, amount=1, unit="g")
+        IngredientList.objects.create(recipe=cls.rice, ingredient=cls.egg, amount=2, unit="slices")
+
+    def setUp(self):
+        """Learn the nutrients from an imported recipe."""
+        learn_ingredient_nutrients(WIDGET_INGREDIENTS)
+
+    def test_learn(self):
+        """Test that the nutrients are stored per gram and averaged over the samples."""
+        self.assertFalse(IngredientNutrient.objects.filter(ingredient=self.egg).exists())
+        row = IngredientNutrient.objects.get(ingredient=self.flour, nutrition__name="Calories")
+        self.assertAlmostEqual(row.per_gram, 3.64)
+        learn_ingredient_nutrients([dict(WIDGET_INGREDIENTS[0], amount=200)])
+        row.refresh_from_db()
+        self.assertEqual(row.samples, 2)
+        self.assertAlmostEqual(row.per_gram, (3.64 + 1.82) / 2)
+
+    def test_estimate_many(self):
+        """Test that the recipes are calculated with two queries and the unknown ingredients are listed."""
+        with self.assertNumQueries(2):
+            estimates = estimate_many([self.bread.id, self.rice.id])
+        bread = estimates[self.bread.id]
+        self.assertTrue(bread.complete)
+        self.assertEqual(bread.nutrients, [
+            {'name': "Calories", 'amount': round(500 * 3.64 + 2 * 106, 2), 'unit': "kcal"},
+            {'name': "Protein", 'amount': 50.0, 'unit': "g"},
+        ])
+        rice = estimates[self.rice.id]
+        self.assertEqual(rice.unknown, ["Saffron, amount: 1.00 g", "Egg, amount: 2.00 slices"])
+        self.assertEqual([nutrient['amount'] for nutrient in rice.nutrients], [364.0, 10.0])
+
+    def test_merge_nutrients(self):
+        """Test that nutrients with the same name and unit are added up."""
+        merged = merge_nutrients([{'name': "Calories", 'amount': 10, 'unit': "kcal"}],
+                                 [{'name': "calories", 'amount': 5.5, 'unit': "kcal"},
+                                  {'name': "Iron", 'amount': 1, 'unit': "mg"}])
+        self.assertEqual(merged, [{'name': "Calories", 'amount': 15.5, 'unit': "kcal"},
+                                  {'name': "Iron", 'amount': 1.0, 'unit': "mg"}])
+
+    @patch('webpage.modules.ai_advisor.AIRecipeAdvisor.recipe_assessment')
+    def test_gpt_only_for_unknown_ingredients(self, mock_assessment):
+        """Test that GPT is only asked about the ingredients the engine does not know, and not at all when it knows them all."""
+        mock_assessment.return_value = {"difficulty": "Easy", "approved": True,
+                                        "nutrients": [{"name": "Calories", "amount": 150, "unit": "kcal"}]}
+        RecipeStep.objects.create(recipe=self.bread, number=1, description="Knead the dough and bake it.")
+        RecipeStep.objects.create(recipe=self.rice, number=1, description="Simmer the rice with the saffron.")
+        builder = NormalRecipeBuilder.from_recipe(self.bread)
+        process_assessment(builder, Job(payload={'done': []}))()
+        mock_assessment.assert_called_once_with(("difficulty", "approved"), None)
+        self.assertEqual([(row.nutrition.name, float(row.amount)) for row in self.bread.nutritionlist_set.order_by('id')],
+                         [(nutrient['name'], nutrient['amount'])
+                          for nutrient in estimate_many([self.bread.id])[self.bread.id].nutrients])
+
+        mock_assessment.reset_mock()
+        builder = NormalRecipeBuilder.from_recipe(self.rice)
+        process_assessment(builder, Job(payload={'done': ['difficulty']}))()
+        mock_assessment.assert_called_once_with(("nutrients", "approved"),
+                                                ["Saffron, amount: 1.00 g", "Egg, amount: 2.00 slices"])
+        self.assertEqual(recipe_nutrients(estimate_nutrition(self.rice.id), mock_assessment.return_value)[0],
+                         {'name': "Calories", 'amount': 514.0, 'unit': "kcal"})
+
+    def test_batch_asks_only_for_unknown_ingredients(self):
+        """Test that a batch adds GPT's nutrients of the unknown ingredients to the local estimate, as the enrichment does."""
+        backend = Mock(submit=Mock(return_value="batch_1"))
+        backend.name = 'local'
+        with tempfile.TemporaryDirectory() as directory:
+            batch = submit_batch(backend, select_recipes(['nutrition']), ['nutrition'], directory=directory)
+            with open(batch.input_file, encoding='utf-8') as file:
+                lines = [json.loads(line) for line in file]
+        self.assertEqual([line['custom_id'] for line in lines], [f"recipe-{self.rice.id}"])
+        question = lines[0]['body']['messages'][1]['content'][0]['text']
+        self.assertIn("Estimate the nutrients of these ingredients only:\n- Saffron, amount: 1.00 g", question)
+        self.assertEqual(float(self.bread.nutritionlist_set.get(nutrition__name="Protein").amount), 50.0)
+
+        answer = {'status_code': 200, 'body': {'choices': [{'message': {'content': json.dumps(
+            {"nutrients": [{"name": "Calories", "amount": 150, "unit": "kcal", "percentOfDailyNeeds": 7}]})}}]}}
+        self.assertEqual(apply_results(batch, [{'custom_id': f"recipe-{self.rice.id}", 'response': answer}]), (1, 0))
+        self.assertEqual(float(self.rice.nutritionlist_set.get(nutrition__name="Calories").amount), 514.0)
+
+    def test_load_command(self):
+        """Test that a CSV dataset is loaded per gram and used for a recipe."""
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write("ingredient,nutrient,unit,per_100g\nSaffron,Calories,kcal,310\nEgg,Calories,kcal,143\n")
+        self.addCleanup(os.remove, file.name)
+        out = StringIO()
+        call_command('nutrition_table', load=file.name, recipe=self.rice.id, stdout=out)
+        self.assertIn("Loaded 2 nutrient row(s)", out.getvalue())
+        self.assertIn("Calories\t367.1 kcal", out.getvalue())
+        self.assertIn("Unknown: Egg, amount: 2.00 slices", out.getvalue())
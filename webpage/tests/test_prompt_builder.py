@@ -0,0 +1,92 @@
+"""Tests for the token budget and compaction of the advisor prompts."""
+import json
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from openai import OpenAI
+from unittest.mock import patch
+from webpage.management.commands.compare_prompts import FIXTURES, create_recipe
+from webpage.models import Recipe
+from webpage.modules import prompt_builder
+from webpage.modules.ai_advisor import AIRecipeAdvisor
+from webpage.modules.fake_openai import FakeOpenAIServer
+from webpage.modules.gpt_cache import default_cache
+from webpage.modules.prompt_builder import PromptBuilder, count_tokens, first_sentence, truncate, unique_lines
+from webpage.modules.telemetry import collector
+
+
+class PromptBuilderTest(TestCase):
+    """Test shortening the prompts and what it saves."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create the fixture recipes."""
+        user = User.objects.create_user(username="compactor", password="password123")
+        with open(FIXTURES, encoding='utf-8') as file:
+            cls.recipes = [create_recipe(fixture, user) for fixture in json.load(file)]
+
+    def test_helpers(self):
+        """Test counting, cutting and merging the text."""
+        self.assertEqual(count_tokens("Whisk the eggs, then fold."), 8)
+        self.assertEqual(count_tokens("caramelization"), 4)
+        self.assertEqual(first_sentence("Sear the beef. Then rest it!"), "Sear the beef.")
+        self.assertEqual(truncate("one two three four five", 4), "one two three...")
+        self.assertEqual(truncate("short", 3), "short")
+        self.assertEqual(unique_lines(["Salt,  1 tsp", "Egg", "salt, 1 tsp"]), ["Salt, 1 tsp (x2)", "Egg"])
+
+    def test_budget(self):
+        """Test that the lowest priorities are shortened first, and the others never."""
+        steps = [f"Step {number} is long. " + "word " * 40 for number in range(10)]
+        prompt = PromptBuilder(budget=120, compact=True).add("Keep me") \
+            .add("A description. " + "more " * 50, priority=0) \
+            .add(steps, header="Steps:", numbered=True, priority=1).add("Unneeded", optional=True).build()
+        self.assertLessEqual(prompt.tokens, 120)
+        self.assertTrue(prompt.startswith("Keep me\nA description.\nSteps:\n1. Step 0 is long."))
+        self.assertNotIn("Unneeded", prompt)
+        self.assertGreater(prompt.saved_tokens, 400)
+        verbatim = PromptBuilder(budget=120, compact=False).add("a  b").add("c", optional=True).build()
+        self.assertEqual((verbatim, verbatim.saved_tokens), ("a  b\nc", 0))
+
+    def test_advisor_prompts(self):
+        """Test that every prompt of the fixture recipes fits its budget and keeps what the call needs."""
+        for recipe in self.recipes:
+            verbatim = AIRecipeAdvisor(recipe)
+            verbatim.compact = False
+            verbatim_prompts = verbatim.prompts()
+            for call_type, (_, prompt) in AIRecipeAdvisor(recipe).prompts().items():
+                self.assertLessEqual(prompt.tokens, prompt_builder.BUDGETS[call_type], (recipe.name, call_type))
+                self.assertEqual(prompt.tokens + prompt.saved_tokens, verbatim_prompts[call_type][1].tokens)
+        wellington = AIRecipeAdvisor(self.recipes[0]).prompts()
+        self.assertIn("salt, amount: 1.00 teaspoon (x2)", wellington["nutrition"][1])
+        self.assertNotIn("Description", wellington["difficulty"][1])
+        self.assertIn("12. Slice into thick portions", wellington["approval"][1])
+        self.assertGreater(wellington["assessment"][1].saved_tokens, 100)
+        self.assertTrue(verbatim_prompts["nutrition"][1].endswith("\n"))
+
+    def test_saved_tokens_recorded(self):
+        """Test that the tokens saved are recorded with the call."""
+        collector.clear()
+        self.addCleanup(collector.clear)
+        with patch('webpage.modules.gpt_handler.GPTHandler.generate', return_value="Hard"), \
+                patch('webpage.modules.difficulty_model.get_model', return_value=None):
+            AIRecipeAdvisor(self.recipes[0]).difficulty_calculator()
+        stats = next(iter(collector.snapshot().values()))
+        self.assertGreater(stats.saved_prompt_tokens, 0)
+
+    def test_compare_command(self):
+        """Test that the command rolls its recipes back and compares the answers against the fake model."""
+        count = Recipe.objects.count()
+        out = StringIO()
+        call_command('compare_prompts', stdout=out)
+        self.assertIn("Classic Beef Wellington\tassessment\t", out.getvalue())
+        self.assertIn("Total: ", out.getvalue())
+        self.assertEqual(Recipe.objects.count(), count)
+
+        default_cache.clear_memory()
+        with FakeOpenAIServer("Hard") as server, \
+                patch('webpage.modules.gpt_handler.client', OpenAI(base_url=server.url, api_key="fake", max_retries=0)):
+            call_command('compare_prompts', '--live', stdout=out)
+        self.assertIn("Overnight Oats With Berries\tdifficulty\t", out.getvalue())
+        self.assertIn("expected Easy, got Hard", out.getvalue())
+        self.assertIn("answers agree", out.getvalue())
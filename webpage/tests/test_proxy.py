@@ -403,6 +403,28 @@ class GetDataSpoonacularTest(TestCase):
         with self.assertRaises(Exception):
             self.get_data_spoonacular.find_by_spoonacular_id(123450)
 
+    @patch('requests.get')
+    def test_find_by_spoonacular_id_failure_leaves_nothing(self, mock_get):
+        """Test that a lookup failing after the first API call does not write anything."""
+        recipe_count = Recipe.objects.count()
+        mock_get.side_effect = [Mock(status_code=200, json=Mock(return_value={"id": 123450, "title": "soup"})),
+                                Mock(status_code=402)]
+        with self.assertRaises(Exception):
+            self.get_data_spoonacular.find_by_spoonacular_id(123450)
+        self.assertEqual(Recipe.objects.count(), recipe_count)
+
+    @patch('webpage.modules.ai_advisor.AIRecipeAdvisor.difficulty_calculator')
+    @patch('requests.get')
+    def test_find_by_spoonacular_id_skips_difficulty(self, mock_get, mock_difficulty):
+        """Test that the import does not wait for the AI, leaving the difficulty to the ai_enrich command."""
+        mock_get.return_value = Mock(status_code=200)
+        mock_get.return_value.json.return_value = {"id": 123450, "title": "soup", "readyInMinutes": 10,
+                                                   "image": "soup.jpg", "summary": "Hot soup."}
+        recipe = self.get_data_spoonacular.find_by_spoonacular_id(123450)
+        self.assertEqual(Recipe.objects.get(spoonacular_id=123450), recipe)
+        self.assertEqual(recipe.difficulty, "Unknown")
+        mock_difficulty.assert_not_called()
+
     @patch('requests.get')
     def test_filter_recipe_success(self, mock_get):
         """Test filtering recipes with a successful response."""
@@ -0,0 +1,84 @@
+"""Tests for the unit registry and the normalized quantities of ingredient lines."""
+import math
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from webpage.models import Recipe, Ingredient, IngredientList
+from webpage.modules.quantities import normalize_queryset, shopping_list
+from webpage.modules.units import convert
+
+
+class ConvertTest(TestCase):
+    """Test the vectorized conversion."""
+
+    def test_convert(self):
+        """Test that masses, volumes and counts are converted with the densities and piece weights."""
+        quantities = convert([2, 1, 3, 4, 1], ["kg", "cups", "Tbsps", "slices", "handful"],
+                             densities=[None, 0.5, None, None, None], piece_weights=[None, None, None, 25, None])
+        self.assertEqual(list(quantities['unit_key']), ["kg", "cup", "tbsp", "slice", "handful"])
+        self.assertEqual(quantities['grams'][0], 2000)
+        self.assertAlmostEqual(quantities['grams'][1], 118.294)
+        self.assertAlmostEqual(quantities['milliliters'][1], 236.588)
+        self.assertAlmostEqual(quantities['grams'][2], 44.3604)
+        self.assertEqual((quantities['grams'][3], quantities['pieces'][3]), (100, 4))
+        self.assertTrue(math.isnan(quantities['pieces'][0]))
+        self.assertTrue(all(math.isnan(quantities[field][4]) for field in ['grams', 'milliliters', 'pieces']))
+
+    def test_convert_nothing(self):
+        """Test that an empty input gives empty arrays."""
+        self.assertEqual(len(convert([], [])['grams']), 0)
+
+
+class NormalizedQuantitiesTest(TestCase):
+    """Test storing and adding up the normalized quantities."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create two recipes sharing ingredients."""
+        cls.user = User.objects.create_user(username="cook", password="password123")
+        cls.flour = Ingredient.objects.create(name="Flour", density=0.53)
+        cls.bread = Ingredient.objects.create(name="Bread")
+        cls.salt = Ingredient.objects.create(name="Salt")
+        cls.toast = Recipe.objects.create(name="Toast", poster_id=cls.user)
+        cls.cake = Recipe.objects.create(name="Cake", poster_id=cls.user)
+        cls.slices = IngredientList.objects.create(recipe=cls.toast, ingredient=cls.bread, amount=2, unit="slice")
+        IngredientList.objects.create(recipe=cls.toast, ingredient=cls.salt, amount=1, unit="")
+        IngredientList.objects.create(recipe=cls.cake, ingredient=cls.flour, amount=1, unit="cup")
+        IngredientList.objects.create(recipe=cls.cake, ingredient=cls.flour, amount=100, unit="grams")
+
+    def test_save_normalizes(self):
+        """Test that saving a line stores its quantities."""
+        line = IngredientList.objects.get(recipe=self.cake, unit="cup")
+        self.assertEqual(line.unit_key, "cup")
+        self.assertAlmostEqual(line.grams, 236.588 * 0.53)
+        self.assertAlmostEqual(line.milliliters, 236.588)
+        self.assertIsNone(line.pieces)
+
+    def test_piece_weight_change_normalizes_lines(self):
+        """Test that setting the piece weight of an ingredient converts its lines again."""
+        self.assertIsNone(IngredientList.objects.get(pk=self.slices.pk).grams)
+        self.bread.piece_weight = 30
+        self.bread.save()
+        self.assertEqual(IngredientList.objects.get(pk=self.slices.pk).grams, 60)
+
+    def test_normalize_queryset(self):
+        """Test that the lines are converted in batches without loading the model instances."""
+        IngredientList.objects.update(unit_key='', grams=None, milliliters=None, pieces=None)
+        self.assertEqual(normalize_queryset(IngredientList.objects.all(), batch_size=3), 4)
+        self.assertEqual(IngredientList.objects.get(pk=self.slices.pk).pieces, 2)
+        self.assertEqual(IngredientList.objects.filter(grams__isnull=False).count(), 2)
+
+    def test_shopping_list(self):
+        """Test that the quantities of the same ingredient are added up and scaled."""
+        items = {item['name']: item for item in shopping_list([self.toast.id, self.cake.id], scale=2)}
+        self.assertEqual(items["Flour"]['grams'], round((236.588 * 0.53 + 100) * 2, 2))
+        self.assertEqual(items["Bread"]['pieces'], 4)
+        self.assertIsNone(items["Bread"]['grams'])
+        self.assertEqual(items["Salt"]['unmeasured'], 1)
+
+    def test_command(self):
+        """Test that the command only converts the selected lines."""
+        out = StringIO()
+        call_command('normalize_units', ingredient=[self.flour.id], stdout=out)
+        self.assertIn("Normalized 2 ingredient line(s)", out.getvalue())
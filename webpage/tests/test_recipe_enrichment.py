@@ -0,0 +1,159 @@
+"""Tests for the background enrichment of submitted recipes."""
+import json
+from unittest.mock import patch
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+from webpage.models import Recipe, Job, Ingredient, IngredientList, RecipeStep
+from webpage.modules import job_queue
+from webpage.modules.recipe_enrichment import enqueue_enrichment
+from webpage.modules.status_code import StatusCode, JobStatus
+
+NUTRIENTS = [{"name": "Calories", "amount": 100, "unit": "kcal", "percentOfDailyNeeds": 5}]
+ASSESSMENT = {"difficulty": "Easy", "nutrients": NUTRIENTS, "approved": True}
+
+
+class AddRecipeViewTest(TestCase):
+    """Test that submitting a recipe only saves it and queues the slow steps."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a user."""
+        cls.user = User.objects.create_user(username="submitter", password="password123")
+
+    @patch('webpage.modules.gpt_handler.GPTHandler.generate')
+    @patch('webpage.modules.recipe_enrichment.upload_image_to_imgur')
+    def test_submit_returns_accepted_without_network(self, mock_upload, mock_generate):
+        """Test that the submission returns 202 and does not call Imgur or GPT."""
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('add_recipe'), {
+            'name': "Toast",
+            'description': "Crispy bread",
+            'estimated_time': 5,
+            'ingredients_data': json.dumps(["2 slice bread", "10 g butter"]),
+            'equipment_data': json.dumps(["1 toaster"]),
+            'steps_data': json.dumps(["Toast the bread", "Spread the butter"]),
+            'photo': SimpleUploadedFile("toast.jpg", b"image-bytes", content_type="image/jpeg"),
+        })
+        self.assertEqual(response.status_code, 202)
+        mock_upload.assert_not_called()
+        mock_generate.assert_not_called()
+        recipe = Recipe.objects.get(id=response.json()['recipe_id'])
+        self.assertEqual(recipe.status, StatusCode.PENDING.value[0])
+        self.assertEqual(recipe.get_ingredients().count(), 2)
+        job = Job.objects.get(id=response.json()['job_id'])
+        self.assertEqual(bytes(job.attachment), b"image-bytes")
+
+        status = self.client.get(response.json()['status_url']).json()
+        self.assertEqual(status['status'], JobStatus.QUEUED.value[0])
+        self.assertEqual(status['recipe_id'], recipe.id)
+
+    def test_blank_rows_are_skipped(self):
+        """Test that blank ingredient and equipment rows do not fail the submission."""
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('add_recipe'), {
+            'name': "Toast",
+            'description': "Crispy bread",
+            'estimated_time': 5,
+            'ingredients_data': json.dumps(["2 slice bread", "", "2 g  "]),
+            'equipment_data': json.dumps(["1 toaster", "   "]),
+            'steps_data': json.dumps(["Toast the bread"]),
+        })
+        self.assertEqual(response.status_code, 202)
+        recipe = Recipe.objects.get(id=response.json()['recipe_id'])
+        self.assertEqual([row.ingredient.name for row in recipe.get_ingredients()], ["bread"])
+        self.assertEqual(recipe.get_equipments().count(), 1)
+        self.assertFalse(Ingredient.objects.filter(normalized_name="").exists())
+
+    def test_job_status_of_other_user(self):
+        """Test that a user cannot read the job of someone else."""
+        other = User.objects.create_user(username="other", password="password123")
+        job = job_queue.enqueue('enrich_recipe', {'recipe_id': 0}, user=other)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('job_status', args=[job.id]))
+        self.assertEqual(response.status_code, 404)
+
+
+class EnrichRecipeTest(TestCase):
+    """Test the enrichment job handler."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a pending recipe."""
+        cls.user = User.objects.create_user(username="submitter", password="password123")
+        cls.recipe = Recipe.objects.create(name="Toast", description="Crispy bread", poster_id=cls.user)
+        IngredientList.objects.create(recipe=cls.recipe, ingredient=Ingredient.objects.create(name="Bread"),
+                                      amount=2, unit="slice")
+        RecipeStep.objects.create(recipe=cls.recipe, number=1, description="Toast the bread")
+
+    @patch('webpage.modules.ai_advisor.AIRecipeAdvisor.recipe_assessment', return_value=ASSESSMENT)
+    @patch('webpage.modules.recipe_enrichment.upload_image_to_imgur', return_value="https://i.imgur.com/toast.jpg")
+    def test_enrich_recipe(self, mock_upload, mock_assessment):
+        """Test that every step is applied to the recipe."""
+        job = enqueue_enrichment(self.recipe, self.user, image=b"image-bytes")
+        job_queue.work("worker-1")
+        job.refresh_from_db()
+        self.recipe.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.DONE.value[0])
+        self.assertIsNone(job.attachment)
+        self.assertEqual(mock_assessment.call_count, 1)
+        self.assertEqual(self.recipe.image, "https://i.imgur.com/toast.jpg")
+        self.assertEqual(self.recipe.difficulty, "Easy")
+        self.assertEqual(self.recipe.status, StatusCode.APPROVE.value[0])
+        self.assertTrue(self.recipe.AI_status)
+        self.assertEqual(self.recipe.get_nutrition().first().nutrition.name, "Calories")
+
+    @patch('webpage.modules.ai_advisor.AIRecipeAdvisor.recipe_assessment')
+    @patch('webpage.modules.recipe_enrichment.upload_image_to_imgur', return_value="https://i.imgur.com/toast.jpg")
+    def test_retry_resumes_after_failed_step(self, mock_upload, mock_assessment):
+        """Test that a retried job does not repeat the steps that already succeeded."""
+        mock_assessment.side_effect = [Exception("LLM down"), dict(ASSESSMENT, difficulty="Hard", approved=False)]
+        job = enqueue_enrichment(self.recipe, self.user, image=b"image-bytes")
+        job_queue.work("worker-1")
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.QUEUED.value[0])
+        self.assertEqual(job.payload['done'], ['image'])
+
+        Job.objects.filter(pk=job.pk).update(run_after=job.created_at)
+        job_queue.work("worker-1")
+        job.refresh_from_db()
+        self.recipe.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.DONE.value[0])
+        self.assertEqual(mock_upload.call_count, 1)
+        self.assertEqual(self.recipe.difficulty, "Hard")
+        self.assertEqual(self.recipe.status, StatusCode.PENDING.value[0])
+        self.assertFalse(self.recipe.AI_status)
+        self.assertEqual(self.recipe.get_nutrition().count(), 1)
+
+    @patch('webpage.modules.ai_advisor.AIRecipeAdvisor.recipe_assessment')
+    @patch('webpage.modules.recipe_enrichment.upload_image_to_imgur')
+    def test_network_calls_run_outside_the_step_transaction(self, mock_upload, mock_assessment):
+        """Test that Imgur and GPT are called without a transaction of the step open."""
+        depth = len(connection.atomic_blocks)
+        depths = []
+
+        def upload(*args):
+            depths.append(len(connection.atomic_blocks))
+            return "https://i.imgur.com/toast.jpg"
+
+        def assess(*args, **kwargs):
+            depths.append(len(connection.atomic_blocks))
+            return ASSESSMENT
+
+        mock_upload.side_effect = upload
+        mock_assessment.side_effect = assess
+        enqueue_enrichment(self.recipe, self.user, image=b"image-bytes")
+        job_queue.work("worker-1")
+        self.assertEqual(depths, [depth, depth])
+
+    @patch('webpage.modules.ai_advisor.AIRecipeAdvisor.recipe_assessment', return_value=ASSESSMENT)
+    def test_job_from_separate_steps_is_not_repeated(self, mock_assessment):
+        """Test that a job queued with the old separate steps does not add its nutrition twice."""
+        job = enqueue_enrichment(self.recipe, self.user)
+        Job.objects.filter(pk=job.pk).update(payload={'recipe_id': self.recipe.id, 'done': ['image', 'nutrition']})
+        job_queue.work("worker-1")
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.get_nutrition().count(), 0)
+        self.assertEqual(self.recipe.difficulty, "Easy")
@@ -0,0 +1,164 @@
+"""Tests for the recipe detail snapshot."""
+from unittest.mock import patch
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from webpage.models import Recipe, RecipeSnapshot, Ingredient, IngredientList, RecipeStep, Diet, Favourite, Profile
+from webpage.modules import job_queue
+from webpage.modules.recipe_snapshot import build_snapshot_data, get_snapshot, mark_stale, rebuild_snapshot, \
+    SNAPSHOT_VERSION
+from webpage.modules.status_code import StatusCode
+
+
+class RecipeSnapshotTest(TestCase):
+    """Test building, invalidating and serving recipe snapshots."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create an approved recipe with an ingredient, a step and a diet."""
+        cls.user = User.objects.create_user(username="chef", password="password123")
+        cls.recipe = Recipe.objects.create(
+            name="Pancake",
+            description="Fluffy",
+            poster_id=cls.user,
+            status=StatusCode.APPROVE.value[0]
+        )
+        cls.flour = Ingredient.objects.create(name="Flour")
+        IngredientList.objects.create(recipe=cls.recipe, ingredient=cls.flour, amount=200, unit="g")
+        RecipeStep.objects.create(recipe=cls.recipe, number=2, description="Fry")
+        RecipeStep.objects.create(recipe=cls.recipe, number=1, description="Mix")
+        cls.recipe.diets.add(Diet.objects.get_or_create(name="Vegetarian")[0])
+
+    def test_get_snapshot_builds_data(self):
+        """Test that the snapshot contains what the detail page shows."""
+        data = get_snapshot(self.recipe.id)
+        self.assertEqual(data['name'], "Pancake")
+        self.assertEqual(data['poster'], {'id': self.user.id, 'username': "chef", 'chef_badge': False})
+        self.assertEqual(data['diets'], ["Vegetarian"])
+        self.assertEqual(data['ingredients'][0]['ingredient']['name'], "Flour")
+        self.assertEqual(data['ingredients'][0]['amount'], "200.00")
+        self.assertEqual([step['description'] for step in data['steps']], ["Mix", "Fry"])
+        self.assertEqual(RecipeSnapshot.objects.get(recipe=self.recipe).version, SNAPSHOT_VERSION)
+
+    def test_get_snapshot_missing_recipe(self):
+        """Test that a missing recipe has no snapshot."""
+        self.assertIsNone(get_snapshot(0))
+
+    def test_child_change_marks_stale(self):
+        """Test that adding a step flags the snapshot and the next read rebuilds it."""
+        rebuild_snapshot(self.recipe.id)
+        RecipeStep.objects.create(recipe=self.recipe, number=3, description="Serve")
+        self.assertTrue(RecipeSnapshot.objects.get(recipe=self.recipe).stale)
+        self.assertEqual(len(get_snapshot(self.recipe.id)['steps']), 3)
+        self.assertFalse(RecipeSnapshot.objects.get(recipe=self.recipe).stale)
+
+    def test_diet_change_marks_stale(self):
+        """Test that changing the diets of the recipe flags the snapshot."""
+        rebuild_snapshot(self.recipe.id)
+        self.recipe.diets.clear()
+        self.assertEqual(get_snapshot(self.recipe.id)['diets'], [])
+
+    def test_catalog_change_marks_stale_and_queues_rebuild(self):
+        """Test that renaming an ingredient flags every recipe using it and queues a rebuild."""
+        rebuild_snapshot(self.recipe.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.flour.name = "Wheat Flour"
+            self.flour.save()
+        self.assertTrue(RecipeSnapshot.objects.get(recipe=self.recipe).stale)
+        job_queue.work("worker-1")
+        snapshot = RecipeSnapshot.objects.get(recipe=self.recipe)
+        self.assertFalse(snapshot.stale)
+        self.assertEqual(snapshot.data['ingredients'][0]['ingredient']['name'], "Wheat Flour")
+
+    def test_upserted_picture_marks_stale(self):
+        """Test that a bulk upsert changing a picture flags the recipes using it, and one keeping it does not."""
+        rebuild_snapshot(self.recipe.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.upsert_many([{'name': "flour", 'picture': "flour.jpg"}], update_fields=['picture'])
+        self.assertTrue(RecipeSnapshot.objects.get(recipe=self.recipe).stale)
+        job_queue.work("worker-1")
+        snapshot = RecipeSnapshot.objects.get(recipe=self.recipe)
+        self.assertEqual(snapshot.data['ingredients'][0]['ingredient']['picture'], "flour.jpg")
+        Ingredient.upsert_many([{'name': "Flour", 'picture': "flour.jpg"}], update_fields=['picture'])
+        self.assertFalse(RecipeSnapshot.objects.get(recipe=self.recipe).stale)
+
+    def test_profile_change_marks_stale(self):
+        """Test that earning the chef badge shows up on the poster's recipes."""
+        rebuild_snapshot(self.recipe.id)
+        Profile.objects.create(user=self.user, chef_badge=True)
+        self.assertTrue(get_snapshot(self.recipe.id)['poster']['chef_badge'])
+
+    def test_username_change_marks_stale(self):
+        """Test that renaming the poster flags the snapshot, and that logging in does not."""
+        rebuild_snapshot(self.recipe.id)
+        self.client.login(username="chef", password="password123")
+        self.user.save()
+        self.assertFalse(RecipeSnapshot.objects.get(recipe=self.recipe).stale)
+        self.user.username = "head chef"
+        self.user.save()
+        self.assertEqual(get_snapshot(self.recipe.id)['poster']['username'], "head chef")
+
+    def test_change_during_rebuild_is_not_overwritten(self):
+        """Test that a snapshot flagged while it is rebuilt is built again rather than saved with the old data."""
+        rebuild_snapshot(self.recipe.id)
+        mark_stale(recipe_id=self.recipe.id)
+        calls = []
+
+        def build_then_change(recipe_id):
+            data = build_snapshot_data(recipe_id)
+            if not calls:
+                RecipeStep.objects.create(recipe=self.recipe, number=3, description="Serve")
+            calls.append(recipe_id)
+            return data
+
+        with patch('webpage.modules.recipe_snapshot.build_snapshot_data', side_effect=build_then_change):
+            snapshot = rebuild_snapshot(self.recipe.id)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(snapshot.data['steps']), 3)
+        stored = RecipeSnapshot.objects.get(recipe=self.recipe)
+        self.assertFalse(stored.stale)
+        self.assertEqual(len(stored.data['steps']), 3)
+
+    def test_rebuild_gives_up_while_the_recipe_keeps_changing(self):
+        """Test that a snapshot flagged during every rebuild stays stale."""
+        def build_then_change(recipe_id):
+            data = build_snapshot_data(recipe_id)
+            mark_stale(recipe_id=recipe_id)
+            return data
+
+        with patch('webpage.modules.recipe_snapshot.build_snapshot_data', side_effect=build_then_change), \
+                self.assertLogs("Recipe snapshot", level="WARNING"):
+            snapshot = rebuild_snapshot(self.recipe.id)
+        self.assertEqual(snapshot.data['name'], "Pancake")
+        self.assertTrue(RecipeSnapshot.objects.get(recipe=self.recipe).stale)
+
+    def test_outdated_version_is_rebuilt(self):
+        """Test that a snapshot from an older version is rebuilt lazily."""
+        rebuild_snapshot(self.recipe.id)
+        RecipeSnapshot.objects.filter(recipe=self.recipe).update(version=SNAPSHOT_VERSION - 1, data={})
+        self.assertEqual(get_snapshot(self.recipe.id)['name'], "Pancake")
+
+    def test_detail_view_reads_snapshot(self):
+        """Test that a warm detail page needs the snapshot lookup and the favourite check only."""
+        rebuild_snapshot(self.recipe.id)
+        Favourite.objects.create(recipe=self.recipe, user=self.user)
+        self.client.force_login(self.user)
+        url = reverse('recipe', args=[self.recipe.id])
+        self.client.get(url)
+        # Session, user, snapshot and favourite.
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Pancake")
+        self.assertEqual(response.context['user_favourites'], [self.recipe.id])
+
+    def test_detail_view_pending_recipe_of_other_user(self):
+        """Test that a pending recipe is hidden from other users."""
+        Recipe.objects.filter(id=self.recipe.id).update(status=StatusCode.PENDING.value[0])
+        response = self.client.get(reverse('recipe', args=[self.recipe.id]))
+        self.assertRedirects(response, reverse('recipe_list'), fetch_redirect_response=False)
+
+    def test_detail_view_missing_recipe(self):
+        """Test that a missing recipe returns 404."""
+        response = self.client.get(reverse('recipe', args=[0]))
+        self.assertEqual(response.status_code, 404)
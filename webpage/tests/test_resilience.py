@@ -0,0 +1,168 @@
+"""Tests for the deadlines, backoff and circuit breaker of the GPT requests."""
+import time
+from unittest.mock import patch
+import httpx
+import openai
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from openai import OpenAI
+from webpage.models import Recipe, Ingredient, IngredientList
+from webpage.modules.ai_advisor import AIRecipeAdvisor
+from webpage.modules.fake_openai import FakeOpenAIServer
+from webpage.modules.gpt_cache import default_cache
+from webpage.modules.gpt_handler import GPTHandler
+from webpage.modules.resilience import CircuitBreaker, CircuitOpenError, Deadline, DeadlineExceeded, \
+    GPTUnavailable, backoff_delay, default_breaker, is_retryable
+from webpage.modules.status_code import StatusCode
+
+
+class FakeClock:
+    """A clock that only moves when told to."""
+
+    def __init__(self):
+        """Start at 0."""
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        """Return the current time."""
+        return self.now
+
+
+def status_error(status: int) -> openai.APIStatusError:
+    """
+    Build the error of a response with a status code.
+
+    :param status: The HTTP status code.
+    :return: The error.
+    """
+    response = httpx.Response(status, request=httpx.Request('POST', 'http://fake/v1/chat/completions'))
+    return openai.APIStatusError("Fake error", response=response, body=None)
+
+
+class ResilienceTest(TestCase):
+    """Test the building blocks without a model."""
+
+    def test_is_retryable(self):
+        """Test that outages are retried and invalid requests are not."""
+        self.assertTrue(is_retryable(status_error(503)))
+        self.assertTrue(is_retryable(status_error(429)))
+        self.assertTrue(is_retryable(openai.APITimeoutError(request=httpx.Request('POST', 'http://fake'))))
+        self.assertFalse(is_retryable(status_error(400)))
+        self.assertFalse(is_retryable(status_error(401)))
+        self.assertFalse(is_retryable(KeyError("choices")))
+
+    def test_backoff_delay(self):
+        """Test that the waits grow with the attempts up to the cap."""
+        with patch('webpage.modules.resilience.random.uniform', side_effect=lambda low, high: high):
+            self.assertEqual([backoff_delay(attempt, base=0.5, cap=3) for attempt in range(4)], [0.5, 1, 2, 3])
+
+    def test_deadline(self):
+        """Test that the requests and waits of a call fit in its deadline."""
+        clock = FakeClock()
+        deadline = Deadline(10, clock=clock)
+        self.assertEqual(deadline.timeout(limit=4), 4)
+        clock.now = 8
+        self.assertEqual(deadline.timeout(limit=4), 2)
+        with patch('webpage.modules.resilience.backoff_delay', return_value=3), self.assertRaises(DeadlineExceeded):
+            deadline.backoff(2)
+        clock.now = 10
+        with self.assertRaises(DeadlineExceeded):
+            deadline.timeout()
+
+    def test_breaker(self):
+        """Test that the breaker opens after consecutive failures and closes after a successful trial request."""
+        clock = FakeClock()
+        breaker = CircuitBreaker(threshold=3, cooldown=30, clock=clock)
+        breaker.record(status_error(503))
+        breaker.record(status_error(400))
+        breaker.record(status_error(503))
+        breaker.record(status_error(503))
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.record(status_error(503))
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError) as raised:
+            breaker.before_call()
+        self.assertEqual(raised.exception.retry_after, 30)
+
+        clock.now = 31
+        self.assertTrue(breaker.before_call())
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record(status_error(503), trial=True)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        clock.now = 62
+        with breaker.guard():
+            pass
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+class ResilientAdvisorTest(TestCase):
+    """Test the advisor against a fake model server that fails."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create an approved recipe with an ingredient."""
+        cls.user = User.objects.create_user(username="resilient", password="password123")
+        cls.recipe = Recipe.objects.create(name="Soup", description="Hot", poster_id=cls.user,
+                                           status=StatusCode.APPROVE.value[0])
+        cls.water = Ingredient.objects.create(name="Water")
+        IngredientList.objects.create(recipe=cls.recipe, ingredient=cls.water, amount=1, unit="l")
+
+    def setUp(self):
+        """Start the fake server with an empty cache, a closed breaker and no waits between retries."""
+        self.server = FakeOpenAIServer("Easy").start()
+        self.addCleanup(self.server.stop)
+        self.client_api = OpenAI(base_url=self.server.url, api_key="fake", max_retries=0)
+        for patcher in [patch('webpage.modules.gpt_handler.client', self.client_api),
+                        patch('webpage.modules.resilience.backoff_delay', return_value=0)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        default_cache.clear_memory()
+        self.addCleanup(default_cache.clear_memory)
+        default_breaker.reset()
+        self.addCleanup(default_breaker.reset)
+
+    def test_retries_server_errors(self):
+        """Test that a brief outage is retried."""
+        self.server.errors = [503, 502]
+        self.assertEqual(AIRecipeAdvisor(self.recipe).difficulty_calculator(), "Easy")
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_does_not_retry_invalid_requests(self):
+        """Test that a request the API rejects is not sent again."""
+        self.server.errors = [400]
+        with self.assertRaises(Exception):
+            AIRecipeAdvisor(self.recipe).difficulty_calculator()
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_deadline_bounds_the_call(self):
+        """Test that a slow model is abandoned when the deadline of the call passes."""
+        self.server.delay = 1
+        start = time.monotonic()
+        with patch('webpage.modules.ai_advisor.Deadline', lambda: Deadline(0.3)), self.assertRaises(GPTUnavailable):
+            AIRecipeAdvisor(self.recipe).difficulty_calculator()
+        self.assertLess(time.monotonic() - start, 0.9)
+
+    def test_breaker_fails_fast(self):
+        """Test that an open breaker stops the requests, while cached answers are still served."""
+        handler = GPTHandler("context", "gpt-4o-mini", temperature=0, client=self.client_api,
+                             breaker=CircuitBreaker(threshold=2, cooldown=60))
+        self.assertEqual(handler.generate("cached"), "Easy")
+        self.server.errors = [503] * 5
+        for _ in range(2):
+            with self.assertRaises(openai.InternalServerError):
+                handler.generate("soup")
+        with self.assertRaises(CircuitOpenError):
+            handler.generate("soup")
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(handler.generate("cached"), "Easy")
+
+    def test_view_when_unavailable(self):
+        """Test that the page is told to try again later while the breaker is open."""
+        for _ in range(default_breaker.threshold):
+            default_breaker.record(status_error(503))
+        response = self.client.post(reverse('recipe', args=[self.recipe.id]), {'ingredient_id': self.water.id})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.server.requests, [])
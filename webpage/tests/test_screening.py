@@ -0,0 +1,109 @@
+"""Tests for the rules screening submitted recipes before GPT."""
+from unittest.mock import patch
+from django.contrib.auth.models import User
+from django.test import TestCase
+from webpage.models import Recipe, Ingredient, IngredientList, RecipeStep, ScreeningDecision
+from webpage.modules import job_queue
+from webpage.modules.recipe_enrichment import enqueue_enrichment
+from webpage.modules.screening import evaluate, screen
+from webpage.modules.status_code import ScreeningVerdict, StatusCode
+
+STEPS = ["Whisk the eggs with the milk and a pinch of salt.", "Cook them slowly in butter, stirring all the time."]
+
+
+class ScreeningTest(TestCase):
+    """Test rejecting junk, flagging copies and skipping GPT for both."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create an approved recipe of scrambled eggs."""
+        cls.user = User.objects.create_user(username="moderated", password="password123")
+        cls.ingredients = [Ingredient.objects.create(name=name) for name in ["Egg", "Milk", "Salt", "Butter"]]
+        cls.original = cls.recipe("Scrambled eggs", status=StatusCode.APPROVE.value[0])
+
+    @classmethod
+    def recipe(cls, name: str, steps: list[str] = STEPS, ingredients: int = 4, description: str = "Soft and creamy",
+               status: str = StatusCode.PENDING.value[0]) -> Recipe:
+        """
+        Create a recipe.
+
+        :param name: The name.
+        :param steps: The descriptions of the steps.
+        :param ingredients: The number of ingredients, taken in order.
+        :param description: The description.
+        :param status: The status.
+        :return: The recipe.
+        """
+        recipe = Recipe.objects.create(name=name, description=description, poster_id=cls.user, status=status)
+        for number, step in enumerate(steps, start=1):
+            RecipeStep.objects.create(recipe=recipe, number=number, description=step)
+        for ingredient in cls.ingredients[:ingredients]:
+            IngredientList.objects.create(recipe=recipe, ingredient=ingredient, amount=1, unit="cup")
+        return recipe
+
+    def assertVerdict(self, recipe: Recipe, verdict: ScreeningVerdict, rule: str = ''):
+        """
+        Assert what the rules decide about a recipe.
+
+        :param recipe: The recipe.
+        :param verdict: The expected verdict.
+        :param rule: The expected rule.
+        """
+        result = evaluate(recipe)
+        self.assertEqual((result.verdict, result.rule), (verdict.value[0], rule), result.detail)
+
+    def test_junk_is_rejected(self):
+        """Test that recipes without ingredients or steps, or with nonsense or rude names, are rejected."""
+        self.assertVerdict(self.recipe("Omelette", ingredients=0), ScreeningVerdict.REJECT, 'no_ingredients')
+        self.assertVerdict(self.recipe("Omelette", steps=["  "]), ScreeningVerdict.REJECT, 'no_steps')
+        for name in ["!!", "Tastyyyyyy", "Sdfghjk soup", "Cheap pills www.spam.example"]:
+            self.assertVerdict(self.recipe(name, steps=["Fry it all."]), ScreeningVerdict.REJECT, 'nonsense_name')
+        self.assertVerdict(self.recipe("Shitty eggs", steps=["Fry it all."]), ScreeningVerdict.REJECT, 'profanity')
+
+    def test_suspicious_text_is_flagged(self):
+        """Test that rude words and links in the text are left to the moderators."""
+        self.assertVerdict(self.recipe("Fried eggs", steps=["Fry the damn eggs, shit."]),
+                           ScreeningVerdict.FLAG, 'profanity')
+        self.assertVerdict(self.recipe("Fried eggs", steps=["Fry."], description="https://a.example https://b.example"),
+                           ScreeningVerdict.FLAG, 'links')
+        self.assertVerdict(self.recipe("Fried eggs", steps=["Fry the eggs in butter."]), ScreeningVerdict.PASS)
+
+    def test_copies(self):
+        """Test that an exact copy is rejected and a near copy of an approved recipe is flagged."""
+        copy = self.recipe(" scrambled  EGGS")
+        self.assertVerdict(copy, ScreeningVerdict.REJECT, 'exact_copy')
+        self.assertEqual(evaluate(copy).duplicate_of, self.original.pk)
+        near = self.recipe("Grandma's eggs", steps=[*STEPS, "Serve at once."])
+        self.assertVerdict(near, ScreeningVerdict.FLAG, 'near_copy')
+        self.assertVerdict(self.recipe("Eggs and milk", ingredients=2), ScreeningVerdict.PASS)
+        self.assertVerdict(self.recipe("Other eggs", steps=["Boil the eggs for ten minutes, then peel them."]),
+                           ScreeningVerdict.PASS)
+
+    def test_first_of_two_pending_copies_survives(self):
+        """Test that of two identical submissions only the later one is a copy."""
+        first = self.recipe("Pancakes", steps=["Mix and fry."], ingredients=3)
+        second = self.recipe("Pancakes", steps=["Mix and fry."], ingredients=3)
+        self.assertVerdict(first, ScreeningVerdict.PASS)
+        self.assertVerdict(second, ScreeningVerdict.REJECT, 'exact_copy')
+
+    def test_decisions_are_logged(self):
+        """Test that every decision is stored with its rule."""
+        screen(self.recipe("Fried eggs", steps=["Fry the eggs in butter."]))
+        screen(self.recipe("zzzzzz"))
+        self.assertEqual(list(ScreeningDecision.objects.order_by('id').values_list('verdict', 'rule')),
+                         [("pass", ""), ("reject", "nonsense_name")])
+
+    @patch('webpage.modules.ai_advisor.AIRecipeAdvisor.recipe_assessment')
+    def test_enrichment_skips_gpt(self, mock_assessment):
+        """Test that rejected and flagged submissions are decided without GPT."""
+        junk = self.recipe("Omelette", ingredients=0)
+        near = self.recipe("Grandma's eggs", steps=[*STEPS, "Serve at once."])
+        for recipe in [junk, near]:
+            enqueue_enrichment(recipe, self.user)
+            job_queue.work("worker-1")
+            recipe.refresh_from_db()
+            self.assertIsNotNone(recipe.enriched_at)
+            self.assertFalse(recipe.AI_status)
+        self.assertEqual(junk.status, StatusCode.REJECTED.value[0])
+        self.assertEqual(near.status, StatusCode.PENDING.value[0])
+        mock_assessment.assert_not_called()
@@ -0,0 +1,230 @@
+"""Tests for sharing one execution between concurrent identical external calls."""
+import asyncio
+import threading
+import time
+from datetime import timedelta
+from unittest.mock import Mock, patch
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from openai import OpenAI
+from webpage.models import FlightLock, Recipe
+from webpage.modules import gpt_handler
+from webpage.modules.ai_advisor import run_concurrently
+from webpage.modules.fake_openai import FakeOpenAIServer, constant
+from webpage.modules.gpt_cache import default_cache
+from webpage.modules.gpt_handler import AsyncGPTHandler, GPTHandler
+from webpage.modules.proxy import GetDataProxy
+from webpage.modules.resilience import default_breaker
+from webpage.modules.single_flight import SingleFlight
+from webpage.modules.telemetry import collector
+
+
+def hold_lock(key: str, seconds: float = 60) -> FlightLock:
+    """
+    Hold the lock of a key as another worker would.
+
+    :param key: The key of the call.
+    :param seconds: The seconds until the lock expires, negative for an abandoned lock.
+    :return: The lock row.
+    """
+    return FlightLock.objects.create(key=key, token="other", expires_at=timezone.now() + timedelta(seconds=seconds))
+
+
+class SingleFlightTest(TestCase):
+    """Test the sharing of a call in the process."""
+
+    def run_together(self, flight: SingleFlight, call, callers: int = 3) -> list:
+        """
+        Call do from several threads at once, the first call lasting until every other caller waits for it.
+
+        :param flight: The single flight.
+        :param call: The call, run after the others started waiting.
+        :param callers: The number of threads.
+        :return: The result or the error of each caller.
+        """
+        def leader():
+            while flight.waiters("key") < callers - 1:
+                time.sleep(0.01)
+            return call()
+
+        outcomes = []
+
+        def caller():
+            try:
+                outcomes.append(flight.do("key", leader))
+            except Exception as e:
+                outcomes.append(e)
+
+        threads = [threading.Thread(target=caller) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+
+    def test_concurrent_calls_share_one_run(self):
+        """Test that the callers waiting for a running call get its result without running it."""
+        call = Mock(return_value="recipe")
+        self.assertEqual(self.run_together(SingleFlight(), call), ["recipe"] * 3)
+        self.assertEqual(call.call_count, 1)
+
+    def test_error_is_shared(self):
+        """Test that the error of the call is raised to every caller waiting for it."""
+        call = Mock(side_effect=ValueError("API down"))
+        outcomes = self.run_together(SingleFlight(), call)
+        self.assertEqual([str(outcome) for outcome in outcomes], ["API down"] * 3)
+        self.assertEqual(call.call_count, 1)
+
+    def test_awaited_calls_share_one_run(self):
+        """Test that concurrent awaited calls with the same key share one run, and its error."""
+        flight = SingleFlight()
+        runs = []
+
+        async def call():
+            runs.append(1)
+            await asyncio.sleep(0.01)
+            return "recipe"
+
+        async def fail():
+            runs.append(1)
+            await asyncio.sleep(0.01)
+            raise ValueError("API down")
+
+        async def main():
+            results = await asyncio.gather(*(flight.ado("key", call) for _ in range(3)))
+            errors = await asyncio.gather(*(flight.ado("key", fail) for _ in range(3)), return_exceptions=True)
+            return results, errors
+
+        results, errors = asyncio.run(main())
+        self.assertEqual(results, ["recipe"] * 3)
+        self.assertEqual([str(error) for error in errors], ["API down"] * 3)
+        self.assertEqual(len(runs), 2)
+
+
+class CrossWorkerFlightTest(TransactionTestCase):
+    """Test the sharing of a call across workers, through lock rows committed outside any transaction."""
+
+    def test_waits_for_another_worker(self):
+        """Test that a call held by another worker is not run again once its result is stored."""
+        hold_lock("key")
+        stored = {}
+
+        def other_worker_finishes(seconds):
+            stored['result'] = "recipe"
+            FlightLock.objects.filter(key="key").delete()
+
+        call = Mock(return_value="again")
+        flight = SingleFlight(sleep=other_worker_finishes)
+        self.assertEqual(flight.do("key", call, lookup=lambda: stored.get('result')), "recipe")
+        call.assert_not_called()
+        self.assertFalse(FlightLock.objects.exists())
+
+    def test_result_committed_after_the_release(self):
+        """Test that a result stored just after the other worker released its lock is found without running the call."""
+        hold_lock("key")
+        stored = []
+
+        def other_worker(seconds):
+            # The first wait releases the lock, the result only commits during the next one.
+            if not FlightLock.objects.filter(token="other").delete()[0]:
+                stored.append("recipe")
+
+        call = Mock(return_value="again")
+        self.assertEqual(SingleFlight(sleep=other_worker).do("key", call, lookup=lambda: stored[0] if stored else None),
+                         "recipe")
+        call.assert_not_called()
+
+    def test_runs_after_another_worker_failed(self):
+        """Test that the call is run once the other worker released the lock without a result."""
+        hold_lock("key")
+        flight = SingleFlight(sleep=lambda seconds: FlightLock.objects.filter(key="key").delete())
+        self.assertEqual(flight.do("key", lambda: "recipe", lookup=lambda: None), "recipe")
+        self.assertFalse(FlightLock.objects.exists())
+
+    def test_abandoned_lock_is_taken_over(self):
+        """Test that an expired lock does not keep the call waiting."""
+        hold_lock("key", seconds=-1)
+        sleep = Mock()
+        self.assertEqual(SingleFlight(sleep=sleep).do("key", lambda: "recipe", lookup=lambda: None), "recipe")
+        sleep.assert_not_called()
+        self.assertFalse(FlightLock.objects.exists())
+
+    def test_gives_up_waiting(self):
+        """Test that the call is run without the lock once the wait timeout passed."""
+        hold_lock("key")
+        now = [0.0]
+
+        def sleep(seconds):
+            now[0] += seconds
+
+        flight = SingleFlight(poll_interval=1, wait_timeout=3, clock=lambda: now[0], sleep=sleep)
+        with self.assertLogs("Single flight", level="WARNING"):
+            self.assertEqual(flight.do("key", lambda: "recipe", lookup=lambda: None), "recipe")
+        self.assertEqual(now[0], 3)
+        self.assertEqual(FlightLock.objects.get().token, "other")
+
+    def test_not_shared_across_workers_in_a_transaction(self):
+        """Test that a call in a transaction neither waits for the lock row of another worker nor writes its own."""
+        hold_lock("key")
+        sleep = Mock()
+        with transaction.atomic():
+            self.assertEqual(SingleFlight(sleep=sleep).do("key", lambda: "recipe", lookup=lambda: None), "recipe")
+        sleep.assert_not_called()
+        self.assertEqual(FlightLock.objects.get().token, "other")
+
+
+class SharedImportTest(TransactionTestCase):
+    """Test that a Spoonacular recipe imported by another worker is not requested again."""
+
+    def test_waits_for_the_import_of_another_worker(self):
+        """Test that the proxy returns the recipe the other worker saved, without calling the service."""
+        user = User.objects.create_user(username="importer")
+        hold_lock("spoonacular:716429")
+
+        def other_worker_imports(seconds):
+            Recipe.objects.create(name="Pasta", description="Imported", poster_id=user, spoonacular_id=716429)
+            FlightLock.objects.filter(key="spoonacular:716429").delete()
+
+        service = Mock()
+        with patch('webpage.modules.proxy.default_flight', SingleFlight(sleep=other_worker_imports)):
+            recipe = GetDataProxy(service).find_by_spoonacular_id(716429)
+        self.assertEqual(recipe.name, "Pasta")
+        service.find_by_spoonacular_id.assert_not_called()
+
+
+class SharedGPTCallTest(TransactionTestCase):
+    """Test that concurrent identical GPT calls send one request to a local stub."""
+
+    def setUp(self):
+        """Start a slow stub and forget the cached responses and calls of the other tests."""
+        self.server = FakeOpenAIServer("Easy", latency=constant(0.1)).start()
+        self.addCleanup(self.server.stop)
+        previous = gpt_handler.BASE_URL
+        gpt_handler.use_base_url(self.server.url)
+        self.addCleanup(gpt_handler.use_base_url, previous)
+        for clear in [default_cache.clear_memory, collector.clear, default_breaker.reset]:
+            clear()
+            self.addCleanup(clear)
+
+    def test_awaited_calls_send_one_request(self):
+        """Test that identical calls awaited together get the response of a single request."""
+        handlers = [AsyncGPTHandler("Rate the difficulty", "gpt-4o-mini", temperature=0) for _ in range(3)]
+        answers = run_concurrently(*(handler.agenerate("Soup") for handler in handlers))
+        self.assertEqual(answers, ["Easy"] * 3)
+        self.assertEqual(self.server.counts['requests'], 1)
+
+    def test_reuses_the_response_of_another_worker(self):
+        """Test that a call waiting for another worker reads its cached response instead of asking the model."""
+        def other_worker_answers(seconds):
+            default_cache.set(key, "Hard", handler.call_type, handler.model)
+            default_cache.clear_memory()
+            FlightLock.objects.filter(key=f"gpt:{key}").delete()
+
+        handler = GPTHandler("Rate the difficulty", "gpt-4o-mini", temperature=0, flight=SingleFlight(sleep=other_worker_answers),
+                             client=OpenAI(base_url=self.server.url, api_key="fake", max_retries=0))
+        key = handler.cache_key("Soup")
+        hold_lock(f"gpt:{key}")
+        self.assertEqual(handler.generate("Soup"), "Hard")
+        self.assertEqual(self.server.counts['requests'], 0)
@@ -0,0 +1,57 @@
+"""Tests for the negative cache of Spoonacular recipe ids."""
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch, Mock
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from webpage.models import SpoonacularMiss
+from webpage.modules.builder import SpoonacularAPIError
+from webpage.modules.proxy import GetDataProxy, GetDataSpoonacular
+from webpage.modules.spoonacular_miss import record_miss, find_miss, NOT_FOUND_TTL, ERROR_TTL
+
+
+class SpoonacularMissTest(TestCase):
+    """Test remembering and skipping Spoonacular ids that failed to load."""
+
+    def setUp(self):
+        """Create the proxy."""
+        self.proxy = GetDataProxy(GetDataSpoonacular())
+
+    @patch('requests.get')
+    def test_failed_id_is_not_requested_again(self, mock_get):
+        """Test that a 404 is remembered and the next lookup does not call the API."""
+        mock_get.return_value = Mock(status_code=404)
+        with self.assertRaises(SpoonacularAPIError):
+            self.proxy.find_by_spoonacular_id(404404)
+        self.assertEqual(mock_get.call_count, 1)
+
+        with self.assertRaises(SpoonacularAPIError) as context:
+            self.proxy.find_by_spoonacular_id(404404)
+        self.assertEqual(context.exception.status_code, 404)
+        self.assertEqual(mock_get.call_count, 1)
+        miss = SpoonacularMiss.objects.get(spoonacular_id=404404)
+        self.assertEqual(miss.reason, "HTTP 404")
+        self.assertEqual(miss.hits, 1)
+
+    def test_ttl_depends_on_reason(self):
+        """Test that a 404 is remembered longer than a temporary failure."""
+        not_found = record_miss(1, SpoonacularAPIError("HTTP 404", 404))
+        quota = record_miss(2, SpoonacularAPIError("HTTP 402", 402))
+        self.assertAlmostEqual((not_found.expires_at - not_found.failed_at).total_seconds(), NOT_FOUND_TTL)
+        self.assertAlmostEqual((quota.expires_at - quota.failed_at).total_seconds(), ERROR_TTL)
+
+    def test_expired_miss_is_ignored(self):
+        """Test that an id is requested again once its failure expired."""
+        SpoonacularMiss.objects.create(spoonacular_id=3, reason="HTTP 500", expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertIsNone(find_miss(3))
+
+    def test_command_lists_and_clears(self):
+        """Test inspecting and clearing the failures with the command."""
+        record_miss(5, SpoonacularAPIError("HTTP 404", 404))
+        record_miss(6, SpoonacularAPIError("HTTP 404", 404))
+        out = StringIO()
+        call_command('spoonacular_misses', stdout=out)
+        self.assertIn("5\tHTTP 404", out.getvalue())
+        call_command('spoonacular_misses', 5, clear=True, stdout=StringIO())
+        self.assertEqual(list(SpoonacularMiss.objects.values_list('spoonacular_id', flat=True)), [6])
@@ -0,0 +1,95 @@
+"""Tests for the substitution knowledge base of alternative ingredients."""
+import json
+from unittest.mock import patch
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from webpage.models import Recipe, Ingredient, IngredientList, Diet, Cuisine, Substitution
+from webpage.modules.status_code import StatusCode
+from webpage.modules.substitutions import find_substitution, remember, similarity
+
+ALTERNATIVES = [{"name": "Coconut oil", "description": "Solid at room temperature.", "amount": 1, "unit": "cup"}]
+
+
+class SubstitutionTest(TestCase):
+    """Test reusing the alternatives between recipes with similar diets and cuisines."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create vegan cookies, vegan muffins and plain cookies, all with butter."""
+        user = User.objects.create_user(username="baker", password="password123")
+        cls.butter = Ingredient.objects.create(name="Butter")
+        vegan = Diet.objects.get_or_create(name="Vegan")[0]
+        american = Cuisine.objects.get_or_create(name="American")[0]
+        cls.cookies = cls.recipe("Vegan cookies", user, amount=1)
+        cls.muffins = cls.recipe("Vegan muffins", user, amount=0.5)
+        cls.plain = cls.recipe("Cookies", user, amount=1)
+        for recipe in [cls.cookies, cls.muffins]:
+            recipe.diets.add(vegan)
+            recipe.cuisine.add(american)
+        cls.plain.cuisine.add(american)
+
+    @classmethod
+    def recipe(cls, name: str, user: User, amount: float) -> Recipe:
+        """
+        Create an approved recipe with butter.
+
+        :param name: The name of the recipe.
+        :param user: The poster.
+        :param amount: The cups of butter.
+        :return: The recipe.
+        """
+        recipe = Recipe.objects.create(name=name, poster_id=user, status=StatusCode.APPROVE.value[0])
+        IngredientList.objects.create(recipe=recipe, ingredient=cls.butter, amount=amount, unit="cups")
+        return recipe
+
+    def ask(self, recipe: Recipe, **data) -> str:
+        """
+        Ask the recipe page for the alternatives to butter.
+
+        :param recipe: The recipe.
+        :param data: More form fields.
+        :return: The content of the response.
+        """
+        response = self.client.post(reverse('recipe', args=[recipe.id]), {'ingredient_id': self.butter.id, **data})
+        return response.content.decode()
+
+    def test_similarity(self):
+        """Test that an answer is only reused for diets it respects."""
+        substitution = Substitution(diets="vegan", cuisines="american")
+        self.assertEqual(similarity("vegan", "american", substitution), 1)
+        self.assertAlmostEqual(similarity("", "american", substitution), 1 / 3)
+        self.assertAlmostEqual(similarity("vegan", "", substitution), 2 / 3)
+        self.assertEqual(similarity("vegan,gluten free", "american", substitution), 0)
+
+    @patch('webpage.modules.ai_advisor.AIRecipeAdvisor.get_alternative_ingredients', return_value=ALTERNATIVES)
+    def test_reused_for_similar_recipe(self, mock_alternatives):
+        """Test that the answer for one vegan recipe is served, scaled, to another without asking GPT."""
+        self.assertIn("1 cup Coconut oil", self.ask(self.cookies))
+        self.assertIn("0.5 cup Coconut oil", self.ask(self.muffins))
+        self.assertEqual(mock_alternatives.call_count, 1)
+        self.assertEqual(Substitution.objects.get(ingredient=self.butter).hits, 1)
+
+    @patch('webpage.modules.ai_advisor.AIRecipeAdvisor.get_alternative_ingredients', return_value=ALTERNATIVES)
+    def test_new_combinations_ask_gpt(self, mock_alternatives):
+        """Test that a recipe without the diet and a special instruction are asked about, the latter not stored."""
+        remember(self.plain, self.butter, [dict(ALTERNATIVES[0], name="Margarine")])
+        self.assertIsNone(find_substitution(self.cookies, self.butter))
+        self.ask(self.cookies, prompt="No coconut please")
+        self.assertEqual(mock_alternatives.call_count, 1)
+        self.assertEqual(Substitution.objects.count(), 1)
+        self.ask(self.cookies)
+        self.assertEqual(mock_alternatives.call_count, 2)
+        self.assertEqual(Substitution.objects.count(), 2)
+
+    @patch('webpage.modules.ai_advisor.AIRecipeAdvisor.stream_alternative_ingredients')
+    def test_stream_from_store(self, mock_stream):
+        """Test that stored alternatives are streamed without asking GPT."""
+        remember(self.cookies, self.butter, ALTERNATIVES)
+        content = self.client.post(reverse('recipe', args=[self.muffins.id]),
+                                   {'ingredient_id': self.butter.id, 'stream': '1'})
+        events = b"".join(content.streaming_content).decode()
+        self.assertIn(json.dumps({'text': "0.5 cup Coconut oil - Solid at room temperature.",
+                                  'ingredient': dict(ALTERNATIVES[0], amount=0.5)}), events)
+        self.assertTrue(events.endswith("event: done\ndata: {}\n\n"))
+        mock_stream.assert_not_called()
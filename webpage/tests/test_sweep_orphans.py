@@ -0,0 +1,41 @@
+"""Tests for the sweep_orphans command."""
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from webpage.models import Recipe, Ingredient, IngredientList, Equipment
+from webpage.modules.builder import SPOONACULAR_USERNAME
+
+
+class SweepOrphansTest(TestCase):
+    """Test removing partial recipes and unreferenced catalog rows."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a partial import, a complete import, a user recipe and an unused equipment."""
+        spoonacular = User.objects.create_user(username=SPOONACULAR_USERNAME)
+        user = User.objects.create_user(username="cook")
+        cls.partial = Recipe.objects.create(name="", poster_id=spoonacular)
+        cls.imported = Recipe.objects.create(name="Soup", poster_id=spoonacular, spoonacular_id=1)
+        cls.own = Recipe.objects.create(name="Toast", poster_id=user)
+        cls.salt = Ingredient.objects.create(name="Salt")
+        cls.pepper = Ingredient.objects.create(name="Pepper")
+        IngredientList.objects.create(recipe=cls.partial, ingredient=cls.salt, amount=1, unit="g")
+        IngredientList.objects.create(recipe=cls.partial, ingredient=cls.pepper, amount=1, unit="g")
+        IngredientList.objects.create(recipe=cls.imported, ingredient=cls.pepper, amount=1, unit="g")
+        cls.whisk = Equipment.objects.create(name="Whisk")
+
+    def test_sweep(self):
+        """Test that only the partial recipe and the rows nothing uses any more are deleted."""
+        call_command('sweep_orphans', batch_size=1, stdout=StringIO())
+        self.assertQuerySetEqual(Recipe.objects.order_by('id'), [self.imported, self.own])
+        self.assertQuerySetEqual(Ingredient.objects.all(), [self.pepper])
+        self.assertFalse(Equipment.objects.exists())
+
+    def test_dry_run(self):
+        """Test that a dry run only reports the counts."""
+        out = StringIO()
+        call_command('sweep_orphans', dry_run=True, stdout=out)
+        self.assertIn("Would delete 1 orphan recipes", out.getvalue())
+        self.assertIn("Would delete 1 orphan equipment", out.getvalue())
+        self.assertEqual(Recipe.objects.count(), 3)
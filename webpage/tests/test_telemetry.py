@@ -0,0 +1,143 @@
+"""Tests for the statistics of the GPT calls and their report."""
+from io import StringIO
+from unittest.mock import patch
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from openai import OpenAI
+from webpage.models import Recipe, Ingredient, IngredientList, GPTCallStat
+from webpage.modules.ai_advisor import AIRecipeAdvisor, run_concurrently
+from webpage.modules.fake_openai import FakeOpenAIServer
+from webpage.modules.gpt_cache import default_cache
+from webpage.modules.resilience import CircuitOpenError, default_breaker
+from webpage.modules.telemetry import LATENCY_BUCKETS, collector, percentile
+
+
+class TelemetryTest(TestCase):
+    """Test recording the advisor calls against a fake model server."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a recipe with an ingredient."""
+        user = User.objects.create_user(username="measured", password="password123")
+        cls.recipe = Recipe.objects.create(name="Soup", description="Hot", poster_id=user)
+        IngredientList.objects.create(recipe=cls.recipe, ingredient=Ingredient.objects.create(name="Water"),
+                                      amount=1, unit="l")
+
+    def setUp(self):
+        """Start the fake server with an empty cache, collector and breaker, and no waits between retries."""
+        self.server = FakeOpenAIServer("Easy").start()
+        self.addCleanup(self.server.stop)
+        client_api = OpenAI(base_url=self.server.url, api_key="fake", max_retries=0)
+        for patcher in [patch('webpage.modules.gpt_handler.client', client_api),
+                        patch('webpage.modules.resilience.backoff_delay', return_value=0)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for clear in [default_cache.clear_memory, collector.clear, default_breaker.reset]:
+            clear()
+            self.addCleanup(clear)
+        self.today = timezone.localdate()
+
+    def stats(self, method: str, outcome: str):
+        """
+        Return the recorded statistics of a method and outcome.
+
+        :param method: The advisor method.
+        :param outcome: The outcome of the calls.
+        :return: The statistics.
+        """
+        return collector.snapshot()[(self.today, method, "gpt-4o-mini", outcome)]
+
+    def test_records_retries_and_tokens(self):
+        """Test that a call is recorded with its retries, tokens and cost."""
+        self.server.errors = [503]
+        AIRecipeAdvisor(self.recipe).difficulty_calculator()
+        stats = self.stats("difficulty_calculator", "ok")
+        self.assertEqual((stats.calls, stats.retries), (1, 1))
+        self.assertGreater(stats.prompt_tokens, 0)
+        self.assertEqual(stats.completion_tokens, 1)
+        self.assertAlmostEqual(stats.cost, (stats.prompt_tokens * 0.15 + 0.60) / 1_000_000)
+        self.assertEqual(sum(stats.latency_buckets), 1)
+
+    def test_awaited_call_counts_as_the_blocking_one(self):
+        """Test that the awaited variant of a call is recorded under the name of the blocking method."""
+        AIRecipeAdvisor(self.recipe).difficulty_calculator()
+        run_concurrently(AIRecipeAdvisor(self.recipe).adifficulty_calculator())
+        self.assertEqual({key[1:] for key in collector.snapshot()},
+                         {("difficulty_calculator", "gpt-4o-mini", "ok"), ("difficulty_calculator", "gpt-4o-mini", "cached")})
+
+    def test_records_outcomes(self):
+        """Test that cached and refused calls are told apart."""
+        advisor = AIRecipeAdvisor(self.recipe)
+        with patch('webpage.modules.ai_advisor.AIRecipeAdvisor._difficulty_gpt') as gpt:
+            gpt.model = "gpt-4o-mini"
+            gpt.generate.side_effect = CircuitOpenError(10)
+            with self.assertRaises(CircuitOpenError):
+                advisor.difficulty_calculator()
+        self.assertEqual(self.stats("difficulty_calculator", "unavailable").calls, 1)
+        run = AIRecipeAdvisor(self.recipe)
+        run._difficulty_gpt.temperature = 0
+        run.difficulty_calculator()
+        run.difficulty_calculator()
+        self.assertEqual(self.stats("difficulty_calculator", "cached").calls, 1)
+
+    def test_streamed_tokens(self):
+        """Test that the tokens of a streamed answer are counted."""
+        self.server.content = '[{"name": "Milk", "description": "Creamy", "amount": 1, "unit": "cup"}]'
+        list(AIRecipeAdvisor(self.recipe).stream_alternative_ingredients([]))
+        stats = self.stats("stream_alternative_ingredients", "ok")
+        self.assertEqual(stats.completion_tokens, len(self.server.content) // 4)
+
+    def test_structured_alternatives(self):
+        """Test that the alternatives are asked with a schema and repaired or invalid responses are counted."""
+        answers = ['{"alternatives": [{"name": "Milk", "description": "Creamy", "amount": 1, "unit": "cup"}]}']
+        formats = []
+
+        def answer(body: dict) -> str:
+            formats.append(body['response_format'])
+            return answers.pop(0)
+
+        self.server.content = answer
+        self.assertEqual(AIRecipeAdvisor(self.recipe).get_alternative_ingredients([])[0]["name"], "Milk")
+        self.assertEqual(formats[0]["json_schema"]["name"], "alternative_ingredients")
+        self.assertEqual(formats[0]["json_schema"]["schema"]["required"], ["alternatives"])
+        answers.extend(['Sorry, I cannot.', '```json\n[{"name": "Soy milk", "description": "Light", "amount": 1, '
+                        '"unit": "cup",},]\n```'])
+        self.assertEqual(AIRecipeAdvisor(self.recipe).get_alternative_ingredients([], "no cow")[0]["name"], "Soy milk")
+        stats = self.stats("get_alternative_ingredients", "ok")
+        self.assertEqual((stats.calls, stats.retries, stats.invalid_responses, stats.repaired_responses), (2, 1, 1, 1))
+        collector.flush()
+        out = StringIO()
+        call_command('gpt_report', stdout=out)
+        self.assertIn("retries=1 (0.50/call) fallbacks=0 invalid=1 repaired=1", out.getvalue())
+
+    def test_flush_adds_up(self):
+        """Test that each flush adds the calls to the rows of the day, and the report prints them."""
+        advisor = AIRecipeAdvisor(self.recipe)
+        advisor.difficulty_calculator()
+        self.assertEqual(collector.flush(), 1)
+        advisor.difficulty_calculator()
+        self.assertEqual(collector.flush(), 1)
+        advisor.difficulty_calculator()
+        with self.assertNumQueries(4):
+            collector.flush()
+        self.assertEqual(GPTCallStat.objects.get(method="difficulty_calculator", outcome="ok").calls, 1)
+        row = GPTCallStat.objects.get(method="difficulty_calculator", outcome="cached")
+        self.assertEqual(row.calls, 2)
+        self.assertEqual(sum(row.latency_buckets), 2)
+        self.assertEqual(collector.snapshot(), {})
+
+        out = StringIO()
+        call_command('gpt_report', stdout=out)
+        self.assertIn(f"{self.today}\tdifficulty_calculator\t3 call(s)\tok=1 cached=2", out.getvalue())
+        self.assertIn("Total cost: $", out.getvalue())
+
+    def test_percentile(self):
+        """Test that the percentile is the bound of the bucket that reaches it."""
+        buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        buckets[1], buckets[3], buckets[-1] = 5, 4, 1
+        self.assertEqual(percentile(buckets, 0.5), 0.25)
+        self.assertEqual(percentile(buckets, 0.9), 1)
+        self.assertEqual(percentile(buckets, 0.95), float('inf'))
+        self.assertIsNone(percentile([0] * len(buckets), 0.5))
@@ -5,7 +5,9 @@ from . import views
 urlpatterns = [
     path("", views.RecipeListView.as_view(), name="recipe_list"),
     path("<int:pk>/", views.RecipeView.as_view(), name="recipe"),
+    path("<int:pk>/alternatives/", views.alternative_ingredients, name="alternative_ingredients"),
     path("randomizer/", views.random_recipe_view, name="random_recipe"),
     path('<int:recipe_id>/toggle_favourite/', views.toggle_favourite, name='toggle_favorite'),
     path('add_recipe/', views.AddRecipeView.as_view(), name='add_recipe'),
+    path('jobs/<int:job_id>/', views.job_status, name='job_status'),
 ]
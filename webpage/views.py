@@ -3,28 +3,36 @@ from decimal import Decimal
 import re
 from django.contrib.auth.decorators import login_required
 from django.db import transaction
-from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.http import Http404, HttpRequest, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views import generic
-from pantry import settings
-from webpage.models import Recipe, Diet, RecipeStep, Favourite, Ingredient, Equipment, Nutrition, \
-    Cuisine
+from django.views.decorators.http import require_POST
+from webpage.models import Recipe, Diet, Favourite, Ingredient, Equipment, Cuisine, Job, \
+    normalize_name
 from webpage.modules.ai_advisor import AIRecipeAdvisor
 from django.contrib import messages
-from django.shortcuts import render, redirect
+from django.shortcuts import get_object_or_404, render, redirect
+from django.urls import reverse
 from django.contrib.auth import login, logout, authenticate
 from webpage.forms import CustomRegisterForm
 from webpage.modules.builder import NormalRecipeBuilder
-from webpage.modules.image_to_url import upload_image_to_imgur
+from webpage.modules.recipe_enrichment import enqueue_enrichment
+from webpage.modules.recipe_snapshot import get_snapshot
+from webpage.modules.resilience import GPTUnavailable
+from webpage.modules import substitutions
 from webpage.modules.proxy import GetDataProxy, GetDataSpoonacular
 from webpage.modules.filter_objects import FilterParam
 from webpage.utils import login_with_backend
 import random
 import json
 import logging
-from webpage.modules.status_code import StatusCode
+from decouple import config
+from webpage.modules.status_code import StatusCode, JobStatus
 
 
 logger = logging.getLogger("Views")
+UNAVAILABLE_MESSAGE = "The AI is busy right now. Please try again in a minute."
+# The most ingredients whose alternatives are asked for in one request.
+ALTERNATIVES_MAX_INGREDIENTS = config('ALTERNATIVES_MAX_INGREDIENTS', cast=int, default=20)
 
 
 def register_view(request):
@@ -175,53 +183,168 @@ class RecipeView(generic.DetailView):
     model = Recipe
     context_object_name = 'recipe'
 
-    def get_context_data(self, **kwargs):
-        """Add steps directly from RecipeStep model to the context."""
-        context = super().get_context_data(**kwargs)
-        recipe: Recipe = self.get_object()
-        context['can_favorite'] = None if recipe.status != StatusCode.APPROVE.value[0] else True
-        context['steps'] = RecipeStep.objects.filter(recipe=recipe).order_by('number')
-        context['equipments'] = Recipe.get_equipments(recipe)
-        if self.request.user.is_authenticated:
-            context['user_favourites'] = Favourite.objects.filter(
-                user=self.request.user).values_list('recipe_id', flat=True)
-        else:
-            context['user_favourites'] = []
+    def get_snapshot_context(self, snapshot: dict) -> dict:
+        """
+        Build the template context from the recipe snapshot.
+
+        :param snapshot: The snapshot data of the recipe.
+        :return: The context for the template.
+        """
+        context = {
+            'recipe': snapshot,
+            'can_favorite': None if snapshot['status'] != StatusCode.APPROVE.value[0] else True,
+            'steps': snapshot['steps'],
+            'equipments': snapshot['equipments'],
+            'user_favourites': [],
+        }
+        if self.request.user.is_authenticated and \
+                Favourite.objects.filter(user=self.request.user, recipe_id=snapshot['id']).exists():
+            context['user_favourites'] = [snapshot['id']]
         return context
 
-    def post(self, request: HttpRequest, *args, **kwargs) -> JsonResponse:
+    def post(self, request: HttpRequest, *args, **kwargs) -> JsonResponse | StreamingHttpResponse:
         """
         Get the alternative ingredient of each recipe.
+
+        With `stream` in the form, each alternative is sent as a server-sent event as soon as the model has written it.
+        Without a special instruction, the alternatives already given for a recipe with the same diets and cuisines
+        are reused instead of asking the model, and new ones are stored for the next recipes. Alternatives
+        answered by the local ingredient index are not stored.
         
         :param request: A POST request
-        :return: The JSON containing the alternative ingredient.
+        :return: The JSON containing the alternative ingredient, or the stream of events.
         """
         recipe = self.get_object()
         ai_consultant = AIRecipeAdvisor(recipe)
         text = ""
         if 'ingredient_id' in request.POST:
             ingredient_id = int(request.POST.get('ingredient_id', 0))
-            alternative = ai_consultant.get_alternative_ingredients(
-                [Ingredient.objects.get(id=ingredient_id)],
-                request.POST.get('prompt', None)
-            )
+            ingredients = [Ingredient.objects.get(id=ingredient_id)]
+            prompt = request.POST.get('prompt', None)
+            stored = None if (prompt or '').strip() else substitutions.lookup(recipe, ingredients[0])
+            if request.POST.get('stream'):
+                events = self.stream_alternatives(ai_consultant, recipe, ingredients, prompt, stored)
+                response = StreamingHttpResponse(events, content_type='text/event-stream')
+                response['Cache-Control'] = 'no-cache'
+                response['X-Accel-Buffering'] = 'no'
+                return response
+            try:
+                alternative = stored or ai_consultant.get_alternative_ingredients(ingredients, prompt)
+            except GPTUnavailable as e:
+                logger.warning(f"Alternative ingredients are unavailable: {e}")
+                return JsonResponse({'text': UNAVAILABLE_MESSAGE}, status=503)
+            if stored is None and not (prompt or '').strip() and not ai_consultant.answered_locally:
+                substitutions.remember(recipe, ingredients[0], alternative)
             for ingredient in alternative:
-                text += str(ingredient['amount']) + " " + ingredient['unit'] + " " + ingredient['name'] + " - " + \
-                    ingredient['description'] + "\n"
+                text += self.format_alternative(ingredient) + "\n"
             
         return JsonResponse({'text': text})
 
+    @staticmethod
+    def format_alternative(ingredient: dict) -> str:
+        """
+        Format one alternative ingredient for the page.
+
+        :param ingredient: The alternative with `amount`, `unit`, `name` and `description`.
+        :return: The line shown to the user.
+        """
+        return str(ingredient['amount']) + " " + ingredient['unit'] + " " + ingredient['name'] + " - " + \
+            ingredient['description']
+
+    def stream_alternatives(self, ai_consultant: AIRecipeAdvisor, recipe: Recipe, ingredients: list[Ingredient],
+                            prompt: str | None, stored: list[dict] | None = None):
+        """
+        Turn the alternatives streamed by the advisor into server-sent events.
+
+        :param ai_consultant: The advisor of the recipe.
+        :param recipe: The recipe.
+        :param ingredients: The ingredients to replace.
+        :param prompt: The special instruction of the user.
+        :param stored: The alternatives from the substitution knowledge base, None to ask the model.
+        :return: An iterator over the events: `suggestion` for each alternative, then `done`, or `error`.
+        """
+        def event(name: str, data: dict) -> str:
+            return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+        streamed = []
+        try:
+            for ingredient in stored or ai_consultant.stream_alternative_ingredients(ingredients, prompt):
+                streamed.append(ingredient)
+                yield event('suggestion', {'text': self.format_alternative(ingredient), 'ingredient': ingredient})
+        except GPTUnavailable as e:
+            logger.warning(f"Alternative ingredients are unavailable: {e}")
+            yield event('error', {'message': UNAVAILABLE_MESSAGE})
+            return
+        except Exception as e:
+            logger.error(f"Streaming the alternative ingredients failed: {e}")
+            yield event('error', {'message': "Error with LLM. Please try again."})
+            return
+        if stored is None and not (prompt or '').strip() and not ai_consultant.answered_locally:
+            substitutions.remember(recipe, ingredients[0], streamed)
+        yield event('done', {})
+
     def get(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
         """
-        Get the Recipe class for the user. If the recipe is not approved, it will redirect to the main page.
+        Render the recipe from its snapshot. If the recipe is not approved, it will redirect to the main page.
         
         :param request: The request from the page.
         :return: A HTTP Response.
         """
-        recipe: Recipe = self.get_object()
-        if recipe.status != StatusCode.APPROVE.value[0] and recipe.poster_id.id != request.user.id:
+        snapshot = get_snapshot(kwargs['pk'])
+        if snapshot is None:
+            raise Http404("Recipe not found")
+        if snapshot['status'] != StatusCode.APPROVE.value[0] and snapshot['poster']['id'] != request.user.id:
             return redirect('recipe_list')
-        return super().get(request, *args, **kwargs)
+        return self.render_to_response(self.get_snapshot_context(snapshot))
+
+
+@require_POST
+def alternative_ingredients(request: HttpRequest, pk: int) -> JsonResponse:
+    """
+    Get the alternatives of several ingredients of a recipe at once, keyed by ingredient id.
+
+    The substitution knowledge base, the local ingredient index and the cached answers about single ingredients
+    answer what they can, and GPT is asked about all the other ingredients in one request.
+
+    :param request: A POST request with the `ingredient_ids`, repeated or separated by commas, and a `prompt`.
+                    The ingredients must be in the recipe, and at most ALTERNATIVES_MAX_INGREDIENTS of them.
+    :param pk: The recipe ID.
+    :return: The JSON with the `text` and the `alternatives` of each ingredient id, or the error with status 400.
+    """
+    recipe = get_object_or_404(Recipe, pk=pk)
+    try:
+        ids = list(dict.fromkeys(int(value) for values in request.POST.getlist('ingredient_ids')
+                                 for value in values.split(',') if value.strip()))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid ingredient id'}, status=400)
+    if len(ids) > ALTERNATIVES_MAX_INGREDIENTS:
+        return JsonResponse({'error': f'At most {ALTERNATIVES_MAX_INGREDIENTS} ingredients'}, status=400)
+    found = Ingredient.objects.filter(ingredientlist__recipe=recipe).in_bulk(ids)
+    if not ids or len(found) != len(ids):
+        return JsonResponse({'error': 'Unknown ingredient'}, status=400)
+    ingredients = [found[ingredient_id] for ingredient_id in ids]
+    prompt = request.POST.get('prompt', None)
+    instructed = bool((prompt or '').strip())
+    answers = {} if instructed else {ingredient.id: stored for ingredient in ingredients
+                                     if (stored := substitutions.lookup(recipe, ingredient)) is not None}
+    asked = [ingredient for ingredient in ingredients if ingredient.id not in answers]
+    if asked:
+        ai_consultant = AIRecipeAdvisor(recipe)
+        try:
+            generated = ai_consultant.get_alternatives_per_ingredient(asked, prompt)
+        except GPTUnavailable as e:
+            logger.warning(f"Alternative ingredients are unavailable: {e}")
+            return JsonResponse({'text': UNAVAILABLE_MESSAGE}, status=503)
+        for ingredient in asked:
+            if not instructed and ingredient.id not in ai_consultant.local_ingredient_ids:
+                substitutions.remember(recipe, ingredient, generated[ingredient.id])
+        answers.update(generated)
+    return JsonResponse({'alternatives': {
+        str(ingredient.id): {
+            'text': "".join(RecipeView.format_alternative(alternative) + "\n" for alternative in answers[ingredient.id]),
+            'alternatives': answers[ingredient.id],
+        } for ingredient in ingredients
+    }})
 
 
 def random_recipe_view(request):
@@ -285,29 +408,34 @@ class AddRecipeView(generic.CreateView):
 
     def form_valid(self, form):
         """
-        Process the submitted recipe form, including details, image upload, ingredients, diets, equipment, and steps.
+        Save the submitted recipe as pending and queue its slow processing steps.
+
+        The recipe details, ingredients, diets, equipment, steps and cuisines are saved right away.
+        The image upload, nutrition, difficulty and AI approval run in the background job queue.
 
         :param form: The RecipeForm instance containing validated data for
         creating a new recipe.
-        :return JsonResponse: A JSON response indicating the success
-        of the recipe creation.
+        :return JsonResponse: A 202 JSON response with the URL to poll for the job status.
         """
         try:
             with transaction.atomic():
                 builder = NormalRecipeBuilder(name=form.cleaned_data['name'], user=self.request.user)
                 self.process_detail(builder, form)
-                self.process_image(builder, form)
                 self.process_ingredients(builder)
                 self.process_diets(builder)
                 self.process_equipments(builder)
                 self.process_steps(builder)
-                self.process_nutrition(builder)
-                builder.build_difficulty()
-                self.process_status(builder)
                 self.process_cuisine(builder)
-                builder.build_recipe().save()
-
-            return JsonResponse({'message': 'Recipe added successfully!'}, status=201)
+                recipe = builder.build_recipe()
+                recipe.save()
+                job = enqueue_enrichment(recipe, self.request.user, image=self.read_image(form))
+
+            return JsonResponse({
+                'message': 'Recipe submitted! It will be reviewed shortly.',
+                'recipe_id': recipe.id,
+                'job_id': job.id,
+                'status_url': reverse('job_status', args=[job.id]),
+            }, status=202)
         except Exception as e:
             logger.error(f"Error occurred while adding recipe: {e}")
             return JsonResponse(
@@ -326,19 +454,15 @@ class AddRecipeView(generic.CreateView):
         )
         builder.build_details(estimated_time=form.cleaned_data['estimated_time'])
 
-    def process_image(self, builder: NormalRecipeBuilder, form):
+    def read_image(self, form) -> bytes | None:
         """
-        Process the image data of the recipe.
+        Read the uploaded photo so the worker can upload it to Imgur.
 
-        :param builder: Recipe Builder instance.
         :param form: The RecipeForm instance containing validated data.
+        :return: The content of the photo, or None if no photo was uploaded.
         """
         image = form.files.get('photo')
-        if image:
-            client_id = settings.IMGUR_CLIENT_ID
-            image_url = upload_image_to_imgur(image, client_id)
-            if image_url:
-                builder.build_details(image=image_url)
+        return image.read() if image else None
 
     def process_ingredients(self, builder: NormalRecipeBuilder):
         """
@@ -348,14 +472,17 @@ class AddRecipeView(generic.CreateView):
         """
         ingredients_data = self.request.POST.get('ingredients_data')
         if ingredients_data:
-            ingredients = json.loads(ingredients_data)
-            for ingredient_entry in ingredients:
+            parsed = []
+            for ingredient_entry in json.loads(ingredients_data):
                 try:
-                    amount, unit, name = self.parse_ingredient_input(ingredient_entry)
-                    ingredient, _ = Ingredient.objects.get_or_create(name=name)
-                    builder.build_ingredient(ingredient=ingredient, amount=amount, unit=unit)
+                    parsed.append(self.parse_ingredient_input(ingredient_entry))
                 except Exception as e:
                     logger.error(f"Error parsing ingredient '{ingredient_entry}': {e}")
+            # Blank rows have no name to look the entry up by.
+            parsed = [(amount, unit, name) for amount, unit, name in parsed if normalize_name(name)]
+            ingredients = Ingredient.upsert_many({'name': name} for _, _, name in parsed)
+            for amount, unit, name in parsed:
+                builder.build_ingredient(ingredient=ingredients[normalize_name(name)], amount=amount, unit=unit)
 
     def process_diets(self, builder: NormalRecipeBuilder):
         """
@@ -381,14 +508,16 @@ class AddRecipeView(generic.CreateView):
         """
         equipments_data = self.request.POST.get('equipment_data')
         if equipments_data:
-            equipments = json.loads(equipments_data)
-            for equipment_entry in equipments:
+            parsed = []
+            for equipment_entry in json.loads(equipments_data):
                 try:
-                    amount, name = self.parse_equipment_input(equipment_entry)
-                    equipment, _ = Equipment.objects.get_or_create(name=name)
-                    builder.build_equipment(equipment=equipment)
+                    parsed.append(self.parse_equipment_input(equipment_entry))
                 except Exception as e:
                     logger.error(f"Error parsing equipment '{equipment_entry}': {e}")
+            parsed = [(amount, name) for amount, name in parsed if normalize_name(name)]
+            equipments = Equipment.upsert_many({'name': name} for _, name in parsed)
+            for amount, name in parsed:
+                builder.build_equipment(equipment=equipments[normalize_name(name)])
 
     def process_steps(self, builder: NormalRecipeBuilder):
         """
@@ -405,51 +534,6 @@ class AddRecipeView(generic.CreateView):
                 except Exception as e:
                     logger.error(f"Error adding step '{step_entry}': {e}")
 
-    def process_status(self, builder: NormalRecipeBuilder):
-        """
-        Process the status data of the recipe.
-
-        :param builder: Recipe Builder instance.
-        """
-        try:
-            is_approved = AIRecipeAdvisor(builder.build_recipe()).recipe_approval()
-            if is_approved == 'True':
-                builder.build_details(AI_status=True)
-                builder.build_details(status=StatusCode.APPROVE.value[0])
-            elif is_approved == 'False':
-                builder.build_details(AI_status=False)
-            builder.build_recipe().save()
-        except Recipe.DoesNotExist:
-            logger.error(f"Recipe with ID {builder.build_recipe()} does not exist.")
-        except Exception as e:
-            logger.error(f"Error during recipe approval: {e}")
-
-    def process_nutrition(self, builder: NormalRecipeBuilder):
-        """
-        Process the nutrition data for the recipe.
-
-        :param builder: Recipe Builder instance.
-        """
-        try:
-            advisor = AIRecipeAdvisor(builder.build_recipe())
-            nutrition_data = json.dumps(advisor.nutrition_calculator())
-            if nutrition_data:
-                nutrition_json = json.loads(nutrition_data)
-                nutrients = nutrition_json.get("nutrients", [])
-                for nutrition_entry in nutrients:
-                    name = nutrition_entry.get("name")
-                    amount = nutrition_entry.get("amount")
-                    unit = nutrition_entry.get("unit")
-                    if name and amount is not None:
-                        nutrition_obj, _ = Nutrition.objects.get_or_create(name=name)
-                        builder.build_nutrition(
-                            nutrition=nutrition_obj,
-                            amount=Decimal(amount),
-                            unit=unit
-                        )
-        except Exception as e:
-            logger.error(f"Error processing nutrition data: {e}")
-
     def process_cuisine(self, builder: NormalRecipeBuilder):
         """
         Process the cuisine data of the recipe.
@@ -488,7 +572,28 @@ class AddRecipeView(generic.CreateView):
         else:
             return 1, equipment_entry
 
-          
+
+@login_required
+def job_status(request, job_id):
+    """
+    Return the status of a background job started by the user.
+
+    :param request: Request from the server.
+    :param job_id: Job ID.
+    """
+    job = Job.objects.filter(id=job_id, user=request.user).first()
+    if job is None:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    data = {'job_id': job.id, 'kind': job.kind, 'status': job.status, 'attempts': job.attempts}
+    recipe = Recipe.objects.filter(id=job.payload.get('recipe_id')).only('status').first()
+    if recipe is not None:
+        data['recipe_id'] = recipe.id
+        data['recipe_status'] = recipe.status
+    if job.status == JobStatus.DEAD.value[0]:
+        data['error'] = 'Processing failed. A moderator will review the recipe.'
+    return JsonResponse(data)
+
+
 class FavouritePage(generic.ListView):
     """FavouritePage view."""
 